@@ -41,7 +41,7 @@ static const int pin_33996_nRST = 40;
 
 const int check_manual_input_interval_us = 5000; // 5 ms
 const int read_sensors_interval_us = 5000; // 5 ms
-const int send_update_interval_us = 20000; // 20 ms
+unsigned long send_update_interval_us = 20000; // 20 ms, set by SET_TELEMETRY_RATE
 IntervalTimer Timer_check_manual_input; // see https://www.pjrc.com/teensy/td_timing_IntervalTimer.html
 IntervalTimer Timer_read_sensors_input;
 IntervalTimer Timer_send_update_input;
@@ -137,13 +137,33 @@ byte 16-17  : flow sensor 1 reading (downstream)
 byte 18-19  : flow sensor 2 reading (upstream)
 byte 20     : elapsed time since the start of the last internal program (in seconds)
 byte 21-22  : volume (ul), range: 0 - 5000
-byte 23-24  : reserved
+byte 23-24  : reserved (frame format 2: CRC-16)
+
+frame format 1: the 25-byte message
+frame format 2: 0xA5 0x5A (sync), sequence counter (1 byte), the 25-byte message with the CRC-16/CCITT-FALSE of the
+                sequence counter and message bytes 0-22 in bytes 23-24 (search for MCU_MSG_FRAME_FORMAT in _def.py)
+the frame format is set by SET_FRAME_FORMAT, which is executed as soon as it is received
 */
 static const int FROM_MCU_MSG_LENGTH = 25; // search for MCU_MSG_LENGTH in _def.py
 static const int TO_MCU_CMD_LENGTH = 15; // search for MCU_CMD_LENGTH in _def.py
+static const int FROM_MCU_FRAME_V2_LENGTH = FROM_MCU_MSG_LENGTH + 3; // search for MCU_MSG_V2_LENGTH in _def.py
+static const byte FRAME_V2_SYNC_1 = 0xA5;
+static const byte FRAME_V2_SYNC_2 = 0x5A;
 byte buffer_rx[1000];
 byte buffer_tx[FROM_MCU_MSG_LENGTH];
+byte frame_tx[FROM_MCU_FRAME_V2_LENGTH];
 volatile int buffer_rx_ptr;
+int frame_format = 1;
+byte frame_sequence = 0;
+
+// command queue - the commands flagged CMD_FLAG_QUEUED (byte 13) are executed in order when no internal program is running, so that
+// the computer can send several commands without waiting for each of them to complete (search for MCU_CMD_QUEUE_LENGTH in _def.py)
+// the other commands are executed as soon as they are received
+static const int CMD_QUEUE_LENGTH = 16;
+static const byte CMD_FLAG_QUEUED = 0x01;
+byte cmd_queue[CMD_QUEUE_LENGTH][TO_MCU_CMD_LENGTH];
+int cmd_queue_head = 0;
+int cmd_queue_size = 0;
 
 // command sets - these are commands from the computer
 // each of the commands may break down to multiple internal programs in the MCU
@@ -151,6 +171,7 @@ volatile int buffer_rx_ptr;
 static const int CLEAR = 0;
 static const int REMOVE_MEDIUM = 1;
 static const int ADD_MEDIUM = 2;
+static const int ABORT = 3;
 static const int SET_SELECTOR_VALVE = 10;
 static const int SET_10MM_SOLENOID_VALVE = 11;
 static const int SET_SOLENOID_VALVE_B = 12;
@@ -162,6 +183,25 @@ static const int SET_PRESSURE_CONTROL_LOOP_P_COEFFICIENT = 32;
 static const int SET_PRESSURE_CONTROL_LOOP_I_COEFFICIENT = 33;
 static const int PREUSE_CHECK_PRESSURE = 40;
 static const int PREUSE_CHECK_VACUUM = 41;
+static const int SET_FRAME_FORMAT = 50;
+static const int SET_TELEMETRY_RATE = 51;
+
+// telemetry (search for MCU_TELEMETRY_PERIOD_MS and class TELEMETRY_MODE in _def.py)
+// full: a frame every period with the latest sensor readings
+// summary: a frame every period with the sensor readings averaged over the period, plus a frame as soon as the command status changes
+static const int TELEMETRY_MODE_FULL = 0;
+static const int TELEMETRY_MODE_SUMMARY = 1;
+static const int TELEMETRY_PERIOD_MS_MIN = 1;
+static const int TELEMETRY_PERIOD_MS_MAX = 200;
+int telemetry_mode = TELEMETRY_MODE_FULL;
+long summary_pressure_1_raw_sum = 0;
+long summary_pressure_2_raw_sum = 0;
+long summary_flow_1_raw_sum = 0;
+long summary_flow_2_raw_sum = 0;
+int summary_number_of_readings = 0;
+uint16_t last_sent_command_uid = 0;
+uint8_t last_sent_command_execution_status = 0;
+uint8_t last_sent_internal_program = 0;
 
 // command parameters
 // search for class MCU_CMD_PARAMETERS in _def.py
@@ -170,6 +210,12 @@ static const int CONSTANT_PRESSURE = 1;
 static const int CONSTANT_FLOW = 2;
 static const int VOLUME_CONTROL = 3;
 
+// aspiration modes (payload 1 of REMOVE_MEDIUM)
+// search for class ASPIRATION_MODE in _def.py
+static const int ASPIRATION_MODE_FIXED_TIME = 0;
+static const int ASPIRATION_MODE_BUBBLE_SENSOR = 1;
+static const int ASPIRATION_AIR_DEBOUNCE_UNIT_MS = 10; // payload 2 of REMOVE_MEDIUM
+
 // command execution status constants
 // search for class CMD_EXECUTION_STATUS in _def.py
 static const int COMPLETED_WITHOUT_ERRORS = 0;
@@ -179,6 +225,7 @@ static const int CMD_INVALID = 3;
 static const int CMD_EXECUTION_ERROR = 4;
 static const int ERROR_CODE_EMPTYING_THE_FLUDIIC_LINE_FAILED = 100;
 static const int ERROR_CODE_PREUSE_CHECK_FAILED = 110;
+static const int ERROR_CODE_CMD_QUEUE_FULL = 120;
 
 // variables related to control by the software program
 uint16_t current_command_uid = 0;
@@ -200,12 +247,17 @@ static const int INTERNAL_PROGRAM_PREUSE_CHECK_VACUUM = 6;
 elapsedMillis elapsed_millis_since_the_start_of_the_internal_program = 0; // for internal program 2-4
 byte time_elapsed_s = 0;
 unsigned long set_vacuum_duration_ms = 0;
+int aspiration_mode = ASPIRATION_MODE_FIXED_TIME;
+unsigned long aspiration_air_debounce_ms = 0;
+bool liquid_has_passed_bubble_sensor_1_during_aspiration = false;
+elapsedMillis elapsed_millis_since_liquid_at_bubble_sensor_1 = 0;
 
 bool pressure_control_loop_enabled = false;
 int control_type = CONSTANT_POWER;
 int fluidic_port = 0;
 float control_setpoint = 0;
 unsigned long set_flow_time_ms = 0;
+float set_volume_ul = 0; // volume control, 0: pump for set_flow_time_ms
 
 // pressure control loop
 float pressure_set_point = 0;
@@ -390,247 +442,54 @@ void loop() {
     if (buffer_rx_ptr == TO_MCU_CMD_LENGTH) 
     {
       buffer_rx_ptr = 0;
-      current_command_uid = uint16_t(buffer_rx[0])*256 + uint16_t(buffer_rx[1]);
-      current_command = buffer_rx[2];
-      uint8_t payload1 = buffer_rx[3];
-      uint8_t payload2 = buffer_rx[4];
-      uint16_t payload3 = (uint16_t(buffer_rx[5])<<8) + uint16_t(buffer_rx[6]);
-      uint32_t payload4 = (uint32_t(buffer_rx[7])<<24) + (uint32_t(buffer_rx[8])<<16) + (uint32_t(buffer_rx[9])<<8) + (uint32_t(buffer_rx[10]));
-
-      // set the controller into appropreaite states based on the command received
-      switch(current_command)
+      if(buffer_rx[2]==SET_FRAME_FORMAT)
       {
-        case CLEAR:
-          current_command_uid = 0;
-          command_execution_status = COMPLETED_WITHOUT_ERRORS;
-          break;
-          
-        // diable/enable manual control
-        case DISABLE_MANUAL_CONTROL:
-          if(payload1==1)
-            manual_control_disabled_by_software = true;
-          if(payload1==0)
-          {
-            manual_control_disabled_by_software = false;
-            pressure_control_loop_enabled = false; // may be changed in the future (e.g. use the knob to set pressure instead of power, right now pressure is set from the GUI)
-          }
-          command_execution_status = COMPLETED_WITHOUT_ERRORS;
-          break;
-
-        // preuse check
-        case PREUSE_CHECK_PRESSURE:
-          fluidic_port = payload2;
-          control_setpoint = PRESSURE_FULL_SCALE_PSI*float(payload3)/65535;
-          set_flow_time_ms = payload4;
-          manual_control_disabled_by_software = true;
-          pressure_control_loop_enabled = false;
-          // (1) disconnect the chamber from the selector valve
-          digitalWrite(pin_valve_B1,LOW);
-          set_mode_to_pressure();
-          // (2) connect the selector valve 
-          selector_valve_position_setValue = fluidic_port;
-          set_selector_valve_position_blocking(selector_valve_position_setValue);
-          check_selector_valve_position();
-          uart_titan_rx_buffer[uart_titan_rx_ptr] = '\0'; // terminate the string
-          // to add: convert the string to numeric value and compare it with selector_valve_position_setValue
-          // to add: error handling
-          // (3) open the 10 mm valve
-          NXP33996_clear_all();
-          NXP33996_turn_on(fluidic_port-1);
-          NXP33996_update();
-          // (4) set the configuration to pressure
-          set_mode_to_pressure();
-          // (5) turn on the pump
-          disc_pump_power = 1000;
-          set_disc_pump_power(disc_pump_power);
-          disc_pump_enabled = true;
-          set_disc_pump_enabled(disc_pump_enabled);
-          // (6) start timing
-          command_execution_status = IN_PROGRESS;
-          internal_program = INTERNAL_PROGRAM_PREUSE_CHECK_PRESSURE;
-          elapsed_millis_since_the_start_of_the_internal_program = 0;
-          break;
-
-        case PREUSE_CHECK_VACUUM:
-          manual_control_disabled_by_software = true;
-          pressure_control_loop_enabled = false;
-          // (1) disconnect the chamber from the selector valve
-          digitalWrite(pin_valve_B1,LOW);
-          control_setpoint = PRESSURE_FULL_SCALE_PSI*float(payload3)/65535;
-          set_flow_time_ms = payload4;
-          // (2) set to vacuum
-          set_mode_to_vacuum();
-          // (3) turn on the pump
-          disc_pump_power = 1000;
-          set_disc_pump_power(disc_pump_power);
-          disc_pump_enabled = true;
-          set_disc_pump_enabled(disc_pump_enabled);
-          // (4) start timing
-          command_execution_status = IN_PROGRESS;
-          internal_program = INTERNAL_PROGRAM_PREUSE_CHECK_VACUUM;
-          elapsed_millis_since_the_start_of_the_internal_program = 0;
-          break;
-          
-        // remove medium
-        case REMOVE_MEDIUM:
-          manual_control_disabled_by_software = true;
-          pressure_control_loop_enabled = false;
-          digitalWrite(pin_valve_B1,LOW);
-          set_vacuum_duration_ms = payload4;
-          disc_pump_power = int((float(payload3)/65535)*1000);
-          // disc_pump_power = DISC_PUMP_POWER_VACUUM;
-          command_execution_status = IN_PROGRESS;
-          internal_program = INTERNAL_PROGRAM_REMOVE_MEDIUM;
-          set_mode_to_vacuum();
-          disc_pump_enabled = true;
-          set_disc_pump_enabled(disc_pump_enabled);
-          set_disc_pump_power(disc_pump_power);
-          elapsed_millis_since_the_start_of_the_internal_program = 0;
-          break;
-          
-        // add medium
-        case ADD_MEDIUM:
-          manual_control_disabled_by_software = true;
-          command_execution_status = IN_PROGRESS;
-          control_type = payload1;
-          fluidic_port = payload2;
-          control_setpoint = float(payload3)/65535;
-          set_flow_time_ms = payload4;
-          
-          // enter the INTERNAL_PROGRAM_RAMP_UP_PRESSURE internal program
-          internal_program = INTERNAL_PROGRAM_RAMP_UP_PRESSURE;
-          // (0) close the valve between the selector valve and the chamber
-          digitalWrite(pin_valve_B1,LOW);
-          // (1) switch the fluidic port
-          selector_valve_position_setValue = fluidic_port;
-          set_selector_valve_position_blocking(selector_valve_position_setValue);
-          check_selector_valve_position();
-          uart_titan_rx_buffer[uart_titan_rx_ptr] = '\0'; // terminate the string
-            // to add: convert the string to numeric value and compare it with selector_valve_position_setValue
-            // to add: error handling
-          // (2) turn on the 10 mm valve
-          NXP33996_clear_all();
-          NXP33996_turn_on(fluidic_port-1);
-          NXP33996_update();
-          // (3) start the control loop
-          if(control_type==CONSTANT_PRESSURE)
-          {
-            pressure_set_point = control_setpoint*PRESSURE_FULL_SCALE_PSI;
-            pressure_control_loop_enabled = true;
-            pressure_loop_integral_error = 0;
-            disc_pump_power = 0;
-            set_disc_pump_power(disc_pump_power);
-            disc_pump_enabled = true;
-            set_disc_pump_enabled(disc_pump_enabled);
-          }
-          else if(control_type==CONSTANT_POWER)
-          {
-            set_mode_to_pressure();
-            disc_pump_power = int(control_setpoint*1000);
-            set_disc_pump_power(disc_pump_power);
-            disc_pump_enabled = true;
-            set_disc_pump_enabled(disc_pump_enabled);
-          }
-          // (4) start the timer
-          elapsed_millis_since_the_start_of_the_internal_program = 0;          
-          break;
-
-        // set selector valve
-        case SET_SELECTOR_VALVE:
-          if(SELECTOR_VALVE_PRESENT)
-          {
-            selector_valve_position_setValue = payload2;
-            set_selector_valve_position_blocking(selector_valve_position_setValue);
-            check_selector_valve_position();
-            uart_titan_rx_buffer[uart_titan_rx_ptr] = '\0'; // terminate the string
-            // to add: convert the string to numeric value and compare it with selector_valve_position_setValue
-            // to add: error handling
-            command_execution_status = COMPLETED_WITHOUT_ERRORS;
-          }
-          break;
-          
-        // set 10 mm valve state
-        case SET_10MM_SOLENOID_VALVE:
-          if(payload2==0)
-          {
-            NXP33996_clear_all();
-            NXP33996_update();
-          }
-          else
-          {
-            NXP33996_clear_all();
-            NXP33996_turn_on(payload2-1);
-            NXP33996_update();
-          }
-          command_execution_status = COMPLETED_WITHOUT_ERRORS;
-          break;
-          
-        // set valve group B state
-        case SET_SOLENOID_VALVE_B:
-          if(payload1==0)
-          {
-            digitalWrite(pin_valve_B1,LOW);
-            digitalWrite(pin_valve_B2,LOW);
-          }
-          if(payload1==1)
-          {
-            digitalWrite(pin_valve_B1,HIGH);
-            digitalWrite(pin_valve_B2,LOW);
-          }
-          if(payload1==2)
-          {
-            digitalWrite(pin_valve_B1,LOW);
-            digitalWrite(pin_valve_B2,HIGH);
-          }
-          if(payload1==3)
-          {
-            digitalWrite(pin_valve_B1,HIGH);
-            digitalWrite(pin_valve_B2,HIGH);
-          }
-          command_execution_status = COMPLETED_WITHOUT_ERRORS;
-          break;
-          
-        // set valve group C state
-        case SET_SOLENOID_VALVE_C:
-          command_execution_status = COMPLETED_WITHOUT_ERRORS;
-          break;
-
-        // pressure control loop
-        case ENABLE_PRESSURE_CONTROL_LOOP:
-          if(payload1==1)
-          {
-            manual_control_disabled_by_software = true;
-            pressure_control_loop_enabled = true;
-            pressure_loop_integral_error = 0;
-            disc_pump_enabled = true;
-            set_disc_pump_enabled(disc_pump_enabled);
-          }
-          if(payload1==0)
-            pressure_control_loop_enabled = false;
-          command_execution_status = COMPLETED_WITHOUT_ERRORS;
-          break;
-
-        // pressure p coefficient
-        case SET_PRESSURE_CONTROL_LOOP_P_COEFFICIENT:
-          pressure_loop_p_coefficient = (float(payload4)/4294967296)*PRESSURE_LOOP_COEFFICIENTS_FULL_SCALE;
-          command_execution_status = COMPLETED_WITHOUT_ERRORS;
-          break;
-
-        // pressure i coefficient
-        case SET_PRESSURE_CONTROL_LOOP_I_COEFFICIENT:
-          pressure_loop_i_coefficient = (float(payload4)/4294967296)*PRESSURE_LOOP_COEFFICIENTS_FULL_SCALE;
-          command_execution_status = COMPLETED_WITHOUT_ERRORS;
-          break;
-          
-        // pressure set point
-        case SET_PRESSURE_CONTROL_SETPOINT_PSI:
-          pressure_set_point = (float(payload3)/65536)*PRESSURE_FULL_SCALE_PSI;
-          command_execution_status = COMPLETED_WITHOUT_ERRORS;
-          break;
+        // link setting - not queued, does not change the command UID/status reported to the computer
+        if(buffer_rx[3]==1 || buffer_rx[3]==2)
+          frame_format = buffer_rx[3];
+      }
+      else if(buffer_rx[2]==SET_TELEMETRY_RATE)
+      {
+        // link setting, as SET_FRAME_FORMAT - payload 1: mode, payload 3: period in ms
+        telemetry_mode = buffer_rx[3]==TELEMETRY_MODE_SUMMARY ? TELEMETRY_MODE_SUMMARY : TELEMETRY_MODE_FULL;
+        uint16_t telemetry_period_ms = (uint16_t(buffer_rx[5])<<8) + uint16_t(buffer_rx[6]);
+        telemetry_period_ms = constrain(telemetry_period_ms,TELEMETRY_PERIOD_MS_MIN,TELEMETRY_PERIOD_MS_MAX);
+        send_update_interval_us = telemetry_period_ms*1000;
+        Timer_send_update_input.update(send_update_interval_us);
+        summary_number_of_readings = 0;
+      }
+      else if(buffer_rx[2]==CLEAR || buffer_rx[2]==ABORT)
+      {
+        // CLEAR and ABORT are executed at once and discard the queued commands
+        cmd_queue_size = 0;
+        execute_command(buffer_rx);
+      }
+      else if((buffer_rx[13] & CMD_FLAG_QUEUED) == 0)
+        execute_command(buffer_rx);
+      else if(cmd_queue_size < CMD_QUEUE_LENGTH)
+      {
+        memcpy(cmd_queue[(cmd_queue_head+cmd_queue_size)%CMD_QUEUE_LENGTH],buffer_rx,TO_MCU_CMD_LENGTH);
+        cmd_queue_size = cmd_queue_size + 1;
+      }
+      else
+      {
+        // the queue is full - the command is dropped and reported, the commands queued before it are discarded so that none runs out of order
+        cmd_queue_size = 0;
+        current_command_uid = uint16_t(buffer_rx[0])*256 + uint16_t(buffer_rx[1]);
+        current_command = buffer_rx[2];
+        command_execution_status = ERROR_CODE_CMD_QUEUE_FULL;
       }
     }
   }
 
+  // execute the queued commands in order, a command waits until the internal program started by the previous one has finished
+  while(cmd_queue_size > 0 && internal_program == INTERNAL_PROGRAM_IDLE)
+  {
+    execute_command(cmd_queue[cmd_queue_head]);
+    cmd_queue_head = (cmd_queue_head+1)%CMD_QUEUE_LENGTH;
+    cmd_queue_size = cmd_queue_size - 1;
+  }
+
   /**************************************************************
    ********************** check manual input ********************
    **************************************************************/
@@ -776,6 +635,20 @@ void loop() {
     liquid_present_1 = 1 - digitalRead(pin_OCB350_0_B);
     liquid_present_2 = 1 - digitalRead(pin_OCB350_1_B);
 
+    // summary mode - sum the readings until the next frame
+    if(summary_number_of_readings==0)
+    {
+      summary_pressure_1_raw_sum = 0;
+      summary_pressure_2_raw_sum = 0;
+      summary_flow_1_raw_sum = 0;
+      summary_flow_2_raw_sum = 0;
+    }
+    summary_pressure_1_raw_sum = summary_pressure_1_raw_sum + pressure_1_raw;
+    summary_pressure_2_raw_sum = summary_pressure_2_raw_sum + pressure_2_raw;
+    summary_flow_1_raw_sum = summary_flow_1_raw_sum + int16_t(flow_1_raw);
+    summary_flow_2_raw_sum = summary_flow_2_raw_sum + int16_t(flow_2_raw);
+    summary_number_of_readings = summary_number_of_readings + 1;
+
     flag_control_loop_update = true;
   }
 
@@ -881,7 +754,14 @@ void loop() {
     // remove medium
     case INTERNAL_PROGRAM_REMOVE_MEDIUM:
       time_elapsed_s = elapsed_millis_since_the_start_of_the_internal_program/1000;
-      // to add - bubble sensor integration
+      // bubble sensor: the aspiration ends once the downstream bubble sensor has seen liquid, then air for the debounce time
+      if(liquid_present_1)
+      {
+        liquid_has_passed_bubble_sensor_1_during_aspiration = true;
+        elapsed_millis_since_liquid_at_bubble_sensor_1 = 0;
+      }
+      if(aspiration_mode==ASPIRATION_MODE_BUBBLE_SENSOR && disc_pump_enabled && liquid_has_passed_bubble_sensor_1_during_aspiration && elapsed_millis_since_liquid_at_bubble_sensor_1>=aspiration_air_debounce_ms && elapsed_millis_since_the_start_of_the_internal_program<set_vacuum_duration_ms)
+        set_vacuum_duration_ms = elapsed_millis_since_the_start_of_the_internal_program; // the pump is stopped below, followed by the vacuum decay
       if(elapsed_millis_since_the_start_of_the_internal_program>set_vacuum_duration_ms)
       {
         disc_pump_power = 0;
@@ -928,7 +808,7 @@ void loop() {
         liquid_has_passed_bubble_sensor_2_during_pumping = true;
         elapsed_millis_since_the_start_of_the_internal_program = 0;
       }
-      if(elapsed_millis_since_the_start_of_the_internal_program>=set_flow_time_ms)
+      if(elapsed_millis_since_the_start_of_the_internal_program>=set_flow_time_ms || (set_volume_ul>0 && volume_ul>=set_volume_ul))
       {
         // (1) close the valve between the selector valve and the chamber
         digitalWrite(pin_valve_B1,LOW);
@@ -1098,6 +978,10 @@ void loop() {
   /*********************************************************
    ********************** send update **********************
    *********************************************************/
+  // summary mode: the change of command status is sent right away instead of at the end of the period
+  if(telemetry_mode==TELEMETRY_MODE_SUMMARY && (current_command_uid!=last_sent_command_uid || command_execution_status!=last_sent_command_execution_status || internal_program!=last_sent_internal_program))
+    flag_send_update = true;
+
   if(flag_send_update)
   {
     if(DEBUG_WITH_SERIAL)
@@ -1142,7 +1026,7 @@ void loop() {
       byte 18-19  : flow sensor 2 reading (upstram)
       byte 20     : elapsed time since the start of the last internal program (in seconds)
       byte 21-22  : volume (ul), range: 0 - 5000
-      byte 23-24  : reserved
+      byte 23-24  : reserved (frame format 2: CRC-16)
       */
       buffer_tx[0] = byte(current_command_uid >> 8);
       buffer_tx[1] = byte(current_command_uid % 256);
@@ -1170,12 +1054,346 @@ void loop() {
       uint16_t volume_ul_uint16 = (volume_ul/VOLUME_UL_MAX)*65535;
       buffer_tx[21] = byte(volume_ul_uint16 >> 8);
       buffer_tx[22] = byte(volume_ul_uint16 % 256);
-      SerialUSB.write(buffer_tx,FROM_MCU_MSG_LENGTH);  
+      if(telemetry_mode==TELEMETRY_MODE_SUMMARY && summary_number_of_readings>0)
+      {
+        uint16_t pressure_1_raw_mean = summary_pressure_1_raw_sum/summary_number_of_readings;
+        uint16_t pressure_2_raw_mean = summary_pressure_2_raw_sum/summary_number_of_readings;
+        int16_t flow_1_raw_mean = summary_flow_1_raw_sum/summary_number_of_readings;
+        int16_t flow_2_raw_mean = summary_flow_2_raw_sum/summary_number_of_readings;
+        buffer_tx[12] = byte(pressure_1_raw_mean >> 8);
+        buffer_tx[13] = byte(pressure_1_raw_mean % 256);
+        buffer_tx[14] = byte(pressure_2_raw_mean >> 8);
+        buffer_tx[15] = byte(pressure_2_raw_mean % 256);
+        buffer_tx[16] = byte(uint16_t(flow_1_raw_mean) >> 8);
+        buffer_tx[17] = byte(uint16_t(flow_1_raw_mean) % 256);
+        buffer_tx[18] = byte(uint16_t(flow_2_raw_mean) >> 8);
+        buffer_tx[19] = byte(uint16_t(flow_2_raw_mean) % 256);
+        summary_number_of_readings = 0;
+      }
+      last_sent_command_uid = current_command_uid;
+      last_sent_command_execution_status = command_execution_status;
+      last_sent_internal_program = internal_program;
+      if(frame_format==2)
+      {
+        frame_tx[0] = FRAME_V2_SYNC_1;
+        frame_tx[1] = FRAME_V2_SYNC_2;
+        frame_tx[2] = frame_sequence;
+        frame_sequence = frame_sequence + 1;
+        memcpy(frame_tx+3,buffer_tx,FROM_MCU_MSG_LENGTH-2);
+        uint16_t crc = crc16_ccitt(frame_tx+2,FROM_MCU_MSG_LENGTH-1);
+        frame_tx[FROM_MCU_FRAME_V2_LENGTH-2] = byte(crc >> 8);
+        frame_tx[FROM_MCU_FRAME_V2_LENGTH-1] = byte(crc % 256);
+        SerialUSB.write(frame_tx,FROM_MCU_FRAME_V2_LENGTH);
+      }
+      else
+        SerialUSB.write(buffer_tx,FROM_MCU_MSG_LENGTH);  
     }
     flag_send_update = false;
   }
 }
 
+/************************************************
+******************** commands *******************
+************************************************/
+
+// set the controller into appropreaite states based on the command received
+void execute_command(byte* cmd)
+{
+  current_command_uid = uint16_t(cmd[0])*256 + uint16_t(cmd[1]);
+  current_command = cmd[2];
+  uint8_t payload1 = cmd[3];
+  uint8_t payload2 = cmd[4];
+  uint16_t payload3 = (uint16_t(cmd[5])<<8) + uint16_t(cmd[6]);
+  uint32_t payload4 = (uint32_t(cmd[7])<<24) + (uint32_t(cmd[8])<<16) + (uint32_t(cmd[9])<<8) + (uint32_t(cmd[10]));
+  uint16_t payload5 = (uint16_t(cmd[11])<<8) + uint16_t(cmd[12]);
+
+  // set the controller into appropreaite states based on the command received
+  switch(current_command)
+  {
+    case CLEAR:
+      current_command_uid = 0;
+      command_execution_status = COMPLETED_WITHOUT_ERRORS;
+      break;
+
+    // stop the internal program in progress (fault detected by the computer)
+    case ABORT:
+      flag_measure_volume = false;
+      pressure_set_point = 0;
+      pressure_control_loop_enabled = false;
+      pressure_loop_integral_error = 0;
+      flowrate_set_point = 0;
+      flowrate_control_loop_enabled = false;
+      flowrate_loop_integral_error = 0;
+      disc_pump_power = 0;
+      set_disc_pump_power(disc_pump_power);
+      disc_pump_enabled = false;
+      set_disc_pump_enabled(disc_pump_enabled);
+      set_mode_to_pressure();
+      digitalWrite(pin_valve_B1,LOW);
+      NXP33996_clear_all();
+      NXP33996_update();
+      internal_program = INTERNAL_PROGRAM_IDLE;
+      time_elapsed_s = 0;
+      command_execution_status = COMPLETED_WITHOUT_ERRORS;
+      break;
+      
+    // diable/enable manual control
+    case DISABLE_MANUAL_CONTROL:
+      if(payload1==1)
+        manual_control_disabled_by_software = true;
+      if(payload1==0)
+      {
+        manual_control_disabled_by_software = false;
+        pressure_control_loop_enabled = false; // may be changed in the future (e.g. use the knob to set pressure instead of power, right now pressure is set from the GUI)
+      }
+      command_execution_status = COMPLETED_WITHOUT_ERRORS;
+      break;
+
+    // preuse check
+    case PREUSE_CHECK_PRESSURE:
+      fluidic_port = payload2;
+      control_setpoint = PRESSURE_FULL_SCALE_PSI*float(payload3)/65535;
+      set_flow_time_ms = payload4;
+      manual_control_disabled_by_software = true;
+      pressure_control_loop_enabled = false;
+      // (1) disconnect the chamber from the selector valve
+      digitalWrite(pin_valve_B1,LOW);
+      set_mode_to_pressure();
+      // (2) connect the selector valve 
+      selector_valve_position_setValue = fluidic_port;
+      set_selector_valve_position_blocking(selector_valve_position_setValue);
+      check_selector_valve_position();
+      uart_titan_rx_buffer[uart_titan_rx_ptr] = '\0'; // terminate the string
+      // to add: convert the string to numeric value and compare it with selector_valve_position_setValue
+      // to add: error handling
+      // (3) open the 10 mm valve
+      NXP33996_clear_all();
+      NXP33996_turn_on(fluidic_port-1);
+      NXP33996_update();
+      // (4) set the configuration to pressure
+      set_mode_to_pressure();
+      // (5) turn on the pump
+      disc_pump_power = 1000;
+      set_disc_pump_power(disc_pump_power);
+      disc_pump_enabled = true;
+      set_disc_pump_enabled(disc_pump_enabled);
+      // (6) start timing
+      command_execution_status = IN_PROGRESS;
+      internal_program = INTERNAL_PROGRAM_PREUSE_CHECK_PRESSURE;
+      elapsed_millis_since_the_start_of_the_internal_program = 0;
+      break;
+
+    case PREUSE_CHECK_VACUUM:
+      manual_control_disabled_by_software = true;
+      pressure_control_loop_enabled = false;
+      // (1) disconnect the chamber from the selector valve
+      digitalWrite(pin_valve_B1,LOW);
+      control_setpoint = PRESSURE_FULL_SCALE_PSI*float(payload3)/65535;
+      set_flow_time_ms = payload4;
+      // (2) set to vacuum
+      set_mode_to_vacuum();
+      // (3) turn on the pump
+      disc_pump_power = 1000;
+      set_disc_pump_power(disc_pump_power);
+      disc_pump_enabled = true;
+      set_disc_pump_enabled(disc_pump_enabled);
+      // (4) start timing
+      command_execution_status = IN_PROGRESS;
+      internal_program = INTERNAL_PROGRAM_PREUSE_CHECK_VACUUM;
+      elapsed_millis_since_the_start_of_the_internal_program = 0;
+      break;
+      
+    // remove medium
+    case REMOVE_MEDIUM:
+      manual_control_disabled_by_software = true;
+      pressure_control_loop_enabled = false;
+      digitalWrite(pin_valve_B1,LOW);
+      set_vacuum_duration_ms = payload4;
+      aspiration_mode = payload1;
+      aspiration_air_debounce_ms = payload2*ASPIRATION_AIR_DEBOUNCE_UNIT_MS;
+      liquid_has_passed_bubble_sensor_1_during_aspiration = false;
+      disc_pump_power = int((float(payload3)/65535)*1000);
+      // disc_pump_power = DISC_PUMP_POWER_VACUUM;
+      command_execution_status = IN_PROGRESS;
+      internal_program = INTERNAL_PROGRAM_REMOVE_MEDIUM;
+      set_mode_to_vacuum();
+      disc_pump_enabled = true;
+      set_disc_pump_enabled(disc_pump_enabled);
+      set_disc_pump_power(disc_pump_power);
+      elapsed_millis_since_the_start_of_the_internal_program = 0;
+      break;
+      
+    // add medium
+    case ADD_MEDIUM:
+      manual_control_disabled_by_software = true;
+      command_execution_status = IN_PROGRESS;
+      control_type = payload1;
+      fluidic_port = payload2;
+      control_setpoint = float(payload3)/65535;
+      set_flow_time_ms = payload4;
+      set_volume_ul = 0;
+      if(control_type==VOLUME_CONTROL)
+      {
+        // pumped at constant pressure until the volume (payload 5) is reached, the flow time is the time limit
+        control_type = CONSTANT_PRESSURE;
+        set_volume_ul = payload5;
+      }
+      
+      // enter the INTERNAL_PROGRAM_RAMP_UP_PRESSURE internal program
+      internal_program = INTERNAL_PROGRAM_RAMP_UP_PRESSURE;
+      // (0) close the valve between the selector valve and the chamber
+      digitalWrite(pin_valve_B1,LOW);
+      // (1) switch the fluidic port
+      selector_valve_position_setValue = fluidic_port;
+      set_selector_valve_position_blocking(selector_valve_position_setValue);
+      check_selector_valve_position();
+      uart_titan_rx_buffer[uart_titan_rx_ptr] = '\0'; // terminate the string
+        // to add: convert the string to numeric value and compare it with selector_valve_position_setValue
+        // to add: error handling
+      // (2) turn on the 10 mm valve
+      NXP33996_clear_all();
+      NXP33996_turn_on(fluidic_port-1);
+      NXP33996_update();
+      // (3) start the control loop
+      if(control_type==CONSTANT_PRESSURE)
+      {
+        pressure_set_point = control_setpoint*PRESSURE_FULL_SCALE_PSI;
+        pressure_control_loop_enabled = true;
+        pressure_loop_integral_error = 0;
+        disc_pump_power = 0;
+        set_disc_pump_power(disc_pump_power);
+        disc_pump_enabled = true;
+        set_disc_pump_enabled(disc_pump_enabled);
+      }
+      else if(control_type==CONSTANT_POWER)
+      {
+        set_mode_to_pressure();
+        disc_pump_power = int(control_setpoint*1000);
+        set_disc_pump_power(disc_pump_power);
+        disc_pump_enabled = true;
+        set_disc_pump_enabled(disc_pump_enabled);
+      }
+      // (4) start the timer
+      elapsed_millis_since_the_start_of_the_internal_program = 0;          
+      break;
+
+    // set selector valve
+    case SET_SELECTOR_VALVE:
+      if(SELECTOR_VALVE_PRESENT)
+      {
+        selector_valve_position_setValue = payload2;
+        set_selector_valve_position_blocking(selector_valve_position_setValue);
+        check_selector_valve_position();
+        uart_titan_rx_buffer[uart_titan_rx_ptr] = '\0'; // terminate the string
+        // to add: convert the string to numeric value and compare it with selector_valve_position_setValue
+        // to add: error handling
+        command_execution_status = COMPLETED_WITHOUT_ERRORS;
+      }
+      break;
+      
+    // set 10 mm valve state
+    case SET_10MM_SOLENOID_VALVE:
+      if(payload2==0)
+      {
+        NXP33996_clear_all();
+        NXP33996_update();
+      }
+      else
+      {
+        NXP33996_clear_all();
+        NXP33996_turn_on(payload2-1);
+        NXP33996_update();
+      }
+      command_execution_status = COMPLETED_WITHOUT_ERRORS;
+      break;
+      
+    // set valve group B state
+    case SET_SOLENOID_VALVE_B:
+      if(payload1==0)
+      {
+        digitalWrite(pin_valve_B1,LOW);
+        digitalWrite(pin_valve_B2,LOW);
+      }
+      if(payload1==1)
+      {
+        digitalWrite(pin_valve_B1,HIGH);
+        digitalWrite(pin_valve_B2,LOW);
+      }
+      if(payload1==2)
+      {
+        digitalWrite(pin_valve_B1,LOW);
+        digitalWrite(pin_valve_B2,HIGH);
+      }
+      if(payload1==3)
+      {
+        digitalWrite(pin_valve_B1,HIGH);
+        digitalWrite(pin_valve_B2,HIGH);
+      }
+      command_execution_status = COMPLETED_WITHOUT_ERRORS;
+      break;
+      
+    // set valve group C state
+    case SET_SOLENOID_VALVE_C:
+      command_execution_status = COMPLETED_WITHOUT_ERRORS;
+      break;
+
+    // pressure control loop
+    case ENABLE_PRESSURE_CONTROL_LOOP:
+      if(payload1==1)
+      {
+        manual_control_disabled_by_software = true;
+        pressure_control_loop_enabled = true;
+        pressure_loop_integral_error = 0;
+        disc_pump_enabled = true;
+        set_disc_pump_enabled(disc_pump_enabled);
+      }
+      if(payload1==0)
+        pressure_control_loop_enabled = false;
+      command_execution_status = COMPLETED_WITHOUT_ERRORS;
+      break;
+
+    // pressure p coefficient
+    case SET_PRESSURE_CONTROL_LOOP_P_COEFFICIENT:
+      pressure_loop_p_coefficient = (float(payload4)/4294967296)*PRESSURE_LOOP_COEFFICIENTS_FULL_SCALE;
+      command_execution_status = COMPLETED_WITHOUT_ERRORS;
+      break;
+
+    // pressure i coefficient
+    case SET_PRESSURE_CONTROL_LOOP_I_COEFFICIENT:
+      pressure_loop_i_coefficient = (float(payload4)/4294967296)*PRESSURE_LOOP_COEFFICIENTS_FULL_SCALE;
+      command_execution_status = COMPLETED_WITHOUT_ERRORS;
+      break;
+      
+    // pressure set point
+    case SET_PRESSURE_CONTROL_SETPOINT_PSI:
+      pressure_set_point = (float(payload3)/65536)*PRESSURE_FULL_SCALE_PSI;
+      command_execution_status = COMPLETED_WITHOUT_ERRORS;
+      break;
+  }
+}
+
+/************************************************
+********************* CRC-16 ********************
+************************************************/
+
+// CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF), same as binascii.crc_hqx(data,0xFFFF) in python
+uint16_t crc16_ccitt(byte* data, int length)
+{
+  uint16_t crc = 0xFFFF;
+  for(int i=0;i<length;i++)
+  {
+    crc = crc ^ (uint16_t(data[i]) << 8);
+    for(int j=0;j<8;j++)
+    {
+      if(crc & 0x8000)
+        crc = (crc << 1) ^ 0x1021;
+      else
+        crc = crc << 1;
+    }
+  }
+  return crc;
+}
+
 /************************************************
 ************* flag setting functions ************
 ************************************************/
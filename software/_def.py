@@ -17,24 +17,145 @@ FLOW_TIME_MAX = 60 # in seconds
 PRESSURE_FULL_SCALE_PSI = 5
 PRESSURE_LOOP_COEFFICIENTS_FULL_SCALE = 100
 
-SEQUENCE_ATTRIBUTES_KEYS = ['Sequence','Fluidic Port','Flow Time (s)','Incubation Time (min)','Repeat','Include']
+SEQUENCE_ATTRIBUTES_KEYS = ['Sequence','Fluidic Port','Flow Time (s)','Volume (ul)','Incubation Time (min)','Repeat','Include']
 SEQUENCE_NAME = ['Remove Medium','Stripping Buffer Wash','Stripping Buffer Rinse','PBST Wash','Ligate','Wash (Post Ligation, 1)','Stain with DAPI','Wash (Post Ligation, 2)','Add Imaging Buffer']
 
-TIMER_CHECK_MCU_STATE_INTERVAL_MS = 10 # make it half of send_update_interval_us in the firmware
+TIMER_CHECK_MCU_STATE_INTERVAL_MS = 10 # when the telemetry period of the MCU is not known (e.g. simulated MCU), otherwise half of the telemetry period (see engine.mcu_poll_interval_s)
 # TIMER_CHECK_MCU_STATE_INTERVAL_MS = 500 # for simulation
-TIMER_CHECK_SEQUENCE_EXECUTION_STATE_INTERVAL_MS = 50
+TIMER_UPDATE_STOPWATCH_DISPLAY_INTERVAL_MS = 500 # sequence execution itself is event driven (MCU messages, stopwatch timeout, abort request)
+MCU_STATE_DISPLAY_RATE_HZ = 10 # refresh rate of the MCU state display, the latest MCU message is shown
+
+# log view - the oldest messages are dropped beyond LOG_VIEW_CAPACITY, new messages are shown in batches
+LOG_VIEW_CAPACITY = 100000
+LOG_VIEW_UPDATE_INTERVAL_MS = 50
+
+class LOG_SEVERITY:
+	INFO = 'Info'
+	ERROR = 'Error'
+
+# log file - written by a background thread (logfile.LogFileWriter)
+LOG_FILE_QUEUE_SIZE = 10000
+LOG_FILE_FLUSH_INTERVAL_MS = 200
+LOG_FILE_FLUSH_INTERVAL_RECORDS = 100
+LOG_FILE_MAX_BYTES = 10*1024*1024 # rotate the log file beyond this size
+LOG_FILE_MAX_AGE_H = 24*7 # or this age
+LOG_FILE_COMPRESS_ROTATED_FILES = True
+
+class LOG_FILE_BACK_PRESSURE:
+	BLOCK = 'block' # wait for room in the queue
+	DROP = 'drop'   # drop the message, the number of dropped messages is logged
+	WAIT = 'wait'   # wait for room up to LOG_FILE_BACK_PRESSURE_WAIT_MS, then drop (as DROP) until the writer has caught up
+
+LOG_FILE_BACK_PRESSURE_POLICY = LOG_FILE_BACK_PRESSURE.WAIT # GUI thread - a slow disk or a rotation costs it at most one wait
+LOG_FILE_BACK_PRESSURE_POLICY_HEADLESS = LOG_FILE_BACK_PRESSURE.BLOCK # devices.py - the log of a run is kept complete
+LOG_FILE_BACK_PRESSURE_WAIT_MS = 50
+
+# read the MCU messages from a dedicated thread instead of polling from the GUI thread (not used in simulation)
+USE_MCU_READER_THREAD = True
+MCU_READER_THREAD_TIMEOUT_S = 0.1 # max time a read blocks, the thread checks for stop requests in between
+
+# in simulation, run the model of the firmware and the fluidics (simulation.py) instead of completing each command after a fixed time
+SIMULATE_FIRMWARE = True
+
+# ports for which controllers.Microcontroller starts a fake firmware (see simulation.launch_firmware)
+FAKE_FIRMWARE_URLS = ['pty://','socket://','loop://']
+
+# controllers (Teensy 4.1) - the first serial number is the one opened by the GUI, devices.discover_controllers() finds
+# the others by serial number or by USB vendor/product id
+CONTROLLER_SERIAL_NUMBERS = ['8219530','9178980']
+CONTROLLER_USB_IDS = [(0x16C0,0x0483)] # (vid, pid) of the Teensy USB serial
 
 # MCU
 MCU_CMD_LENGTH = 15
 MCU_MSG_LENGTH = 25
 
+# MCU -> computer frame format (see the message structure below and telemetry.FrameParser)
+# 1: the 25-byte message, aligned by the number of bytes received
+# 2: sync header + sequence counter + the message with a CRC-16 in bytes 23-24, set when connecting (CMD_SET.SET_FRAME_FORMAT)
+MCU_MSG_FRAME_FORMAT = 1
+MCU_MSG_V2_SYNC = b'\xa5\x5a'
+MCU_MSG_V2_LENGTH = MCU_MSG_LENGTH + 3
+
+# MCU telemetry (status frames): period and mode, set on the MCU when connecting (CMD_SET.SET_TELEMETRY_RATE) - the MCU state
+# is polled at half the period, e.g. 5 ms for pressure loop tuning, 200 ms with TELEMETRY_MODE.SUMMARY for long incubations
+class TELEMETRY_MODE:
+	FULL = 0    # a frame every period with the latest sensor readings
+	SUMMARY = 1 # a frame every period with the sensor readings averaged over the period, plus a frame as soon as the command status changes
+
+MCU_TELEMETRY_PERIOD_MS = 20
+MCU_TELEMETRY_PERIOD_MS_MIN = 1
+MCU_TELEMETRY_PERIOD_MS_MAX = 200
+MCU_TELEMETRY_MODE = TELEMETRY_MODE.FULL
+
+# the period set is checked against the interval of the frames received over MCU_TELEMETRY_RATE_CHECK_PERIODS periods (at least
+# MCU_TELEMETRY_RATE_CHECK_S), beyond MCU_TELEMETRY_RATE_TOLERANCE the measured period is used instead (e.g. a firmware that
+# ignores CMD_SET.SET_TELEMETRY_RATE keeps sending every 20 ms in TELEMETRY_MODE.FULL)
+MCU_TELEMETRY_RATE_CHECK_PERIODS = 10
+MCU_TELEMETRY_RATE_CHECK_S = 0.5
+MCU_TELEMETRY_RATE_TOLERANCE = 0.5
+
+# measurement logging
+TELEMETRY_RECORDER_FLUSH_INTERVAL_RECORDS = 500
+
+# live telemetry plot - the decoded MCU messages are kept in a fixed-memory history (see telemetry.TelemetryHistory) sized for
+# TELEMETRY_HISTORY_DURATION_S at the default telemetry period (a shorter period shortens the history that is kept) - a day
+# of incubations and washes, about 160 MB at 50 Hz (32 bytes per message plus the summary levels)
+TELEMETRY_HISTORY_DURATION_S = 24*3600
+TELEMETRY_HISTORY_FIELDS = ['pressure','vacuum','flow_upstream','flow_downstream','volume_ul','pump_power']
+TELEMETRY_HISTORY_LEVEL_FACTOR = 16 # min/max summary levels of 16, 256, 4096, ... messages
+TELEMETRY_PLOT_UPDATE_INTERVAL_MS = 200
+TELEMETRY_PLOT_TIME_SPANS_S = [60, 600, 3600, 6*3600, 24*3600]
+
 # MCU - COMPUTER
 T_DIFF_COMPUTER_MCU_MISMATCH_FAULT_THRESHOLD_SECONDS = 3
+MCU_NO_FRAMES_TIMEOUT_S = T_DIFF_COMPUTER_MCU_MISMATCH_FAULT_THRESHOLD_SECONDS # devices.py - an instrument without frames for this long is not waited for
+
+# streaming fault detection on the MCU telemetry (see faults.py) - numbers of samples are MCU messages (MCU_TELEMETRY_PERIOD_MS apart)
+class FAULT_TYPE:
+	LEAK = 'leak'
+	CLOG = 'clog'
+	EMPTY_RESERVOIR = 'empty reservoir'
+	AIR_IN_LINE = 'air in line'
+
+# the faults are logged - aborting is opt-in, the thresholds below are tuned on the simulated fluidics (simulation.py), not on hardware
+FAULT_DETECTOR_ENABLED = True
+FAULT_DETECTOR_ABORT_STEP = [] # the MCU command in progress is aborted (CMD_SET.ABORT) on these faults, e.g. [FAULT_TYPE.LEAK, FAULT_TYPE.CLOG, FAULT_TYPE.EMPTY_RESERVOIR]
+FAULT_DETECTOR_SETTLE_S = 1.5 # the checks start this long after the start of pumping/aspiration
+FAULT_CUSUM_SAMPLES = 10 # a deviation of twice the tolerance is detected within this number of samples
+FAULT_EWMA_ALPHA = 0.1
+FAULT_LEAK_PRESSURE_TOLERANCE_PSI = 0.5 # below the setpoint (constant pressure)
+FAULT_LEAK_VACUUM_PSI_PER_PUMP_POWER = 3 # minimum vacuum during aspiration, e.g. 0.9 psi at a pump power of 0.3
+FAULT_LEAK_VACUUM_TOLERANCE_PSI = 0.25
+FAULT_LEAK_FLOW_TOLERANCE_UL_PER_MIN = 100 # upstream - downstream flow, with a downstream flow sensor
+FAULT_CLOG_MIN_FLOW_UL_PER_MIN = 100 # upstream flow with liquid at the upstream bubble sensor, also the tolerance of the check
+FAULT_AIR_IN_LINE_SAMPLES = 3 # air at the upstream bubble sensor once liquid has reached it
+FAULT_EMPTY_RESERVOIR_SAMPLES = 100 # same, without liquid coming back
+FAULT_NOISE_SIGMAS = 3 # the pressure/vacuum tolerances are at least this many standard deviations of the sensor noise
+
+# command pipelining (opt-in): with MCU_CMD_PIPELINE_WINDOW > 1, up to MCU_CMD_PIPELINE_WINDOW commands of MCU_CMD_PIPELINED are
+# sent without waiting for the previous ones to complete - they are flagged (MCU_CMD_FLAG_QUEUED in byte 13), the firmware queues
+# them (up to MCU_CMD_QUEUE_LENGTH) and executes them in order, the other commands are executed as soon as they are received
+# 1: one command at a time, e.g. 8 requires the firmware with the command queue
+MCU_CMD_PIPELINE_WINDOW = 1
+MCU_CMD_QUEUE_LENGTH = 16 # search for CMD_QUEUE_LENGTH in firmware.ino
+MCU_CMD_FLAG_QUEUED = 0x01
 
 class SUBSEQUENCE_TYPE:
 	MCU_CMD = 'MCU CMD'
 	COMPUTER_STOPWATCH = 'COMPUTER STOPWATCH'
 
+# number of (sequence name, parameters) for which the sequence definitions are kept (see engine.build_sequence)
+SEQUENCE_DEFINITION_CACHE_SIZE = 1024
+
+# number of encoded MCU commands kept (see engine.encode_mcu_command)
+MCU_CMD_PACKET_CACHE_SIZE = 1024
+
+# steps of a precompiled plan (see engine.PlanCompiler)
+class PLAN_STEP_TYPE:
+	SEQUENCE = 0 # start of a sequence (round)
+	MCU_CMD = 1
+	COMPUTER_STOPWATCH = 2
+
 PRINT_DEBUG_INFO = False
 
 # status of command execution on the MCU
@@ -46,6 +167,7 @@ class CMD_EXECUTION_STATUS:
 	CMD_EXECUTION_ERROR = 4
 	ERROR_CODE_EMPTYING_THE_FLUDIIC_LINE_FAILED = 100
 	ERROR_CODE_PREUSE_CHECK_FAILED = 110
+	ERROR_CODE_CMD_QUEUE_FULL = 120 # a command flagged MCU_CMD_FLAG_QUEUED was dropped, the commands queued before it are discarded
 
 #########################################################
 ############   Computer -> MCU command set   ############
@@ -54,6 +176,7 @@ class CMD_SET:
 	CLEAR = 0
 	REMOVE_MEDIUM = 1
 	ADD_MEDIUM = 2
+	ABORT = 3 # stops the internal program in progress (pump, control loops, valves), executed as soon as it is received
 	SET_SELECTOR_VALVE = 10
 	SET_10MM_SOLENOID_VALVE = 11
 	SET_SOLENOID_VALVE_B = 12
@@ -65,9 +188,39 @@ class CMD_SET:
 	SET_PRESSURE_CONTROL_LOOP_I_COEFFICIENT = 33
 	PREUSE_CHECK_PRESSURE = 40
 	PREUSE_CHECK_VACUUM = 41
+	SET_FRAME_FORMAT = 50 # executed as soon as it is received, the UID and status reported by the MCU are not changed
+	SET_TELEMETRY_RATE = 51 # same - payload 1: TELEMETRY_MODE, payload 3: period in ms
+
+# expected execution time of the MCU commands, for the ETA of a plan: (payload 4 is the duration in ms, overhead in seconds)
+# commands that are not listed complete right away
+MCU_CMD_EXPECTED_DURATION = {
+	CMD_SET.REMOVE_MEDIUM:(True,1),         # + vacuum decay
+	CMD_SET.ADD_MEDIUM:(True,10),           # + selector valve, pressure ramp up and emptying the fluidic line
+	CMD_SET.PREUSE_CHECK_PRESSURE:(True,0), # payload 4 is the timeout
+	CMD_SET.PREUSE_CHECK_VACUUM:(True,0)}
+
+# the expected durations are corrected with the durations of the steps measured in past runs (see estimator.py), saved at exit
+# to STEP_DURATION_HISTORY_FILE (relative to the home directory, ' (simulation)' is added to the name for the simulated MCUs) - None
+# to learn within the session only
+STEP_DURATION_ESTIMATOR_ENABLED = True
+STEP_DURATION_EWMA_ALPHA = 0.3
+STEP_DURATION_HISTORY_FILE = 'Documents/starmap-automation step durations.json'
+
+# commands that complete right away (no internal program) - they can be pipelined (see MCU_CMD_PIPELINE_WINDOW)
+MCU_CMD_PIPELINED = frozenset([
+	CMD_SET.SET_SELECTOR_VALVE,
+	CMD_SET.SET_10MM_SOLENOID_VALVE,
+	CMD_SET.SET_SOLENOID_VALVE_B,
+	CMD_SET.SET_SOLENOID_VALVE_C,
+	CMD_SET.DISABLE_MANUAL_CONTROL,
+	CMD_SET.ENABLE_PRESSURE_CONTROL_LOOP,
+	CMD_SET.SET_PRESSURE_CONTROL_SETPOINT_PSI,
+	CMD_SET.SET_PRESSURE_CONTROL_LOOP_P_COEFFICIENT,
+	CMD_SET.SET_PRESSURE_CONTROL_LOOP_I_COEFFICIENT])
 
 class CMD_SET_DESCRIPTION:
 	CLEAR = 'Clear'
+	ABORT = 'Abort'
 	REMOVE_MEDIUM = 'Remove Medium'
 	ADD_MEDIUM = 'Add Medium'
 	SET_SELECTOR_VALVE = '' # the description is manually added (with parameters)
@@ -82,6 +235,16 @@ class MCU_CMD_PARAMETERS:
 	CONSTANT_FLOW = 2
 	VOLUME_CONTROL = 3
 
+# payload 1 of REMOVE_MEDIUM
+class ASPIRATION_MODE:
+	FIXED_TIME = 0 # payload 4 is the duration
+	BUBBLE_SENSOR = 1 # ends once the downstream bubble sensor (bubble_sensor_1) has seen liquid, then air for payload 2 x ASPIRATION_AIR_DEBOUNCE_UNIT_MS - payload 4 is the time limit
+
+# aspiration modes by name, as shown in the GUI and saved in the settings file (Mode of aspiration_setting)
+ASPIRATION_MODES = {'Fixed Time':ASPIRATION_MODE.FIXED_TIME,'Bubble Sensor':ASPIRATION_MODE.BUBBLE_SENSOR}
+
+ASPIRATION_AIR_DEBOUNCE_UNIT_MS = 10 # payload 2 of REMOVE_MEDIUM, up to 2.55 s
+
 class MCU_CMD_PARAMETERS_DESCRIPTION:
 	CONSTANT_POWER = 'constant power'
 	CONSTANT_PRESSURE = 'constant pressure'
@@ -99,8 +262,10 @@ class MCU_CONSTANTS:
 
 class DEFAULT_VALUES:
 	aspiration_pump_power = 0.3
-	vacuum_aspiration_time_s = 8
-	aspiration_timeout_limit_s = 60 # to replace vacuum_aspiration_time_s once bubble sensor is in place
+	vacuum_aspiration_time_s = 8 # time limit in ASPIRATION_MODE.BUBBLE_SENSOR
+	aspiration_timeout_limit_s = 60
+	aspiration_mode = ASPIRATION_MODE.FIXED_TIME # ASPIRATION_MODE.BUBBLE_SENSOR is selected per run (aspiration settings)
+	aspiration_air_debounce_ms = 500 # air at the downstream bubble sensor for this long ends the aspiration (ASPIRATION_MODE.BUBBLE_SENSOR)
 	# control_type_for_adding_medium = MCU_CMD_PARAMETERS.CONSTANT_POWER
 	control_type_for_adding_medium = MCU_CMD_PARAMETERS.CONSTANT_PRESSURE
 	pump_power_for_adding_medium_constant_power_mode = 0.8
@@ -148,7 +313,11 @@ byte 16-17	: flow sensor 1 reading (downstream)
 byte 18-19	: flow sensor 2 reading (upstream)
 byte 20     : elapsed time since the start of the last internal program (in seconds)
 byte 21-22  : volume (ul), range: 0 - 5000
-byte 23-24  : reserved
+byte 23-24  : reserved (frame format 2: CRC-16)
+
+frame format 1: the 25-byte message
+frame format 2: 0xA5 0x5A (sync), sequence counter (1 byte), the 25-byte message with the CRC-16/CCITT-FALSE of the
+                sequence counter and message bytes 0-22 in bytes 23-24
 
 #########################################################
 #########   Computer -> MCU command structure   #########
@@ -159,7 +328,9 @@ byte 3		: payload 1 (1 byte) - e.g. control type [constant power, constant press
 byte 4		: payload 2 (1 byte) - e.g. fluidic port
 byte 5-6	: payload 3 (2 byte) - e.g. power, pressure, flow rate or volume setting
 byte 7-10	: payload 4 (4 byte) - e.g. duration in ms
-byte 11-14	: reserved (4 byte) (including checksum)
+byte 11-12	: payload 5 (2 byte) - e.g. volume (ul) in volume control
+byte 13		: flags - bit 0 (MCU_CMD_FLAG_QUEUED): queued and executed in order once no internal program is running, otherwise the command is executed as soon as it is received
+byte 14		: reserved
 
 '''
 
@@ -0,0 +1,1401 @@
+# set QT_API environment variable
+import os
+os.environ["QT_API"] = "pyqt5"
+os.environ.setdefault("QT_QPA_PLATFORM","offscreen")
+import qtpy
+
+# qt libraries
+from qtpy.QtCore import *
+from qtpy.QtWidgets import *
+
+'''
+benchmarks for the host software - run on linux/macOS (pseudo-terminals are used in place of the Teensy)
+usage:
+	python3 benchmarks.py               # run all the benchmarks
+	python3 benchmarks.py serial_reader # run one benchmark
+'''
+
+# other libraries
+import io
+import sys
+import time
+import pty
+import tty
+import queue
+import random
+import asyncio
+import contextlib
+import tempfile
+import threading
+import serial
+import serial.serialposix
+
+from datetime import datetime
+import numpy as np
+
+import controllers
+import devices
+import engine
+import estimator
+import faults
+import logfile
+import simulation
+import telemetry
+import utils
+from _def import *
+
+#######################################################
+###################### helpers ########################
+#######################################################
+
+class FakeTeensyPty(object):
+	''' streams MCU status frames into a pseudo-terminal, some frames are split in two writes like across USB packets '''
+	def __init__(self,frame_rate_hz=50,split_probability=0.2):
+		self.master_fd, self.slave_fd = pty.openpty()
+		tty.setraw(self.slave_fd)
+		self.port = os.ttyname(self.slave_fd)
+		os.set_blocking(self.master_fd,False)
+		self.bytes_discarded = 0 # bytes that did not fit into the pty buffer (the host was not reading)
+		self.frame_rate_hz = frame_rate_hz
+		self.split_probability = split_probability
+		self.t_sent = []
+		self.thread = None
+		self.stop_requested = False
+
+	def make_frame(self,counter):
+		# idle MCU with UID 0 (in sync with a freshly started FluidController), the frame counter goes into bytes 20 and 23-24
+		frame = bytearray(MCU_MSG_LENGTH)
+		frame[20] = (counter >> 16) & 0xff
+		frame[23] = (counter >> 8) & 0xff
+		frame[24] = counter & 0xff
+		return frame
+
+	def start(self,num_frames):
+		self.stop_requested = False
+		self.thread = threading.Thread(target=self._stream,args=(num_frames,),daemon=True)
+		self.thread.start()
+
+	def join(self):
+		self.thread.join()
+
+	def _stream(self,num_frames):
+		t_start = time.perf_counter()
+		for i in range(num_frames):
+			if self.stop_requested:
+				break
+			frame = self.make_frame(i)
+			self.t_sent.append(time.perf_counter())
+			if random.random() < self.split_probability:
+				n = random.randint(1,MCU_MSG_LENGTH-1)
+				self._write(frame[:n])
+				time.sleep(0.0002)
+				self._write(frame[n:])
+			else:
+				self._write(frame)
+			t_next = t_start + (i+1)/self.frame_rate_hz
+			time.sleep(max(0,t_next-time.perf_counter()))
+
+	def _write(self,data):
+		try:
+			n = os.write(self.master_fd,data)
+		except BlockingIOError:
+			n = 0
+		self.bytes_discarded = self.bytes_discarded + len(data) - n
+
+	def close(self):
+		os.close(self.master_fd)
+		os.close(self.slave_fd)
+
+class SyscallCounter(object):
+	''' counts read/select/ioctl calls made by pyserial from the calling thread '''
+	def __init__(self):
+		self.count = 0
+		self.thread = threading.current_thread()
+
+	def _wrap(self,f):
+		def wrapped(*args,**kwargs):
+			if threading.current_thread() is self.thread:
+				self.count = self.count + 1
+			return f(*args,**kwargs)
+		return wrapped
+
+	def __enter__(self):
+		self._os_read = serial.serialposix.os.read
+		self._select = serial.serialposix.select.select
+		self._ioctl = serial.serialposix.fcntl.ioctl
+		serial.serialposix.os.read = self._wrap(self._os_read)
+		serial.serialposix.select.select = self._wrap(self._select)
+		serial.serialposix.fcntl.ioctl = self._wrap(self._ioctl)
+		return self
+
+	def __exit__(self,*args):
+		serial.serialposix.os.read = self._os_read
+		serial.serialposix.select.select = self._select
+		serial.serialposix.fcntl.ioctl = self._ioctl
+
+def frame_counter(frame):
+	return (frame[20] << 16) + (frame[23] << 8) + frame[24]
+
+def print_histogram(values_ms,edges_ms=(0,1,2,5,10,20,50,100)):
+	for i in range(len(edges_ms)):
+		lower = edges_ms[i]
+		upper = edges_ms[i+1] if i+1 < len(edges_ms) else float('inf')
+		n = len([v for v in values_ms if lower <= v < upper])
+		label = ('{:>4}'.format(lower) + '-' + '{:<4}'.format(upper if upper != float('inf') else '') + 'ms')
+		print('\t' + label + ' ' + '{:6d}'.format(n) + ' ' + '#'*int(60*n/max(1,len(values_ms))))
+
+def get_qt_application():
+	app = QApplication.instance()
+	if app is None:
+		app = QApplication([])
+	return app
+
+def run_qt_event_loop(duration_s):
+	loop = QEventLoop()
+	QTimer.singleShot(int(duration_s*1000),loop.quit)
+	loop.exec_()
+
+def percentile(values,p):
+	if len(values) == 0:
+		return float('nan')
+	values = sorted(values)
+	return values[min(len(values)-1,int(p/100*len(values)))]
+
+#######################################################
+################### serial reader #####################
+#######################################################
+
+def legacy_read_received_packet_nowait(microcontroller):
+	# the per-byte reader that Microcontroller.read_received_packet_nowait used to implement
+	if microcontroller.serial.in_waiting==0:
+		return None
+	if microcontroller.serial.in_waiting % microcontroller.rx_buffer_length != 0:
+		return None
+	num_bytes_in_rx_buffer = microcontroller.serial.in_waiting
+	if num_bytes_in_rx_buffer > microcontroller.rx_buffer_length:
+		for i in range(num_bytes_in_rx_buffer-microcontroller.rx_buffer_length):
+			microcontroller.serial.read()
+	data=[]
+	for i in range(microcontroller.rx_buffer_length):
+		data.append(ord(microcontroller.serial.read()))
+	return data
+
+def benchmark_serial_reader(frame_rate_hz=1000,duration_s=3,poll_interval_ms=TIMER_CHECK_MCU_STATE_INTERVAL_MS):
+	print('--- serial reader: ' + str(frame_rate_hz) + ' frames/s for ' + str(duration_s) + ' s, polled every ' + str(poll_interval_ms) + ' ms ---')
+	num_frames = int(frame_rate_hz*duration_s)
+	readers = [('per-byte (legacy)',lambda mcu: [m for m in [legacy_read_received_packet_nowait(mcu)] if m is not None]),
+		('bulk',lambda mcu: mcu.read_received_packets_nowait())]
+	for name, read in readers:
+		fake_teensy = FakeTeensyPty(frame_rate_hz)
+		mcu = controllers.Microcontroller(port=fake_teensy.port,telemetry_period_ms=None)
+		received = []
+		t_call = []
+		with SyscallCounter() as counter:
+			fake_teensy.start(num_frames)
+			t_end = time.perf_counter() + duration_s + 0.2
+			while time.perf_counter() < t_end:
+				t0 = time.perf_counter()
+				frames = read(mcu)
+				t1 = time.perf_counter()
+				t_call.append(t1-t0)
+				for frame in frames:
+					received.append((frame_counter(frame),t1))
+				time.sleep(poll_interval_ms/1000)
+			fake_teensy.join()
+		latency = [t - fake_teensy.t_sent[i] for i, t in received if i < len(fake_teensy.t_sent)]
+		print(name)
+		print('\tframes sent/received/lost  : ' + str(num_frames) + ' / ' + str(len(received)) + ' / ' + str(num_frames-len(set(i for i, t in received))))
+		print('\tsyscalls per poll          : ' + '{:.1f}'.format(counter.count/len(t_call)))
+		print('\ttime per poll (mean, us)   : ' + '{:.1f}'.format(1e6*sum(t_call)/len(t_call)))
+		print('\tframe latency p50/p99 (ms) : ' + '{:.2f}'.format(1e3*percentile(latency,50)) + ' / ' + '{:.2f}'.format(1e3*percentile(latency,99)))
+		mcu.serial.close()
+		mcu.serial = None
+		fake_teensy.close()
+
+#######################################################
+################# serial reader thread ################
+#######################################################
+
+def benchmark_serial_reader_thread(duration_s=5,gui_stall_ms=30,gui_stall_interval_ms=250):
+	print('--- latency from frame sent to MCU state update, 50 frames/s, GUI thread blocked for ' + str(gui_stall_ms) + ' ms every ' + str(gui_stall_interval_ms) + ' ms ---')
+	app = get_qt_application()
+	# simulate slow repaints/dialogs on the GUI thread
+	timer_gui_load = QTimer()
+	timer_gui_load.setInterval(gui_stall_interval_ms)
+	timer_gui_load.timeout.connect(lambda: time.sleep(gui_stall_ms/1000))
+	timer_gui_load.start()
+	for use_reader_thread in [False,True]:
+		fake_teensy = FakeTeensyPty(50)
+		mcu = controllers.Microcontroller(port=fake_teensy.port,telemetry_period_ms=None)
+		fluidController = controllers.FluidController(mcu,use_reader_thread=use_reader_thread)
+		latency_ms = []
+		process_microcontroller_message = fluidController._process_microcontroller_message
+		def process_and_record(msg,*args):
+			process_microcontroller_message(msg,*args)
+			latency_ms.append(1000*(time.perf_counter()-fake_teensy.t_sent[frame_counter(msg)]))
+		fluidController._process_microcontroller_message = process_and_record
+		fake_teensy.start(int(50*duration_s))
+		run_qt_event_loop(duration_s+0.5)
+		fake_teensy.join()
+		fluidController.close()
+		print(('reader thread' if use_reader_thread else 'QTimer polling (' + str(TIMER_CHECK_MCU_STATE_INTERVAL_MS) + ' ms)') + 
+			': ' + str(len(latency_ms)) + ' frames, p50 ' + '{:.2f}'.format(percentile(latency_ms,50)) + ' ms, p99 ' + '{:.2f}'.format(percentile(latency_ms,99)) + ' ms')
+		print_histogram(latency_ms)
+		mcu.serial.close()
+		mcu.serial = None
+		fake_teensy.close()
+	timer_gui_load.stop()
+
+#######################################################
+################### message decoding ##################
+#######################################################
+
+def legacy_decode_mcu_message(msg):
+	# the per-field parsing that FluidController._check_microcontroller_state used to do
+	# (np.int16(x) wraps x >= 32768 on numpy 1.x but raises OverflowError on numpy 2.x, np.uint16(x).astype(np.int16) wraps on both)
+	measurement_pump_power = float((int(msg[10])<<8)+msg[11])/65535
+	_vacuum_raw  = controllers.constrain((int(msg[12])<<8) + msg[13],MCU_CONSTANTS._output_min,MCU_CONSTANTS._output_max)
+	_pressure_raw = controllers.constrain((int(msg[14])<<8) + msg[15],MCU_CONSTANTS._output_min,MCU_CONSTANTS._output_max)
+	measurement_pressure = (_pressure_raw - MCU_CONSTANTS._output_min) * (MCU_CONSTANTS._p_max - MCU_CONSTANTS._p_min) / (MCU_CONSTANTS._output_max - MCU_CONSTANTS._output_min) + MCU_CONSTANTS._p_min
+	measurement_vacuum = (_vacuum_raw - MCU_CONSTANTS._output_min) * (MCU_CONSTANTS._p_max - MCU_CONSTANTS._p_min) / (MCU_CONSTANTS._output_max - MCU_CONSTANTS._output_min) + MCU_CONSTANTS._p_min
+	flow_upstream = float(np.uint16((int(msg[18])<<8)+msg[19]).astype(np.int16))/MCU_CONSTANTS.SCALE_FACTOR_FLOW
+	volume_ul = (float(np.uint16((int(msg[21])<<8)+msg[22]).astype(np.int16))/65535)*MCU_CONSTANTS.VOLUME_UL_MAX
+	return measurement_pump_power, measurement_pressure, measurement_vacuum, flow_upstream, volume_ul
+
+def random_mcu_messages(num_frames):
+	return np.random.default_rng(0).integers(0,256,num_frames*MCU_MSG_LENGTH,dtype=np.uint8).tobytes()
+
+def benchmark_decoder(frame_counts=(1,100,100000)):
+	print('--- decoding of MCU messages ---')
+	for num_frames in frame_counts:
+		data = random_mcu_messages(num_frames)
+		frames = [data[i:i+MCU_MSG_LENGTH] for i in range(0,len(data),MCU_MSG_LENGTH)]
+		repeat = max(1,100000//num_frames)
+		t0 = time.perf_counter()
+		for k in range(repeat):
+			for frame in frames:
+				legacy_decode_mcu_message(frame)
+		t1 = time.perf_counter()
+		for k in range(repeat):
+			for frame in frames:
+				telemetry.decode_mcu_message(frame)
+		t2 = time.perf_counter()
+		for k in range(repeat):
+			telemetry.decode_mcu_messages(data)
+		t3 = time.perf_counter()
+		n = repeat*num_frames
+		print(str(num_frames) + ' frame(s): ns per frame - scalar (legacy, numpy scalars) ' + '{:.0f}'.format(1e9*(t1-t0)/n) + 
+			', scalar (python ints) ' + '{:.0f}'.format(1e9*(t2-t1)/n) + ', vectorized ' + '{:.0f}'.format(1e9*(t3-t2)/n))
+	# check that the decoders agree
+	data = random_mcu_messages(1000)
+	frames, calibrated = telemetry.decode_mcu_messages(data)
+	for i in range(1000):
+		decoded_msg = telemetry.decode_mcu_message(data[i*MCU_MSG_LENGTH:(i+1)*MCU_MSG_LENGTH])
+		legacy = legacy_decode_mcu_message(data[i*MCU_MSG_LENGTH:(i+1)*MCU_MSG_LENGTH])
+		# the legacy parsing wrapped volumes above VOLUME_UL_MAX/2 to negative values, the volume is unsigned (see firmware.ino)
+		volume_ul = ((data[i*MCU_MSG_LENGTH+21]*256 + data[i*MCU_MSG_LENGTH+22])/65535)*MCU_CONSTANTS.VOLUME_UL_MAX
+		assert np.allclose([decoded_msg.pump_power,decoded_msg.pressure,decoded_msg.vacuum,decoded_msg.flow_upstream,decoded_msg.volume_ul],legacy[:4] + (volume_ul,))
+		assert np.allclose([calibrated[key][i] for key in ['pump_power','pressure','vacuum','flow_upstream','volume_ul']],legacy[:4] + (volume_ul,))
+
+#######################################################
+################# telemetry recording #################
+#######################################################
+
+def legacy_log_measurement(measurement_file,timestamp,msg):
+	# the csv line that FluidController used to build for every message
+	decoded_msg = telemetry.decode_mcu_message(msg)
+	line = str(timestamp) + ',' + \
+		str(decoded_msg.uid) + ',' + \
+		str(decoded_msg.cmd) + ',' + \
+		str(decoded_msg.status) + ',' + \
+		str(decoded_msg.internal_program) + ',' + \
+		str(decoded_msg.valve_A_B_and_bubble_sensors) + ',' + \
+		str(decoded_msg.time_elapsed) + ',' + \
+		str(decoded_msg.selector_valve_position) + ',' + \
+		"{:.2f}".format(decoded_msg.pump_power) + ',' + \
+		"{:.2f}".format(decoded_msg.pressure) + ',' + \
+		"{:.2f}".format(decoded_msg.vacuum) + ',' + \
+		str(decoded_msg.bubble_sensor_1) + ',' + \
+		str(decoded_msg.bubble_sensor_2) + ',' + \
+		"{:.2f}".format(decoded_msg.flow_upstream) + ',' + \
+		"{:.2f}".format(decoded_msg.volume_ul) + '\n'
+	measurement_file.write(line)
+
+def benchmark_telemetry_recorder(duration_h=1,frame_rate_hz=50):
+	print('--- measurement logging: ' + str(duration_h) + ' h of ' + str(frame_rate_hz) + ' Hz telemetry ---')
+	num_frames = int(duration_h*3600*frame_rate_hz)
+	data = random_mcu_messages(num_frames)
+	frames = [data[i:i+MCU_MSG_LENGTH] for i in range(0,len(data),MCU_MSG_LENGTH)]
+	t_start = time.time()
+	with tempfile.TemporaryDirectory() as directory:
+		# csv (previous implementation), decoding included since it was needed to build the line
+		filename_csv = os.path.join(directory,'measurement.csv')
+		measurement_file = open(filename_csv,'w+')
+		t0 = time.process_time()
+		for i in range(num_frames):
+			legacy_log_measurement(measurement_file,t_start+i/frame_rate_hz,frames[i])
+			if i % 500 == 0:
+				measurement_file.flush()
+		measurement_file.close()
+		t_csv = time.process_time() - t0
+		# binary records
+		filename_tlm = os.path.join(directory,'measurement.tlm')
+		recorder = telemetry.TelemetryRecorder(filename_tlm)
+		t0 = time.process_time()
+		for i in range(num_frames):
+			recorder.record(t_start+i/frame_rate_hz,frames[i])
+		recorder.close()
+		t_tlm = time.process_time() - t0
+		# reading back
+		t0 = time.perf_counter()
+		timestamps, decoded_frames, calibrated = telemetry.decode_telemetry(telemetry.load_telemetry(filename_tlm))
+		t_load = time.perf_counter() - t0
+		assert len(timestamps) == num_frames and bytes(decoded_frames.tobytes()) == data
+		print('csv    : ' + '{:.1f}'.format(os.path.getsize(filename_csv)/1e6) + ' MB, CPU ' + '{:.2f}'.format(t_csv) + ' s')
+		print('binary : ' + '{:.1f}'.format(os.path.getsize(filename_tlm)/1e6) + ' MB, CPU ' + '{:.2f}'.format(t_tlm) + ' s (memory-map and decode: ' + '{:.2f}'.format(t_load) + ' s)')
+
+#######################################################
+############## sequence execution dead time ###########
+#######################################################
+
+class RecordingMicrocontrollerSimulation(controllers.Microcontroller_Simulation):
+	''' simulated MCU that records when commands are received and when they finish '''
+	def __init__(self,*args,**kwargs):
+		super().__init__(*args,**kwargs)
+		self.t_subsequence_finished = []
+		self.t_command_sent = []
+
+	def send_command(self,cmd):
+		self.t_command_sent.append(self.clock.now())
+		super().send_command(cmd)
+
+	def _simulation_update_cmd_execution_status(self):
+		self.t_subsequence_finished.append(self.cmd_execution_deadline)
+		super()._simulation_update_cmd_execution_status()
+
+def record_stopwatch_timeouts(fluidController):
+	stopwatch_timeout_callback = fluidController.engine._current_stopwatch_timeout_callback
+	def record_and_call():
+		fluidController.microcontroller.t_subsequence_finished.append(fluidController.engine.clock.now())
+		stopwatch_timeout_callback()
+	fluidController.engine._current_stopwatch_timeout_callback = record_and_call
+
+def poll_sequence_execution_state(fluidController,interval_ms=50):
+	''' reproduces the previous behavior - the sequence execution state is polled by a 50 ms timer instead of updated on events '''
+	fluidController.engine._advance_sequence_execution = lambda: None
+	fluidController.timer_update_sequence_execution_state = QTimer()
+	fluidController.timer_update_sequence_execution_state.setInterval(interval_ms)
+	fluidController.timer_update_sequence_execution_state.timeout.connect(fluidController.engine._update_sequence_execution_state)
+	fluidController.signal_sequences_execution_started.connect(fluidController.timer_update_sequence_execution_state.start)
+	fluidController.signal_sequences_execution_stopped.connect(fluidController.timer_update_sequence_execution_state.stop)
+
+def benchmark_sequence_dead_time(rounds=10,cmd_execution_time_s=0.1):
+	print('--- dead time between subsequences: ' + str(rounds) + ' rounds of PBST Wash (no incubation), simulated MCU commands take ' + str(cmd_execution_time_s) + ' s ---')
+	app = get_qt_application()
+	for name, polled in [('polled every 50 ms (legacy)',True),('event driven',False)]:
+		mcu = RecordingMicrocontrollerSimulation(cmd_execution_time_s)
+		fluidController = controllers.FluidController(mcu)
+		mcu.t_command_sent.clear() # the CLEAR command sent by the constructor is not part of the sequences
+		record_stopwatch_timeouts(fluidController)
+		if polled:
+			poll_sequence_execution_state(fluidController)
+		for i in range(rounds):
+			fluidController.add_sequence('PBST Wash',fluidic_port=1,flow_time_s=1,incubation_time_min=0,aspiration_pump_power=0.5,aspiration_time_s=1,round_=i)
+		t_start = time.perf_counter()
+		fluidController.start_sequence_execution()
+		while fluidController.engine.sequences_in_progress:
+			app.processEvents(QEventLoop.AllEvents,10)
+		t_total = time.perf_counter() - t_start
+		fluidController.close()
+		# dead time: from the end of a subsequence (MCU command or stopwatch) to the next command sent to the MCU
+		dead_time_ms = []
+		for t_sent in mcu.t_command_sent[1:]:
+			dead_time_ms.append(1000*(t_sent - max(t for t in mcu.t_subsequence_finished if t <= t_sent)))
+		print(name + ': total ' + '{:.2f}'.format(t_total) + ' s for ' + str(len(mcu.t_command_sent)) + ' commands, dead time mean ' + '{:.1f}'.format(sum(dead_time_ms)/len(dead_time_ms)) + 
+			' ms, p50 ' + '{:.1f}'.format(percentile(dead_time_ms,50)) + ' ms, max ' + '{:.1f}'.format(max(dead_time_ms)) + ' ms')
+
+#######################################################
+#################### virtual clock ####################
+#######################################################
+
+class RecordingSequenceEngineListener(engine.SequenceEngineListener):
+	''' records (time since start, message without the time stamp) '''
+	def __init__(self,clock):
+		self.clock = clock
+		self.t_start = clock.wall_time()
+		self.messages = []
+
+	def on_log_message(self,message):
+		self.messages.append((self.clock.wall_time()-self.t_start,message.split(' : ',1)[1]))
+
+def add_sequences(sequence_engine,sequences,aspiration_pump_power=0.4,aspiration_time_s=8,volume_ul=None,aspiration_mode=None):
+	for sequence_name, repeat, incubation_time_min, flow_time_s in sequences:
+		for k in range(repeat):
+			sequence_engine.add_sequence(sequence_name,engine.SEQUENCE_FLUIDIC_PORT[sequence_name],flow_time_s,incubation_time_min,
+				aspiration_pump_power=aspiration_pump_power,aspiration_time_s=aspiration_time_s,round_=k,volume_ul=volume_ul,aspiration_mode=aspiration_mode)
+
+def benchmark_virtual_clock():
+	# (sequence name, repeat, incubation time (min), flow time (s))
+	short_protocol = [('PBST Wash',2,0.02,15),('Add Imaging Buffer',1,-1,15)]
+	starmap_cycle = [('Stripping Buffer Wash',2,10,15),('Stripping Buffer Rinse',1,0.5,15),('PBST Wash',3,5,15),('Ligate',3,180,15),
+		('Wash (Post Ligation, 1)',2,10,15),('Stain with DAPI',1,10,15),('Wash (Post Ligation, 2)',2,10,15),('Add Imaging Buffer',1,-1,15)]
+	print('--- virtual clock: a short protocol in real time and on the virtual clock, then a full STARmap cycle ---')
+	runs = {}
+	for name in ['real time','virtual clock']:
+		clock = engine.AsyncioClock() if name == 'real time' else engine.VirtualClock()
+		with contextlib.redirect_stdout(io.StringIO()):
+			mcu = controllers.Microcontroller_Simulation(cmd_execution_time_s=0.3,clock=clock)
+			listener = RecordingSequenceEngineListener(clock)
+			sequence_engine = engine.SequenceEngine(mcu,clock,listener)
+			add_sequences(sequence_engine,short_protocol)
+			t0 = time.perf_counter()
+			if name == 'real time':
+				asyncio.run(engine.run_sequences(sequence_engine))
+			else:
+				engine.run_sequences_virtual(sequence_engine)
+			t_run = time.perf_counter() - t0
+		runs[name] = listener.messages
+		print(name + ': ' + str(len(listener.messages)) + ' log messages, simulated ' + '{:.2f}'.format(listener.messages[-1][0]) + ' s in ' + '{:.1f}'.format(1000*t_run) + ' ms')
+	same_order = [m for t, m in runs['real time']] == [m for t, m in runs['virtual clock']]
+	max_time_difference = max(abs(a[0]-b[0]) for a, b in zip(runs['real time'],runs['virtual clock']))
+	print('same log messages in the same order: ' + str(same_order) + ', max difference in time stamps: ' + '{:.3f}'.format(max_time_difference) + ' s')
+	clock = engine.VirtualClock()
+	with contextlib.redirect_stdout(io.StringIO()):
+		mcu = controllers.Microcontroller_Simulation(clock=clock)
+		listener = RecordingSequenceEngineListener(clock)
+		sequence_engine = engine.SequenceEngine(mcu,clock,listener)
+		add_sequences(sequence_engine,starmap_cycle)
+		t0 = time.perf_counter()
+		t_simulated = engine.run_sequences_virtual(sequence_engine)
+		t_run = time.perf_counter() - t0
+	print('STARmap cycle: ' + str(len(listener.messages)) + ' log messages, simulated ' + '{:.1f}'.format(t_simulated/3600) + ' h in ' + '{:.1f}'.format(1000*t_run) + ' ms')
+
+#######################################################
+################## simulated firmware #################
+#######################################################
+
+def benchmark_firmware_pty():
+	print('--- simulated firmware: a PBST wash through a pseudo-terminal, controllers.Microcontroller + SequenceEngine ---')
+	firmware_pty = simulation.FirmwarePty()
+	telemetry_file = os.path.join(tempfile.mkdtemp(),'firmware_pty.tlm')
+	with contextlib.redirect_stdout(io.StringIO()):
+		mcu = controllers.Microcontroller(port=firmware_pty.port)
+		firmware_pty.start()
+		clock = engine.AsyncioClock()
+		listener = RecordingSequenceEngineListener(clock)
+		measurement_recorder = telemetry.TelemetryRecorder(telemetry_file)
+		sequence_engine = engine.SequenceEngine(mcu,clock,listener,measurement_recorder)
+		add_sequences(sequence_engine,[('PBST Wash',1,0.05,10)],aspiration_pump_power=1,aspiration_time_s=6)
+		t0 = time.perf_counter()
+		asyncio.run(engine.run_sequences(sequence_engine))
+		t_run = time.perf_counter() - t0
+		measurement_recorder.close()
+		firmware_pty.close()
+	timestamps, frames, calibrated = telemetry.decode_telemetry(telemetry.load_telemetry(telemetry_file))
+	gaps_ms = 1000*np.diff(timestamps)
+	print('run time: ' + '{:.1f}'.format(t_run) + ' s, frames sent: ' + str(firmware_pty.firmware.frames_sent) + ', received: ' + str(len(frames)) + ' (' + str(mcu.rx_frames_dropped) + ' dropped by the host, ' + str(firmware_pty.frames_dropped) + ' by the firmware)')
+	print('frame interval: median ' + '{:.1f}'.format(np.median(gaps_ms)) + ' ms, p99 ' + '{:.1f}'.format(np.percentile(gaps_ms,99)) + ' ms, max ' + '{:.1f}'.format(gaps_ms.max()) + ' ms')
+	print('internal programs: ' + str(sorted(set(frames['internal_program'].tolist()))) + ', final status: ' + str(frames['status'][-1]))
+	print('max pressure: ' + '{:.2f}'.format(calibrated['pressure'].max()) + ' psi, min vacuum: ' + '{:.2f}'.format(calibrated['vacuum'].min()) + ' psi, max flow: ' + '{:.0f}'.format(calibrated['flow_upstream'].max()) + ' ul/min, max volume: ' + '{:.0f}'.format(calibrated['volume_ul'].max()) + ' ul')
+	print('bubble sensor transitions: downstream ' + str(np.count_nonzero(np.diff(calibrated['bubble_sensor_1'].astype(int)))) + ', upstream ' + str(np.count_nonzero(np.diff(calibrated['bubble_sensor_2'].astype(int)))))
+	for t, message in listener.messages:
+		print('{:6.2f}'.format(t) + ' s ' + message)
+
+#######################################################
+############## serial transports end to end ###########
+#######################################################
+
+def benchmark_transports(duration_s=3,command_interval_ms=10,baudrate=2000000):
+	# the fake firmware sends frames back to back at the line rate, numbered in bytes 23-24; a no-op command (SET_SOLENOID_VALVE_C)
+	# is sent every command_interval_ms, its round trip ends when the first frame with its UID arrives
+	frame_interval_ms = 1000*MCU_MSG_LENGTH*10/baudrate # 8N1
+	print('--- serial transports: fake firmware at the ' + str(baudrate/1e6) + ' Mbaud line rate (' + '{:.0f}'.format(1000/frame_interval_ms) + ' frames/s offered), ' + str(duration_s) + ' s each ---')
+	for url in ['pty://','socket://','loop://']:
+		with contextlib.redirect_stdout(io.StringIO()):
+			mcu = controllers.Microcontroller(port=url + '?frame_interval_ms=' + str(frame_interval_ms) + '&mark_frames=1',telemetry_period_ms=None)
+		# skip the frames queued before the port was opened
+		t_end = time.perf_counter() + 0.2
+		while time.perf_counter() < t_end:
+			mcu.read_received_packets(0.01)
+		cmd_packet = engine.Microcontroller_Command(CMD_SET.SET_SOLENOID_VALVE_C).get_ready_to_decorate_cmd_packet()
+		uid = 0
+		t_command_sent = {}
+		round_trip = []
+		counters = []
+		t_start = time.perf_counter()
+		t_next_command = t_start
+		while time.perf_counter() < t_start + duration_s:
+			if time.perf_counter() >= t_next_command:
+				uid = uid % 65535 + 1
+				cmd_packet[0] = uid >> 8
+				cmd_packet[1] = uid & 0xff
+				t_command_sent[uid] = time.perf_counter()
+				mcu.send_command(cmd_packet)
+				t_next_command = t_next_command + command_interval_ms/1000
+			frames = mcu.read_received_packets(command_interval_ms/1000)
+			t_received = time.perf_counter()
+			for frame in frames:
+				counters.append((frame[23] << 8) + frame[24])
+				frame_uid = (frame[0] << 8) + frame[1]
+				if frame_uid in t_command_sent:
+					round_trip.append(t_received - t_command_sent.pop(frame_uid))
+		t_run = time.perf_counter() - t_start
+		mcu.close()
+		gaps = (np.diff(np.array(counters,dtype=np.int64)) - 1) % 65536
+		frames_expected = len(counters) + int(gaps.sum())
+		round_trip_ms = [1000*t for t in round_trip]
+		print(url + '\t' + '{:.0f}'.format(len(counters)/t_run) + ' frames/s, loss ' + '{:.3f}'.format(100*gaps.sum()/frames_expected) + ' %, '
+			+ 'round trip median ' + '{:.2f}'.format(percentile(round_trip_ms,50)) + ' ms, p99 ' + '{:.2f}'.format(percentile(round_trip_ms,99)) + ' ms ('
+			+ str(len(round_trip)) + ' commands, ' + str(len(t_command_sent)) + ' without reply)')
+
+#######################################################
+################# MCU state display ###################
+#######################################################
+
+class LegacyMCUStateSignals(QObject):
+	''' one signal per displayed value, emitted for every MCU message (as FluidController did before signal_mcu_state) '''
+	signal_MCU_CMD_UID = Signal(int)
+	signal_MCU_CMD = Signal(int)
+	signal_MCU_CMD_status = Signal(str)
+	signal_MCU_internal_program = Signal(str)
+	signal_MCU_CMD_time_elapsed = Signal(int)
+	signal_pump_power = Signal(str)
+	signal_selector_valve_position = Signal(int)
+	signal_pressure = Signal(str)
+	signal_vacuum = Signal(str)
+	signal_bubble_sensor_1 = Signal(bool)
+	signal_bubble_sensor_2 = Signal(bool)
+	signal_flow_upstream = Signal(str)
+	signal_volume_ul = Signal(str)
+
+	def connect_to(self,widget):
+		self.signal_MCU_CMD_UID.connect(widget.label_MCU_CMD_UID.setNum)
+		self.signal_MCU_CMD.connect(widget.label_CMD.setNum)
+		self.signal_MCU_CMD_status.connect(widget.label_CMD_status.setText)
+		self.signal_MCU_internal_program.connect(widget.label_MCU_internal_program.setText)
+		self.signal_MCU_CMD_time_elapsed.connect(widget.label_MCU_CMD_time_elapsed.setNum)
+		self.signal_pump_power.connect(widget.label_pump_power.setText)
+		self.signal_selector_valve_position.connect(widget.label_selector_valve_position.setNum)
+		self.signal_pressure.connect(widget.label_pressure.setText)
+		self.signal_vacuum.connect(widget.label_vacuum.setText)
+		self.signal_bubble_sensor_1.connect(widget.label_bubble_sensor_downstream.setNum)
+		self.signal_bubble_sensor_2.connect(widget.label_bubble_sensor_upstream.setNum)
+		self.signal_flow_upstream.connect(widget.label_flowrate_upstream.setText)
+		self.signal_volume_ul.connect(widget.label_dispensed_volume.setText)
+
+	def on_mcu_message(self,decoded_msg):
+		self.signal_MCU_CMD_UID.emit(decoded_msg.uid)
+		self.signal_MCU_CMD.emit(decoded_msg.cmd)
+		self.signal_MCU_CMD_status.emit(str(decoded_msg.status))
+		self.signal_MCU_internal_program.emit(MCU_INTERNAL_PROGRAMS[decoded_msg.internal_program])
+		self.signal_MCU_CMD_time_elapsed.emit(decoded_msg.time_elapsed)
+		self.signal_pump_power.emit('{:.2f}'.format(decoded_msg.pump_power))
+		self.signal_selector_valve_position.emit(decoded_msg.selector_valve_position)
+		self.signal_pressure.emit('{:.2f}'.format(decoded_msg.pressure))
+		self.signal_vacuum.emit('{:.2f}'.format(decoded_msg.vacuum))
+		self.signal_bubble_sensor_1.emit(decoded_msg.bubble_sensor_1>0)
+		self.signal_bubble_sensor_2.emit(decoded_msg.bubble_sensor_2>0)
+		self.signal_flow_upstream.emit('{:.1f}'.format(decoded_msg.flow_upstream))
+		self.signal_volume_ul.emit('{:.1f}'.format(decoded_msg.volume_ul))
+
+def benchmark_mcu_state_display(duration_s=5,frame_rate_hz=100):
+	print('--- GUI thread CPU time with the MCU state display shown, fake firmware at ' + str(frame_rate_hz) + ' frames/s, reader thread ---')
+	app = get_qt_application()
+	import widgets
+	display_widgets = [] # deleted at the end, after the queued signals of all the runs have been delivered
+	for name in ['per-frame signals (legacy)','coalesced snapshot at ' + str(MCU_STATE_DISPLAY_RATE_HZ) + ' Hz']:
+		with contextlib.redirect_stdout(io.StringIO()):
+			mcu = controllers.Microcontroller(port='loop://?frame_interval_ms=' + str(1000/frame_rate_hz),telemetry_period_ms=None)
+			fluidController = controllers.FluidController(mcu,use_reader_thread=True)
+		display_widget = widgets.MicrocontrollerStateDisplayWidget()
+		display_widgets.append(display_widget)
+		display_widget.show()
+		if name.startswith('per-frame'):
+			legacy_signals = LegacyMCUStateSignals()
+			legacy_signals.connect_to(display_widget)
+			fluidController.on_mcu_message = legacy_signals.on_mcu_message
+		else:
+			fluidController.signal_mcu_state.connect(display_widget.update_state)
+		run_qt_event_loop(0.5)
+		t_cpu_0 = time.thread_time()
+		frames_0 = mcu.rx_frames_parsed
+		run_qt_event_loop(duration_s)
+		t_cpu = time.thread_time() - t_cpu_0
+		frames = mcu.rx_frames_parsed - frames_0
+		with contextlib.redirect_stdout(io.StringIO()):
+			fluidController.close()
+			mcu.close()
+		display_widget.close()
+		print(name + ': ' + str(frames) + ' frames, GUI thread CPU ' + '{:.1f}'.format(100*t_cpu/duration_s) + ' % (' + '{:.0f}'.format(1e6*t_cpu/frames) + ' us per frame)')
+
+#######################################################
+###################### log view #######################
+#######################################################
+
+def rss_mb():
+	# resident memory of this process (linux)
+	with open('/proc/self/statm') as f:
+		return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/1e6
+
+def benchmark_log_view(number_of_messages=1000000,legacy_number_of_messages=2000,process_events_interval=1000):
+	# QListWidget lays out all the items on scrollToBottom(), the cost per message grows with the log - it is run on fewer messages
+	print('--- log view: messages appended to the shown log, Qt events processed every ' + str(process_events_interval) + ' messages ---')
+	app = get_qt_application()
+	import widgets
+	messages = [utils.timestamp() + ('! ' if i % 100 == 0 else '') + 'Execute PBST Wash, round ' + str(i) for i in range(number_of_messages)]
+	for name in ['QListWidget (legacy)','LogWidget']:
+		n = legacy_number_of_messages if name == 'QListWidget (legacy)' else number_of_messages
+		rss_start = rss_mb()
+		if name == 'LogWidget':
+			log_widget = widgets.LogWidget()
+			log = log_widget.log
+		else:
+			log_widget = QListWidget()
+			def log(message):
+				log_widget.addItem(message)
+				log_widget.scrollToBottom()
+		log_widget.show()
+		t_call = []
+		t0 = time.perf_counter()
+		for i in range(n):
+			t1 = time.perf_counter()
+			log(messages[i])
+			if i % process_events_interval == 0:
+				app.processEvents()
+			t_call.append(time.perf_counter()-t1)
+		if name == 'LogWidget':
+			log_widget.model.flush()
+		app.processEvents()
+		t_run = time.perf_counter() - t0
+		rows = log_widget.model.rowCount() if name == 'LogWidget' else log_widget.count()
+		print(name + ': ' + str(n) + ' messages, ' + '{:.0f}'.format(n/t_run) + ' messages/s, last 1000 messages ' + '{:.1f}'.format(1e6*sum(t_call[-1000:])/1000) + ' us each, '
+			+ str(rows) + ' rows kept, memory +' + '{:.0f}'.format(rss_mb()-rss_start) + ' MB')
+		if name == 'LogWidget':
+			t0 = time.perf_counter()
+			log_widget.entry_search.setText('round 99999')
+			app.processEvents()
+			t_filter = time.perf_counter() - t0
+			print('filter by text: ' + str(log_widget.view.model().rowCount()) + ' rows in ' + '{:.0f}'.format(1000*t_filter) + ' ms')
+			log_widget.entry_search.setText('')
+			t0 = time.perf_counter()
+			for i in range(1000):
+				log_widget.set_status('[ stop watch remaining time: ' + str(i) + ' seconds ]')
+			app.processEvents()
+			print('status row updates: ' + '{:.1f}'.format(1000*(time.perf_counter()-t0)) + ' us each')
+		log_widget.close()
+		log_widget.deleteLater()
+		app.processEvents()
+		del log_widget
+
+#######################################################
+###################### log file #######################
+#######################################################
+
+def legacy_log(log_file,log_message):
+	# controllers.Logger.log before the background writer
+	log_file.write(log_message + '\n')
+
+def benchmark_log_file(number_of_messages=100000,max_bytes=1024*1024):
+	print('--- log file: time spent in log() on the calling thread for ' + str(number_of_messages) + ' messages ---')
+	messages = [utils.timestamp() + ('! ' if i % 100 == 0 else '') + 'Execute PBST Wash, round ' + str(i) for i in range(number_of_messages)]
+	directory = tempfile.mkdtemp()
+	filename = os.path.join(directory,'legacy logs.txt')
+	log_file = open(filename,'a')
+	t_call = []
+	for message in messages:
+		t0 = time.perf_counter()
+		legacy_log(log_file,message)
+		t_call.append(time.perf_counter()-t0)
+	# what a crash 0.5 s after the last message would lose
+	time.sleep(0.5)
+	bytes_not_on_disk = sum(len(message)+1 for message in messages) - os.path.getsize(filename)
+	t0 = time.perf_counter()
+	log_file.close()
+	t_close = time.perf_counter() - t0
+	print('synchronous write (legacy): ' + '{:.2f}'.format(1e6*np.mean(t_call)) + ' us per message, p99.9 ' + '{:.1f}'.format(1e6*percentile(t_call,99.9)) + ' us, close ' + '{:.1f}'.format(1000*t_close) + ' ms, '
+		+ str(bytes_not_on_disk) + ' bytes not written 0.5 s after the last message')
+	messages = messages[:-1] + [messages[-1] + ' (last)']
+	for back_pressure in [LOG_FILE_BACK_PRESSURE.DROP,LOG_FILE_BACK_PRESSURE.WAIT,LOG_FILE_BACK_PRESSURE.BLOCK]:
+		filename = os.path.join(directory,back_pressure + ' logs.txt')
+		writer = logfile.LogFileWriter(filename,max_bytes=max_bytes,back_pressure=back_pressure)
+		t_call = []
+		for i, message in enumerate(messages):
+			t0 = time.perf_counter()
+			writer.write(message,utils.log_severity(message),'PBST Wash',i,i)
+			t_call.append(time.perf_counter()-t0)
+		time.sleep(0.5)
+		with open(writer.filename) as f:
+			last_message_on_disk = f.read().endswith('(last)\n')
+		t0 = time.perf_counter()
+		writer.close()
+		t_close = time.perf_counter() - t0
+		rotated_files = [f for f in os.listdir(directory) if f.startswith(back_pressure) and f.endswith('.gz')]
+		number_of_records = sum(len(logfile.load_log_records(os.path.join(directory,f))) for f in rotated_files if f.endswith('.jsonl.gz'))
+		number_of_records = number_of_records + len(logfile.load_log_records(writer.records_filename))
+		print('background writer (' + back_pressure + '): ' + '{:.2f}'.format(1e6*np.mean(t_call)) + ' us per message, p99.9 ' + '{:.1f}'.format(1e6*percentile(t_call,99.9)) + ' us, close ' + '{:.1f}'.format(1000*t_close) + ' ms, '
+			+ str(writer.messages_dropped) + ' dropped, ' + str(number_of_records) + ' records on disk, ' + str(writer.number_of_rotations) + ' rotations (compressed), last message on disk 0.5 s after it was logged: ' + str(last_message_on_disk))
+
+#######################################################
+##################### timestamps ######################
+#######################################################
+
+def legacy_timestamp(t=None):
+	# utils.timestamp before the cached prefix
+	return (datetime.now() if t is None else datetime.fromtimestamp(t)).strftime('%Y/%m/%d %H:%M:%S') + ' : '
+
+def legacy_print_message_prefix():
+	# utils.print_message before the cached prefix (without the print)
+	return datetime.now().strftime('%m/%d %H:%M:%S') + ' : '
+
+def benchmark_timestamp(calls_per_s=10000,duration_s=60):
+	print('--- timestamps: cost per call at ' + str(calls_per_s) + ' calls/s ---')
+	n = calls_per_s*duration_s
+	t_start = time.time()
+	times = [t_start + i/calls_per_s for i in range(n)]
+	for t in times[::997]:
+		assert utils.timestamp(t) == legacy_timestamp(t)
+	cases = [('timestamp(t), legacy',legacy_timestamp,times),('timestamp(t), cached prefix',utils.timestamp,times),
+		('timestamp(), legacy',legacy_timestamp,None),('timestamp(), cached prefix',utils.timestamp,None),
+		('print_message prefix, legacy',legacy_print_message_prefix,None),('now() (monotonic, wall-clock)',utils.now,None)]
+	for name, function, arguments in cases:
+		t0 = time.perf_counter()
+		if arguments is None:
+			for i in range(n):
+				function()
+		else:
+			for t in arguments:
+				function(t)
+		t_call = (time.perf_counter()-t0)/n
+		print(name + ': ' + '{:.0f}'.format(1e9*t_call) + ' ns per call, ' + '{:.2f}'.format(100*t_call*calls_per_s) + ' % of one core at ' + str(calls_per_s) + ' calls/s')
+
+#######################################################
+######################## plans ########################
+#######################################################
+
+def legacy_queue_sequences(sequences,aspiration_pump_power=0.4,aspiration_time_s=8):
+	# SequenceEngine.add_sequence before the plans: one Sequence (and queue of subsequences) per round
+	queue_sequence = queue.Queue()
+	for sequence_name, repeat, incubation_time_min, flow_time_s in sequences:
+		for k in range(repeat):
+			queue_sequence.put(engine.Sequence(sequence_name,engine.SEQUENCE_FLUIDIC_PORT[sequence_name],flow_time_s,incubation_time_min,None,aspiration_pump_power,aspiration_time_s,k))
+	return queue_sequence
+
+def compile_plan(sequences,aspiration_pump_power=0.4,aspiration_time_s=8):
+	compiler = engine.PlanCompiler()
+	for sequence_name, repeat, incubation_time_min, flow_time_s in sequences:
+		compiler.add_sequence(sequence_name,engine.SEQUENCE_FLUIDIC_PORT[sequence_name],flow_time_s,incubation_time_min,
+			aspiration_pump_power=aspiration_pump_power,aspiration_time_s=aspiration_time_s,round_=0,repeat=repeat)
+	return compiler.compile()
+
+def benchmark_plan(number_of_cycles=20):
+	# a run of STARmap cycles: (sequence name, repeat, incubation time (min), flow time (s))
+	starmap_cycle = [('Stripping Buffer Wash',2,10,15),('Stripping Buffer Rinse',1,0.5,15),('PBST Wash',3,5,15),('Ligate',3,180,15),
+		('Wash (Post Ligation, 1)',2,10,15),('Stain with DAPI',1,10,15),('Wash (Post Ligation, 2)',2,10,15),('Add Imaging Buffer',1,-1,15)]
+	run = [(sequence_name,number_of_cycles*repeat,incubation_time_min,flow_time_s) for sequence_name, repeat, incubation_time_min, flow_time_s in starmap_cycle]
+	print('--- plans: queueing a run of ' + str(number_of_cycles) + ' STARmap cycles (' + str(sum(r[1] for r in run)) + ' sequences) ---')
+	t0 = time.perf_counter()
+	queue_sequence = legacy_queue_sequences(run)
+	t_legacy = time.perf_counter() - t0
+	t0 = time.perf_counter()
+	plan = compile_plan(run)
+	t_compile = time.perf_counter() - t0
+	print('one Sequence per round (legacy): ' + '{:.1f}'.format(1000*t_legacy) + ' ms, ' + str(queue_sequence.qsize()) + ' sequences')
+	print('plan compiler: ' + '{:.1f}'.format(1000*t_compile) + ' ms, ' + str(len(plan)) + ' steps, expected duration ' + '{:.1f}'.format(plan.duration_s()/3600) + ' h')
+	# execute on the virtual clock, the ETA is queried at every step
+	clock = engine.VirtualClock()
+	with contextlib.redirect_stdout(io.StringIO()):
+		mcu = controllers.Microcontroller_Simulation(cmd_execution_time_s=1,clock=clock)
+		sequence_engine = engine.SequenceEngine(mcu,clock,engine.SequenceEngineListener())
+	sequence_engine.add_plan(plan)
+	t_eta = []
+	eta_errors = []
+	def on_log_message(message):
+		t0 = time.perf_counter()
+		time_remaining = sequence_engine.time_remaining()
+		t_eta.append(time.perf_counter()-t0)
+		if time_remaining is not None:
+			eta_errors.append((clock.now(),time_remaining))
+	sequence_engine.listener.on_log_message = on_log_message
+	t0 = time.perf_counter()
+	with contextlib.redirect_stdout(io.StringIO()):
+		t_simulated = engine.run_sequences_virtual(sequence_engine)
+	t_run = time.perf_counter() - t0
+	eta_error = max(abs(t_simulated - t - time_remaining) for t, time_remaining in eta_errors)
+	print('execution: ' + '{:.1f}'.format(t_simulated/3600) + ' h simulated in ' + '{:.0f}'.format(1000*t_run) + ' ms, ' + '{:.1f}'.format(1e6*t_run/len(plan)) + ' us per step (incl. MCU simulation and polling)')
+	print('ETA: ' + '{:.1f}'.format(1e6*np.mean(t_eta)) + ' us per query, max error ' + '{:.0f}'.format(eta_error) + ' s (simulated MCU commands take 1 s)')
+	filename = os.path.join(tempfile.mkdtemp(),'plan.jsonl')
+	t0 = time.perf_counter()
+	plan.save(filename)
+	t_save = time.perf_counter() - t0
+	t0 = time.perf_counter()
+	engine.load_plan(filename)
+	t_load = time.perf_counter() - t0
+	print('plan file: ' + '{:.0f}'.format(os.path.getsize(filename)/1024) + ' kB, save ' + '{:.1f}'.format(1000*t_save) + ' ms, load ' + '{:.1f}'.format(1000*t_load) + ' ms')
+
+#######################################################
+################## sequence builders ##################
+#######################################################
+
+def benchmark_sequence_builder():
+	# rounds of a STARmap cycle: (sequence name, incubation time (min), flow time (s))
+	cycle = [('Stripping Buffer Wash',10,15),('Stripping Buffer Wash',10,15),('Stripping Buffer Rinse',0.5,15),('PBST Wash',5,15),('PBST Wash',5,15),('PBST Wash',5,15),
+		('Ligate',180,15),('Ligate',180,15),('Ligate',180,15),('Wash (Post Ligation, 1)',10,15),('Wash (Post Ligation, 1)',10,15),('Stain with DAPI',10,15),
+		('Wash (Post Ligation, 2)',10,15),('Wash (Post Ligation, 2)',10,15),('Add Imaging Buffer',-1,15)]
+	print('--- sequence builders: cost per sequence of building protocols, one sequence at a time ---')
+	for number_of_sequences in [10,100,1000,10000]:
+		protocol = [cycle[i % len(cycle)] for i in range(number_of_sequences)]
+		results = []
+		# builder called for every sequence (no memoization) / memoized definitions / Sequence objects / compiled into a plan
+		t0 = time.perf_counter()
+		for sequence_name, incubation_time_min, flow_time_s in protocol:
+			engine.SEQUENCE_BUILDERS[sequence_name](engine.SEQUENCE_FLUIDIC_PORT[sequence_name],flow_time_s,incubation_time_min,None,0.4,8,None,None)
+		results.append(('builder',time.perf_counter()-t0))
+		engine.build_sequence.cache_clear()
+		t0 = time.perf_counter()
+		for sequence_name, incubation_time_min, flow_time_s in protocol:
+			engine.build_sequence(sequence_name,engine.SEQUENCE_FLUIDIC_PORT[sequence_name],flow_time_s,incubation_time_min,None,0.4,8)
+		results.append(('memoized',time.perf_counter()-t0))
+		t0 = time.perf_counter()
+		for k, (sequence_name, incubation_time_min, flow_time_s) in enumerate(protocol):
+			engine.Sequence(sequence_name,engine.SEQUENCE_FLUIDIC_PORT[sequence_name],flow_time_s,incubation_time_min,None,0.4,8,k)
+		results.append(('Sequence',time.perf_counter()-t0))
+		t0 = time.perf_counter()
+		compiler = engine.PlanCompiler()
+		for k, (sequence_name, incubation_time_min, flow_time_s) in enumerate(protocol):
+			compiler.add_sequence(sequence_name,engine.SEQUENCE_FLUIDIC_PORT[sequence_name],flow_time_s,incubation_time_min,None,0.4,8,k)
+		plan = compiler.compile()
+		results.append(('plan',time.perf_counter()-t0))
+		print(str(number_of_sequences) + ' sequences (' + str(len(plan)) + ' plan steps): ' + ', '.join([name + ' ' + '{:.2f}'.format(1e6*t/number_of_sequences) + ' us' for name, t in results]))
+	print('memoized definitions: ' + str(engine.build_sequence.cache_info()))
+
+#######################################################
+################## command encoding ###################
+#######################################################
+
+def legacy_format_command(mcu_command):
+	# Microcontroller_Command._format_command before the struct encoder
+	cmd_packet = bytearray(MCU_CMD_LENGTH)
+	cmd_packet[2] = mcu_command.cmd
+	cmd_packet[3] = mcu_command.payload1
+	cmd_packet[4] = int(mcu_command.payload2)
+	cmd_packet[5] = int(mcu_command.payload3) >> 8
+	cmd_packet[6] = int(mcu_command.payload3) & 0xff
+	cmd_packet[7] = int(mcu_command.payload4) >> 24
+	cmd_packet[8] = (int(mcu_command.payload4) >> 16) & 0xff
+	cmd_packet[9] = (int(mcu_command.payload4) >> 8) & 0xff
+	cmd_packet[10] = int(mcu_command.payload4) & 0xff
+	return cmd_packet
+
+def legacy_add_uid(cmd_packet,command_UID):
+	cmd_packet[0] = command_UID >> 8
+	cmd_packet[1] = command_UID & 0xff
+	return cmd_packet
+
+def benchmark_command_encoder(number_of_packets=200000):
+	print('--- command encoder: ' + str(number_of_packets) + ' command packets with UID ---')
+	commands = [engine.Microcontroller_Command(CMD_SET.ADD_MEDIUM,MCU_CMD_PARAMETERS.CONSTANT_PRESSURE,i % 12,0.72*65535,15000) for i in range(100)]
+	commands = [commands[i % len(commands)] for i in range(number_of_packets)]
+	packets_legacy = []
+	t0 = time.perf_counter()
+	for uid, mcu_command in enumerate(commands):
+		packets_legacy.append(bytes(legacy_add_uid(legacy_format_command(mcu_command),uid & 0xffff)))
+	t_legacy = time.perf_counter() - t0
+	# packing every packet (no cache)
+	encode = engine.encode_mcu_command.__wrapped__
+	packets = []
+	t0 = time.perf_counter()
+	for uid, mcu_command in enumerate(commands):
+		packet = bytearray(encode(mcu_command.cmd,mcu_command.payload1,mcu_command.payload2,mcu_command.payload3,mcu_command.payload4))
+		engine.MCU_CMD_UID_STRUCT.pack_into(packet,0,uid & 0xffff)
+		packets.append(bytes(packet))
+	t_struct = time.perf_counter() - t0
+	assert packets == packets_legacy
+	# cached body copied to the reusable send buffer, only the UID is packed (as in SequenceEngine._send_mcu_command)
+	tx_packet = bytearray(MCU_CMD_LENGTH)
+	tx_packet_view = memoryview(tx_packet)
+	packets = []
+	t0 = time.perf_counter()
+	for uid, mcu_command in enumerate(commands):
+		tx_packet_view[:] = mcu_command.packet
+		engine.MCU_CMD_UID_STRUCT.pack_into(tx_packet,0,uid & 0xffff)
+		packets.append(bytes(tx_packet))
+	t_cached = time.perf_counter() - t0
+	assert packets == packets_legacy
+	for name, t in [('byte by byte (legacy)',t_legacy),('struct, packed per command',t_struct),('struct, cached body + UID',t_cached)]:
+		print(name + ': ' + '{:.2f}'.format(1e6*t/number_of_packets) + ' us per packet, ' + '{:.2f}'.format(number_of_packets/t/1e6) + ' M packets/s')
+
+#######################################################
+################# command pipelining ##################
+#######################################################
+
+def benchmark_command_pipelining(number_of_commands=48):
+	# a batch of manual-control commands (as queued from the manual control tab) against the simulated firmware through a pseudo-terminal,
+	# sent one at a time (window 1, the previous behavior) and pipelined
+	batch = [('Set Selector Valve Position',{'fluidic_port':1+i%24}) for i in range(number_of_commands//4)]
+	batch = batch + [('Set 10 mm Valve State',{'fluidic_port':i%17}) for i in range(number_of_commands//4)]
+	batch = batch + [('Set Pressure Loop P Coefficient',{'pressure_setting':0.1*i}) for i in range(number_of_commands//4)]
+	batch = batch + [('Set Pressure Loop I Coefficient',{'pressure_setting':0.1*i}) for i in range(number_of_commands - 3*(number_of_commands//4))]
+	print('--- command pipelining: ' + str(len(batch)) + ' manual-control commands, simulated firmware through a pseudo-terminal (status frame every ' + str(int(1000*simulation.SEND_UPDATE_INTERVAL_S)) + ' ms) ---')
+	for pipeline_window in [1,4,8,MCU_CMD_QUEUE_LENGTH]:
+		firmware_pty = simulation.FirmwarePty()
+		with contextlib.redirect_stdout(io.StringIO()):
+			mcu = controllers.Microcontroller(port=firmware_pty.port)
+			firmware_pty.start()
+			clock = engine.AsyncioClock()
+			listener = RecordingSequenceEngineListener(clock)
+			sequence_engine = engine.SequenceEngine(mcu,clock,listener,pipeline_window=pipeline_window)
+			for sequence_name, parameters in batch:
+				sequence_engine.add_sequence(sequence_name,**parameters)
+			t0 = time.perf_counter()
+			asyncio.run(engine.run_sequences(sequence_engine))
+			t_run = time.perf_counter() - t0
+			firmware_pty.close()
+		firmware = firmware_pty.firmware
+		# the last command of each type is the state left on the firmware
+		state = (firmware.selector_valve_position_setValue,firmware.NXP33996_state,round(firmware.pressure_loop_p_coefficient,3),round(firmware.pressure_loop_i_coefficient,3))
+		print('window ' + str(pipeline_window) + ': ' + '{:.3f}'.format(t_run) + ' s, ' + '{:.1f}'.format(1000*t_run/len(batch)) + ' ms per command, '
+			+ str(firmware.commands_dropped) + ' dropped by the firmware, final state (selector valve, 10 mm valves, P, I) ' + str(state))
+
+#######################################################
+################### frame parsing #####################
+#######################################################
+
+def corrupt_stream(frames,error,number_of_errors,rng):
+	''' joins the frames and applies number_of_errors errors of one kind at random frames, returns the corrupted stream '''
+	frame_indices = set(rng.sample(range(len(frames)),number_of_errors))
+	stream = bytearray()
+	for i, frame in enumerate(frames):
+		frame = bytearray(frame)
+		if i in frame_indices:
+			k = rng.randrange(len(frame))
+			if error == 'dropped byte':
+				del frame[k]
+			elif error == 'inserted byte':
+				frame.insert(k,rng.randrange(256))
+			elif error == 'bit flip':
+				frame[k] = frame[k] ^ (1 << rng.randrange(8))
+			elif error == 'garbage burst':
+				frame[k:k] = rng.randbytes(rng.randrange(1,64))
+		stream += frame
+	return bytes(stream)
+
+def parse_in_chunks(parse,stream,rng,max_chunk_size=512):
+	messages = []
+	i = 0
+	while i < len(stream):
+		n = rng.randrange(1,max_chunk_size)
+		messages.extend(parse(stream[i:i+n]))
+		i = i + n
+	return messages
+
+def legacy_frame_parser():
+	# frame format 1 - Microcontroller._parse_received_data(): consecutive 25-byte slices
+	rx_buffer = bytearray()
+	def parse(data):
+		rx_buffer.extend(data)
+		num_bytes = len(rx_buffer)//MCU_MSG_LENGTH*MCU_MSG_LENGTH
+		frames = [bytes(rx_buffer[i:i+MCU_MSG_LENGTH]) for i in range(0,num_bytes,MCU_MSG_LENGTH)]
+		del rx_buffer[:num_bytes]
+		return frames
+	return parse
+
+def benchmark_frame_parser(number_of_frames=100000,number_of_errors=100,seed=0):
+	rng = random.Random(seed)
+	# random messages (unique, so that a message received can be checked against the ones sent), bytes 23-24 hold the CRC in format 2
+	messages = [rng.randbytes(MCU_MSG_LENGTH-2) + bytes(2) for i in range(number_of_frames)]
+	frames_v2 = [telemetry.encode_mcu_frame_v2(message,i) for i, message in enumerate(messages)]
+	sent = set(message[:MCU_MSG_LENGTH-2] for message in messages)
+	print('--- frame parsing: ' + str(number_of_frames) + ' frames received in chunks of random size (1-512 bytes), format 1 (25-byte slices) vs format 2 (sync + sequence + CRC-16) ---')
+	for error in ['none','dropped byte','inserted byte','bit flip','garbage burst']:
+		results = []
+		for frame_format, frames in [(1,messages),(2,frames_v2)]:
+			stream = corrupt_stream(frames,error,number_of_errors if error != 'none' else 0,random.Random(seed))
+			frame_parser = telemetry.FrameParser()
+			parse = legacy_frame_parser() if frame_format == 1 else frame_parser.parse
+			t0 = time.perf_counter()
+			received = parse_in_chunks(parse,stream,random.Random(seed))
+			t_parse = time.perf_counter() - t0
+			valid = sum(1 for message in received if message[:MCU_MSG_LENGTH-2] in sent)
+			result = ('format ' + str(frame_format) + ': ' + str(valid) + ' valid, ' + str(len(received)-valid) + ' corrupted delivered')
+			if frame_format == 2:
+				result = result + ' (' + str(frame_parser.crc_errors) + ' CRC errors, ' + str(frame_parser.frames_missed) + ' missed, ' + str(frame_parser.bytes_skipped) + ' bytes skipped)'
+			result = result + ', ' + '{:.2f}'.format(len(received)/t_parse/1e6) + ' M frames/s'
+			results.append(result)
+		print(error + (' x' + str(number_of_errors) if error != 'none' else '') + '\n\t' + '\n\t'.join(results))
+	# end to end - the fake firmware switches to format 2 when the host connects
+	with contextlib.redirect_stdout(io.StringIO()):
+		mcu = controllers.Microcontroller(port='loop://?frame_interval_ms=1',frame_format=2,telemetry_period_ms=None)
+	t_end = time.perf_counter() + 2
+	frames = []
+	while time.perf_counter() < t_end:
+		frames.extend(mcu.read_received_packets(0.01))
+	mcu.close()
+	print('loop:// fake firmware, 1 ms frame interval, 2 s: ' + str(len(frames)) + ' frames, ' + str(mcu.frame_parser.crc_errors) + ' CRC errors, '
+		+ str(mcu.frame_parser.frames_missed) + ' missed, ' + str(mcu.frame_parser.bytes_skipped) + ' bytes skipped')
+
+#######################################################
+################### telemetry rate ####################
+#######################################################
+
+def benchmark_telemetry_rate(duration_s=5,command_interval_s=0.5):
+	# the host polls at half the negotiated telemetry period and decodes every frame, the fake firmware runs in a separate process
+	# (pty://) so that the CPU time measured is the host's; a no-op command (SET_SOLENOID_VALVE_C) is sent every command_interval_s,
+	# its round trip ends when the first frame with its UID arrives
+	print('--- telemetry rate: host CPU time and command round trip for telemetry periods/modes negotiated at connect time, ' + str(duration_s) + ' s each ---')
+	for telemetry_period_ms, telemetry_mode in [(1,TELEMETRY_MODE.FULL),(5,TELEMETRY_MODE.FULL),(20,TELEMETRY_MODE.FULL),(200,TELEMETRY_MODE.FULL),(200,TELEMETRY_MODE.SUMMARY)]:
+		with contextlib.redirect_stdout(io.StringIO()):
+			mcu = controllers.Microcontroller(port='pty://',telemetry_period_ms=telemetry_period_ms,telemetry_mode=telemetry_mode)
+		poll_interval_s = engine.mcu_poll_interval_s(mcu)
+		# skip the frames sent before the rate was set
+		t_end = time.perf_counter() + 0.5
+		while time.perf_counter() < t_end:
+			mcu.read_received_packets_nowait()
+			time.sleep(poll_interval_s)
+		cmd_packet = engine.Microcontroller_Command(CMD_SET.SET_SOLENOID_VALVE_C).get_ready_to_decorate_cmd_packet()
+		uid = 0
+		t_command_sent = {}
+		round_trip = []
+		pressure = []
+		number_of_frames = 0
+		t_start = time.perf_counter()
+		cpu_start = time.process_time()
+		t_next_command = t_start
+		while time.perf_counter() < t_start + duration_s:
+			if time.perf_counter() >= t_next_command:
+				uid = uid + 1
+				engine.MCU_CMD_UID_STRUCT.pack_into(cmd_packet,0,uid)
+				t_command_sent[uid] = time.perf_counter()
+				mcu.send_command(cmd_packet)
+				t_next_command = t_next_command + command_interval_s
+			t_received = time.perf_counter()
+			for frame in mcu.read_received_packets_nowait():
+				decoded_msg = telemetry.decode_mcu_message(frame)
+				pressure.append(decoded_msg.vacuum)
+				number_of_frames = number_of_frames + 1
+				if decoded_msg.uid in t_command_sent:
+					round_trip.append(t_received - t_command_sent.pop(decoded_msg.uid))
+			time.sleep(poll_interval_s)
+		cpu_time = time.process_time() - cpu_start
+		t_run = time.perf_counter() - t_start
+		mcu.close()
+		round_trip_ms = [1000*t for t in round_trip]
+		print(str(telemetry_period_ms) + ' ms' + (' summary' if telemetry_mode == TELEMETRY_MODE.SUMMARY else '') + ' (poll every ' + '{:.1f}'.format(1000*poll_interval_s) + ' ms): '
+			+ '{:.0f}'.format(number_of_frames/t_run) + ' frames/s, host CPU ' + '{:.1f}'.format(100*cpu_time/t_run) + ' %, '
+			+ 'round trip median ' + '{:.1f}'.format(percentile(round_trip_ms,50)) + ' ms, max ' + '{:.1f}'.format(max(round_trip_ms)) + ' ms, '
+			+ 'vacuum reading std ' + '{:.4f}'.format(np.std(pressure)) + ' psi')
+
+#######################################################
+################### device manager ####################
+#######################################################
+
+def benchmark_device_manager(device_counts=(1,4,16)):
+	# each instrument runs a short PBST wash against its own fake firmware (pty://, a separate process, so that the CPU time measured
+	# is the host's); the ports are polled at half the telemetry period (one timer per instrument, as one GUI per instrument)
+	# or watched by the selector of the shared loop
+	print('--- device manager: N instruments from one process, each running a PBST wash against a fake firmware (pty://) ---')
+	for number_of_devices in device_counts:
+		for use_selector in [False,True]:
+			device_manager = devices.DeviceManager(use_selector=use_selector)
+			with contextlib.redirect_stdout(io.StringIO()):
+				for i in range(number_of_devices):
+					instrument = device_manager.add_instrument('simulated ' + str(i+1),controllers.Microcontroller(port='pty://?seed=' + str(i)),print_log=False)
+					add_sequences(instrument.engine,[('PBST Wash',1,0.05,2)],aspiration_pump_power=1,aspiration_time_s=2)
+			t0 = time.perf_counter()
+			cpu0 = time.process_time()
+			asyncio.run(device_manager.run_sequences())
+			cpu_time = time.process_time() - cpu0
+			t_run = time.perf_counter() - t0
+			frames = sum(instrument.frames_received for instrument in device_manager.instruments)
+			finished = sum(1 for instrument in device_manager.instruments if instrument.engine.sequences_in_progress == False)
+			not_responding = sum(1 for instrument in device_manager.instruments if instrument.not_responding)
+			device_manager.close()
+			print(str(number_of_devices) + ' instruments, ' + ('selector' if use_selector else 'polling ') + ': ' + '{:.1f}'.format(t_run) + ' s, '
+				+ '{:.0f}'.format(frames/t_run) + ' frames/s, host CPU ' + '{:.2f}'.format(100*cpu_time/t_run) + ' % (' + '{:.2f}'.format(100*cpu_time/t_run/number_of_devices) + ' % per instrument), '
+				+ str(finished) + '/' + str(number_of_devices) + ' finished, ' + str(not_responding) + ' not responding')
+
+#######################################################
+################### telemetry plot ####################
+#######################################################
+
+def telemetry_history_filled(duration_s,period_s=MCU_TELEMETRY_PERIOD_MS/1000):
+	# a telemetry.TelemetryHistory sized for and filled with duration_s of messages (pressure loop oscillation + noise)
+	number_of_messages = int(duration_s/period_s)
+	history = telemetry.TelemetryHistory(capacity=number_of_messages)
+	rng = np.random.default_rng(0)
+	t = time.time() - duration_s + np.arange(number_of_messages)*period_s
+	values = (np.sin(t/5)[:,np.newaxis] + 0.1*rng.standard_normal((number_of_messages,len(history.fields)))).astype(np.float32)
+	history.extend(t,values)
+	return history
+
+def benchmark_telemetry_plot(history_durations_s=[3600,24*3600],width=1000,number_of_redraws=20):
+	print('--- telemetry plot: redraw of a ' + str(width) + ' px wide plot of ' + str(len(TELEMETRY_HISTORY_FIELDS)) + ' traces (median of ' + str(number_of_redraws) + ') ---')
+	app = get_qt_application()
+	import widgets
+	from qtpy.QtGui import QImage, QPainter
+	# cost of feeding the history from the MCU polling, messages arrive one or a few at a time
+	history = telemetry.TelemetryHistory()
+	messages = [bytes(random.getrandbits(8) for i in range(MCU_MSG_LENGTH)) for j in range(5)]
+	for batch in [1,5]:
+		t_call = []
+		for i in range(10000):
+			t0 = time.perf_counter()
+			history.append_messages(time.time(),messages[:batch])
+			t_call.append(time.perf_counter()-t0)
+		print('append ' + str(batch) + ' message(s): ' + '{:.1f}'.format(1e6*percentile(t_call,50)) + ' us per call')
+	for duration_s in history_durations_s:
+		rss_start = rss_mb()
+		t0 = time.perf_counter()
+		history = telemetry_history_filled(duration_s)
+		print('history of ' + '{:g}'.format(duration_s/3600) + ' h: ' + str(len(history)) + ' messages, ' + str(len(history.levels)-1) + ' summary levels, filled in '
+			+ '{:.2f}'.format(time.perf_counter()-t0) + ' s, memory +' + '{:.0f}'.format(rss_mb()-rss_start) + ' MB')
+		t_end = history.time_range()[1]
+		for time_span_s in sorted(set(TELEMETRY_PLOT_TIME_SPANS_S + [duration_s])):
+			t_decimate = []
+			for i in range(number_of_redraws):
+				t0 = time.perf_counter()
+				t, y = history.decimate('pressure',t_end-time_span_s,t_end,width)
+				t_decimate.append(time.perf_counter()-t0)
+			canvas = widgets.TelemetryPlotCanvas(history,time_span_s=time_span_s)
+			canvas.resize(width + canvas.LABEL_WIDTH,600)
+			image = QImage(canvas.size(),QImage.Format_ARGB32)
+			t_redraw = []
+			for i in range(number_of_redraws):
+				t0 = time.perf_counter()
+				canvas.render(image)
+				t_redraw.append(time.perf_counter()-t0)
+			print('  window ' + '{:>6}'.format(str(time_span_s) + ' s') + ': decimated to ' + str(len(t)) + ' points in ' + '{:.2f}'.format(1000*percentile(t_decimate,50))
+				+ ' ms per trace, redraw ' + '{:.1f}'.format(1000*percentile(t_redraw,50)) + ' ms')
+		if duration_s == history_durations_s[0]:
+			# all the points drawn (no decimation), once
+			raw = history.levels[0]
+			t0 = time.perf_counter()
+			painter = QPainter(image)
+			for field_index in range(len(history.fields)):
+				x_pixels = (raw.t - raw.t[0])*(width/duration_s)
+				y_pixels = 100*(field_index + 1) - 40*raw.min[:,field_index]
+				painter.drawPolyline(widgets._polygon(x_pixels,y_pixels))
+			painter.end()
+			print('  window ' + '{:>6}'.format(str(duration_s) + ' s') + ' without decimation: ' + str(len(history)) + ' points per trace, redraw ' + '{:.0f}'.format(1000*(time.perf_counter()-t0)) + ' ms')
+		del history
+		app.processEvents()
+
+#######################################################
+################### fault detection ###################
+#######################################################
+
+class MCUMessageRecordingListener(RecordingSequenceEngineListener):
+	''' also records (wall time, decoded MCU message), the time base of the fault events '''
+	def __init__(self,clock):
+		super().__init__(clock)
+		self.mcu_messages = []
+
+	def on_mcu_message(self,decoded_msg):
+		self.mcu_messages.append((self.clock.wall_time(),decoded_msg))
+
+def run_fault_scenario(fault=None,t_fault_s=4,seed=0,downstream_flow_sensor_present=False):
+	# a PBST wash on the in-process firmware simulation with the fault injected at t_fault_s (during the pumping of fluid),
+	# the step in progress is aborted on a leak, clog or empty reservoir - returns the fault detector, the listener (log and MCU messages) and the wall time of the fault
+	clock = engine.VirtualClock()
+	with contextlib.redirect_stdout(io.StringIO()):
+		mcu = simulation.Microcontroller_Firmware_Simulation(clock=clock,seed=seed,downstream_flow_sensor_present=downstream_flow_sensor_present)
+		listener = MCUMessageRecordingListener(clock)
+		fault_detector = faults.FaultDetector()
+		sequence_engine = engine.SequenceEngine(mcu,clock,listener,fault_detector=fault_detector,fault_abort_step=[FAULT_TYPE.LEAK,FAULT_TYPE.CLOG,FAULT_TYPE.EMPTY_RESERVOIR])
+		add_sequences(sequence_engine,[('PBST Wash',1,0.05,10)],aspiration_pump_power=0.3,aspiration_time_s=5)
+		if fault is not None:
+			clock.call_later(t_fault_s,lambda: mcu.firmware.inject_fault(fault))
+		sequence_engine.start_sequence_execution()
+		engine.run_sequences_virtual(sequence_engine)
+	return fault_detector, listener, listener.t_start + t_fault_s
+
+def benchmark_fault_detector(number_of_seeds=5,t_fault_s=4):
+	print('--- fault detector: cost per MCU message, detection latency of injected faults and false alarms (PBST wash, firmware simulation) ---')
+	fault_detector, listener, t_fault = run_fault_scenario()
+	t_simulated = listener.mcu_messages[-1][0] - listener.mcu_messages[0][0]
+	fault_detector = faults.FaultDetector()
+	t0 = time.perf_counter()
+	for repeat in range(20):
+		for timestamp, decoded_msg in listener.mcu_messages:
+			fault_detector.update(decoded_msg,timestamp + repeat*t_simulated)
+	t_update = (time.perf_counter()-t0)/(20*len(listener.mcu_messages))
+	print('update: ' + '{:.1f}'.format(1e6*t_update) + ' us per message (' + '{:.3f}'.format(100*t_update*1000/MCU_TELEMETRY_PERIOD_MS) + ' % of the telemetry period)')
+	for downstream_flow_sensor_present in [False,True]:
+		false_alarms = 0
+		for seed in range(number_of_seeds):
+			fault_detector, listener, t_fault = run_fault_scenario(seed=seed,downstream_flow_sensor_present=downstream_flow_sensor_present)
+			false_alarms = false_alarms + len(fault_detector.events)
+		print('no fault' + (', downstream flow sensor' if downstream_flow_sensor_present else '') + ': ' + str(false_alarms) + ' false alarm(s) in ' + str(number_of_seeds) + ' runs')
+	for fault in [FAULT_TYPE.LEAK,FAULT_TYPE.CLOG,FAULT_TYPE.AIR_IN_LINE,FAULT_TYPE.EMPTY_RESERVOIR]:
+		latencies = []
+		aborted = 0
+		for seed in range(number_of_seeds):
+			fault_detector, listener, t_fault = run_fault_scenario(fault,t_fault_s,seed)
+			events = [event for event in fault_detector.events if event.fault == fault]
+			if len(events) == 0:
+				continue
+			samples = sum(1 for timestamp, decoded_msg in listener.mcu_messages if t_fault <= timestamp <= events[0].timestamp)
+			latencies.append((events[0].timestamp - t_fault,samples))
+			aborted = aborted + (1 if any(message.endswith('aborted ]') for t, message in listener.messages) else 0)
+		print('{:<16}'.format(fault) + ': detected in ' + str(len(latencies)) + '/' + str(number_of_seeds) + ' runs, latency ' + '{:.2f}'.format(np.median([latency[0] for latency in latencies]) if latencies else float('nan'))
+			+ ' s (' + '{:.0f}'.format(np.median([latency[1] for latency in latencies]) if latencies else float('nan')) + ' messages), step aborted in ' + str(aborted) + ' runs')
+
+#######################################################
+############# bubble-sensor aspiration ################
+#######################################################
+
+class AspirationRecordingListener(RecordingSequenceEngineListener):
+	''' also records the volume left in the chamber of the simulated firmware at the end of each aspiration '''
+	def __init__(self,clock,firmware):
+		super().__init__(clock)
+		self.firmware = firmware
+		self.internal_program = None
+		self.volumes_left_ul = []
+
+	def on_mcu_message(self,decoded_msg):
+		if self.internal_program == simulation.INTERNAL_PROGRAM.REMOVE_MEDIUM and decoded_msg.internal_program != simulation.INTERNAL_PROGRAM.REMOVE_MEDIUM:
+			self.volumes_left_ul.append(self.firmware.chamber_volume_ul)
+		self.internal_program = decoded_msg.internal_program
+
+def benchmark_aspiration(debounce_ms=[100,500,1000],aspiration_time_s=8):
+	# a wash block (10 aspirations) on the in-process firmware simulation, the aspirations run for aspiration_time_s (ASPIRATION_MODE.FIXED_TIME)
+	# or end at the downstream bubble sensor (ASPIRATION_MODE.BUBBLE_SENSOR) - the air debounce time is taken from DEFAULT_VALUES
+	wash_block = [('Stripping Buffer Wash',2,0.05,10),('Stripping Buffer Rinse',1,0.05,10),('PBST Wash',3,0.05,10),('Wash (Post Ligation, 1)',2,0.05,10),('Wash (Post Ligation, 2)',2,0.05,10)]
+	print('--- aspiration: a wash block of ' + str(sum(repeat for name, repeat, incubation_time_min, flow_time_s in wash_block)) + ' aspirations of up to ' + str(aspiration_time_s) + ' s (firmware simulation, virtual clock) ---')
+	default_air_debounce_ms = DEFAULT_VALUES.aspiration_air_debounce_ms
+	try:
+		t_fixed_time = None
+		for aspiration_mode, air_debounce_ms in [(ASPIRATION_MODE.FIXED_TIME,0)] + [(ASPIRATION_MODE.BUBBLE_SENSOR,t) for t in debounce_ms]:
+			DEFAULT_VALUES.aspiration_air_debounce_ms = air_debounce_ms
+			engine.build_sequence.cache_clear()
+			clock = engine.VirtualClock()
+			with contextlib.redirect_stdout(io.StringIO()):
+				mcu = simulation.Microcontroller_Firmware_Simulation(clock=clock)
+				listener = AspirationRecordingListener(clock,mcu.firmware)
+				sequence_engine = engine.SequenceEngine(mcu,clock,listener)
+				add_sequences(sequence_engine,wash_block,aspiration_pump_power=DEFAULT_VALUES.aspiration_pump_power,aspiration_time_s=aspiration_time_s,aspiration_mode=aspiration_mode)
+				t_simulated = engine.run_sequences_virtual(sequence_engine)
+			t_fixed_time = t_simulated if t_fixed_time is None else t_fixed_time
+			if aspiration_mode == ASPIRATION_MODE.FIXED_TIME:
+				print('fixed time            : ' + '{:.1f}'.format(t_simulated) + ' s, at most ' + '{:.0f}'.format(max(listener.volumes_left_ul)) + ' ul left in the chamber')
+			else:
+				print('bubble sensor, ' + '{:>4}'.format(air_debounce_ms) + ' ms: ' + '{:.1f}'.format(t_simulated) + ' s, at most ' + '{:.0f}'.format(max(listener.volumes_left_ul)) + ' ul left in the chamber, '
+					+ '{:.1f}'.format(sequence_engine.aspiration_time_saved_s) + ' s saved (logged), ' + '{:.1f}'.format(t_fixed_time - t_simulated) + ' s shorter')
+	finally:
+		DEFAULT_VALUES.aspiration_air_debounce_ms = default_air_debounce_ms
+		engine.build_sequence.cache_clear()
+
+class DispenseRecordingListener(RecordingSequenceEngineListener):
+	''' also records the volume measured by the MCU at the end of each Pump Fluid and the volume in the chamber of the simulated firmware '''
+	def __init__(self,clock,firmware):
+		super().__init__(clock)
+		self.firmware = firmware
+		self.internal_program = None
+		self.volume_ul = 0
+		self.volumes_dispensed_ul = []
+		self.chamber_volumes_ul = []
+
+	def on_mcu_message(self,decoded_msg):
+		if self.internal_program == simulation.INTERNAL_PROGRAM.PUMP_FLUID and decoded_msg.internal_program != simulation.INTERNAL_PROGRAM.PUMP_FLUID:
+			self.volumes_dispensed_ul.append(self.volume_ul)
+			self.chamber_volumes_ul.append(self.firmware.chamber_volume_ul)
+		self.internal_program = decoded_msg.internal_program
+		self.volume_ul = decoded_msg.volume_ul
+
+def benchmark_add_medium_volume(volumes_ul=[100,150,200],flow_time_s=15):
+	# a wash block (10 additions) on the in-process firmware simulation, the medium is pumped for flow_time_s or until the volume measured
+	# at the upstream flow sensor reaches the target (VOLUME_CONTROL, flow_time_s is the time limit)
+	wash_block = [('Stripping Buffer Wash',2,0.05,flow_time_s),('Stripping Buffer Rinse',1,0.05,flow_time_s),('PBST Wash',3,0.05,flow_time_s),('Wash (Post Ligation, 1)',2,0.05,flow_time_s),('Wash (Post Ligation, 2)',2,0.05,flow_time_s)]
+	print('--- add medium: a wash block of ' + str(sum(repeat for name, repeat, incubation_time_min, flow_time_s in wash_block)) + ' additions of ' + str(flow_time_s) + ' s (firmware simulation, virtual clock) ---')
+	t_flow_time = None
+	for volume_ul in [None] + volumes_ul:
+		engine.build_sequence.cache_clear()
+		clock = engine.VirtualClock()
+		with contextlib.redirect_stdout(io.StringIO()):
+			mcu = simulation.Microcontroller_Firmware_Simulation(clock=clock)
+			listener = DispenseRecordingListener(clock,mcu.firmware)
+			sequence_engine = engine.SequenceEngine(mcu,clock,listener)
+			add_sequences(sequence_engine,wash_block,aspiration_pump_power=DEFAULT_VALUES.aspiration_pump_power,aspiration_time_s=DEFAULT_VALUES.vacuum_aspiration_time_s,volume_ul=volume_ul)
+			t_simulated = engine.run_sequences_virtual(sequence_engine)
+		t_flow_time = t_simulated if t_flow_time is None else t_flow_time
+		label = 'flow time       ' if volume_ul is None else 'volume, ' + '{:>4}'.format(volume_ul) + ' ul '
+		print(label + ': ' + '{:.1f}'.format(t_simulated) + ' s, ' + '{:.0f}'.format(sum(listener.volumes_dispensed_ul)) + ' ul dispensed ('
+			+ '{:.0f}'.format(min(listener.volumes_dispensed_ul)) + '-' + '{:.0f}'.format(max(listener.volumes_dispensed_ul)) + ' ul per addition), at most '
+			+ '{:.0f}'.format(max(listener.chamber_volumes_ul)) + ' ul in the chamber, ' + '{:.1f}'.format(t_flow_time - t_simulated) + ' s shorter')
+	engine.build_sequence.cache_clear()
+
+class ETARecordingListener(RecordingSequenceEngineListener):
+	''' also records (time, time remaining estimated by the engine) at the start of each sequence '''
+	def __init__(self,clock):
+		super().__init__(clock)
+		self.sequence_engine = None
+		self.estimates = []
+
+	def on_current_sequence_changed(self,sequence_name):
+		self.estimates.append((self.clock.now(),self.sequence_engine.time_remaining()))
+
+def benchmark_eta(number_of_runs=3,plan_sizes=[100,10000]):
+	# the same protocol run several times on the in-process firmware simulation with one estimator, the aspirations end at the bubble sensor:
+	# error of the estimated time remaining at the start of each sequence, without (plan durations) and with the history of the previous runs
+	protocol = [('Stripping Buffer Wash',2,0.05,10),('PBST Wash',3,0.05,10),('Ligate',1,0.1,15),('Wash (Post Ligation, 1)',2,0.05,10),('Stain with DAPI',1,0.1,15)]
+	print('--- eta: ' + str(number_of_runs) + ' runs of a protocol of ' + str(sum(repeat for name, repeat, incubation_time_min, flow_time_s in protocol)) + ' sequences (firmware simulation, virtual clock) ---')
+	duration_estimator = estimator.StepDurationEstimator()
+	for run in range(number_of_runs):
+		clock = engine.VirtualClock()
+		with contextlib.redirect_stdout(io.StringIO()):
+			mcu = simulation.Microcontroller_Firmware_Simulation(clock=clock)
+			listener = ETARecordingListener(clock)
+			sequence_engine = engine.SequenceEngine(mcu,clock,listener,duration_estimator=duration_estimator)
+			listener.sequence_engine = sequence_engine
+			plan = compile_plan(protocol,aspiration_pump_power=DEFAULT_VALUES.aspiration_pump_power,aspiration_time_s=DEFAULT_VALUES.vacuum_aspiration_time_s)
+			t_forecast = duration_estimator.plan_forecast_s(plan)
+			sequence_engine.add_plan(plan)
+			t_simulated = engine.run_sequences_virtual(sequence_engine)
+		errors = np.array([abs(t_simulated - t - time_remaining) for t, time_remaining in listener.estimates])
+		print('run ' + str(run+1) + ': ' + '{:.1f}'.format(t_simulated) + ' s, estimated ' + '{:.1f}'.format(t_forecast) + ' s at the start (plan: ' + '{:.1f}'.format(plan.duration_s())
+			+ ' s), time remaining off by ' + '{:.1f}'.format(errors.mean()) + ' s on average (max ' + '{:.1f}'.format(errors.max()) + ' s)')
+	# cost of the updates - the same per step whatever the size of the plan
+	for number_of_steps in plan_sizes:
+		number_of_cycles = max(1,number_of_steps//len(plan))
+		steps = np.concatenate([plan.steps]*number_of_cycles)
+		duration_estimator.add_plan(engine.concatenate_plans([plan]*number_of_cycles))
+		t0 = time.perf_counter()
+		for step in steps:
+			duration_estimator.step_started(step)
+			duration_estimator.step_completed(step,float(step['duration_s']))
+		t = time.perf_counter() - t0
+		duration_estimator.clear()
+		print(str(len(steps)) + ' steps: ' + '{:.2f}'.format(t/len(steps)*1e6) + ' us per step (started and completed)')
+
+#######################################################
+
+BENCHMARKS = {
+	'serial_reader':benchmark_serial_reader,
+	'serial_reader_thread':benchmark_serial_reader_thread,
+	'decoder':benchmark_decoder,
+	'telemetry_recorder':benchmark_telemetry_recorder,
+	'sequence_dead_time':benchmark_sequence_dead_time,
+	'virtual_clock':benchmark_virtual_clock,
+	'firmware_pty':benchmark_firmware_pty,
+	'transports':benchmark_transports,
+	'mcu_state_display':benchmark_mcu_state_display,
+	'log_view':benchmark_log_view,
+	'log_file':benchmark_log_file,
+	'timestamp':benchmark_timestamp,
+	'plan':benchmark_plan,
+	'sequence_builder':benchmark_sequence_builder,
+	'command_encoder':benchmark_command_encoder,
+	'command_pipelining':benchmark_command_pipelining,
+	'frame_parser':benchmark_frame_parser,
+	'telemetry_rate':benchmark_telemetry_rate,
+	'device_manager':benchmark_device_manager,
+	'telemetry_plot':benchmark_telemetry_plot,
+	'fault_detector':benchmark_fault_detector,
+	'aspiration':benchmark_aspiration,
+	'add_medium_volume':benchmark_add_medium_volume,
+	'eta':benchmark_eta,
+}
+
+if __name__ == "__main__":
+	names = sys.argv[1:] if len(sys.argv) > 1 else BENCHMARKS.keys()
+	for name in names:
+		BENCHMARKS[name]()
@@ -10,12 +10,20 @@ from qtpy.QtGui import *
 
 # other libraries
 import utils
+import logfile
+import telemetry
+import engine
+import faults
+import estimator
 import platform
 import serial
 import serial.tools.list_ports
+import serial.urlhandler.protocol_socket
+import socket
 import io
 import sys
 import time
+import math
 import queue
 from pathlib import Path
 import numpy as np
@@ -23,6 +31,9 @@ from datetime import datetime
 
 from _def import *
 
+# the sequence definitions are part of the Qt-free engine, imported here for backward compatibility
+from engine import Sequence, Subsequence, Microcontroller_Command, constrain
+
 '''
 trigger control
 '''
@@ -120,55 +131,205 @@ class TriggerController_simulation(QObject):
 fluid control
 '''
 
+class SocketSerial(serial.urlhandler.protocol_socket.Serial):
+	''' socket:// port that reports the actual number of bytes waiting (pyserial reports 0 or 1), so that frames can be read in one call '''
+	@property
+	def in_waiting(self):
+		try:
+			return len(self._socket.recv(65536,socket.MSG_PEEK))
+		except BlockingIOError:
+			return 0
+
+def open_serial_port(port,baudrate=2000000):
+	''' open a serial device or a pyserial url (socket://host:port, ...) '''
+	if port.startswith('socket://'):
+		return SocketSerial(port,baudrate)
+	return serial.serial_for_url(port,baudrate)
+
 class Microcontroller(object):
-	def __init__(self,serial_number):
+	'''
+	port: the serial device of the Teensy (found using serial_number if None) or a url
+		pty://, socket://, loop://  a fake firmware is started for the connection (see simulation.launch_firmware)
+		socket://host:port           connect to a fake firmware that is already running
+	frame_format: format of the MCU -> computer frames, set on the MCU when connecting (see MCU_MSG_FRAME_FORMAT)
+	telemetry_period_ms, telemetry_mode: rate of the MCU -> computer frames, set on the MCU when connecting (see MCU_TELEMETRY_PERIOD_MS)
+	and checked against the interval of the frames received (see MCU_TELEMETRY_RATE_CHECK_PERIODS) - None to keep the rate of the MCU
+	(e.g. the frame_interval_ms of a fake firmware), it is then neither set nor checked
+	'''
+	def __init__(self,serial_number=None,port=None,frame_format=MCU_MSG_FRAME_FORMAT,telemetry_period_ms=MCU_TELEMETRY_PERIOD_MS,telemetry_mode=MCU_TELEMETRY_MODE):
 		self.serial = None
+		self.firmware = None # fake firmware started for a pty://, socket:// or loop:// port
 		self.tx_buffer_length = MCU_CMD_LENGTH
 		self.rx_buffer_length = MCU_MSG_LENGTH
 
-		controller_ports = [ p.device for p in serial.tools.list_ports.comports() if serial_number == p.serial_number]
-		if not controller_ports:
-			raise IOError("No Controller Found")
-		self.serial = serial.Serial(controller_ports[0],2000000)
+		# persistent rx buffer - holds the trailing partial frame (if any) until the next read
+		self.rx_buffer = bytearray()
+		self.rx_frame_synchronized = False
+		self.rx_frames_parsed = 0
+		self.rx_frames_dropped = 0
+		self.rx_bytes_discarded = 0 # while not synchronized
+
+		# frame format 2 - frames are found by their sync header and checked by their CRC (see telemetry.FrameParser)
+		self.frame_format = frame_format
+		self.frame_parser = telemetry.FrameParser() if frame_format == 2 else None
+
+		self.telemetry_period_ms = MCU_TELEMETRY_PERIOD_MS
+		self.telemetry_mode = TELEMETRY_MODE.FULL
+		self.telemetry_rate_check = None # [start time, frames received since then] while the period set is checked
+		self.telemetry_rate_confirmed = None # True once the frames arrive at the period set, False if the measured period is used instead
+
+		if port is None:
+			controller_ports = [ p.device for p in serial.tools.list_ports.comports() if serial_number == p.serial_number]
+			if not controller_ports:
+				raise IOError("No Controller Found")
+			port = controller_ports[0]
+		elif port.split('?')[0] in FAKE_FIRMWARE_URLS:
+			import simulation
+			self.firmware = simulation.launch_firmware(port)
+			port = self.firmware.url
+		self.serial = open_serial_port(port,2000000)
 		utils.print_message('Teensy connected')
+		if self.frame_parser is not None:
+			# the frames sent before the command takes effect are skipped by the parser
+			self.send_command(engine.encode_mcu_command(CMD_SET.SET_FRAME_FORMAT,frame_format))
+			self.rx_frame_synchronized = True
+		if telemetry_period_ms is not None:
+			self.set_telemetry_rate(telemetry_period_ms,telemetry_mode)
 		# clear counter - @@@ to add
 
 	def __del__(self):
-		self.serial.close()
+		self.close()
 
-	def read_received_packet_nowait(self):
-		# wait to receive data
-		if self.serial.in_waiting==0:
-			return None
-		if self.serial.in_waiting % self.rx_buffer_length != 0:
-			return None
-		
-		# get rid of old data
+	def close(self):
+		if self.serial is not None:
+			self.serial.close()
+		if self.firmware is not None:
+			self.firmware.close()
+			self.firmware = None
+
+	def set_telemetry_rate(self,period_ms,mode=TELEMETRY_MODE.FULL):
+		''' set the period and mode of the MCU status frames, the period is limited as on the MCU, returns the period set (in ms) '''
+		period_ms = int(min(MCU_TELEMETRY_PERIOD_MS_MAX,max(MCU_TELEMETRY_PERIOD_MS_MIN,round(period_ms))))
+		self.send_command(engine.encode_mcu_command(CMD_SET.SET_TELEMETRY_RATE,mode,0,period_ms))
+		self.telemetry_period_ms = period_ms
+		self.telemetry_mode = mode
+		self.telemetry_rate_check = []
+		self.telemetry_rate_confirmed = None
+		return period_ms
+
+	def _check_telemetry_rate(self,number_of_frames):
+		# the frames of the first read after the command may have been sent at the previous rate, the interval is measured from there
+		if number_of_frames == 0:
+			return
+		t = time.monotonic()
+		if len(self.telemetry_rate_check) == 0:
+			self.telemetry_rate_check = [t,0]
+			return
+		self.telemetry_rate_check[1] = self.telemetry_rate_check[1] + number_of_frames
+		t_check = t - self.telemetry_rate_check[0]
+		if t_check < max(MCU_TELEMETRY_RATE_CHECK_S,MCU_TELEMETRY_RATE_CHECK_PERIODS*self.telemetry_period_ms/1000):
+			return
+		measured_period_ms = 1000*t_check/self.telemetry_rate_check[1]
+		self.telemetry_rate_check = None
+		self.telemetry_rate_confirmed = abs(measured_period_ms - self.telemetry_period_ms) <= MCU_TELEMETRY_RATE_TOLERANCE*self.telemetry_period_ms
+		if self.telemetry_rate_confirmed == False:
+			utils.print_message('MCU telemetry: frames every ' + '{:.1f}'.format(measured_period_ms) + ' ms instead of ' + str(self.telemetry_period_ms) + ' ms, the MCU did not apply the rate set')
+			self.telemetry_period_ms = int(min(MCU_TELEMETRY_PERIOD_MS_MAX,max(MCU_TELEMETRY_PERIOD_MS_MIN,round(measured_period_ms))))
+			self.telemetry_mode = TELEMETRY_MODE.FULL
+
+	def read_received_packets_nowait(self):
 		num_bytes_in_rx_buffer = self.serial.in_waiting
-		if num_bytes_in_rx_buffer > self.rx_buffer_length:
-			# print('getting rid of old data')
-			for i in range(num_bytes_in_rx_buffer-self.rx_buffer_length):
-				self.serial.read()
+		if num_bytes_in_rx_buffer == 0:
+			return []
+		# the MCU message has no start marker - wait until the first read ends on a frame boundary,
+		# after that partial frames are kept in self.rx_buffer so that the alignment is never lost
+		if self.rx_frame_synchronized == False:
+			if num_bytes_in_rx_buffer % self.rx_buffer_length != 0:
+				# the bytes are discarded - a port that is not read for a while fills up at a size that is not a multiple
+				# of the frame length and would never be synchronized, the frames sent after this read are
+				self.serial.read(num_bytes_in_rx_buffer)
+				self.rx_bytes_discarded = self.rx_bytes_discarded + num_bytes_in_rx_buffer
+				return []
+			self.rx_frame_synchronized = True
+
+		# read everything that is available in one call
+		return self._parse_received_data(self.serial.read(num_bytes_in_rx_buffer))
+
+	def read_received_packets(self,timeout=MCU_READER_THREAD_TIMEOUT_S):
+		# blocking version of read_received_packets_nowait(), for use by MicrocontrollerReaderThread
+		if self.rx_frame_synchronized == False:
+			time.sleep(engine.mcu_poll_interval_s(self))
+			return self.read_received_packets_nowait()
+		# the pyserial timeout setter reconfigures the port (tcsetattr) even if the value is the same
+		if self.serial.timeout != timeout:
+			self.serial.timeout = timeout
+		data = self.serial.read(1) # block until data arrives (or timeout)
+		if len(data) == 0:
+			return []
+		return self._parse_received_data(data + self.serial.read(self.serial.in_waiting))
+
+	def _parse_received_data(self,data):
+		if self.frame_parser is not None:
+			frames = self.frame_parser.parse(data)
+		else:
+			# slice out all the complete frames, keep the partial frame for the next call
+			self.rx_buffer.extend(data)
+			num_frames = len(self.rx_buffer)//self.rx_buffer_length
+			num_bytes = num_frames*self.rx_buffer_length
+			frames = [bytes(self.rx_buffer[i:i+self.rx_buffer_length]) for i in range(0,num_bytes,self.rx_buffer_length)]
+			del self.rx_buffer[:num_bytes]
+		self.rx_frames_parsed = self.rx_frames_parsed + len(frames)
+		if self.telemetry_rate_check is not None:
+			self._check_telemetry_rate(len(frames))
+		return frames
 
-		# read the buffer
-		data=[]
-		for i in range(self.rx_buffer_length):
-			data.append(ord(self.serial.read()))
-		return data
+	def read_received_packet_nowait(self):
+		# return the most recent complete frame only
+		frames = self.read_received_packets_nowait()
+		if len(frames) == 0:
+			return None
+		self.rx_frames_dropped = self.rx_frames_dropped + len(frames) - 1
+		return frames[-1]
 
 	def send_command(self,cmd):
 		self.serial.write(cmd)
 
+class MicrocontrollerReaderThread(QThread):
+	'''
+	owns the reading side of the serial port: blocks on reads, timestamps the frames when they arrive and
+	hands them to the GUI thread through a queued signal (list of (timestamp, frame) tuples)
+	'''
+
+	signal_packets_received = Signal(object)
+
+	def __init__(self,microcontroller):
+		QThread.__init__(self)
+		self.microcontroller = microcontroller
+		self.stop_requested = False
+
+	def run(self):
+		while self.stop_requested == False:
+			frames = self.microcontroller.read_received_packets()
+			if len(frames) > 0:
+				timestamp = time.time()
+				self.signal_packets_received.emit([(timestamp,frame) for frame in frames])
+
+	def stop(self):
+		self.stop_requested = True
+		self.wait()
+
 class Microcontroller_Simulation(object):
-	def __init__(self):
+	''' simulated MCU without Qt - a command completes cmd_execution_time_s after it is received (checked when the MCU state is read) '''
+	def __init__(self,cmd_execution_time_s=2,clock=None):
 		self.serial = None
 		self.tx_buffer_length = MCU_CMD_LENGTH
 		self.rx_buffer_length = MCU_MSG_LENGTH
 		utils.print_message('MCU simulator connected')		
 
 		# for simulation 
-		self.timer_update_command_execution_status = QTimer()
-		self.timer_update_command_execution_status.timeout.connect(self._simulation_update_cmd_execution_status)
+		self.clock = clock if clock is not None else engine.MonotonicClock()
+		self.cmd_execution_time_s = cmd_execution_time_s
+		self.cmd_execution_deadline = None
 		self.cmd_execution_status = 0
 		self.current_cmd = 0
 		self.current_cmd_uid = 0
@@ -177,6 +338,8 @@ class Microcontroller_Simulation(object):
 		pass
 
 	def read_received_packet_nowait(self):
+		if self.cmd_execution_deadline is not None and self.clock.now() >= self.cmd_execution_deadline:
+			self._simulation_update_cmd_execution_status()
 		msg=[]
 		for i in range(self.rx_buffer_length):
 			msg.append(0)
@@ -188,12 +351,18 @@ class Microcontroller_Simulation(object):
 		# 	print('### msg from the MCU: ' + str(msg) + ']')
 		return msg
 
+	def read_received_packets_nowait(self):
+		return [self.read_received_packet_nowait()]
+
+	def next_event_time(self):
+		# for running on engine.VirtualClock - time at which the simulated MCU state changes next, None if it does not change by itself
+		return self.cmd_execution_deadline
+
 	def send_command(self,cmd):
 		self.current_cmd_uid = (cmd[0] << 8) + cmd[1]
 		self.current_cmd = cmd[2]
 		self.cmd_execution_status = CMD_EXECUTION_STATUS.IN_PROGRESS
-		self.timer_update_command_execution_status.setInterval(2000)
-		self.timer_update_command_execution_status.start()
+		self.cmd_execution_deadline = self.clock.now() + self.cmd_execution_time_s
 		if PRINT_DEBUG_INFO:
 			print('### cmd sent to mcu: ' + str(cmd))
 			print('[ MCU current cmd uid is ' + str(self.current_cmd_uid) + ' ]')
@@ -205,237 +374,27 @@ class Microcontroller_Simulation(object):
 		# self.cmd_execution_status = CMD_EXECUTION_STATUS.ERROR_CODE_PREUSE_CHECK_FAILED
 		# print('simulation - MCU command execution error')
 		# self.cmd_execution_status = CMD_EXECUTION_STATUS.CMD_EXECUTION_ERROR
-		self.timer_update_command_execution_status.stop()
+		self.cmd_execution_deadline = None
 
 #######################################################
-################# Sequence Defination #################
+############## Sequence Execution (Qt) ###############
 #######################################################
-class Sequence():
-	def __init__(self,sequence_name,fluidic_port=None,flow_time_s=None,incubation_time_min=None,pressure_setting=None,aspiration_pump_power=None,aspiration_time_s=None,round_=1,port_name = None):
-		self.sequence_name = sequence_name
-		self.fluidic_port = fluidic_port
-		self.flow_time_s = flow_time_s
-		self.incubation_time_min = incubation_time_min
-		self.pressure_setting = pressure_setting
-		self.round = round_
-		self.port_name = port_name
-
-		self.sequence_started = False  # can be removed
-		self.sequence_finished = False # can be removed
-		self.queue_subsequences = queue.Queue()
-
-		self.is_single_round_sequence = False
-
-		self.disable_manual_control = False
-
-		# populate the queue of subsequences, depending on the tyepes of the sequence
-		# case 1: strip, wash (post-strip), ligate, wash (post-ligate), stain with DAPI
-		# case 2: add imaging buffer
-		# case 3: remove imaging buffer (can apply to removing any other liquid)
-
-		# case 3, remove medium
-		if sequence_name == 'Remove Medium':
-			# subsequence 1
-			mcu_command = Microcontroller_Command(CMD_SET.REMOVE_MEDIUM,payload3=int(65535*aspiration_pump_power),payload4=aspiration_time_s*1000)
-			mcu_command.set_description(CMD_SET_DESCRIPTION.REMOVE_MEDIUM)
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-			self.disable_manual_control = True
-
-		# case 2, add imaging buffer
-		if sequence_name == 'Add Imaging Buffer':
-			# subsequence 1
-			control_type = DEFAULT_VALUES.control_type_for_adding_medium
-			if control_type == MCU_CMD_PARAMETERS.CONSTANT_POWER:
-				pump_power = DEFAULT_VALUES.pump_power_for_adding_medium_constant_power_mode # *** make this adjustable in the GUI ***
-				payload3 = pump_power*65535 # *** make this adjustable in the GUI ***
-				# *** to do: add timeout limit ***
-			if control_type == MCU_CMD_PARAMETERS.CONSTANT_PRESSURE:
-				payload3 = ((DEFAULT_VALUES.pressure_setpoint_for_pumping_fluid_constant_pressure_mode)/PRESSURE_FULL_SCALE_PSI)*65535
-			payload4 = flow_time_s*1000
-			mcu_command = Microcontroller_Command(CMD_SET.ADD_MEDIUM,control_type,fluidic_port,payload3,payload4)
-			mcu_command.set_description(CMD_SET_DESCRIPTION.ADD_MEDIUM + ' from port ' + str(fluidic_port) + ' using ' + MCU_CMD_PARAMETERS_DESCRIPTION.CONSTANT_POWER + ' mode, duration: ' + str(flow_time_s) + ' s')
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-			self.disable_manual_control = True
-
-		# case 1, add medium, incubate for specified amount of time, remove medium
-		# use incubation_time_min to detect this kind of command
-		if incubation_time_min is not None and incubation_time_min >= 0 and fluidic_port > 0:
-			# subsequence 1: add medium
-			control_type = DEFAULT_VALUES.control_type_for_adding_medium
-			if control_type == MCU_CMD_PARAMETERS.CONSTANT_POWER:
-				pump_power = DEFAULT_VALUES.pump_power_for_adding_medium_constant_power_mode # *** make this adjustable in the GUI ***
-				payload3 = pump_power*65535 # *** make this adjustable in the GUI ***
-				# *** to do: add timeout limit ***
-			if control_type == MCU_CMD_PARAMETERS.CONSTANT_PRESSURE:
-				payload3 = ((DEFAULT_VALUES.pressure_setpoint_for_pumping_fluid_constant_pressure_mode)/PRESSURE_FULL_SCALE_PSI)*65535
-			payload4 = flow_time_s*1000
-			mcu_command = Microcontroller_Command(CMD_SET.ADD_MEDIUM,control_type,fluidic_port,payload3,payload4)
-			mcu_command.set_description(CMD_SET_DESCRIPTION.ADD_MEDIUM + ' from port ' + str(fluidic_port) + ' using ' + MCU_CMD_PARAMETERS_DESCRIPTION.CONSTANT_POWER + ' mode, duration: ' + str(flow_time_s) + ' s')
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-
-			# subsequence 2: incubate
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.COMPUTER_STOPWATCH,microcontroller_command=None,stopwatch_time_remaining_seconds=incubation_time_min*60))
-
-			# subsequence 3: remove medium
-			mcu_command = Microcontroller_Command(CMD_SET.REMOVE_MEDIUM,payload3=int(65535*aspiration_pump_power),payload4=aspiration_time_s*1000)
-			mcu_command.set_description(CMD_SET_DESCRIPTION.REMOVE_MEDIUM)
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-
-			self.is_single_round_sequence = False # for message display only, no other essence
-			self.disable_manual_control = True
-
-		# case 4: flush
-		if sequence_name == 'Flush':
-			control_type = DEFAULT_VALUES.control_type_for_adding_medium
-			if control_type == MCU_CMD_PARAMETERS.CONSTANT_POWER:
-				pump_power = DEFAULT_VALUES.pump_power_for_adding_medium_constant_power_mode # *** make this adjustable in the GUI ***
-				payload3 = pump_power*65535 # *** make this adjustable in the GUI ***
-				# *** to do: add timeout limit ***
-			if control_type == MCU_CMD_PARAMETERS.CONSTANT_PRESSURE:
-				payload3 = ((pressure_setting)/PRESSURE_FULL_SCALE_PSI)*65535
-			payload4 = flow_time_s*1000
-			mcu_command = Microcontroller_Command(CMD_SET.ADD_MEDIUM,control_type,fluidic_port,payload3,payload4)
-			mcu_command.set_description('Flush line ' + str(fluidic_port) + ' using ' + MCU_CMD_PARAMETERS_DESCRIPTION.CONSTANT_POWER + ' mode, duration: ' + str(flow_time_s) + ' s')
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-			self.disable_manual_control = True
-
-		# preuse check sequences
-		if sequence_name == 'Preuse Check (Pressure)':
-			mcu_command = Microcontroller_Command(CMD_SET.PREUSE_CHECK_PRESSURE,payload2=fluidic_port,
-				payload3=(pressure_setting/PRESSURE_FULL_SCALE_PSI)*65535,payload4=flow_time_s*1000)
-			mcu_command.set_description('Preuse Check For Port ' + str(fluidic_port))
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-			self.disable_manual_control = True
-
-		if sequence_name == 'Preuse Check (Vacuum)':
-			mcu_command = Microcontroller_Command(CMD_SET.PREUSE_CHECK_VACUUM,payload2=fluidic_port,
-				payload3=(pressure_setting/PRESSURE_FULL_SCALE_PSI)*65535,payload4=flow_time_s*1000)
-			mcu_command.set_description('Preuse Check (Vacuum)')
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-			self.disable_manual_control = True
-
-		# manual control sequences
-		# case 10
-		if sequence_name == 'Set Selector Valve Position':
-			mcu_command = Microcontroller_Command(CMD_SET.SET_SELECTOR_VALVE,payload2=fluidic_port)
-			mcu_command.set_description('Set Selector Valve Position to ' + str(fluidic_port))
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-
-		if sequence_name == 'Set 10 mm Valve State':
-			mcu_command = Microcontroller_Command(CMD_SET.SET_10MM_SOLENOID_VALVE,payload2=fluidic_port)
-			if fluidic_port == 0:
-				mcu_command.set_description('Turn Off All 10 mm Valves')
-			else:
-				mcu_command.set_description('Turn On 10 mm valve ' + str(fluidic_port))
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-
-		if sequence_name == 'Enable Manual Control':
-			mcu_command = Microcontroller_Command(CMD_SET.DISABLE_MANUAL_CONTROL,payload1=0)
-			mcu_command.set_description('Enable Manual Control (the hardware enable button still needs to be set)')
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-
-		if sequence_name == 'Disable Manual Control':
-			mcu_command = Microcontroller_Command(CMD_SET.DISABLE_MANUAL_CONTROL,payload1=1)
-			mcu_command.set_description('Disable Manual Control')
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-
-		if sequence_name == 'Connect Selector Valve and Chamber':
-			mcu_command = Microcontroller_Command(CMD_SET.SET_SOLENOID_VALVE_B,payload1=1)
-			mcu_command.set_description('Connect Selector Valve and Chamber')
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-
-		if sequence_name == 'Disconnect Selector Valve and Chamber':
-			mcu_command = Microcontroller_Command(CMD_SET.SET_SOLENOID_VALVE_B,payload1=0)
-			mcu_command.set_description('Disconnect Selector Valve and Chamber')
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-
-		if sequence_name == 'Enable Pressure Control Loop':
-			mcu_command = Microcontroller_Command(CMD_SET.ENABLE_PRESSURE_CONTROL_LOOP,payload1=1)
-			mcu_command.set_description('Enable Pressure Control Loop')
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-
-		if sequence_name == 'Disable Pressure Control Loop':
-			mcu_command = Microcontroller_Command(CMD_SET.ENABLE_PRESSURE_CONTROL_LOOP,payload1=0)
-			mcu_command.set_description('Disable Pressure Control Loop')
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-
-		if sequence_name == 'Set Pressure Control Setpoint (psi)':
-			mcu_command = Microcontroller_Command(CMD_SET.SET_PRESSURE_CONTROL_SETPOINT_PSI,payload3=(pressure_setting/PRESSURE_FULL_SCALE_PSI)*65535)
-			mcu_command.set_description('Set Pressure Control Setpoint to ' + str(pressure_setting) + ' psi')
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-
-		if sequence_name == 'Set Pressure Loop P Coefficient':
-			mcu_command = Microcontroller_Command(CMD_SET.SET_PRESSURE_CONTROL_LOOP_P_COEFFICIENT,payload4=(pressure_setting/PRESSURE_LOOP_COEFFICIENTS_FULL_SCALE)*4294967295)
-			mcu_command.set_description('Set Pressure Loop P Coefficient to ' + str(pressure_setting))
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-
-		if sequence_name == 'Set Pressure Loop I Coefficient':
-			mcu_command = Microcontroller_Command(CMD_SET.SET_PRESSURE_CONTROL_LOOP_I_COEFFICIENT,payload4=(pressure_setting/PRESSURE_LOOP_COEFFICIENTS_FULL_SCALE)*4294967295)
-			mcu_command.set_description('Set Pressure Loop I Coefficient to ' + str(pressure_setting))
-			self.queue_subsequences.put(Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command))
-			self.is_single_round_sequence = True
-
-class Subsequence():
-	def __init__(self,subsequence_type=None,microcontroller_command=None,stopwatch_time_remaining_seconds=None):
-		self.type = subsequence_type
-		self.microcontroller_command = microcontroller_command
-		self.stopwatch_time_remaining_seconds = stopwatch_time_remaining_seconds
-
-# utility function for converting pressure sensor raw reading to psi
-def constrain(val, min_val, max_val):
-    return min(max_val, max(min_val, val))
-
-class Microcontroller_Command():
-	def __init__(self,cmd,payload1=0,payload2=0,payload3=0,payload4=0,timeout_limit=0):
-		self.cmd = cmd
-		self.payload1 = payload1
-		self.payload2 = payload2
-		self.payload3 = payload3
-		self.payload4 = payload4
-		self.description = ''
-		self.timeout_limit = timeout_limit
-
-	def get_ready_to_decorate_cmd_packet(self):
-		return self._format_command()
-
-	def get_description(self):
-		return self.description
-
-	def set_description(self,description):
-		self.description = description
-
-	def _format_command(self):
-		cmd_packet = bytearray(MCU_CMD_LENGTH)
-		cmd_packet[0] = 0 # reserved byte for UID
-		cmd_packet[1] = 0 # reserved byte for UID
-		cmd_packet[2] = self.cmd
-		cmd_packet[3] = self.payload1
-		cmd_packet[4] = int(self.payload2)
-		cmd_packet[5] = int(self.payload3) >> 8
-		cmd_packet[6] = int(self.payload3) & 0xff
-		cmd_packet[7] = int(self.payload4) >> 24
-		cmd_packet[8] = (int(self.payload4) >> 16) & 0xff
-		cmd_packet[9] = (int(self.payload4) >> 8) & 0xff
-		cmd_packet[10] = int(self.payload4) & 0xff
-		return cmd_packet
-
-class FluidController(QObject):
-	
+class QtClock(engine.MonotonicClock):
+	''' real time, callbacks are run by single-shot QTimers in the GUI thread '''
+	def call_later(self,delay_s,callback):
+		timer = QTimer()
+		timer.setSingleShot(True)
+		timer.setInterval(int(delay_s*1000))
+		timer.timeout.connect(callback)
+		timer.start()
+		handle = engine.TimerHandle(self,self.now()+delay_s,timer.stop)
+		handle.timer = timer # keep a reference to the timer
+		return handle
+
+class FluidController(QObject,engine.SequenceEngineListener):
+	'''
+	Qt adapter of engine.SequenceEngine - feeds the MCU messages to the engine and forwards the engine events as signals
+	'''
 	log_message = Signal(str)
 	signal_log_highlight_current_item = Signal()
 	signal_update_stopwatch_display = Signal(str)
@@ -445,21 +404,8 @@ class FluidController(QObject):
 	signal_highlight_current_sequence = Signal(str)
 	signal_clear_highlight = Signal()
 
-	# for displaying the MCU states
-	signal_MCU_CMD_UID = Signal(int)
-	signal_MCU_CMD = Signal(int)     # @@@ to-do: map the command to the command description
-	signal_MCU_CMD_status = Signal(str)
-	signal_MCU_internal_program = Signal(str)
-	signal_MCU_CMD_time_elapsed = Signal(int)
-
-	signal_pump_power = Signal(str)
-	signal_selector_valve_position = Signal(int)
-	signal_pressure = Signal(str)
-	signal_vacuum = Signal(str)
-	signal_bubble_sensor_1 = Signal(bool)
-	signal_bubble_sensor_2 = Signal(bool)
-	signal_flow_upstream = Signal(str)
-	signal_volume_ul = Signal(str)
+	# for displaying the MCU states - telemetry.MCUMessage of the latest MCU message, at most MCU_STATE_DISPLAY_RATE_HZ times per second
+	signal_mcu_state = Signal(object)
 
 	signal_uncheck_manual_control_enabled = Signal()
 
@@ -467,416 +413,229 @@ class FluidController(QObject):
 
 	signal_preuse_check_result = Signal(str,bool)
 
-	def __init__(self,microcontroller,log_measurements=False):
+	# faults.FaultEvent of the fault detector (leak, clog, empty reservoir, air in line)
+	signal_fault_detected = Signal(object)
+
+	def __init__(self,microcontroller,log_measurements=False,use_reader_thread=False,step_duration_history_file=STEP_DURATION_HISTORY_FILE):
 		QObject.__init__(self)
 		self.microcontroller = microcontroller		
-		self.cmd_length = MCU_CMD_LENGTH
-
-		# clear counter on both the computer and the MCU
-		self.computer_to_MCU_command_counter = 0 # this is the UID
-		self.computer_to_MCU_command = CMD_SET.CLEAR # when init the MCU in the firmware, set computer_to_MCU_command = 255 (reserved), so that there will be mismatch until proper communication
-		mcu_cmd = Microcontroller_Command(self.computer_to_MCU_command)
-		cmd_packet = mcu_cmd.get_ready_to_decorate_cmd_packet()
-		cmd_packet = self._add_UID_to_mcu_command_packet(cmd_packet,self.computer_to_MCU_command_counter)
-		self.microcontroller.send_command(cmd_packet)
 
-		self.abort_sequences_requested = False
-		self.sequences_in_progress = False
-		self.current_sequence = None
+		self.log_measurements = log_measurements
+		self.measurement_recorder = None
+		if(self.log_measurements):
+			# raw messages are recorded, use telemetry.load_telemetry() for analysis and telemetry.telemetry_to_csv() for conversion
+			self.measurement_recorder = telemetry.TelemetryRecorder(os.path.join(Path.home(),"Downloads","Fluidic Controller Logged Measurement_" + datetime.now().strftime('%Y-%m-%d %H-%M-%S.%f') + ".tlm"))
+
+		# the sequences are executed by the engine, this object only connects it to Qt
+		# the durations of the steps are learned across runs, the simulated MCUs have their own history
+		self.duration_estimator = None
+		if STEP_DURATION_ESTIMATOR_ENABLED:
+			history_file = None
+			if step_duration_history_file is not None:
+				history_file = os.path.join(Path.home(),step_duration_history_file)
+				if not isinstance(self.microcontroller,Microcontroller):
+					history_file = ' (simulation)'.join(os.path.splitext(history_file))
+			# loaded once the event loop runs, so that its messages reach the log (the signals are connected after __init__)
+			self.duration_estimator = estimator.StepDurationEstimator(history_file,log=self._log_message,load=False)
+			QTimer.singleShot(0,self.duration_estimator.load)
+		self.engine = engine.SequenceEngine(self.microcontroller,QtClock(),self,self.measurement_recorder,fault_detector=faults.FaultDetector() if FAULT_DETECTOR_ENABLED else None,
+			duration_estimator=self.duration_estimator)
+
+		# decoded MCU messages for the live plot (widgets.TelemetryPlotWidget), fixed memory
+		self.telemetry_history = telemetry.TelemetryHistory()
+
+		# receive MCU messages either from a dedicated reader thread (real hardware) or by polling from the GUI thread
+		self.reader_thread = None
+		self.telemetry_rate_confirmed = None # see _check_telemetry_rate()
+		self.timer_check_microcontroller_state = QTimer()
+		self.timer_check_microcontroller_state.setInterval(max(1,int(1000*engine.mcu_poll_interval_s(self.microcontroller))))
+		self.timer_check_microcontroller_state.timeout.connect(self._check_microcontroller_state)
+		if use_reader_thread and hasattr(self.microcontroller,'read_received_packets'):
+			self.reader_thread = MicrocontrollerReaderThread(self.microcontroller)
+			self.reader_thread.signal_packets_received.connect(self._on_microcontroller_packets_received)
+			self.reader_thread.start()
+		else:
+			self.timer_check_microcontroller_state.start()
+
+		# the MCU state display is refreshed at a fixed rate with the latest MCU message (all the messages are still processed and recorded)
+		self.mcu_state = None
+		self.mcu_state_changed = False
+		self.timer_update_mcu_state_display = QTimer()
+		self.timer_update_mcu_state_display.setInterval(int(1000/MCU_STATE_DISPLAY_RATE_HZ))
+		self.timer_update_mcu_state_display.timeout.connect(self._update_mcu_state_display)
+		self.timer_update_mcu_state_display.start()
+
+		# the sequence execution state is updated on events, this timer only refreshes the countdown display
+		self.timer_update_stopwatch_display = QTimer()
+		self.timer_update_stopwatch_display.setInterval(TIMER_UPDATE_STOPWATCH_DISPLAY_INTERVAL_MS)
+		self.timer_update_stopwatch_display.timeout.connect(self._update_stopwatch_display)
+
+	def set_telemetry_rate(self,period_ms,mode=TELEMETRY_MODE.FULL):
+		''' change the rate of the MCU status frames (e.g. high rate for pressure loop tuning), the MCU state is polled at half the period '''
+		if hasattr(self.microcontroller,'set_telemetry_rate') == False:
+			return None
+		period_ms = self.microcontroller.set_telemetry_rate(period_ms,mode)
+		self.telemetry_rate_confirmed = None
+		self.timer_check_microcontroller_state.setInterval(max(1,int(1000*engine.mcu_poll_interval_s(self.microcontroller))))
+		self.log_message.emit(utils.timestamp() + 'MCU telemetry: ' + str(period_ms) + ' ms' + (' (summary)' if mode == TELEMETRY_MODE.SUMMARY else ''))
+		return period_ms
+
+	def _update_stopwatch_display(self):
+		time_remaining = self.engine.stopwatch_time_remaining()
+		plan_time_remaining = self.engine.time_remaining()
+		status = ''
+		if time_remaining is not None:
+			status = '[ stop watch remaining time: ' + str(int(time_remaining)) + ' seconds ]' # @@@ change format to to x min x s
+		if plan_time_remaining is not None and self.engine.progress() is not None:
+			step, number_of_steps = self.engine.progress()
+			step_forecast_s = self.engine.current_step_forecast_s()
+			if time_remaining is None and step_forecast_s is not None:
+				status = status + '[ current step: ' + '{:.0f}'.format(self.engine.current_step_elapsed_s()) + ' s of ~' + '{:.0f}'.format(step_forecast_s) + ' s ]'
+			t_end = datetime.fromtimestamp(self.engine.clock.wall_time() + plan_time_remaining)
+			status = status + '[ step ' + str(step) + '/' + str(number_of_steps) + ', estimated time remaining: ' + str(math.ceil(plan_time_remaining/60)) + ' min, done at ' + t_end.strftime('%H:%M') + ' ]'
+		if status != '':
+			self.signal_update_stopwatch_display.emit(utils.timestamp(self.engine.clock.wall_time()) + status)
+			self.signal_log_highlight_current_item.emit()
+		else:
+			self.signal_update_stopwatch_display.emit('') # nothing in progress, clears the display
 
-		self.subsequences_in_progress = False
-		self.current_subsequence = None
-		self.current_stopwatch = None
+	def _update_mcu_state_display(self):
+		if self.mcu_state_changed:
+			self.mcu_state_changed = False
+			self.signal_mcu_state.emit(self.mcu_state)
 
-		self.mcu_subsequence_in_progress = False
-		self.computer_stopwatch_subsequence_in_progress = False
+	# <<< core portion of the computer - MCU interation >>>
+	def _check_microcontroller_state(self):
+		# check the microcontroller state, if mcu cmd execution has completed, send new mcu cmd in the queue
+		# all the frames received since the last check are processed in order
+		messages = self.microcontroller.read_received_packets_nowait()
+		if len(messages) > 0:
+			self.telemetry_history.append_messages(self.engine.clock.wall_time(),messages)
+			self._check_telemetry_rate()
+		for msg in messages:
+			self._process_microcontroller_message(msg)
+
+	def _on_microcontroller_packets_received(self,packets):
+		# slot for MicrocontrollerReaderThread, runs in the GUI thread
+		self.telemetry_history.append_messages([timestamp for timestamp, msg in packets],[msg for timestamp, msg in packets])
+		self._check_telemetry_rate()
+		for timestamp, msg in packets:
+			self._process_microcontroller_message(msg,timestamp)
+
+	def _check_telemetry_rate(self):
+		# the MCU may not apply the rate set (see Microcontroller.telemetry_rate_confirmed), the state is then polled at the measured rate
+		telemetry_rate_confirmed = getattr(self.microcontroller,'telemetry_rate_confirmed',None)
+		if telemetry_rate_confirmed == self.telemetry_rate_confirmed:
+			return
+		self.telemetry_rate_confirmed = telemetry_rate_confirmed
+		if telemetry_rate_confirmed == False:
+			self.timer_check_microcontroller_state.setInterval(max(1,int(1000*engine.mcu_poll_interval_s(self.microcontroller))))
+			self.log_message.emit(utils.timestamp() + 'MCU telemetry: the rate set was not applied by the MCU, frames every ' + str(self.microcontroller.telemetry_period_ms) + ' ms')
 
-		self.queue_sequence = queue.Queue()
-		self.queue_subsequence = queue.Queue()
-		# self.queque_to_microcontroller_command_packet = queue.Queue() # no longer needed - each cmd correspond to one subsequence
+	def _process_microcontroller_message(self,msg,timestamp=None):
+		self.engine.process_microcontroller_message(msg,timestamp)
 
-		self.timer_check_microcontroller_state = QTimer()
-		self.timer_check_microcontroller_state.setInterval(TIMER_CHECK_MCU_STATE_INTERVAL_MS)
-		self.timer_check_microcontroller_state.timeout.connect(self._check_microcontroller_state)
-		self.timer_check_microcontroller_state.start()
+	# engine events
+	def _log_message(self,message):
+		self.on_log_message(utils.timestamp() + message)
 
-		self.timer_update_sequence_execution_state = QTimer()
-		self.timer_update_sequence_execution_state.setInterval(TIMER_CHECK_SEQUENCE_EXECUTION_STATE_INTERVAL_MS)
-		self.timer_update_sequence_execution_state.timeout.connect(self._update_sequence_execution_state)
+	def on_log_message(self,message):
+		self.log_message.emit(message)
+		self.signal_clear_highlight.emit()
+		self.signal_log_highlight_current_item.emit()
 
-		self.timestamp_last_computer_mcu_mismatch = None
+	def on_current_sequence_changed(self,sequence_name):
+		self.signal_clear_highlight.emit()
+		self.signal_highlight_current_sequence.emit(sequence_name)
 
-		self.log_measurements = log_measurements
-		if(self.log_measurements):
-			self.measurement_file = open(os.path.join(Path.home(),"Downloads","Fluidic Controller Logged Measurement_" + datetime.now().strftime('%Y-%m-%d %H-%M-%S.%f') + ".csv"), "w+")
-			self.counter_measurement_file_flush = 0
-
-	def _add_UID_to_mcu_command_packet(self,cmd,command_UID):
-		cmd[0] = command_UID >> 8
-		cmd[1] = command_UID & 0xff
-		return cmd
-
-	def _current_stopwatch_timeout_callback(self):
-		self.current_stopwatch.stop() # make sure to stop the stopwatch first
-		self.computer_stopwatch_subsequence_in_progress = False
-		self.log_message.emit(utils.timestamp() + '[ countdown of ' + str(self.current_subsequence.stopwatch_time_remaining_seconds/60) + ' min finished ]')
+	def on_stopwatch_started(self,message):
+		self.signal_initialize_stopwatch_display.emit(message)
 		self.signal_clear_highlight.emit()
 		self.signal_log_highlight_current_item.emit()
-		QApplication.processEvents()
-		self.current_stopwatch = None
-		self.current_subsequence = None
-
-	# <<< core portion of the program>>>
-	def _update_sequence_execution_state(self):
-		# previous sequence finished execution, now try to load the next sequence
-		if self.current_sequence == None and self.current_subsequence == None:
-			# if the queue is not empty, load the next sequence to execute
-			if self.queue_sequence.empty() == False:
-				# start a new queued sequence if no abort sequence requested
-				if self.abort_sequences_requested == False:
-					# pull the next sequence from the queue
-					self.current_sequence = self.queue_sequence.get()
-					# logging (display round number for multiround sequences)
-					if self.current_sequence.is_single_round_sequence == False:
-						self.log_message.emit(utils.timestamp() + 'Execute ' + self.current_sequence.sequence_name + ', round ' + str(self.current_sequence.round+1))
-					else:
-						self.log_message.emit(utils.timestamp() + 'Execute ' + self.current_sequence.sequence_name)
-					self.signal_clear_highlight.emit()
-					self.signal_highlight_current_sequence.emit(self.current_sequence.sequence_name)
-					QApplication.processEvents()
-					self.sequence_started = True # can be removed
-				# abort sequence is requested
-				else:
-					while self.queue_sequence.empty() == False:
-						self.current_sequence = self.queue_sequence.get()
-						if self.current_sequence.is_single_round_sequence == False:
-							self.log_message.emit(utils.timestamp() + '! ' + self.current_sequence.sequence_name + ', round ' + str(self.current_sequence.round+1) + ' aborted')
-						else:
-							self.log_message.emit(utils.timestamp() + '! ' + self.current_sequence.sequence_name + ' aborted')
-						self.signal_clear_highlight.emit()
-						self.signal_highlight_current_sequence.emit(self.current_sequence.sequence_name)
-						QApplication.processEvents()
-						self.current_sequence.sequence_started = False
-						# void the sequence
-						self.current_sequence = None 
-					self.signal_clear_highlight.emit()
-					self.log_message.emit(utils.timestamp() + 'Abort completed')
-					self.signal_clear_highlight.emit()
-					self.signal_log_highlight_current_item.emit()
-					QApplication.processEvents()
-					return
-			# if the queue is empty, set the sequences_in_progress flag to False
-			else:
-				self.sequences_in_progress = False
-				self.timer_update_sequence_execution_state.stop()
-				self.signal_uncheck_all_sequences.emit()
-				self.signal_sequences_execution_stopped.emit()
-				self.log_message.emit(utils.timestamp() + 'Finished executing all the selected sequences')
-				self.signal_clear_highlight.emit()
-				self.signal_log_highlight_current_item.emit()
-				QApplication.processEvents()
-				if PRINT_DEBUG_INFO:
-					print('no more sequences in the queue')
-				return
-		# else:
-		# [removed else, so that the new sequence can be executed in the same call of the callback function]
-		# [if there's no current sequence, the function would have already returned]
-
-		# work on the subsequences of the current sequence
-		# [the below code is directly derived from the above]
-		# if the queue is not empty, load the next subsequence to execute
-		if self.current_subsequence == None:
-			if self.current_sequence.queue_subsequences.empty() == False:
-				if self.abort_sequences_requested == False:
-					# start a new subsequence if no abort sequence requested
-					self.current_subsequence = self.current_sequence.queue_subsequences.get()
-					if self.current_subsequence.type == SUBSEQUENCE_TYPE.MCU_CMD:
-						mcu_cmd = self.current_subsequence.microcontroller_command
-						cmd_packet = mcu_cmd.get_ready_to_decorate_cmd_packet()
-						# update the computer command counter and register the command
-						self.computer_to_MCU_command_counter = self.computer_to_MCU_command_counter + 1 # UID for the command
-						self.computer_to_MCU_command = cmd_packet[2]
-						# set the mcu_subsequence_in_progress flag
-						self.mcu_subsequence_in_progress = True # important: set it *after* the new UID is recorded , *before* sending the new command to MCU
-						# send the command to the microcontroller
-						cmd_with_uid = self._add_UID_to_mcu_command_packet(cmd_packet,self.computer_to_MCU_command_counter)
-						self.microcontroller.send_command(cmd_with_uid)
-						self.log_message.emit(utils.timestamp() + '[ microcontroller: ' + self.current_subsequence.microcontroller_command.get_description() +  ' ]')
-						self.signal_clear_highlight.emit()
-						self.signal_log_highlight_current_item.emit()
-						QApplication.processEvents()
-					elif self.current_subsequence.type == SUBSEQUENCE_TYPE.COMPUTER_STOPWATCH:
-						self.current_stopwatch = QTimer()
-						self.current_stopwatch.setInterval(self.current_subsequence.stopwatch_time_remaining_seconds*1000)
-						# self.current_stopwatch.setInterval(self.current_subsequence.stopwatch_time_remaining_seconds*1000/60) # for simulation, speed up by 60x
-						self.current_stopwatch.timeout.connect(self._current_stopwatch_timeout_callback)
-						self.current_stopwatch.start()
-						self.computer_stopwatch_subsequence_in_progress = True
-						self.log_message.emit(utils.timestamp() + '[ countdown of ' + str(self.current_subsequence.stopwatch_time_remaining_seconds/60) + ' min started ]')
-						self.signal_clear_highlight.emit()
-						self.signal_log_highlight_current_item.emit()
-						self.signal_initialize_stopwatch_display.emit(utils.timestamp() + '[ stop watch remaining time: ' + str(int(self.current_stopwatch.remainingTime()/1000)) + ' seconds ]') # @@@ change format to to x min x s
-						self.signal_clear_highlight.emit()
-						self.signal_log_highlight_current_item.emit()
-						QApplication.processEvents()
-				else:
-					# abort sequence is requested
-					while self.current_sequence.queue_subsequences.empty() == False:
-						self.current_subsequence = self.current_sequence.queue_subsequences.get()
-						self.current_subsequence = None
-					self.current_sequence = None
-					return
-			else:
-				# finished executing all the subsequences of the current sequence
-				self.current_sequence.sequence_finished = True # can be removed
-				self.current_sequence = None
-				# can add a signal here to set the sequence text to green #TO-DO
-
-		# case for updating the stopwatch display
-		if self.computer_stopwatch_subsequence_in_progress == True:
-			self.signal_update_stopwatch_display.emit(utils.timestamp() + '[ stop watch remaining time: ' + str(int(self.current_stopwatch.remainingTime()/1000)) + ' seconds ]') # @@@ change format to to x min x s
-			self.signal_log_highlight_current_item.emit()
 
-		# case for handling abort request during computer stopwatch countdown
-		if self.computer_stopwatch_subsequence_in_progress == True and self.abort_sequences_requested == True:
-			self.log_message.emit(utils.timestamp() + '[ countdown of ' + str(self.current_subsequence.stopwatch_time_remaining_seconds/60) + ' min aborted ]')
-			self.signal_clear_highlight.emit()
-			self.signal_log_highlight_current_item.emit()
-			QApplication.processEvents()
-			self.current_stopwatch.stop()
-			self.current_stopwatch = None
-			self.computer_stopwatch_subsequence_in_progress = False
-			self.current_subsequence = None
+	def on_sequences_execution_started(self):
+		self.signal_sequences_execution_started.emit()
+		self.timer_update_stopwatch_display.start()
+
+	def on_sequences_execution_stopped(self):
+		self.timer_update_stopwatch_display.stop()
+		self.signal_update_stopwatch_display.emit('')
+		self.signal_uncheck_all_sequences.emit()
+		self.signal_sequences_execution_stopped.emit()
+
+	def on_manual_control_disabled(self):
+		self.signal_uncheck_manual_control_enabled.emit()
+
+	def on_preuse_check_result(self,port_name,passed):
+		self.signal_preuse_check_result.emit(port_name,passed)
+
+	def on_emptying_fluidic_line_failed(self):
+		msg = QMessageBox()
+		msg.setIcon(QMessageBox.Information)
+		msg.setText("Emptying Fluidic Line Failed")
+		msg.setInformativeText("The fludic path has been switched to port 24. Now use a syringe to manually empty the fluidic line.")
+		msg.setWindowTitle("Warning")
+		msg.setStandardButtons(QMessageBox.Ok)
+		msg.setDefaultButton(QMessageBox.Ok)
+		retval = msg.exec_()
+
+	def on_mcu_message(self,decoded_msg):
+		# latest value wins, emitted by _update_mcu_state_display()
+		self.mcu_state = decoded_msg
+		self.mcu_state_changed = True
+
+	def on_fault_detected(self,event):
+		self.signal_fault_detected.emit(event)
+
+	def add_sequence(self,*args,**kwargs):
+		# invalid parameters (e.g. a payload out of range) are reported when the sequence is added, nothing is queued
+		try:
+			return self.engine.add_sequence(*args,**kwargs)
+		except ValueError as e:
+			self.log_message.emit(utils.timestamp() + '! sequence not added: ' + str(e) + ' !')
+			return None
 
-	# <<< core portion of the computer - MCU interation >>>
-	def _check_microcontroller_state(self):
-		# check the microcontroller state, if mcu cmd execution has completed, send new mcu cmd in the queue
-		msg = self.microcontroller.read_received_packet_nowait()
-		if msg is None:
-			return
+	def add_plan(self,plan):
+		return self.engine.add_plan(plan)
 
-		'''
-		#########################################################
-		#########   MCU -> Computer message structure   #########
-		#########################################################
-		byte 0-1	: computer -> MCU CMD counter (UID)
-		byte 2  	: cmd from host computer (error checking through check sum => no need to transmit back the parameters associated with the command)
-				  	<see below for command set>
-		byte 3  	: status of the command
-						- 1: in progress
-						- 0: completed without errors
-						- 2: error in cmd check sum
-						- 3: invalid cmd
-						- 4: error during execution
-		byte 4  	: MCU internal program being executed
-						- 0: idle
-					  	<see below for command set>
-		byte 5  	: state of valve A1,A2,B1,B2,bubble_sensor_1,bubble_sensor_2,x,x
-		byte 6  	: state of valve C1-C7, manual input bit
-		byte 7-8	: state of valve D1-D16
-		byte 9		: state of selector valve
-		byte 10-11	: pump power
-		byte 12-13	: pressure sensor 1 reading
-		byte 13-15	: pressure sensor 2 reading
-		byte 16-17	: flow sensor 1 reading
-		byte 18-19	: flow sensor 2 reading
-		byte 20     : elapsed time since the start of the last internal program (in seconds)
-		byte 21-22  : volume (ul), range: 0 - 5000
-		byte 23-24  : reserved
-
-		'''
-		# parse packet, step 0: display parsed packet (to add)
-		MCU_received_command_UID = (msg[0] << 8) + msg[1] # the parentheses around << is necessary !!!
-		MCU_received_command = msg[2]
-		MCU_command_execution_status = msg[3]
-		MCU_interal_program = msg[4]
-		MCU_valve_A_B_and_bubble_sensors = msg[5]
-		MCU_CMD_time_elapsed = msg[20]
-
-		measurement_selector_valve_position = msg[9]
-		measurement_pump_power = float((int(msg[10])<<8)+msg[11])/65535
-		_vacuum_raw  = constrain((int(msg[12])<<8) + msg[13],MCU_CONSTANTS._output_min,MCU_CONSTANTS._output_max)
-		_pressure_raw = constrain((int(msg[14])<<8) + msg[15],MCU_CONSTANTS._output_min,MCU_CONSTANTS._output_max)
-		measurement_pressure = (_pressure_raw - MCU_CONSTANTS._output_min) * (MCU_CONSTANTS._p_max - MCU_CONSTANTS._p_min) / (MCU_CONSTANTS._output_max - MCU_CONSTANTS._output_min) + MCU_CONSTANTS._p_min
-		measurement_vacuum = (_vacuum_raw - MCU_CONSTANTS._output_min) * (MCU_CONSTANTS._p_max - MCU_CONSTANTS._p_min) / (MCU_CONSTANTS._output_max - MCU_CONSTANTS._output_min) + MCU_CONSTANTS._p_min
-		
-		bubble_sensor_1_state = MCU_valve_A_B_and_bubble_sensors & 0b00001000
-		bubble_sensor_2_state = MCU_valve_A_B_and_bubble_sensors & 0b00000100
-
-		flow_upstream = float(np.int16((int(msg[18])<<8)+msg[19]))/MCU_CONSTANTS.SCALE_FACTOR_FLOW
-		volume_ul = (float(np.int16((int(msg[21])<<8)+msg[22]))/65535)*MCU_CONSTANTS.VOLUME_UL_MAX
-
-		self.signal_MCU_CMD_UID.emit(MCU_received_command_UID)
-		self.signal_MCU_CMD.emit(MCU_received_command) # @@@ to-do: map the command to the command description
-		self.signal_MCU_CMD_status.emit(str(MCU_command_execution_status)) # @@@ to-do: map the numerical value to text description
-		# self.signal_MCU_internal_program.emit(str(MCU_interal_program)) # @@@ to-do: map the numerical value to text description
-		self.signal_MCU_internal_program.emit(MCU_INTERNAL_PROGRAMS[MCU_interal_program])
-		self.signal_MCU_CMD_time_elapsed.emit(MCU_CMD_time_elapsed)
-
-		self.signal_pump_power.emit('{:.2f}'.format(measurement_pump_power))
-		self.signal_selector_valve_position.emit(measurement_selector_valve_position)
-		self.signal_pressure.emit('{:.2f}'.format(measurement_pressure))
-		self.signal_vacuum.emit('{:.2f}'.format(measurement_vacuum))
-
-		self.signal_bubble_sensor_1.emit(bubble_sensor_1_state>0)
-		self.signal_bubble_sensor_2.emit(bubble_sensor_2_state>0)
-
-		self.signal_flow_upstream.emit('{:.1f}'.format(flow_upstream))
-		self.signal_volume_ul.emit('{:.1f}'.format(volume_ul))
-
-		# step 1: check if MCU is "up to date" with the computer in terms of command
-		if (MCU_received_command_UID != self.computer_to_MCU_command_counter) or (MCU_received_command != self.computer_to_MCU_command):
-			if PRINT_DEBUG_INFO:
-					print('computer\t UID = ' + str(self.computer_to_MCU_command_counter) + ', CMD = ' + str(self.computer_to_MCU_command))
-					print('MCU\t\t UID = ' + str(MCU_received_command_UID) + ', CMD = ' + str(MCU_received_command))
-					print('----------------')
-			if self.timestamp_last_computer_mcu_mismatch == None:
-				self.timestamp_last_computer_mcu_mismatch = time.time() # new mismatch, record time stamp
-				if PRINT_DEBUG_INFO:
-					print('a new MCU received cmd out of sync with computer cmd occured')
-			else:
-				t_diff = time.time() - self.timestamp_last_computer_mcu_mismatch
-				if t_diff > T_DIFF_COMPUTER_MCU_MISMATCH_FAULT_THRESHOLD_SECONDS:
-					print('Fault! MCU and computer out of sync for more than 3 seconds')
-					# @@@@@ to-do: add error handling @@@@@ #
-			return
-		else:
-			self.timestamp_last_computer_mcu_mismatch = None
-
-		# step 2: check command execution on MCU
-		if (MCU_command_execution_status != CMD_EXECUTION_STATUS.IN_PROGRESS) and (MCU_command_execution_status != CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS):
-			# @@@@@ to-do: add error handling @@@@@ #
-			# return # no need to return here
-			if MCU_command_execution_status == CMD_EXECUTION_STATUS.ERROR_CODE_EMPTYING_THE_FLUDIIC_LINE_FAILED:
-				# can add a signal here to set the sequence text to green #TO-DO
-				# abort all the steps that follows
-				if self.mcu_subsequence_in_progress:
-					self.mcu_subsequence_in_progress = False
-					self.current_subsequence = None
-					self.abort_sequences_requested = True
-					print('cmd execution error, status code: ' + str(MCU_command_execution_status))
-					print('emptying fluidic line failed, all subsequent sequences aborted')
-					self.log_message.emit(utils.timestamp() + '! emptying fluidic line failed, all subsequent sequences aborted !')
-					msg = QMessageBox()
-					msg.setIcon(QMessageBox.Information)
-					msg.setText("Emptying Fluidic Line Failed")
-					msg.setInformativeText("The fludic path has been switched to port 24. Now use a syringe to manually empty the fluidic line.")
-					msg.setWindowTitle("Warning")
-					msg.setStandardButtons(QMessageBox.Ok)
-					msg.setDefaultButton(QMessageBox.Ok)
-					retval = msg.exec_()
-
-			if MCU_command_execution_status == CMD_EXECUTION_STATUS.ERROR_CODE_PREUSE_CHECK_FAILED:
-				if self.mcu_subsequence_in_progress:
-					# show preuse check result
-					self.signal_preuse_check_result.emit(self.current_sequence.port_name,False)
-					# close the current subsequence
-					self.mcu_subsequence_in_progress = False
-					self.current_subsequence = None
-					self.log_message.emit(utils.timestamp() + '! preuse check for port ' + self.current_sequence.port_name + ' failed !')
-					if PRINT_DEBUG_INFO:
-						print('moving to the next subsequence (if any)')
-
-
-		if MCU_command_execution_status == CMD_EXECUTION_STATUS.IN_PROGRESS:
-			# the commented section below is not necessary, as when MCU_received_command_UID and MCU_received_command are set or initialized to 0, 
-			# MCU_command_execution_status will also be set to CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS, 
-			# i.e. under no circumstances, CMD_EXECUTION_STATUS.IN_PROGRESS would occur when MCU_received_command_UID == 0 and MCU_received_command == 0
-			'''
-			if MCU_received_command_UID == 0 and MCU_received_command == 0:
-				pass # wait for the first command -> go ahead to load new command
-			else:
-				# command execution in progress
-				if PRINT_DEBUG_INFO:
-					print('cmd being executed on the MCU')
-				return 
-			'''
-			# command execution in progress
-			if PRINT_DEBUG_INFO:
-				# print('[ cmd being executed on the MCU ]')
-				pass
-			# return # no need to return here
-
-		if MCU_command_execution_status == CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS:
-			# command execucation has completed, can move to the next command
-			# important: only move to the next subsequence upon completion of a *MCU* subsequence
-			if self.mcu_subsequence_in_progress:
-				# show preuse check result
-				if self.current_sequence.port_name is not None:
-					self.signal_preuse_check_result.emit(self.current_sequence.port_name,True)
-					self.log_message.emit(utils.timestamp() + 'Preuse check for port ' + self.current_sequence.port_name + ' passed')
-				# close the current subsequence
-				self.mcu_subsequence_in_progress = False
-				self.current_subsequence = None
-				if PRINT_DEBUG_INFO:
-					print('moving to the next subsequence (if any)')
-
-		''' moved to handling of queue of subsequences
-		# step 3: send the new command to MCU
-		if self.queque_to_microcontroller_command_packet.empty() == False:
-			# get the new command to execute
-			cmd_packet = self.queque_to_microcontroller_command_packet.get()
-			self.computer_to_MCU_command_counter = self.computer_to_MCU_command_counter + 1
-			self.computer_to_MCU_command = cmd_packet[2]
-			# send the command to the microcontroller
-			cmd_with_uid = self._add_UID_to_mcu_command_packet(cmd_packet,self.computer_to_MCU_command_counter)
-			self.microcontroller.send_command(cmd_with_uid)
-		'''
-
-		# log measurement
-		if(self.log_measurements):
-			line = str(time.time()) + ',' + \
-				str(MCU_received_command_UID) + ',' + \
-				str(MCU_received_command) + ',' + \
-				str(MCU_command_execution_status) + ',' + \
-				str(MCU_interal_program) + ',' + \
-				str(MCU_valve_A_B_and_bubble_sensors) + ',' + \
-				str(MCU_CMD_time_elapsed) + ',' + \
-				str(measurement_selector_valve_position) + ',' + \
-				"{:.2f}".format(measurement_pump_power) + ',' + \
-				"{:.2f}".format(measurement_pressure) + ',' + \
-				"{:.2f}".format(measurement_vacuum) + ',' + \
-				str(bubble_sensor_1_state) + ',' + \
-				str(bubble_sensor_2_state) + ',' + \
-				"{:.2f}".format(flow_upstream) + ',' + \
-				"{:.2f}".format(volume_ul) + '\n'
-			self.measurement_file.write(line)
-			self.counter_measurement_file_flush = self.counter_measurement_file_flush + 1
-			if self.counter_measurement_file_flush>=500:
-				self.counter_measurement_file_flush = 0
-				self.measurement_file.flush()
-
-	def add_sequence(self,sequence_name,fluidic_port=None,flow_time_s=None,incubation_time_min=None,pressure_setting=None,aspiration_pump_power=None,aspiration_time_s=None,round_=1,port_name=None):
-		print('adding sequence to the queue ' + sequence_name + ' - flow time: ' + str(flow_time_s) + ' s, incubation time: ' + str(incubation_time_min) + ' s [negative number means no removal]')
-		sequence_to_add = Sequence(sequence_name,fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,round_,port_name)
-		self.queue_sequence.put(sequence_to_add)
-		if sequence_to_add.disable_manual_control == True:
-			self.signal_uncheck_manual_control_enabled.emit()
-			
 	def request_abort_sequences(self):
-		self.abort_sequences_requested = True
+		self.engine.request_abort_sequences()
 
 	def start_sequence_execution(self):
-		self.abort_sequences_requested = False
-		self.sequences_in_progress = True
-		self.signal_sequences_execution_started.emit()
-		self.timer_update_sequence_execution_state.start()
+		self.engine.start_sequence_execution()
 
 	def close(self):
+		if self.reader_thread is not None:
+			self.reader_thread.stop()
+		# the engine refers back to this object, the timers would keep polling the MCU after it is closed
+		self.timer_check_microcontroller_state.stop()
+		self.timer_update_stopwatch_display.stop()
+		self.timer_update_mcu_state_display.stop()
 		if(self.log_measurements):
-			self.measurement_file.close()
+			self.measurement_recorder.close()
+		if self.duration_estimator is not None:
+			self.duration_estimator.save()
+		if hasattr(self.microcontroller,'rx_frames_parsed'):
+			utils.print_message('MCU frames parsed: ' + str(self.microcontroller.rx_frames_parsed) + ', dropped: ' + str(self.microcontroller.rx_frames_dropped))
+		if getattr(self.microcontroller,'frame_parser',None) is not None:
+			frame_parser = self.microcontroller.frame_parser
+			utils.print_message('MCU frames with CRC errors: ' + str(frame_parser.crc_errors) + ', missed: ' + str(frame_parser.frames_missed) + ', bytes skipped: ' + str(frame_parser.bytes_skipped))
 
-class Logger(QObject):
 
-	def __init__(self,filepath = os.path.join(Path.home(),"Documents","starmap-automation logs.txt")):
+class Logger(QObject):
+	''' writes the log messages to a text file and to a structured records file (see logfile.py) without blocking the GUI thread '''
+	def __init__(self,filepath = os.path.join(Path.home(),"Documents","starmap-automation logs.txt"),context=None):
 		QObject.__init__(self)
-		self.file = open(filepath,'a')
+		# context: returns (sequence name, round, MCU command UID) for the records, e.g. SequenceEngine.log_context
+		self.context = context
+		self.writer = logfile.LogFileWriter(filepath)
 
 	def log(self,log_message):
-		self.file.write(log_message + '\n')
+		sequence, round_, uid = self.context() if self.context is not None else (None,None,None)
+		self.writer.write(log_message,utils.log_severity(log_message),sequence,round_,uid)
 
 	def __del__(self):
-		self.file.close()
+		self.writer.close()
 		
 	def close(self):
-		self.file.close()
\ No newline at end of file
+		self.writer.close()
@@ -0,0 +1,206 @@
+'''
+running several fluidics controllers (one chamber each) from one process
+	discover_controllers() : serial ports of the controllers connected, by serial number or by the USB ids of the Teensy
+	Instrument             : one controller - its connection, its sequence engine and its log
+	DeviceManager          : runs the sequence engines of all the instruments on one asyncio loop (one thread), the MCU frames
+	                         are read when a port becomes readable (selector), ports without a file descriptor are polled -
+	                         an instrument that sends no frames for MCU_NO_FRAMES_TIMEOUT_S is reported and no longer waited for
+usage:
+	python3 devices.py --list                                          # controllers connected
+	python3 devices.py settings_default.xml 'PBST Wash'                # run the sequences on all the controllers connected
+	python3 devices.py settings_default.xml 'PBST Wash' --simulation 4 # same, on 4 simulated controllers (pty://)
+'''
+
+# other libraries
+import os
+import sys
+import asyncio
+import argparse
+import serial.tools.list_ports
+
+import utils
+import logfile
+import engine
+from _def import *
+
+def discover_controllers(serial_numbers=None):
+	'''
+	returns [(serial number, port)] of the controllers connected - the ones of serial_numbers (in that order) if given,
+	otherwise all the boards with the USB ids of CONTROLLER_USB_IDS, sorted by serial number
+	'''
+	ports = [p for p in serial.tools.list_ports.comports() if p.serial_number is not None]
+	if serial_numbers is not None:
+		port_of_serial_number = {p.serial_number:p.device for p in ports}
+		return [(serial_number,port_of_serial_number[serial_number]) for serial_number in serial_numbers if serial_number in port_of_serial_number]
+	return sorted([(p.serial_number,p.device) for p in ports if (p.vid,p.pid) in CONTROLLER_USB_IDS])
+
+def _fileno(microcontroller):
+	# file descriptor of the port, None for the simulated MCUs and the ports that do not have one
+	serial_port = getattr(microcontroller,'serial',None)
+	if serial_port is None:
+		return None
+	try:
+		return serial_port.fileno()
+	except Exception:
+		return None
+
+class Instrument(engine.SequenceEngineListener):
+	'''
+	one controller: its connection, its sequence engine (the instrument is the engine listener) and its log
+	log_filename: log file of the instrument (see logfile.LogFileWriter), the log messages are printed if None and print_log is True
+	'''
+	def __init__(self,name,microcontroller,clock,log_filename=None,measurement_recorder=None,print_log=True):
+		self.name = name
+		self.microcontroller = microcontroller
+		self.measurement_recorder = measurement_recorder
+		self.print_log = print_log
+		self.log_writer = logfile.LogFileWriter(log_filename,back_pressure=LOG_FILE_BACK_PRESSURE_POLICY_HEADLESS) if log_filename is not None else None
+		self.engine = engine.SequenceEngine(microcontroller,clock,self,measurement_recorder)
+		self.number_of_log_messages = 0
+		self.frames_received = 0
+		self.not_responding = False # no frames for MCU_NO_FRAMES_TIMEOUT_S while its sequences were in progress
+		self.stopped_callback = None # set by DeviceManager
+
+	def on_log_message(self,message):
+		self.number_of_log_messages = self.number_of_log_messages + 1
+		if self.log_writer is not None:
+			sequence, round_, uid = self.engine.log_context()
+			self.log_writer.write(message,utils.log_severity(message),sequence,round_,uid)
+		elif self.print_log:
+			print('[' + self.name + '] ' + message)
+
+	def on_sequences_execution_stopped(self):
+		if self.stopped_callback is not None:
+			self.stopped_callback()
+
+	def read_frames(self):
+		''' feed the frames received since the last call to the engine '''
+		frames = self.microcontroller.read_received_packets_nowait()
+		for msg in frames:
+			self.engine.process_microcontroller_message(msg)
+		self.frames_received = self.frames_received + len(frames)
+
+	def close(self):
+		if self.log_writer is not None:
+			self.log_writer.close()
+		if self.measurement_recorder is not None:
+			self.measurement_recorder.close()
+		if hasattr(self.microcontroller,'close'):
+			self.microcontroller.close()
+
+class DeviceManager(object):
+	'''
+	the instruments share one asyncio loop: the stopwatches of all the engines are timers of the loop and the ports are
+	watched by its selector, so that an instrument costs nothing between its MCU frames
+	use_selector: False - poll every port at half its telemetry period instead (as one FluidController timer per instrument)
+	'''
+	def __init__(self,use_selector=True):
+		self.instruments = []
+		self.clock = engine.AsyncioClock()
+		self.use_selector = use_selector
+
+	def add_instrument(self,name,microcontroller,**kwargs):
+		instrument = Instrument(name,microcontroller,self.clock,**kwargs)
+		self.instruments.append(instrument)
+		return instrument
+
+	def open_controllers(self,serial_numbers=None,**kwargs):
+		''' open the controllers found by discover_controllers(), returns the instruments added '''
+		import controllers
+		return [self.add_instrument(serial_number,controllers.Microcontroller(port=port),**kwargs) for serial_number, port in discover_controllers(serial_numbers)]
+
+	def _on_readable(self,instrument,fd):
+		instrument.read_frames()
+		if getattr(instrument.microcontroller,'rx_frame_synchronized',True) == False:
+			# frame format 1, the stream is not aligned yet and the bytes are left in the port - check again later instead of spinning
+			loop = asyncio.get_running_loop()
+			loop.remove_reader(fd)
+			loop.call_later(engine.mcu_poll_interval_s(instrument.microcontroller),loop.add_reader,fd,self._on_readable,instrument,fd)
+
+	async def _poll(self,instrument):
+		# the period may change once it has been checked (see controllers.Microcontroller.telemetry_rate_confirmed)
+		while instrument.engine.sequences_in_progress:
+			instrument.read_frames()
+			await asyncio.sleep(engine.mcu_poll_interval_s(instrument.microcontroller))
+
+	async def _watch(self,instrument):
+		# the engine cannot end a step without the MCU, an instrument that sends nothing would be waited for forever
+		frames_received = instrument.frames_received
+		while instrument.engine.sequences_in_progress:
+			await asyncio.sleep(MCU_NO_FRAMES_TIMEOUT_S)
+			if instrument.engine.sequences_in_progress and instrument.frames_received == frames_received:
+				instrument.not_responding = True
+				instrument.on_log_message(utils.timestamp() + '! no frames from the microcontroller for ' + str(MCU_NO_FRAMES_TIMEOUT_S) + ' s, the sequences in progress are abandoned !')
+				instrument.stopped_callback()
+				return
+			frames_received = instrument.frames_received
+
+	async def run_sequences(self):
+		''' start executing the queued sequences of all the instruments and run until they are all done or not responding '''
+		loop = asyncio.get_running_loop()
+		all_stopped = asyncio.Event()
+		def check_all_stopped():
+			if all(instrument.engine.sequences_in_progress == False or instrument.not_responding for instrument in self.instruments):
+				all_stopped.set()
+		readers = []
+		polling_tasks = []
+		for instrument in self.instruments:
+			instrument.stopped_callback = check_all_stopped
+			fd = _fileno(instrument.microcontroller) if self.use_selector else None
+			if fd is not None:
+				try:
+					loop.add_reader(fd,self._on_readable,instrument,fd)
+					readers.append(fd)
+					continue
+				except NotImplementedError:
+					pass # e.g. the proactor event loop on Windows
+			polling_tasks.append(instrument)
+		for instrument in self.instruments:
+			instrument.engine.start_sequence_execution()
+		polling_tasks = [asyncio.ensure_future(self._poll(instrument)) for instrument in polling_tasks]
+		polling_tasks = polling_tasks + [asyncio.ensure_future(self._watch(instrument)) for instrument in self.instruments]
+		check_all_stopped()
+		await all_stopped.wait()
+		for fd in readers:
+			loop.remove_reader(fd)
+		for task in polling_tasks:
+			task.cancel()
+
+	def close(self):
+		for instrument in self.instruments:
+			instrument.close()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='run sequences on several controllers from one process')
+	parser.add_argument('settings',nargs='?',help='sequence settings file saved by the GUI')
+	parser.add_argument('sequences',nargs='*',help='names of the sequences to run, executed in the order of the sequence table')
+	parser.add_argument('--list',action='store_true',help='list the controllers connected and exit')
+	parser.add_argument('--serial_numbers',nargs='+',help='controllers to use (default: all the controllers connected)')
+	parser.add_argument('--simulation',type=int,help='use this number of simulated controllers (fake firmware on pseudo-terminals)')
+	parser.add_argument('--log_directory',help='write the log of each instrument to <log_directory>/<name>.txt instead of printing it')
+	args = parser.parse_args()
+
+	if args.list:
+		for serial_number, port in discover_controllers(args.serial_numbers):
+			print(serial_number + '\t' + port)
+		sys.exit(0)
+	if args.settings is None or len(args.sequences) == 0:
+		parser.error('the settings file and the sequences are required')
+
+	import controllers
+	device_manager = DeviceManager()
+	if args.simulation:
+		controllers_found = [('simulated ' + str(i+1),'pty://?seed=' + str(i)) for i in range(args.simulation)]
+	else:
+		controllers_found = discover_controllers(args.serial_numbers)
+	for name, port in controllers_found:
+		log_filename = os.path.join(args.log_directory,name + '.txt') if args.log_directory else None
+		device_manager.add_instrument(name,controllers.Microcontroller(port=port),log_filename=log_filename)
+	utils.print_message(str(len(device_manager.instruments)) + ' instruments')
+	for instrument in device_manager.instruments:
+		instrument.engine.add_plan(engine.compile_plan_from_settings(args.settings,args.sequences))
+	asyncio.run(device_manager.run_sequences())
+	for instrument in device_manager.instruments:
+		if instrument.not_responding:
+			utils.print_message(instrument.name + ' not responding')
+	device_manager.close()
@@ -0,0 +1,1060 @@
+'''
+sequencing engine - executes the queue of sequences (each a queue of subsequences) against a microcontroller
+the engine does not depend on Qt: time is provided by a clock object and the events are reported to a listener object
+	- FluidController (controllers.py) is the Qt adapter used by the GUI
+	- run_sequences() drives the engine from asyncio, e.g. for running protocols from scripts (see the bottom of this file)
+'''
+
+# other libraries
+import sys
+import time
+import math
+import queue
+import json
+import struct
+import functools
+import heapq
+import asyncio
+import argparse
+from collections import deque, namedtuple
+import numpy as np
+from lxml import etree as ET
+
+import utils
+import telemetry
+from _def import *
+
+#######################################################
+################# Sequence Defination #################
+#######################################################
+'''
+sequence types: a builder per sequence name returns the SequenceDefinition (subsequences and flags) for the parameters of the sequence
+	- builders are registered with @sequence_builder('name', ...), new sequence types do not need changes to Sequence
+	- build_sequence() memoizes the definitions per (name, parameters), the subsequences are shared and must not be modified
+'''
+SequenceDefinition = namedtuple('SequenceDefinition',['subsequences','is_single_round_sequence','disable_manual_control'])
+
+SEQUENCE_BUILDERS = {}
+
+def sequence_builder(*sequence_names):
+	''' decorator registering a builder: f(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode) -> SequenceDefinition '''
+	def register(builder):
+		for sequence_name in sequence_names:
+			SEQUENCE_BUILDERS[sequence_name] = builder
+		return builder
+	return register
+
+@functools.lru_cache(maxsize=SEQUENCE_DEFINITION_CACHE_SIZE)
+def build_sequence(sequence_name,fluidic_port=None,flow_time_s=None,incubation_time_min=None,pressure_setting=None,aspiration_pump_power=None,aspiration_time_s=None,volume_ul=None,aspiration_mode=None):
+	if sequence_name not in SEQUENCE_BUILDERS:
+		raise ValueError('unknown sequence ' + str(sequence_name))
+	return SEQUENCE_BUILDERS[sequence_name](fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode)
+
+def _mcu_cmd(mcu_command,description):
+	mcu_command.set_description(description)
+	return Subsequence(SUBSEQUENCE_TYPE.MCU_CMD,mcu_command)
+
+def _remove_medium(aspiration_pump_power,aspiration_time_s,aspiration_mode=None):
+	# with ASPIRATION_MODE.BUBBLE_SENSOR, the aspiration time is the time limit
+	if aspiration_mode is None:
+		aspiration_mode = DEFAULT_VALUES.aspiration_mode
+	payload2 = DEFAULT_VALUES.aspiration_air_debounce_ms//ASPIRATION_AIR_DEBOUNCE_UNIT_MS if aspiration_mode == ASPIRATION_MODE.BUBBLE_SENSOR else 0
+	return _mcu_cmd(Microcontroller_Command(CMD_SET.REMOVE_MEDIUM,aspiration_mode,payload2,int(65535*aspiration_pump_power),aspiration_time_s*1000),CMD_SET_DESCRIPTION.REMOVE_MEDIUM)
+
+def _add_medium(fluidic_port,flow_time_s,pressure_setting_psi,description,volume_ul=None):
+	# a volume (ul) is dispensed in volume control mode: at constant pressure until the volume is reached, the flow time is the time limit
+	control_type = DEFAULT_VALUES.control_type_for_adding_medium if not volume_ul else MCU_CMD_PARAMETERS.VOLUME_CONTROL
+	if control_type == MCU_CMD_PARAMETERS.CONSTANT_POWER:
+		pump_power = DEFAULT_VALUES.pump_power_for_adding_medium_constant_power_mode # *** make this adjustable in the GUI ***
+		payload3 = pump_power*65535 # *** make this adjustable in the GUI ***
+		# *** to do: add timeout limit ***
+	if control_type in (MCU_CMD_PARAMETERS.CONSTANT_PRESSURE,MCU_CMD_PARAMETERS.VOLUME_CONTROL):
+		payload3 = (pressure_setting_psi/PRESSURE_FULL_SCALE_PSI)*65535
+	payload4 = flow_time_s*1000
+	payload5 = volume_ul if control_type == MCU_CMD_PARAMETERS.VOLUME_CONTROL else 0
+	return _mcu_cmd(Microcontroller_Command(CMD_SET.ADD_MEDIUM,control_type,fluidic_port,payload3,payload4,payload5),description)
+
+def _add_medium_description(fluidic_port,flow_time_s,volume_ul):
+	if volume_ul:
+		return CMD_SET_DESCRIPTION.ADD_MEDIUM + ' from port ' + str(fluidic_port) + ' using ' + MCU_CMD_PARAMETERS_DESCRIPTION.VOLUME_CONTROL + ' mode, volume: ' + str(volume_ul) + ' ul, time limit: ' + str(flow_time_s) + ' s'
+	return CMD_SET_DESCRIPTION.ADD_MEDIUM + ' from port ' + str(fluidic_port) + ' using ' + MCU_CMD_PARAMETERS_DESCRIPTION.CONSTANT_POWER + ' mode, duration: ' + str(flow_time_s) + ' s'
+
+def _single_mcu_cmd(mcu_command,description,disable_manual_control=False):
+	return SequenceDefinition((_mcu_cmd(mcu_command,description),),True,disable_manual_control)
+
+# case 3, remove medium
+@sequence_builder('Remove Medium')
+def _build_remove_medium(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return SequenceDefinition((_remove_medium(aspiration_pump_power,aspiration_time_s,aspiration_mode),),True,True)
+
+# case 2, add imaging buffer
+@sequence_builder('Add Imaging Buffer')
+def _build_add_imaging_buffer(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	description = _add_medium_description(fluidic_port,flow_time_s,volume_ul)
+	return SequenceDefinition((_add_medium(fluidic_port,flow_time_s,DEFAULT_VALUES.pressure_setpoint_for_pumping_fluid_constant_pressure_mode,description,volume_ul),),True,True)
+
+# case 1, add medium, incubate for specified amount of time, remove medium (nothing runs for a negative incubation time - the sequence is skipped)
+@sequence_builder('Stripping Buffer Wash','Stripping Buffer Rinse','PBST Wash','Ligate','Wash (Post Ligation, 1)','Stain with DAPI','Wash (Post Ligation, 2)')
+def _build_add_incubate_remove(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	if incubation_time_min is None or incubation_time_min < 0 or fluidic_port <= 0:
+		return SequenceDefinition((),False,False)
+	description = _add_medium_description(fluidic_port,flow_time_s,volume_ul)
+	return SequenceDefinition((
+		_add_medium(fluidic_port,flow_time_s,DEFAULT_VALUES.pressure_setpoint_for_pumping_fluid_constant_pressure_mode,description,volume_ul), # subsequence 1: add medium
+		Subsequence(SUBSEQUENCE_TYPE.COMPUTER_STOPWATCH,microcontroller_command=None,stopwatch_time_remaining_seconds=incubation_time_min*60), # subsequence 2: incubate
+		_remove_medium(aspiration_pump_power,aspiration_time_s,aspiration_mode)), # subsequence 3: remove medium
+		False,True) # is_single_round_sequence is for message display only, no other essence
+
+# case 4: flush
+@sequence_builder('Flush')
+def _build_flush(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	description = 'Flush line ' + str(fluidic_port) + ' using ' + MCU_CMD_PARAMETERS_DESCRIPTION.CONSTANT_POWER + ' mode, duration: ' + str(flow_time_s) + ' s'
+	return SequenceDefinition((_add_medium(fluidic_port,flow_time_s,pressure_setting,description),),True,True)
+
+# preuse check sequences
+@sequence_builder('Preuse Check (Pressure)')
+def _build_preuse_check_pressure(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.PREUSE_CHECK_PRESSURE,payload2=fluidic_port,payload3=(pressure_setting/PRESSURE_FULL_SCALE_PSI)*65535,payload4=flow_time_s*1000),
+		'Preuse Check For Port ' + str(fluidic_port),disable_manual_control=True)
+
+@sequence_builder('Preuse Check (Vacuum)')
+def _build_preuse_check_vacuum(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.PREUSE_CHECK_VACUUM,payload2=fluidic_port,payload3=(pressure_setting/PRESSURE_FULL_SCALE_PSI)*65535,payload4=flow_time_s*1000),
+		'Preuse Check (Vacuum)',disable_manual_control=True)
+
+# manual control sequences
+@sequence_builder('Set Selector Valve Position')
+def _build_set_selector_valve_position(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.SET_SELECTOR_VALVE,payload2=fluidic_port),'Set Selector Valve Position to ' + str(fluidic_port))
+
+@sequence_builder('Set 10 mm Valve State')
+def _build_set_10mm_valve_state(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	description = 'Turn Off All 10 mm Valves' if fluidic_port == 0 else 'Turn On 10 mm valve ' + str(fluidic_port)
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.SET_10MM_SOLENOID_VALVE,payload2=fluidic_port),description)
+
+@sequence_builder('Enable Manual Control')
+def _build_enable_manual_control(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.DISABLE_MANUAL_CONTROL,payload1=0),'Enable Manual Control (the hardware enable button still needs to be set)')
+
+@sequence_builder('Disable Manual Control')
+def _build_disable_manual_control(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.DISABLE_MANUAL_CONTROL,payload1=1),'Disable Manual Control')
+
+@sequence_builder('Connect Selector Valve and Chamber')
+def _build_connect_selector_valve_and_chamber(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.SET_SOLENOID_VALVE_B,payload1=1),'Connect Selector Valve and Chamber')
+
+@sequence_builder('Disconnect Selector Valve and Chamber')
+def _build_disconnect_selector_valve_and_chamber(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.SET_SOLENOID_VALVE_B,payload1=0),'Disconnect Selector Valve and Chamber')
+
+@sequence_builder('Enable Pressure Control Loop')
+def _build_enable_pressure_control_loop(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.ENABLE_PRESSURE_CONTROL_LOOP,payload1=1),'Enable Pressure Control Loop')
+
+@sequence_builder('Disable Pressure Control Loop')
+def _build_disable_pressure_control_loop(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.ENABLE_PRESSURE_CONTROL_LOOP,payload1=0),'Disable Pressure Control Loop')
+
+@sequence_builder('Set Pressure Control Setpoint (psi)')
+def _build_set_pressure_control_setpoint(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.SET_PRESSURE_CONTROL_SETPOINT_PSI,payload3=(pressure_setting/PRESSURE_FULL_SCALE_PSI)*65535),
+		'Set Pressure Control Setpoint to ' + str(pressure_setting) + ' psi')
+
+@sequence_builder('Set Pressure Loop P Coefficient')
+def _build_set_pressure_loop_p_coefficient(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.SET_PRESSURE_CONTROL_LOOP_P_COEFFICIENT,payload4=(pressure_setting/PRESSURE_LOOP_COEFFICIENTS_FULL_SCALE)*4294967295),
+		'Set Pressure Loop P Coefficient to ' + str(pressure_setting))
+
+@sequence_builder('Set Pressure Loop I Coefficient')
+def _build_set_pressure_loop_i_coefficient(fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode):
+	return _single_mcu_cmd(Microcontroller_Command(CMD_SET.SET_PRESSURE_CONTROL_LOOP_I_COEFFICIENT,payload4=(pressure_setting/PRESSURE_LOOP_COEFFICIENTS_FULL_SCALE)*4294967295),
+		'Set Pressure Loop I Coefficient to ' + str(pressure_setting))
+
+class Sequence():
+	def __init__(self,sequence_name,fluidic_port=None,flow_time_s=None,incubation_time_min=None,pressure_setting=None,aspiration_pump_power=None,aspiration_time_s=None,round_=1,port_name = None,volume_ul=None,aspiration_mode=None):
+		self.sequence_name = sequence_name
+		self.fluidic_port = fluidic_port
+		self.flow_time_s = flow_time_s
+		self.incubation_time_min = incubation_time_min
+		self.pressure_setting = pressure_setting
+		self.round = round_
+		self.port_name = port_name
+
+		self.sequence_started = False  # can be removed
+		self.sequence_finished = False # can be removed
+		self.queue_subsequences = queue.Queue()
+
+		# populate the queue of subsequences, depending on the type of the sequence (see the sequence builders above)
+		definition = build_sequence(sequence_name,fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode)
+		for subsequence in definition.subsequences:
+			self.queue_subsequences.put(subsequence)
+		self.is_single_round_sequence = definition.is_single_round_sequence
+		self.disable_manual_control = definition.disable_manual_control
+
+class Subsequence():
+	def __init__(self,subsequence_type=None,microcontroller_command=None,stopwatch_time_remaining_seconds=None):
+		self.type = subsequence_type
+		self.microcontroller_command = microcontroller_command
+		self.stopwatch_time_remaining_seconds = stopwatch_time_remaining_seconds
+
+# utility function for converting pressure sensor raw reading to psi
+def constrain(val, min_val, max_val):
+    return min(max_val, max(min_val, val))
+
+# computer -> MCU command packet (see the command structure in _def.py): UID, cmd, payload 1-5, 2 reserved bytes
+MCU_CMD_STRUCT = struct.Struct('>HBBBHIH2x')
+assert MCU_CMD_STRUCT.size == MCU_CMD_LENGTH
+MCU_CMD_UID_STRUCT = struct.Struct('>H')
+MCU_CMD_UID_MAX = 65535
+MCU_CMD_FLAGS_BYTE = 13
+_MCU_CMD_FIELDS_MAX = (('cmd',255),('payload1',255),('payload2',255),('payload3',65535),('payload4',4294967295),('payload5',65535))
+
+@functools.lru_cache(maxsize=MCU_CMD_PACKET_CACHE_SIZE)
+def encode_mcu_command(cmd,payload1=0,payload2=0,payload3=0,payload4=0,payload5=0):
+	''' command packet without UID (bytes 0-1 are 0), the payloads are truncated to integers - raises ValueError if a field is out of range '''
+	fields = (int(cmd),int(payload1),int(payload2),int(payload3),int(payload4),int(payload5))
+	try:
+		return MCU_CMD_STRUCT.pack(0,*fields)
+	except struct.error:
+		for (name, value_max), value in zip(_MCU_CMD_FIELDS_MAX,fields):
+			if value < 0 or value > value_max:
+				raise ValueError(name + ' = ' + str(value) + ' is out of range [0, ' + str(value_max) + '] (command ' + str(fields[0]) + ')')
+		raise
+
+class Microcontroller_Command():
+	''' the command is encoded (and checked) when it is created, the payloads are not meant to be changed afterwards '''
+	def __init__(self,cmd,payload1=0,payload2=0,payload3=0,payload4=0,payload5=0,timeout_limit=0):
+		self.cmd = cmd
+		self.payload1 = payload1
+		self.payload2 = payload2
+		self.payload3 = payload3
+		self.payload4 = payload4
+		self.payload5 = payload5
+		self.description = ''
+		self.timeout_limit = timeout_limit
+		self.packet = encode_mcu_command(cmd,payload1,payload2,payload3,payload4,payload5)
+
+	def get_ready_to_decorate_cmd_packet(self):
+		return self._format_command()
+
+	def get_description(self):
+		return self.description
+
+	def set_description(self,description):
+		self.description = description
+
+	def _format_command(self):
+		# a copy, the UID is added to it
+		return bytearray(self.packet)
+
+#######################################################
+######################## plans ########################
+#######################################################
+'''
+a plan is a whole run compiled upfront: a flat, read-only array of steps that the engine walks with an index
+	SEQUENCE            : start of a sequence (round), description is e.g. 'PBST Wash, round 2'
+	MCU_CMD             : the 15-byte command packet, the UID (bytes 0-1) is added when the command is sent
+	COMPUTER_STOPWATCH  : duration_s is the incubation time
+the expected duration of each step is computed when the plan is compiled (see MCU_CMD_EXPECTED_DURATION)
+plan file (Plan.save(), load_plan()): JSON lines, a header followed by one line per step, so that the plans of two runs can be diffed
+'''
+PLAN_STEP_DTYPE = np.dtype([
+	('type','u1'),                       # PLAN_STEP_TYPE
+	('sequence','<u4'),                  # index in Plan.sequences
+	('packet','u1',(MCU_CMD_LENGTH,)),   # MCU_CMD only
+	('duration_s','<f8'),                # expected duration
+	('description','<u4')])              # index in Plan.descriptions
+
+PLAN_FILE_FORMAT = 'fluidics plan'
+PLAN_FILE_VERSION = 1
+
+PLAN_STEP_TYPE_NAMES = {PLAN_STEP_TYPE.SEQUENCE:'sequence',PLAN_STEP_TYPE.MCU_CMD:'mcu_cmd',PLAN_STEP_TYPE.COMPUTER_STOPWATCH:'stopwatch'}
+
+# a sequence (round) of a plan - same attributes as Sequence for the code that reports on the current sequence
+PlanSequence = namedtuple('PlanSequence',['sequence_name','round','is_single_round_sequence','port_name','disable_manual_control'])
+
+def expected_duration_s(packet):
+	''' expected execution time of an MCU command packet on the MCU '''
+	payload4_is_duration, overhead_s = MCU_CMD_EXPECTED_DURATION.get(packet[2],(False,0))
+	if payload4_is_duration:
+		return int.from_bytes(bytes(packet[7:11]),'big')/1000 + overhead_s
+	return overhead_s
+
+class Plan(object):
+	''' compiled steps of a run (see PlanCompiler), the steps are not modified after compilation '''
+	def __init__(self,steps,sequences,descriptions):
+		self.steps = steps
+		self.steps.flags.writeable = False
+		self.sequences = tuple(sequences)
+		self.descriptions = tuple(descriptions)
+		# expected time from the start of step i to the end of the plan, time_remaining_s[len(plan)] is 0
+		self.time_remaining_s = np.zeros(len(steps)+1)
+		self.time_remaining_s[:-1] = np.cumsum(steps['duration_s'][::-1])[::-1]
+		self.time_remaining_s.flags.writeable = False
+
+	def __len__(self):
+		return len(self.steps)
+
+	def duration_s(self):
+		return float(self.time_remaining_s[0])
+
+	def number_of_sequences(self):
+		return len(self.sequences)
+
+	def save(self,filename):
+		with open(filename,'w') as f:
+			f.write(json.dumps({'format':PLAN_FILE_FORMAT,'version':PLAN_FILE_VERSION,'steps':len(self),'duration_s':self.duration_s()}) + '\n')
+			for step in self.steps:
+				sequence = self.sequences[step['sequence']]
+				record = {'type':PLAN_STEP_TYPE_NAMES[int(step['type'])],'sequence':sequence.sequence_name,'round':sequence.round+1,
+					'packet':step['packet'].tobytes().hex() if step['type'] == PLAN_STEP_TYPE.MCU_CMD else None,
+					'duration_s':float(step['duration_s']),'description':self.descriptions[step['description']]}
+				if step['type'] == PLAN_STEP_TYPE.SEQUENCE:
+					record.update(is_single_round_sequence=sequence.is_single_round_sequence,port_name=sequence.port_name,disable_manual_control=sequence.disable_manual_control)
+				f.write(json.dumps(record) + '\n')
+
+def load_plan(filename):
+	''' load a plan saved by Plan.save() '''
+	step_types = {name:step_type for step_type, name in PLAN_STEP_TYPE_NAMES.items()}
+	with open(filename) as f:
+		header = json.loads(f.readline())
+		if header.get('format') != PLAN_FILE_FORMAT:
+			raise IOError(filename + ' is not a plan file')
+		if header['version'] != PLAN_FILE_VERSION:
+			raise IOError('unsupported plan file version ' + str(header['version']))
+		steps = np.zeros(header['steps'],dtype=PLAN_STEP_DTYPE)
+		sequences = []
+		descriptions = {}
+		for i, line in enumerate(f):
+			record = json.loads(line)
+			if record['type'] == 'sequence':
+				sequences.append(PlanSequence(record['sequence'],record['round']-1,record['is_single_round_sequence'],record['port_name'],record['disable_manual_control']))
+			steps[i]['type'] = step_types[record['type']]
+			steps[i]['sequence'] = len(sequences) - 1
+			if record['packet'] is not None:
+				steps[i]['packet'] = np.frombuffer(bytes.fromhex(record['packet']),dtype=np.uint8)
+			steps[i]['duration_s'] = record['duration_s']
+			steps[i]['description'] = descriptions.setdefault(record['description'],len(descriptions))
+	return Plan(steps,sequences,descriptions)
+
+def concatenate_plans(plans):
+	steps = np.concatenate([plan.steps for plan in plans])
+	steps.flags.writeable = True
+	sequences = []
+	descriptions = []
+	number_of_steps = 0
+	for plan in plans:
+		steps['sequence'][number_of_steps:number_of_steps+len(plan)] += len(sequences)
+		steps['description'][number_of_steps:number_of_steps+len(plan)] += len(descriptions)
+		sequences.extend(plan.sequences)
+		descriptions.extend(plan.descriptions)
+		number_of_steps = number_of_steps + len(plan)
+	return Plan(steps,sequences,descriptions)
+
+@functools.lru_cache(maxsize=SEQUENCE_DEFINITION_CACHE_SIZE)
+def compile_subsequences(subsequences):
+	''' (step type, packet, expected duration, description) of the subsequences of a sequence definition (see build_sequence) '''
+	steps = []
+	for subsequence in subsequences:
+		if subsequence.type == SUBSEQUENCE_TYPE.MCU_CMD:
+			packet = subsequence.microcontroller_command.packet
+			steps.append((PLAN_STEP_TYPE.MCU_CMD,packet,expected_duration_s(packet),subsequence.microcontroller_command.get_description()))
+		elif subsequence.type == SUBSEQUENCE_TYPE.COMPUTER_STOPWATCH:
+			duration_s = subsequence.stopwatch_time_remaining_seconds
+			steps.append((PLAN_STEP_TYPE.COMPUTER_STOPWATCH,bytes(MCU_CMD_LENGTH),duration_s,'countdown of ' + str(duration_s/60) + ' min'))
+	return tuple(steps)
+
+class PlanCompiler(object):
+	'''
+	compiles rows of the sequence table into a Plan - the steps of each row are compiled once (see build_sequence) and repeated for its rounds
+	usage:
+		compiler = PlanCompiler()
+		compiler.add_sequence('PBST Wash',Port['PBST'],flow_time_s=10,incubation_time_min=1,aspiration_pump_power=0.4,aspiration_time_s=8,round_=0,repeat=3)
+		plan = compiler.compile()
+	'''
+	def __init__(self):
+		self.steps = [] # (type, sequence, packet, duration_s, description)
+		self.sequences = []
+		self.descriptions = {} # description -> index
+
+	def _description(self,description):
+		return self.descriptions.setdefault(description,len(self.descriptions))
+
+	def add_sequence(self,sequence_name,fluidic_port=None,flow_time_s=None,incubation_time_min=None,pressure_setting=None,aspiration_pump_power=None,aspiration_time_s=None,round_=1,port_name=None,repeat=1,volume_ul=None,aspiration_mode=None):
+		''' add the rounds round_ ... round_+repeat-1 of a sequence (same arguments as Sequence) '''
+		sequence = build_sequence(sequence_name,fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,volume_ul,aspiration_mode)
+		steps = [(step_type,packet,duration_s,self._description(description)) for step_type, packet, duration_s, description in compile_subsequences(sequence.subsequences)]
+		for k in range(round_,round_+repeat):
+			sequence_index = len(self.sequences)
+			self.sequences.append(PlanSequence(sequence_name,k,sequence.is_single_round_sequence,port_name,sequence.disable_manual_control))
+			# logging (display round number for multiround sequences)
+			description = sequence_name if sequence.is_single_round_sequence else sequence_name + ', round ' + str(k+1)
+			self.steps.append((PLAN_STEP_TYPE.SEQUENCE,sequence_index,bytes(MCU_CMD_LENGTH),0,self._description(description)))
+			self.steps.extend([(step_type,sequence_index,packet,duration_s,description) for step_type, packet, duration_s, description in steps])
+
+	def compile(self):
+		steps = np.zeros(len(self.steps),dtype=PLAN_STEP_DTYPE)
+		if len(self.steps) > 0:
+			step_types, sequences, packets, durations, descriptions = zip(*self.steps)
+			steps['type'] = step_types
+			steps['sequence'] = sequences
+			steps['packet'] = np.frombuffer(b''.join(packets),dtype=np.uint8).reshape(-1,MCU_CMD_LENGTH)
+			steps['duration_s'] = durations
+			steps['description'] = descriptions
+		return Plan(steps,self.sequences,list(self.descriptions))
+
+#######################################################
+####################### clocks ########################
+#######################################################
+'''
+a clock provides
+	now()                           : monotonic time in seconds, used for stopwatches and timeouts
+	wall_time()                     : seconds since epoch, used for time stamps
+	call_later(delay_s,callback)    : run callback after delay_s, returns a TimerHandle (not for MonotonicClock, which has
+	                                  no event loop - the engine runs on AsyncioClock, VirtualClock or controllers.QtClock)
+'''
+
+class TimerHandle(object):
+	''' returned by call_later(), the callback can be cancelled and the remaining time queried '''
+	def __init__(self,clock,deadline,cancel_callback=None):
+		self.clock = clock
+		self.deadline = deadline
+		self.cancel_callback = cancel_callback
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+		if self.cancel_callback is not None:
+			self.cancel_callback()
+
+	def remaining(self):
+		return max(0,self.deadline - self.clock.now())
+
+class MonotonicClock(object):
+	''' real time only, for the simulated MCUs - the subclasses add call_later() on an event loop '''
+	def now(self):
+		return time.monotonic()
+
+	def wall_time(self):
+		return time.time()
+
+class AsyncioClock(MonotonicClock):
+	''' real time, callbacks are scheduled on the running asyncio event loop '''
+	def call_later(self,delay_s,callback):
+		handle = asyncio.get_running_loop().call_later(delay_s,callback)
+		return TimerHandle(self,self.now()+delay_s,handle.cancel)
+
+class VirtualClock(object):
+	'''
+	discrete-event clock - time only moves when advance_to() is called, the callbacks that are due run in the order of their deadlines
+	used with run_sequences_virtual() to execute protocols against the simulated MCU as fast as possible
+	'''
+	def __init__(self,start_wall_time=None):
+		self.t = 0
+		self.start_wall_time = start_wall_time if start_wall_time is not None else time.time()
+		self.events = [] # heap of (deadline, order, handle, callback)
+		self.number_of_events_scheduled = 0
+
+	def now(self):
+		return self.t
+
+	def wall_time(self):
+		return self.start_wall_time + self.t
+
+	def call_later(self,delay_s,callback):
+		handle = TimerHandle(self,self.t+max(0,delay_s))
+		heapq.heappush(self.events,(handle.deadline,self.number_of_events_scheduled,handle,callback))
+		self.number_of_events_scheduled = self.number_of_events_scheduled + 1
+		return handle
+
+	def next_event_time(self):
+		while len(self.events) > 0 and self.events[0][2].cancelled:
+			heapq.heappop(self.events)
+		return self.events[0][0] if len(self.events) > 0 else None
+
+	def advance_to(self,t):
+		# callbacks scheduled by the callbacks are also run if they are due
+		while self.next_event_time() is not None and self.next_event_time() <= t:
+			deadline, order, handle, callback = heapq.heappop(self.events)
+			self.t = max(self.t,deadline)
+			callback()
+		self.t = max(self.t,t)
+
+#######################################################
+###################### listener #######################
+#######################################################
+
+class SequenceEngineListener(object):
+	''' receives the events from SequenceEngine - the default implementation ignores all of them '''
+	def on_log_message(self,message):
+		pass
+
+	def on_current_sequence_changed(self,sequence_name):
+		pass
+
+	def on_stopwatch_started(self,message):
+		pass
+
+	def on_sequences_execution_started(self):
+		pass
+
+	def on_sequences_execution_stopped(self):
+		pass
+
+	def on_manual_control_disabled(self):
+		pass
+
+	def on_preuse_check_result(self,port_name,passed):
+		pass
+
+	def on_emptying_fluidic_line_failed(self):
+		pass
+
+	def on_mcu_message(self,decoded_msg):
+		pass
+
+	def on_fault_detected(self,event):
+		pass
+
+class PrintingSequenceEngineListener(SequenceEngineListener):
+	''' prints the log messages, for running without GUI '''
+	def on_log_message(self,message):
+		print(message)
+
+#######################################################
+####################### engine ########################
+#######################################################
+
+class SequenceEngine(object):
+	'''
+	the engine executes plans (see PlanCompiler) and talks to the microcontroller through send_command()
+	the owner feeds the MCU messages through process_microcontroller_message(), the engine advances on
+	MCU command completion, stopwatch timeout, abort request and start of execution
+	commands that complete right away (MCU_CMD_PIPELINED) are sent without waiting for the previous ones to complete,
+	up to pipeline_window commands in flight, they are acknowledged in order
+	fault_detector (faults.FaultDetector, optional) is fed every MCU message, the faults are logged and those of fault_abort_step
+	(FAULT_DETECTOR_ABORT_STEP) abort the MCU command in progress, execution then continues with the next step
+	duration_estimator (estimator.StepDurationEstimator, optional) learns the durations of the steps, time_remaining() uses its forecasts
+	'''
+	def __init__(self,microcontroller,clock=None,listener=None,measurement_recorder=None,pipeline_window=MCU_CMD_PIPELINE_WINDOW,fault_detector=None,duration_estimator=None,fault_abort_step=FAULT_DETECTOR_ABORT_STEP):
+		self.microcontroller = microcontroller
+		self.pipeline_window = pipeline_window
+		self.fault_detector = fault_detector
+		self.fault_abort_step = fault_abort_step
+		self.duration_estimator = duration_estimator
+		self.clock = clock if clock is not None else AsyncioClock()
+		self.listener = listener if listener is not None else SequenceEngineListener()
+		self.measurement_recorder = measurement_recorder
+
+		# clear counter on both the computer and the MCU
+		self.computer_to_MCU_command_counter = 0 # this is the UID
+		self.computer_to_MCU_command = CMD_SET.CLEAR # when init the MCU in the firmware, set computer_to_MCU_command = 255 (reserved), so that there will be mismatch until proper communication
+		self.tx_packet = bytearray(MCU_CMD_LENGTH) # reused for all the commands, the UID is patched in when a command is sent
+		self.tx_packet_view = memoryview(self.tx_packet) # for copying from any buffer (bytes, numpy arrays)
+		self._send_mcu_command(Microcontroller_Command(self.computer_to_MCU_command).packet)
+
+		self.abort_sequences_requested = False
+		self.sequences_in_progress = False
+		self.current_sequence = None # PlanSequence
+
+		# the plan being executed and the index of its next step, plans added during execution are executed after it
+		self.plan = None
+		self.plan_step_index = 0
+		self.pending_plans = deque()
+
+		self.current_step = None # index of the MCU command or stopwatch step in progress
+		self.t_current_step_started = None
+		self.current_stopwatch = None
+
+		# aspiration time saved by ending the aspirations at the bubble sensor (ASPIRATION_MODE.BUBBLE_SENSOR) in this run
+		self.aspiration_time_saved_s = 0
+
+		# (UID, command) of the pipelined commands sent and not yet completed, in the order they were sent
+		self.mcu_commands_in_flight = deque()
+
+		self.mcu_subsequence_in_progress = False
+		self.computer_stopwatch_subsequence_in_progress = False
+
+		self.sequence_execution_state_update_in_progress = False
+		self.timestamp_last_computer_mcu_mismatch = None
+
+	def _add_UID_to_mcu_command_packet(self,cmd,command_UID):
+		MCU_CMD_UID_STRUCT.pack_into(cmd,0,command_UID)
+		return cmd
+
+	def _send_mcu_command(self,packet,flags=0):
+		# packet: command packet without UID (bytes-like), sent with the current UID and flags (MCU_CMD_FLAG_QUEUED for pipelined commands)
+		self.tx_packet_view[:] = packet
+		self._add_UID_to_mcu_command_packet(self.tx_packet,self.computer_to_MCU_command_counter)
+		self.tx_packet[MCU_CMD_FLAGS_BYTE] = flags
+		self.microcontroller.send_command(self.tx_packet)
+
+	def _log(self,message):
+		self.listener.on_log_message(utils.timestamp(self.clock.wall_time()) + message)
+
+	def log_context(self):
+		''' (name of the current sequence, round, UID of the last command sent to the MCU), for structured log records '''
+		if self.current_sequence is None:
+			return (None,None,self.computer_to_MCU_command_counter)
+		return (self.current_sequence.sequence_name,self.current_sequence.round+1,self.computer_to_MCU_command_counter)
+
+	def stopwatch_time_remaining(self):
+		''' remaining time (in seconds) of the current stopwatch subsequence, None if there is no stopwatch subsequence in progress '''
+		if self.computer_stopwatch_subsequence_in_progress == False:
+			return None
+		return self.current_stopwatch.remaining()
+
+	def time_remaining(self):
+		''' expected time (in seconds) until all the plans are executed, None if there is nothing to execute '''
+		if self.plan is None and len(self.pending_plans) == 0:
+			return None
+		time_remaining = sum(plan.duration_s() for plan in self.pending_plans)
+		if self.plan is not None:
+			time_remaining = time_remaining + self.plan.time_remaining_s[self.plan_step_index]
+			if self.current_step is not None:
+				if self.computer_stopwatch_subsequence_in_progress:
+					time_remaining = time_remaining + self.current_stopwatch.remaining()
+				else:
+					time_remaining = time_remaining + max(0,self.current_step_forecast_s() - (self.clock.now() - self.t_current_step_started))
+		if self.duration_estimator is not None:
+			time_remaining = time_remaining + self.duration_estimator.queued_correction_s
+		return max(0,float(time_remaining))
+
+	def current_step_forecast_s(self):
+		''' expected duration of the MCU command or stopwatch in progress (corrected with the history if there is a duration estimator), None if there is none '''
+		if self.plan is None or self.current_step is None:
+			return None
+		step = self.plan.steps[self.current_step]
+		if self.duration_estimator is None:
+			return float(step['duration_s'])
+		return self.duration_estimator.forecast_s(step)
+
+	def current_step_elapsed_s(self):
+		if self.current_step is None:
+			return None
+		return self.clock.now() - self.t_current_step_started
+
+	def progress(self):
+		''' (number of steps started, number of steps) of the plan being executed, None if there is none '''
+		if self.plan is None:
+			return None
+		return (self.plan_step_index,len(self.plan))
+
+	def _current_step_description(self):
+		return self.plan.descriptions[self.plan.steps[self.current_step]['description']]
+
+	def _current_stopwatch_timeout_callback(self):
+		self.current_stopwatch.cancel() # make sure to stop the stopwatch first
+		self.computer_stopwatch_subsequence_in_progress = False
+		self._step_completed()
+		self._log('[ ' + self._current_step_description() + ' finished ]')
+		self.current_stopwatch = None
+		self.current_step = None
+		self._advance_sequence_execution()
+
+	def _advance_sequence_execution(self):
+		# called on events (MCU command completed, stopwatch timeout, abort requested, execution started)
+		# update the state until it stops changing, i.e. until a subsequence is in progress or all the sequences are done
+		if self.sequence_execution_state_update_in_progress:
+			return # re-entered from a listener, the outer call keeps updating
+		self.sequence_execution_state_update_in_progress = True
+		try:
+			while self.sequences_in_progress:
+				state = (self.plan,self.plan_step_index,self.current_step,len(self.pending_plans),len(self.mcu_commands_in_flight))
+				self._update_sequence_execution_state()
+				if state == (self.plan,self.plan_step_index,self.current_step,len(self.pending_plans),len(self.mcu_commands_in_flight)):
+					break
+		finally:
+			# an exception (e.g. from a listener) must not leave the engine unable to advance on the next event
+			self.sequence_execution_state_update_in_progress = False
+
+	# <<< core portion of the program>>>
+	def _update_sequence_execution_state(self):
+		# a step is in progress - only an abort request during a computer stopwatch changes the state
+		if self.current_step is not None:
+			if self.computer_stopwatch_subsequence_in_progress == True and self.abort_sequences_requested == True:
+				self._log('[ ' + self._current_step_description() + ' aborted ]')
+				self.current_stopwatch.cancel()
+				self.current_stopwatch = None
+				self.computer_stopwatch_subsequence_in_progress = False
+				self.current_step = None
+			return
+
+		# the plan is done, load the next plan if any
+		if self.plan is None or self.plan_step_index >= len(self.plan):
+			self.current_sequence = None
+			if len(self.pending_plans) > 0:
+				self.plan = self.pending_plans.popleft()
+				self.plan_step_index = 0
+			else:
+				self.plan = None
+				if len(self.mcu_commands_in_flight) > 0:
+					return # done once the pipelined commands have completed
+				self.sequences_in_progress = False
+				if self.duration_estimator is not None:
+					self.duration_estimator.clear()
+				self.listener.on_sequences_execution_stopped()
+				if self.aspiration_time_saved_s > 0:
+					self._log('[ aspirations ended by the bubble sensor: ' + '{:.1f}'.format(self.aspiration_time_saved_s) + ' s saved in this run ]')
+				self._log('Finished executing all the selected sequences')
+				if PRINT_DEBUG_INFO:
+					print('no more sequences in the queue')
+				return
+
+		if self.abort_sequences_requested == True:
+			self._abort_plans()
+			return
+
+		# execute the next step - MCU commands and stopwatches wait for the pipelined commands to complete, unless they can be pipelined too
+		i = self.plan_step_index
+		step = self.plan.steps[i]
+		step_type = step['type']
+		pipelined = self.pipeline_window > 1 and step_type == PLAN_STEP_TYPE.MCU_CMD and int(step['packet'][2]) in MCU_CMD_PIPELINED
+		if step_type != PLAN_STEP_TYPE.SEQUENCE and len(self.mcu_commands_in_flight) >= (self.pipeline_window if pipelined else 1):
+			return
+		self.plan_step_index = i + 1
+		if self.duration_estimator is not None:
+			self.duration_estimator.step_started(step)
+		if step_type == PLAN_STEP_TYPE.SEQUENCE:
+			self.current_sequence = self.plan.sequences[step['sequence']]
+			self.listener.on_current_sequence_changed(self.current_sequence.sequence_name)
+			self._log('Execute ' + self.plan.descriptions[step['description']])
+		elif pipelined:
+			cmd_packet = step['packet']
+			self.computer_to_MCU_command_counter = (self.computer_to_MCU_command_counter + 1) % (MCU_CMD_UID_MAX + 1)
+			self.computer_to_MCU_command = int(cmd_packet[2])
+			self.mcu_commands_in_flight.append((self.computer_to_MCU_command_counter,self.computer_to_MCU_command))
+			self._send_mcu_command(cmd_packet,MCU_CMD_FLAG_QUEUED)
+			self._log('[ microcontroller: ' + self.plan.descriptions[step['description']] +  ' ]')
+		elif step_type == PLAN_STEP_TYPE.MCU_CMD:
+			self.current_step = i
+			self.t_current_step_started = self.clock.now()
+			cmd_packet = step['packet']
+			# update the computer command counter and register the command
+			self.computer_to_MCU_command_counter = (self.computer_to_MCU_command_counter + 1) % (MCU_CMD_UID_MAX + 1) # UID for the command (2 bytes)
+			self.computer_to_MCU_command = int(cmd_packet[2])
+			# set the mcu_subsequence_in_progress flag
+			self.mcu_subsequence_in_progress = True # important: set it *after* the new UID is recorded , *before* sending the new command to MCU
+			# send the command to the microcontroller
+			self._send_mcu_command(cmd_packet)
+			if self.fault_detector is not None:
+				self.fault_detector.start_command(cmd_packet)
+			self._log('[ microcontroller: ' + self._current_step_description() +  ' ]')
+		elif step_type == PLAN_STEP_TYPE.COMPUTER_STOPWATCH:
+			self.current_step = i
+			self.t_current_step_started = self.clock.now()
+			self.current_stopwatch = self.clock.call_later(step['duration_s'],self._current_stopwatch_timeout_callback)
+			self.computer_stopwatch_subsequence_in_progress = True
+			self._log('[ ' + self._current_step_description() + ' started ]')
+			self.listener.on_stopwatch_started(utils.timestamp(self.clock.wall_time()) + '[ stop watch remaining time: ' + str(int(self.current_stopwatch.remaining())) + ' seconds ]') # @@@ change format to to x min x s
+
+	def _abort_plans(self):
+		# the remaining steps of the current sequence are skipped, the sequences that have not started are reported as aborted
+		number_of_sequences_aborted = 0
+		for plan, step_index in [(self.plan,self.plan_step_index)] + [(plan,0) for plan in self.pending_plans]:
+			for i in step_index + np.flatnonzero(plan.steps['type'][step_index:] == PLAN_STEP_TYPE.SEQUENCE):
+				self.current_sequence = plan.sequences[plan.steps[i]['sequence']]
+				self.listener.on_current_sequence_changed(self.current_sequence.sequence_name)
+				self._log('! ' + plan.descriptions[plan.steps[i]['description']] + ' aborted')
+				number_of_sequences_aborted = number_of_sequences_aborted + 1
+		self.current_sequence = None
+		self.plan = None
+		self.plan_step_index = 0
+		self.pending_plans.clear()
+		if self.duration_estimator is not None:
+			self.duration_estimator.clear()
+		if number_of_sequences_aborted > 0:
+			self._log('Abort completed')
+
+	# <<< core portion of the computer - MCU interation >>>
+	def process_microcontroller_message(self,msg,timestamp=None):
+		''' process one 25-byte MCU message (see the message structure in _def.py) '''
+		if timestamp is None:
+			timestamp = self.clock.wall_time()
+
+		decoded_msg = telemetry.decode_mcu_message(msg)
+
+		# log measurement
+		if self.measurement_recorder is not None:
+			self.measurement_recorder.record(timestamp,msg)
+
+		self.listener.on_mcu_message(decoded_msg)
+
+		if self.fault_detector is not None:
+			for event in self.fault_detector.update(decoded_msg,timestamp):
+				self._on_fault_detected(event)
+
+		# pipelined commands are executed in order - the completion of one also acknowledges the commands sent before it
+		if len(self.mcu_commands_in_flight) > 0 and decoded_msg.status == CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS and (decoded_msg.uid,decoded_msg.cmd) in self.mcu_commands_in_flight:
+			while self.mcu_commands_in_flight.popleft() != (decoded_msg.uid,decoded_msg.cmd):
+				pass
+			if self.sequences_in_progress and self.current_step == None:
+				self._advance_sequence_execution()
+		elif len(self.mcu_commands_in_flight) > 0 and decoded_msg.status == CMD_EXECUTION_STATUS.ERROR_CODE_CMD_QUEUE_FULL and (decoded_msg.uid,decoded_msg.cmd) in self.mcu_commands_in_flight:
+			# the command and the ones queued before it were discarded by the firmware
+			self.mcu_commands_in_flight.clear()
+			self.abort_sequences_requested = True
+			self._log('! the command queue of the microcontroller is full, all subsequent sequences aborted !')
+			if self.sequences_in_progress and self.current_step == None:
+				self._advance_sequence_execution()
+
+		# step 1: check if MCU is "up to date" with the computer in terms of command
+		if (decoded_msg.uid != self.computer_to_MCU_command_counter) or (decoded_msg.cmd != self.computer_to_MCU_command):
+			if PRINT_DEBUG_INFO:
+					print('computer\t UID = ' + str(self.computer_to_MCU_command_counter) + ', CMD = ' + str(self.computer_to_MCU_command))
+					print('MCU\t\t UID = ' + str(decoded_msg.uid) + ', CMD = ' + str(decoded_msg.cmd))
+					print('----------------')
+			if self.timestamp_last_computer_mcu_mismatch == None:
+				self.timestamp_last_computer_mcu_mismatch = self.clock.now() # new mismatch, record time stamp
+				if PRINT_DEBUG_INFO:
+					print('a new MCU received cmd out of sync with computer cmd occured')
+			else:
+				t_diff = self.clock.now() - self.timestamp_last_computer_mcu_mismatch
+				if t_diff > T_DIFF_COMPUTER_MCU_MISMATCH_FAULT_THRESHOLD_SECONDS:
+					print('Fault! MCU and computer out of sync for more than 3 seconds')
+					# @@@@@ to-do: add error handling @@@@@ #
+			return
+		else:
+			self.timestamp_last_computer_mcu_mismatch = None
+
+		# step 2: check command execution on MCU
+		MCU_command_execution_status = decoded_msg.status
+		if (MCU_command_execution_status != CMD_EXECUTION_STATUS.IN_PROGRESS) and (MCU_command_execution_status != CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS):
+			# @@@@@ to-do: add error handling @@@@@ #
+			if MCU_command_execution_status == CMD_EXECUTION_STATUS.ERROR_CODE_EMPTYING_THE_FLUDIIC_LINE_FAILED:
+				# can add a signal here to set the sequence text to green #TO-DO
+				# abort all the steps that follows
+				if self.mcu_subsequence_in_progress:
+					self.mcu_subsequence_in_progress = False
+					self.current_step = None
+					self.abort_sequences_requested = True
+					print('cmd execution error, status code: ' + str(MCU_command_execution_status))
+					print('emptying fluidic line failed, all subsequent sequences aborted')
+					self._log('! emptying fluidic line failed, all subsequent sequences aborted !')
+					self.listener.on_emptying_fluidic_line_failed()
+
+			if MCU_command_execution_status == CMD_EXECUTION_STATUS.ERROR_CODE_PREUSE_CHECK_FAILED:
+				if self.mcu_subsequence_in_progress:
+					# show preuse check result
+					self.listener.on_preuse_check_result(self.current_sequence.port_name,False)
+					# close the current subsequence
+					self.mcu_subsequence_in_progress = False
+					self.current_step = None
+					self._log('! preuse check for port ' + self.current_sequence.port_name + ' failed !')
+					if PRINT_DEBUG_INFO:
+						print('moving to the next subsequence (if any)')
+
+		if MCU_command_execution_status == CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS:
+			# command execucation has completed, can move to the next command
+			# important: only move to the next subsequence upon completion of a *MCU* subsequence
+			if self.mcu_subsequence_in_progress:
+				# show preuse check result
+				if self.current_sequence.port_name is not None:
+					self.listener.on_preuse_check_result(self.current_sequence.port_name,True)
+					self._log('Preuse check for port ' + self.current_sequence.port_name + ' passed')
+				if self.computer_to_MCU_command == CMD_SET.REMOVE_MEDIUM:
+					self._report_aspiration_time()
+				if self.computer_to_MCU_command == CMD_SET.ADD_MEDIUM:
+					self._report_volume_dispensed(decoded_msg)
+				# a step stopped by CMD_SET.ABORT is not representative of its duration
+				if self.computer_to_MCU_command != CMD_SET.ABORT:
+					self._step_completed()
+				# close the current subsequence
+				self.mcu_subsequence_in_progress = False
+				self.current_step = None
+				if PRINT_DEBUG_INFO:
+					print('moving to the next subsequence (if any)')
+
+		# step 3: move on to the next subsequence right away if the MCU subsequence has been closed
+		if self.sequences_in_progress and self.current_step == None:
+			self._advance_sequence_execution()
+
+	def _step_completed(self):
+		if self.duration_estimator is not None:
+			self.duration_estimator.step_completed(self.plan.steps[self.current_step],self.clock.now() - self.t_current_step_started)
+
+	def _report_aspiration_time(self):
+		# the expected duration of the step is that of the aspiration running to its time limit
+		step = self.plan.steps[self.current_step]
+		if int(step['packet'][3]) != ASPIRATION_MODE.BUBBLE_SENSOR:
+			return
+		t_aspiration = self.clock.now() - self.t_current_step_started
+		time_saved_s = max(0,step['duration_s'] - t_aspiration)
+		self.aspiration_time_saved_s = self.aspiration_time_saved_s + time_saved_s
+		self._log('[ ' + self._current_step_description() + ' completed in ' + '{:.1f}'.format(t_aspiration) + ' s (bubble sensor), ' + '{:.1f}'.format(time_saved_s) + ' s saved ]')
+
+	def _report_volume_dispensed(self,decoded_msg):
+		# volume control: the volume measured by the MCU (including the emptying of the fluidic line) and the time saved over the time limit
+		step = self.plan.steps[self.current_step]
+		if int(step['packet'][3]) != MCU_CMD_PARAMETERS.VOLUME_CONTROL:
+			return
+		t_step = self.clock.now() - self.t_current_step_started
+		volume_target_ul = MCU_CMD_STRUCT.unpack(bytes(step['packet']))[6]
+		self._log('[ ' + '{:.0f}'.format(decoded_msg.volume_ul) + ' ul dispensed (' + str(volume_target_ul) + ' ul requested) in ' + '{:.1f}'.format(t_step) + ' s, '
+			+ '{:.1f}'.format(max(0,step['duration_s'] - t_step)) + ' s saved ]')
+
+	def _on_fault_detected(self,event):
+		self._log('! ' + event.message + ' !')
+		self.listener.on_fault_detected(event)
+		if event.fault in self.fault_abort_step:
+			self.abort_current_step()
+
+	def abort_current_step(self):
+		''' stop the MCU command in progress (CMD_SET.ABORT), execution continues with the next step once the MCU has stopped '''
+		if self.current_step is None or self.mcu_subsequence_in_progress == False or self.computer_to_MCU_command == CMD_SET.ABORT:
+			return False
+		self._log('[ ' + self._current_step_description() + ' aborted ]')
+		# the step is closed when the MCU reports the completion of the abort command
+		self.computer_to_MCU_command_counter = (self.computer_to_MCU_command_counter + 1) % (MCU_CMD_UID_MAX + 1)
+		self.computer_to_MCU_command = CMD_SET.ABORT
+		self._send_mcu_command(encode_mcu_command(CMD_SET.ABORT))
+		return True
+
+	def add_sequence(self,sequence_name,fluidic_port=None,flow_time_s=None,incubation_time_min=None,pressure_setting=None,aspiration_pump_power=None,aspiration_time_s=None,round_=1,port_name=None,volume_ul=None,aspiration_mode=None):
+		''' compile one sequence (see PlanCompiler) and queue it, returns the plan '''
+		print('adding sequence to the queue ' + sequence_name + ' - flow time: ' + str(flow_time_s) + ' s, incubation time: ' + str(incubation_time_min) + ' min [negative number skips the sequence]')
+		compiler = PlanCompiler()
+		compiler.add_sequence(sequence_name,fluidic_port,flow_time_s,incubation_time_min,pressure_setting,aspiration_pump_power,aspiration_time_s,round_,port_name,volume_ul=volume_ul,aspiration_mode=aspiration_mode)
+		return self.add_plan(compiler.compile())
+
+	def add_plan(self,plan):
+		''' queue a plan, it is executed after the plans already queued '''
+		self.pending_plans.append(plan)
+		if self.duration_estimator is not None:
+			self.duration_estimator.add_plan(plan)
+		if any(sequence.disable_manual_control for sequence in plan.sequences):
+			self.listener.on_manual_control_disabled()
+		return plan
+
+	def request_abort_sequences(self):
+		self.abort_sequences_requested = True
+		self._advance_sequence_execution()
+
+	def start_sequence_execution(self):
+		self.abort_sequences_requested = False
+		if self.sequences_in_progress == False:
+			self.aspiration_time_saved_s = 0
+		# the plans queued before the start are executed as one plan, e.g. for the ETA
+		if self.sequences_in_progress == False and len(self.pending_plans) > 1:
+			self.pending_plans = deque([concatenate_plans(self.pending_plans)])
+		self.sequences_in_progress = True
+		self.listener.on_sequences_execution_started()
+		self._advance_sequence_execution()
+
+#######################################################
+################### asyncio runner ####################
+#######################################################
+
+def mcu_poll_interval_s(microcontroller):
+	''' the MCU state is polled at half the telemetry period of the MCU (see controllers.Microcontroller.set_telemetry_rate) '''
+	telemetry_period_ms = getattr(microcontroller,'telemetry_period_ms',None)
+	if telemetry_period_ms is None:
+		return TIMER_CHECK_MCU_STATE_INTERVAL_MS/1000
+	return telemetry_period_ms/2/1000
+
+async def run_sequences(engine,poll_interval_s=None):
+	''' start executing the queued sequences and feed the MCU messages to the engine until all the sequences are done '''
+	engine.start_sequence_execution()
+	while engine.sequences_in_progress:
+		for msg in engine.microcontroller.read_received_packets_nowait():
+			engine.process_microcontroller_message(msg)
+		# the period may change once it has been checked (see controllers.Microcontroller.telemetry_rate_confirmed)
+		await asyncio.sleep(poll_interval_s if poll_interval_s is not None else mcu_poll_interval_s(engine.microcontroller))
+
+def run_sequences_virtual(engine,poll_interval_s=None):
+	'''
+	start executing the queued sequences on a VirtualClock - instead of waiting, the clock jumps to the next event
+	(a stopwatch timeout or the completion of the simulated MCU command), returns the simulated duration in seconds
+	'''
+	if poll_interval_s is None:
+		poll_interval_s = mcu_poll_interval_s(engine.microcontroller)
+	clock = engine.clock
+	t_start = clock.now()
+	engine.start_sequence_execution()
+	while True:
+		for msg in engine.microcontroller.read_received_packets_nowait():
+			engine.process_microcontroller_message(msg)
+		if engine.sequences_in_progress == False:
+			break
+		next_event_times = [t for t in [clock.next_event_time(),engine.microcontroller.next_event_time()] if t is not None]
+		if len(next_event_times) == 0:
+			raise RuntimeError('sequence execution cannot advance - no pending event on the virtual clock')
+		# the MCU state is polled, the engine sees a change at the first poll after it
+		number_of_polls = max(1,math.ceil((min(next_event_times) - clock.now())/poll_interval_s - 1e-9))
+		clock.advance_to(clock.now() + number_of_polls*poll_interval_s)
+	return clock.now() - t_start
+
+# fluidic port of the sequences in the sequence table (see SequenceWidget), the port of 'Ligate' is chosen by the user
+SEQUENCE_FLUIDIC_PORT = {
+	'Remove Medium':Port['Vacuum'],
+	'Stripping Buffer Wash':Port['Stripping Buffer'],
+	'Stripping Buffer Rinse':Port['Stripping Buffer'],
+	'PBST Wash':Port['PBST'],
+	'Ligate':Port['1'],
+	'Wash (Post Ligation, 1)':Port['Imaging Buffer'],
+	'Stain with DAPI':Port['DAPI'],
+	'Wash (Post Ligation, 2)':Port['Imaging Buffer'],
+	'Add Imaging Buffer':Port['Imaging Buffer']}
+
+def compile_plan_from_settings(filename,sequence_names):
+	''' compile the sequences (in the order of the sequence table) with the settings saved by SequenceWidget '''
+	root = ET.parse(filename).getroot()
+	settings = {}
+	for sequence in root.iter('sequence'):
+		# Volume_in_ul: 0 or missing (older settings files) for pumping for the flow time
+		settings[sequence.get('Name')] = (int(sequence.get('Repeat')),float(sequence.get('Incubation_Time_in_minute')),float(sequence.get('Flow_Time_in_second')),int(float(sequence.get('Volume_in_ul','0'))))
+	aspiration_setting = root.find('aspiration_setting')
+	# Mode: missing in older settings files
+	aspiration_mode = ASPIRATION_MODES.get(aspiration_setting.get('Mode'),DEFAULT_VALUES.aspiration_mode)
+	# defaults of the sequences not saved in the settings file (same as SequenceWidget)
+	settings.setdefault('Remove Medium',(1,0,-1,0))
+	settings.setdefault('Add Imaging Buffer',(1,-1,0,0))
+	compiler = PlanCompiler()
+	for sequence_name in SEQUENCE_NAME:
+		if sequence_name in sequence_names:
+			repeat, incubation_time_min, flow_time_s, volume_ul = settings[sequence_name]
+			compiler.add_sequence(sequence_name,SEQUENCE_FLUIDIC_PORT[sequence_name],flow_time_s,incubation_time_min,pressure_setting=None,
+				aspiration_pump_power=float(aspiration_setting.get('Pump_Power')),aspiration_time_s=float(aspiration_setting.get('Duration_Seconds')),round_=0,repeat=repeat,volume_ul=volume_ul,aspiration_mode=aspiration_mode)
+	return compiler.compile()
+
+def add_sequences_from_settings(engine,filename,sequence_names):
+	''' queue the sequences (in the order of the sequence table) with the settings saved by SequenceWidget, returns the number of sequences added '''
+	return engine.add_plan(compile_plan_from_settings(filename,sequence_names)).number_of_sequences()
+
+if __name__ == "__main__":
+	# python3 engine.py settings_default.xml 'PBST Wash' 'Stain with DAPI' --simulation
+	# python3 engine.py settings_default.xml 'PBST Wash' --simulation --virtual_time --save_plan plan.jsonl
+	parser = argparse.ArgumentParser(description='run sequences without GUI')
+	parser.add_argument('settings',help='sequence settings file saved by the GUI')
+	parser.add_argument('sequences',nargs='+',help='names of the sequences to run, executed in the order of the sequence table')
+	parser.add_argument('--simulation',nargs='?',const='commands',choices=['commands','firmware'],
+		help='use the simulated microcontroller - commands complete after a fixed time (default), or firmware runs the model of the firmware and the fluidics')
+	parser.add_argument('--serial_number',default=CONTROLLER_SERIAL_NUMBERS[0])
+	parser.add_argument('--virtual_time',action='store_true',help='with --simulation, run as fast as possible on a virtual clock')
+	parser.add_argument('--log_measurements',help='record the MCU messages to this telemetry file')
+	parser.add_argument('--save_plan',help='save the compiled plan to this file (see Plan.save)')
+	args = parser.parse_args()
+
+	import controllers
+	clock = VirtualClock() if (args.simulation and args.virtual_time) else AsyncioClock()
+	if args.simulation == 'firmware':
+		import simulation
+		microcontroller = simulation.Microcontroller_Firmware_Simulation(clock=clock)
+	elif args.simulation:
+		microcontroller = controllers.Microcontroller_Simulation(clock=clock)
+	else:
+		microcontroller = controllers.Microcontroller(args.serial_number)
+	measurement_recorder = telemetry.TelemetryRecorder(args.log_measurements) if args.log_measurements else None
+	engine = SequenceEngine(microcontroller,clock,PrintingSequenceEngineListener(),measurement_recorder)
+	plan = compile_plan_from_settings(args.settings,args.sequences)
+	if args.save_plan:
+		plan.save(args.save_plan)
+	utils.print_message(str(plan.number_of_sequences()) + ' sequences, ' + str(len(plan)) + ' steps, expected duration ' + '{:.1f}'.format(plan.duration_s()/60) + ' min')
+	if engine.add_plan(plan).number_of_sequences() > 0:
+		if isinstance(clock,VirtualClock):
+			utils.print_message('simulated ' + '{:.1f}'.format(run_sequences_virtual(engine)/3600) + ' h')
+		else:
+			asyncio.run(run_sequences(engine))
+	if measurement_recorder is not None:
+		measurement_recorder.close()
@@ -0,0 +1,135 @@
+'''
+run time estimation from the durations of the steps measured in past runs
+	estimator = estimator.StepDurationEstimator(filename)  # the history is loaded from filename (if it exists), see load()
+	estimator.add_plan(plan)                               # plan queued
+	estimator.step_started(step)                           # step of the plan started (all the step types)
+	estimator.step_completed(step,duration_s)              # MCU command or stopwatch completed, measured duration
+	estimator.queued_correction_s                          # learned correction of the steps queued and not started
+	estimator.save()
+the steps are grouped by kind - step type, command, payload 1 (control type/aspiration mode) and payload 2 (fluidic port) - and an EWMA of
+(measured - expected duration) is learned for each kind: MCU command latency, pressure ramp up, emptying of the fluidic line, aspirations ended
+at the bubble sensor ... the forecast of a step is its expected duration (flow time, incubation time, see MCU_CMD_EXPECTED_DURATION) plus the
+correction of its kind
+the number of queued steps of each kind is kept, so that queued_correction_s is updated in O(1) per step started or completed
+the messages (history not readable or not saved) go to log, e.g. the log of the GUI (default: printed)
+usage:
+	python3 estimator.py <plan file> [history file]   # forecast of each step of a plan saved by Plan.save()
+'''
+
+# other libraries
+import sys
+import json
+import numpy as np
+
+import engine
+from _def import *
+
+STEP_DURATION_HISTORY_FORMAT = 'fluidics step durations'
+STEP_DURATION_HISTORY_VERSION = 1
+
+def step_kinds(steps):
+	''' kind of each step of an array of plan steps (PLAN_STEP_DTYPE) - step type, command, payload 1 and payload 2 '''
+	packets = steps['packet'].astype(np.uint32)
+	return (steps['type'].astype(np.uint32) << 24) | (packets[:,2] << 16) | (packets[:,3] << 8) | packets[:,4]
+
+def step_kind(step):
+	packet = step['packet']
+	return (int(step['type']) << 24) | (int(packet[2]) << 16) | (int(packet[3]) << 8) | int(packet[4])
+
+class StepDurationEstimator(object):
+	def __init__(self,filename=None,alpha=STEP_DURATION_EWMA_ALPHA,log=print,load=True):
+		self.filename = filename
+		self.alpha = alpha
+		self.log = log
+		self.corrections = {} # kind -> (EWMA of measured - expected duration, number of steps measured)
+		self.queued = {} # kind -> number of steps queued and not started
+		self.queued_correction_s = 0
+		if filename is not None and load:
+			self.load()
+
+	def correction_s(self,kind):
+		correction = self.corrections.get(kind)
+		return correction[0] if correction is not None else 0
+
+	def forecast_s(self,step):
+		''' expected duration of a step corrected with the history '''
+		return max(0,float(step['duration_s']) + self.correction_s(step_kind(step)))
+
+	def plan_forecast_s(self,plan):
+		''' expected duration of a plan corrected with the history - O(number of steps) '''
+		kinds, counts = np.unique(step_kinds(plan.steps),return_counts=True)
+		return plan.duration_s() + sum(count*self.correction_s(int(kind)) for kind, count in zip(kinds,counts))
+
+	def add_plan(self,plan):
+		kinds, counts = np.unique(step_kinds(plan.steps),return_counts=True)
+		for kind, count in zip(kinds.tolist(),counts.tolist()):
+			self.queued[kind] = self.queued.get(kind,0) + count
+			self.queued_correction_s = self.queued_correction_s + count*self.correction_s(kind)
+
+	def step_started(self,step):
+		kind = step_kind(step)
+		if self.queued.get(kind,0) > 0:
+			self.queued[kind] = self.queued[kind] - 1
+			self.queued_correction_s = self.queued_correction_s - self.correction_s(kind)
+
+	def step_completed(self,step,duration_s):
+		kind = step_kind(step)
+		error_s = duration_s - float(step['duration_s'])
+		correction = self.corrections.get(kind)
+		if correction is None:
+			self.corrections[kind] = (error_s,1)
+			previous_correction_s = 0
+		else:
+			previous_correction_s, count = correction
+			self.corrections[kind] = (previous_correction_s + self.alpha*(error_s - previous_correction_s),count + 1)
+		# the queued steps of the same kind get the new correction
+		self.queued_correction_s = self.queued_correction_s + self.queued.get(kind,0)*(self.corrections[kind][0] - previous_correction_s)
+
+	def clear(self):
+		''' no step queued (end of the run or abort) '''
+		self.queued = {}
+		self.queued_correction_s = 0
+
+	def load(self,filename=None):
+		filename = filename if filename is not None else self.filename
+		if filename is None:
+			return
+		try:
+			with open(filename) as f:
+				history = json.load(f)
+		except FileNotFoundError:
+			return # first run
+		except (OSError,ValueError) as e:
+			self.log('step duration history not loaded: ' + str(e))
+			return
+		if not isinstance(history,dict) or history.get('format') != STEP_DURATION_HISTORY_FORMAT or history.get('version') != STEP_DURATION_HISTORY_VERSION:
+			self.log(filename + ' is not a step duration history, ignored')
+			return
+		self.corrections = {int(kind):(correction_s,count) for kind, (correction_s,count) in history['corrections'].items()}
+		# steps may have been queued before the history was loaded
+		self.queued_correction_s = sum(count*self.correction_s(kind) for kind, count in self.queued.items())
+
+	def save(self,filename=None):
+		filename = filename if filename is not None else self.filename
+		if filename is None or len(self.corrections) == 0:
+			return
+		try:
+			with open(filename,'w') as f:
+				json.dump({'format':STEP_DURATION_HISTORY_FORMAT,'version':STEP_DURATION_HISTORY_VERSION,
+					'corrections':{str(kind):correction for kind, correction in self.corrections.items()}},f,indent=1)
+		except OSError as e:
+			self.log('step duration history not saved: ' + str(e))
+
+if __name__ == "__main__":
+	# python3 estimator.py <plan file> [history file]
+	plan = engine.load_plan(sys.argv[1])
+	estimator = StepDurationEstimator(sys.argv[2] if len(sys.argv) > 2 else None)
+	t = 0
+	for step in plan.steps:
+		if step['type'] == PLAN_STEP_TYPE.SEQUENCE:
+			print(plan.descriptions[step['description']])
+			continue
+		forecast_s = estimator.forecast_s(step)
+		t = t + forecast_s
+		print('\t' + '{:>8.1f}'.format(t) + ' s  ' + '{:>7.1f}'.format(forecast_s) + ' s (expected ' + '{:.1f}'.format(float(step['duration_s'])) + ' s)  ' + plan.descriptions[step['description']])
+	print('expected duration ' + '{:.1f}'.format(plan.duration_s()/60) + ' min, forecast ' + '{:.1f}'.format(estimator.plan_forecast_s(plan)/60) + ' min')
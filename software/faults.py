@@ -0,0 +1,197 @@
+'''
+streaming detection of fluidic faults from the MCU telemetry - leak, clog, empty reservoir and air in the line
+	detector = faults.FaultDetector()
+	detector.start_command(packet)                   # MCU command sent (pressure setpoint of ADD_MEDIUM)
+	events = detector.update(decoded_msg,timestamp)  # per MCU message (telemetry.MCUMessage), returns [FaultEvent]
+the statistics are updated in O(1) per message; the checks are armed FAULT_DETECTOR_SETTLE_S after the MCU starts pumping
+fluid ('Pump Fluid') or aspirating ('Remove Medium'), and are reset when the internal program changes
+	leak            : pressure below the setpoint (constant pressure), vacuum below FAULT_LEAK_VACUUM_PSI_PER_PUMP_POWER*pump power,
+	                  or upstream flow above the downstream flow (if a downstream flow sensor reports, bytes 16-17) - CUSUM
+	clog            : upstream flow below FAULT_CLOG_MIN_FLOW_UL_PER_MIN with liquid at the upstream bubble sensor - CUSUM
+	air in line     : FAULT_AIR_IN_LINE_SAMPLES of air at the upstream bubble sensor once liquid has reached it
+	empty reservoir : FAULT_EMPTY_RESERVOIR_SAMPLES of air at the upstream bubble sensor once liquid has reached it
+a CUSUM with tolerance k and threshold FAULT_CUSUM_SAMPLES*k detects a deviation of 2k within FAULT_CUSUM_SAMPLES messages; the
+tolerance of the pressure and vacuum checks is raised to FAULT_NOISE_SIGMAS standard deviations (EWMA) of the sensor while settling
+the flow sensors are used once they have reported a non-zero reading (the firmware sends 0 for a sensor that is not fitted)
+usage:
+	python3 faults.py <telemetry file>   # faults in a recorded telemetry file (see telemetry.TelemetryRecorder)
+'''
+
+# other libraries
+import sys
+import math
+from collections import namedtuple
+
+import telemetry
+from _def import *
+
+FaultEvent = namedtuple('FaultEvent',['fault','timestamp','sample','internal_program','message'])
+
+INTERNAL_PROGRAM_REMOVE_MEDIUM = MCU_INTERNAL_PROGRAMS.index('Remove Medium')
+INTERNAL_PROGRAM_PUMP_FLUID = MCU_INTERNAL_PROGRAMS.index('Pump Fluid')
+
+class EWMA(object):
+	''' exponentially weighted mean and variance '''
+	def __init__(self,alpha=FAULT_EWMA_ALPHA):
+		self.alpha = alpha
+		self.reset()
+
+	def reset(self):
+		self.mean = None
+		self.variance = 0
+		self.count = 0
+
+	def update(self,x):
+		self.count = self.count + 1
+		if self.mean is None:
+			self.mean = x
+			return
+		delta = x - self.mean
+		self.mean = self.mean + self.alpha*delta
+		self.variance = (1 - self.alpha)*(self.variance + self.alpha*delta*delta)
+
+class CUSUM(object):
+	''' one-sided CUSUM of the deviation (x - reference), alarm when the sum of the deviations beyond the tolerance exceeds the threshold '''
+	def __init__(self,tolerance,number_of_samples=FAULT_CUSUM_SAMPLES):
+		self.number_of_samples = number_of_samples
+		self.set_tolerance(tolerance)
+		self.sum = 0
+
+	def set_tolerance(self,tolerance):
+		self.tolerance = tolerance
+		self.threshold = self.number_of_samples*tolerance
+
+	def reset(self):
+		self.sum = 0
+
+	def update(self,deviation):
+		self.sum = max(0,self.sum + deviation - self.tolerance)
+		return self.sum > self.threshold
+
+class FaultDetector(object):
+	def __init__(self,settle_time_s=FAULT_DETECTOR_SETTLE_S):
+		self.settle_time_s = settle_time_s
+		self.pressure_setpoint_psi = DEFAULT_VALUES.pressure_setpoint_for_pumping_fluid_constant_pressure_mode
+		self.control_type = DEFAULT_VALUES.control_type_for_adding_medium
+		self.upstream_flow_sensor_present = False
+		self.downstream_flow_sensor_present = False
+		self.pressure_deficit = CUSUM(FAULT_LEAK_PRESSURE_TOLERANCE_PSI)
+		self.vacuum_deficit = CUSUM(FAULT_LEAK_VACUUM_TOLERANCE_PSI)
+		self.flow_difference = CUSUM(FAULT_LEAK_FLOW_TOLERANCE_UL_PER_MIN)
+		self.flow_deficit = CUSUM(FAULT_CLOG_MIN_FLOW_UL_PER_MIN)
+		self.pressure = EWMA()
+		self.vacuum = EWMA()
+		self.flow_upstream = EWMA()
+		self.number_of_samples = 0
+		self.events = [] # all the events raised
+		self.internal_program = None
+		self._reset(0)
+
+	def _reset(self,timestamp):
+		self.t_internal_program_started = timestamp
+		self.armed = False
+		self.liquid_reached_bubble_sensor = False
+		self.air_samples = 0
+		self.faults_raised = set() # each fault is raised once per internal program (air in line: once per run of air)
+		for statistic in (self.pressure_deficit,self.vacuum_deficit,self.flow_difference,self.flow_deficit,self.pressure,self.vacuum,self.flow_upstream):
+			statistic.reset()
+
+	def _settled(self,timestamp):
+		# at the end of the settling time, the tolerances are adapted to the noise of the pressure sensors
+		if self.armed:
+			return True
+		if timestamp - self.t_internal_program_started < self.settle_time_s:
+			return False
+		self.armed = True
+		self.pressure_deficit.set_tolerance(max(FAULT_LEAK_PRESSURE_TOLERANCE_PSI,FAULT_NOISE_SIGMAS*math.sqrt(self.pressure.variance)))
+		self.vacuum_deficit.set_tolerance(max(FAULT_LEAK_VACUUM_TOLERANCE_PSI,FAULT_NOISE_SIGMAS*math.sqrt(self.vacuum.variance)))
+		return True
+
+	def start_command(self,packet):
+		''' MCU command sent (packet without UID) - the pressure setpoint of ADD_MEDIUM in constant pressure (or volume control) '''
+		if int(packet[2]) == CMD_SET.ADD_MEDIUM:
+			self.control_type = int(packet[3])
+			self.pressure_setpoint_psi = ((int(packet[5]) << 8) + int(packet[6]))/65535*PRESSURE_FULL_SCALE_PSI
+
+	def _raise(self,fault,timestamp,message):
+		if fault in self.faults_raised:
+			return None
+		self.faults_raised.add(fault)
+		event = FaultEvent(fault,timestamp,self.number_of_samples,self.internal_program,message)
+		self.events.append(event)
+		return event
+
+	def update(self,decoded_msg,timestamp):
+		''' process one MCU message (telemetry.MCUMessage), returns the FaultEvents raised by this message '''
+		self.number_of_samples = self.number_of_samples + 1
+		if decoded_msg.flow_upstream != 0:
+			self.upstream_flow_sensor_present = True
+		if decoded_msg.flow_downstream != 0:
+			self.downstream_flow_sensor_present = True
+		if decoded_msg.internal_program != self.internal_program:
+			self.internal_program = decoded_msg.internal_program
+			self._reset(timestamp)
+		if self.internal_program == INTERNAL_PROGRAM_PUMP_FLUID:
+			return self._update_pumping(decoded_msg,timestamp)
+		if self.internal_program == INTERNAL_PROGRAM_REMOVE_MEDIUM:
+			return self._update_aspiration(decoded_msg,timestamp)
+		return []
+
+	def _update_pumping(self,decoded_msg,timestamp):
+		events = []
+		self.pressure.update(decoded_msg.pressure)
+		# air at the upstream bubble sensor, once liquid has reached it
+		liquid_present = decoded_msg.bubble_sensor_2 > 0
+		if liquid_present:
+			if self.liquid_reached_bubble_sensor == False:
+				self.liquid_reached_bubble_sensor = True
+				self.flow_upstream.reset()
+			if self.air_samples > 0:
+				# end of a run of air, the next one is reported again
+				self.air_samples = 0
+				self.faults_raised.discard(FAULT_TYPE.AIR_IN_LINE)
+		elif self.liquid_reached_bubble_sensor:
+			self.air_samples = self.air_samples + 1
+			if self.air_samples == FAULT_AIR_IN_LINE_SAMPLES:
+				events.append(self._raise(FAULT_TYPE.AIR_IN_LINE,timestamp,'air in the fluidic line (upstream bubble sensor)'))
+			if self.air_samples == FAULT_EMPTY_RESERVOIR_SAMPLES:
+				events.append(self._raise(FAULT_TYPE.EMPTY_RESERVOIR,timestamp,'empty reservoir: no liquid at the upstream bubble sensor for ' + str(self.air_samples) + ' samples'))
+		if self.upstream_flow_sensor_present and liquid_present:
+			self.flow_upstream.update(decoded_msg.flow_upstream)
+		if self._settled(timestamp) == False:
+			return [event for event in events if event is not None]
+
+		if self.control_type in (MCU_CMD_PARAMETERS.CONSTANT_PRESSURE,MCU_CMD_PARAMETERS.VOLUME_CONTROL) and self.pressure_deficit.update(self.pressure_setpoint_psi - decoded_msg.pressure):
+			events.append(self._raise(FAULT_TYPE.LEAK,timestamp,'leak: pressure ' + '{:.2f}'.format(self.pressure.mean) + ' psi, setpoint ' + '{:.2f}'.format(self.pressure_setpoint_psi) + ' psi'))
+		# the downstream flow sensor reads ~0 until the liquid reaches it
+		if self.upstream_flow_sensor_present and self.downstream_flow_sensor_present and decoded_msg.flow_downstream > FAULT_CLOG_MIN_FLOW_UL_PER_MIN and self.flow_difference.update(decoded_msg.flow_upstream - decoded_msg.flow_downstream):
+			events.append(self._raise(FAULT_TYPE.LEAK,timestamp,'leak: upstream flow ' + '{:.0f}'.format(decoded_msg.flow_upstream) + ' ul/min, downstream flow ' + '{:.0f}'.format(decoded_msg.flow_downstream) + ' ul/min'))
+		# a stopped flow (2x the tolerance below 2x the minimum flow) is detected within FAULT_CUSUM_SAMPLES
+		if self.upstream_flow_sensor_present and liquid_present and self.flow_deficit.update(2*FAULT_CLOG_MIN_FLOW_UL_PER_MIN - decoded_msg.flow_upstream):
+			events.append(self._raise(FAULT_TYPE.CLOG,timestamp,'clog: flow ' + '{:.0f}'.format(self.flow_upstream.mean) + ' ul/min at ' + '{:.2f}'.format(self.pressure.mean) + ' psi'))
+		return [event for event in events if event is not None]
+
+	def _update_aspiration(self,decoded_msg,timestamp):
+		self.vacuum.update(decoded_msg.vacuum)
+		# the pump is stopped at the end of the aspiration, the vacuum then decays
+		if self._settled(timestamp) == False or decoded_msg.pump_power == 0:
+			return []
+		if self.vacuum_deficit.update(FAULT_LEAK_VACUUM_PSI_PER_PUMP_POWER*decoded_msg.pump_power - abs(decoded_msg.vacuum)):
+			event = self._raise(FAULT_TYPE.LEAK,timestamp,'leak: vacuum ' + '{:.2f}'.format(abs(self.vacuum.mean)) + ' psi at a pump power of ' + '{:.2f}'.format(decoded_msg.pump_power))
+			if event is not None:
+				return [event]
+		return []
+
+def detect_faults(timestamps,messages,detector=None):
+	''' run a FaultDetector over recorded or simulated messages (25-byte MCU messages), returns the FaultEvents '''
+	detector = detector if detector is not None else FaultDetector()
+	events = []
+	for timestamp, msg in zip(timestamps,messages):
+		events.extend(detector.update(telemetry.decode_mcu_message(bytes(msg)),timestamp))
+	return events
+
+if __name__ == "__main__":
+	# python3 faults.py <telemetry file>
+	records = telemetry.load_telemetry(sys.argv[1])
+	for event in detect_faults(records['timestamp'],records['frame']):
+		print('{:.3f}'.format(event.timestamp) + ' ' + MCU_INTERNAL_PROGRAMS[event.internal_program] + ': ' + event.message)
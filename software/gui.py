@@ -10,11 +10,14 @@ from qtpy.QtGui import *
 
 # app specific libraries
 import controllers
+import simulation
 import widgets
 
+from _def import *
+
 class STARmapAutomationControllerGUI(QMainWindow):
 
-	def __init__(self, is_simulation=False, log_measurements=False, *args, **kwargs):
+	def __init__(self, is_simulation=False, log_measurements=False, serial_number=CONTROLLER_SERIAL_NUMBERS[0], *args, **kwargs):
 		super().__init__(*args, **kwargs)
 
 		# load objects
@@ -23,23 +26,26 @@ class STARmapAutomationControllerGUI(QMainWindow):
 		#elf.fluidController = controllers.FluidController()
 
 		if(is_simulation):
-			self.teensy41 = controllers.Microcontroller_Simulation()
+			if SIMULATE_FIRMWARE:
+				self.teensy41 = simulation.Microcontroller_Firmware_Simulation()
+			else:
+				self.teensy41 = controllers.Microcontroller_Simulation()
 		else:
-			serial_number = '8219530'
-			# serial_number = '9178980'
+			# other controllers: see devices.discover_controllers()
 			self.teensy41 = controllers.Microcontroller(serial_number)
-		self.fluidController = controllers.FluidController(self.teensy41,log_measurements)
-		self.logger = controllers.Logger()
+		self.fluidController = controllers.FluidController(self.teensy41,log_measurements,use_reader_thread=USE_MCU_READER_THREAD)
+		self.logger = controllers.Logger(context=self.fluidController.engine.log_context)
 
 		# load widgets
 		self.chillerWidget = widgets.ChillerWidget(self.fluidController)
 		self.preUseCheckWidget = widgets.PreUseCheckWidget(self.fluidController)
-		self.logWidget = QListWidget()
+		self.logWidget = widgets.LogWidget()
 		# self.triggerWidget = widgets.TriggerWidget(self.triggerController)
 		self.sequenceWidget = widgets.SequenceWidget(self.fluidController)
 		self.manualFlushWidget = widgets.ManualFlushWidget(self.fluidController)
 		self.manualControlWidget = widgets.ManualControlWidget(self.fluidController)
 		self.microcontrollerStateDisplayWidget = widgets.MicrocontrollerStateDisplayWidget()
+		self.telemetryPlotWidget = widgets.TelemetryPlotWidget(self.fluidController)
 
 		# disable preuse check before it is fully implemented
 		# self.preUseCheckWidget.setEnabled(False)
@@ -75,6 +81,7 @@ class STARmapAutomationControllerGUI(QMainWindow):
 		self.tabWidget = QTabWidget()
 		self.tabWidget.addTab(tab1_widget, "Run Experiments")
 		self.tabWidget.addTab(tab2_widget, "Settings and Manual Control")
+		self.tabWidget.addTab(self.telemetryPlotWidget, "Live Plot")
 		
 		layout = QGridLayout()
 		layout.addWidget(self.tabWidget,0,0)
@@ -97,23 +104,14 @@ class STARmapAutomationControllerGUI(QMainWindow):
 		# layout widgets (using tabs)  - end
 
 		# connecting signals to slots
-		# @@@ to do: addItem and scrollToBottom need to happen in sequence - create a function for this
-		self.chillerWidget.log_message.connect(self.logWidget.addItem)
-		self.preUseCheckWidget.log_message.connect(self.logWidget.addItem)
-		self.fluidController.log_message.connect(self.logWidget.addItem)
-		# self.triggerController.log_message.connect(self.logWidget.addItem)
-		self.sequenceWidget.log_message.connect(self.logWidget.addItem)
-		self.manualFlushWidget.log_message.connect(self.logWidget.addItem)
-		self.manualControlWidget.log_message.connect(self.logWidget.addItem)
-
-		self.chillerWidget.log_message.connect(self.logWidget.scrollToBottom)
-		self.preUseCheckWidget.log_message.connect(self.logWidget.scrollToBottom)
-		self.fluidController.log_message.connect(self.logWidget.scrollToBottom)
-		# self.triggerController.log_message.connect(self.logWidget.scrollToBottom)
-		self.sequenceWidget.log_message.connect(self.logWidget.scrollToBottom)
-		self.manualFlushWidget.log_message.connect(self.logWidget.scrollToBottom)
-		self.manualControlWidget.log_message.connect(self.logWidget.scrollToBottom)
-		
+		self.chillerWidget.log_message.connect(self.logWidget.log)
+		self.preUseCheckWidget.log_message.connect(self.logWidget.log)
+		self.fluidController.log_message.connect(self.logWidget.log)
+		# self.triggerController.log_message.connect(self.logWidget.log)
+		self.sequenceWidget.log_message.connect(self.logWidget.log)
+		self.manualFlushWidget.log_message.connect(self.logWidget.log)
+		self.manualControlWidget.log_message.connect(self.logWidget.log)
+
 		self.chillerWidget.log_message.connect(self.logger.log)
 		self.preUseCheckWidget.log_message.connect(self.logger.log)
 		self.fluidController.log_message.connect(self.logger.log)
@@ -122,7 +120,7 @@ class STARmapAutomationControllerGUI(QMainWindow):
 		self.manualFlushWidget.log_message.connect(self.logger.log)
 		self.manualControlWidget.log_message.connect(self.logger.log)
 
-		self.fluidController.signal_log_highlight_current_item.connect(self.highlight_current_log_item)
+		self.fluidController.signal_log_highlight_current_item.connect(self.logWidget.highlight_last_row)
 
 		self.sequenceWidget.signal_disable_manualControlWidget.connect(self.disableManualControlWidget)
 		self.sequenceWidget.signal_enable_manualControlWidget.connect(self.enableManualControlWidget)
@@ -134,28 +132,16 @@ class STARmapAutomationControllerGUI(QMainWindow):
 
 		self.fluidController.signal_uncheck_all_sequences.connect(self.sequenceWidget.uncheck_all_sequences)
 
-		self.fluidController.signal_initialize_stopwatch_display.connect(self.logWidget.addItem)
-		self.fluidController.signal_initialize_stopwatch_display.connect(self.logWidget.scrollToBottom)
-		self.fluidController.signal_update_stopwatch_display.connect(self.update_stopwatch_display)
+		# the stopwatch countdown is shown in the pinned status row of the log
+		self.fluidController.signal_initialize_stopwatch_display.connect(self.logWidget.set_status)
+		self.fluidController.signal_update_stopwatch_display.connect(self.logWidget.set_status)
 
 		# connections for displaying the MCU state
-		self.fluidController.signal_MCU_CMD_UID.connect(self.microcontrollerStateDisplayWidget.label_MCU_CMD_UID.setNum)
-		self.fluidController.signal_MCU_CMD.connect(self.microcontrollerStateDisplayWidget.label_CMD.setNum)
-		self.fluidController.signal_MCU_CMD_status.connect(self.microcontrollerStateDisplayWidget.label_CMD_status.setText)
-		self.fluidController.signal_MCU_internal_program.connect(self.microcontrollerStateDisplayWidget.label_MCU_internal_program.setText)
-		self.fluidController.signal_MCU_CMD_time_elapsed.connect(self.microcontrollerStateDisplayWidget.label_MCU_CMD_time_elapsed.setNum)
-
-		self.fluidController.signal_pump_power.connect(self.microcontrollerStateDisplayWidget.label_pump_power.setText)
-		self.fluidController.signal_selector_valve_position.connect(self.microcontrollerStateDisplayWidget.label_selector_valve_position.setNum)
-		self.fluidController.signal_pressure.connect(self.microcontrollerStateDisplayWidget.label_pressure.setText)
-		self.fluidController.signal_vacuum.connect(self.microcontrollerStateDisplayWidget.label_vacuum.setText)
-		self.fluidController.signal_bubble_sensor_1.connect(self.microcontrollerStateDisplayWidget.label_bubble_sensor_downstream.setNum)
-		self.fluidController.signal_bubble_sensor_2.connect(self.microcontrollerStateDisplayWidget.label_bubble_sensor_upstream.setNum)
-		self.fluidController.signal_flow_upstream.connect(self.microcontrollerStateDisplayWidget.label_flowrate_upstream.setText)
-		self.fluidController.signal_volume_ul.connect(self.microcontrollerStateDisplayWidget.label_dispensed_volume.setText)
+		self.fluidController.signal_mcu_state.connect(self.microcontrollerStateDisplayWidget.update_state)
 
 		# highlight current sequence
 		self.fluidController.signal_highlight_current_sequence.connect(self.sequenceWidget.select_row_using_sequence_name)
+		self.fluidController.signal_highlight_current_sequence.connect(self.logWidget.set_current_sequence)
 
 		# connection for the manual control
 		self.fluidController.signal_uncheck_manual_control_enabled.connect(self.manualControlWidget.uncheck_enable_manual_control_button)
@@ -179,15 +165,9 @@ class STARmapAutomationControllerGUI(QMainWindow):
 	def enableSequenceWidget(self):
 		self.tabWidget.setTabEnabled(0,True)
 
-	def update_stopwatch_display(self,text):
-		if 'stop watch remaining time' in self.logWidget.item(self.logWidget.count()-1).text():
-			# use this if statement to prevent other messages being overwritten
-			self.logWidget.item(self.logWidget.count()-1).setText(text)
-
-	def highlight_current_log_item(self):
-		self.logWidget.setCurrentRow(self.logWidget.count()-1)
-		
 	def closeEvent(self, event):
 		self.fluidController.close()
 		self.sequenceWidget.close()
+		self.telemetryPlotWidget.close()
+		self.logger.close()
 		event.accept()
\ No newline at end of file
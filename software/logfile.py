@@ -0,0 +1,151 @@
+'''
+log file writer - the messages are written to disk by a background thread
+	text file    : one message per line, as displayed in the GUI
+	records file : one JSON object per line with the fields of LOG_RECORD_FIELDS, next to the text file (.jsonl), see load_log_records()
+the files are rotated by size and by age, rotated files are optionally compressed (gzip)
+usage:
+	python3 logfile.py "starmap-automation logs.jsonl" --level Error --sequence "PBST Wash"
+'''
+
+import os
+import sys
+import gzip
+import json
+import time
+import queue
+import shutil
+import argparse
+import threading
+from datetime import datetime
+
+import utils
+from _def import *
+
+LOG_RECORD_FIELDS = ['t','t_monotonic','level','sequence','round','uid','message'] # t: seconds since epoch, t_monotonic: for ordering/intervals
+
+class LogFileWriter(object):
+	'''
+	write() queues the message and returns, the writer thread writes the queued messages in groups and flushes them
+	every flush_interval_ms or every flush_interval_records messages (whichever comes first)
+	when the queue is full, back_pressure decides: LOG_FILE_BACK_PRESSURE.BLOCK waits for room, LOG_FILE_BACK_PRESSURE.DROP
+	drops the message (the number of dropped messages is logged once there is room again), LOG_FILE_BACK_PRESSURE.WAIT waits
+	up to wait_ms and then drops the messages until the dropped ones have been logged
+	'''
+	def __init__(self,filename,max_bytes=LOG_FILE_MAX_BYTES,max_age_h=LOG_FILE_MAX_AGE_H,compress_rotated_files=LOG_FILE_COMPRESS_ROTATED_FILES,
+		queue_size=LOG_FILE_QUEUE_SIZE,flush_interval_ms=LOG_FILE_FLUSH_INTERVAL_MS,flush_interval_records=LOG_FILE_FLUSH_INTERVAL_RECORDS,
+		back_pressure=LOG_FILE_BACK_PRESSURE_POLICY,wait_ms=LOG_FILE_BACK_PRESSURE_WAIT_MS):
+		self.filename = filename
+		self.records_filename = os.path.splitext(filename)[0] + '.jsonl'
+		self.max_bytes = max_bytes
+		self.max_age_s = max_age_h*3600
+		self.compress_rotated_files = compress_rotated_files
+		self.flush_interval_s = flush_interval_ms/1000
+		self.flush_interval_records = flush_interval_records
+		self.back_pressure = back_pressure
+		self.wait_s = wait_ms/1000
+		self.queue = queue.Queue(queue_size)
+		self.messages_dropped = 0
+		self.messages_dropped_logged = 0
+		self.number_of_rotations = 0
+		self.closed = False
+		self._open()
+		self.thread = threading.Thread(target=self._run,daemon=True)
+		self.thread.start()
+
+	def write(self,message,level=LOG_SEVERITY.INFO,sequence=None,round_=None,uid=None,t=None):
+		# t: (monotonic time, wall-clock time) as returned by utils.now(), default is now
+		t_monotonic, t_wall = utils.now() if t is None else t
+		record = (t_wall,t_monotonic,level,sequence,round_,uid,message)
+		if self.back_pressure == LOG_FILE_BACK_PRESSURE.BLOCK:
+			self.queue.put(record)
+			return
+		# WAIT: no waiting while the messages dropped have not been logged, so that a burst waits once
+		wait = self.back_pressure == LOG_FILE_BACK_PRESSURE.WAIT and self.messages_dropped == self.messages_dropped_logged
+		try:
+			self.queue.put(record,block=wait,timeout=self.wait_s if wait else None)
+		except queue.Full:
+			self.messages_dropped = self.messages_dropped + 1
+
+	def close(self):
+		# write the queued messages and close the files
+		if self.closed:
+			return
+		self.closed = True
+		self.queue.put(None)
+		self.thread.join()
+
+	def _open(self):
+		self.file = open(self.filename,'a')
+		self.records_file = open(self.records_filename,'a')
+		self.t_opened = time.time()
+
+	def _run(self):
+		records = []
+		t_flush = time.monotonic() + self.flush_interval_s
+		stop_requested = False
+		while stop_requested == False:
+			try:
+				record = self.queue.get(timeout=max(0,t_flush-time.monotonic()))
+				if record is None:
+					stop_requested = True
+				else:
+					records.append(record)
+			except queue.Empty:
+				pass
+			if stop_requested or len(records) >= self.flush_interval_records or time.monotonic() >= t_flush:
+				if self.messages_dropped > self.messages_dropped_logged:
+					number_of_messages_dropped = self.messages_dropped - self.messages_dropped_logged
+					self.messages_dropped_logged = self.messages_dropped
+					t_monotonic, t_wall = utils.now()
+					records.append((t_wall,t_monotonic,LOG_SEVERITY.ERROR,None,None,None,utils.timestamp() + '! ' + str(number_of_messages_dropped) + ' log messages dropped (log file writer queue full) !'))
+				if len(records) > 0:
+					self._write(records)
+					records = []
+				t_flush = time.monotonic() + self.flush_interval_s
+		self.file.close()
+		self.records_file.close()
+
+	def _write(self,records):
+		self.file.write(''.join([record[-1] + '\n' for record in records]))
+		self.records_file.write(''.join([json.dumps(dict(zip(LOG_RECORD_FIELDS,record))) + '\n' for record in records]))
+		self.file.flush()
+		self.records_file.flush()
+		if self.file.tell() >= self.max_bytes or time.time() - self.t_opened >= self.max_age_s:
+			self._rotate()
+
+	def _rotate(self):
+		self.file.close()
+		self.records_file.close()
+		suffix = ' ' + datetime.now().strftime('%Y-%m-%d %H-%M-%S')
+		counter = 1
+		while any(os.path.exists(os.path.splitext(filename)[0] + suffix + os.path.splitext(filename)[1] + gz) for filename in [self.filename,self.records_filename] for gz in ['','.gz']):
+			counter = counter + 1 # more than one rotation in the same second
+			suffix = ' ' + datetime.now().strftime('%Y-%m-%d %H-%M-%S') + ' (' + str(counter) + ')'
+		for filename in [self.filename,self.records_filename]:
+			name, extension = os.path.splitext(filename)
+			rotated_filename = name + suffix + extension
+			os.replace(filename,rotated_filename)
+			if self.compress_rotated_files:
+				with open(rotated_filename,'rb') as f_in, gzip.open(rotated_filename + '.gz','wb') as f_out:
+					shutil.copyfileobj(f_in,f_out)
+				os.remove(rotated_filename)
+		self.number_of_rotations = self.number_of_rotations + 1
+		self._open()
+
+def load_log_records(filename):
+	''' read a records file (.jsonl, or .jsonl.gz if rotated and compressed), returns a list of dicts '''
+	open_file = gzip.open if filename.endswith('.gz') else open
+	with open_file(filename,'rt') as f:
+		return [json.loads(line) for line in f if line.strip() != '']
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='print the log records that match')
+	parser.add_argument('filenames',nargs='+',help='records files (.jsonl or .jsonl.gz)')
+	parser.add_argument('--level')
+	parser.add_argument('--sequence')
+	parser.add_argument('--uid',type=int)
+	args = parser.parse_args()
+	for filename in args.filenames:
+		for record in load_log_records(filename):
+			if (args.level is None or record['level'] == args.level) and (args.sequence is None or record['sequence'] == args.sequence) and (args.uid is None or record['uid'] == args.uid):
+				print(record['message'])
@@ -0,0 +1,960 @@
+'''
+model of the MCU firmware (firmware/firmware.ino) and of the fluidics it drives, for testing the host software without hardware
+	FirmwareModel                       : firmware state machine + fluidics, stepped every 5 ms, produces the 25-byte status frames every 20 ms
+	Microcontroller_Firmware_Simulation : drop-in replacement for Microcontroller_Simulation, runs the model on an engine clock
+	FirmwarePty, FirmwareSocketServer   : serve the model over a pseudo-terminal / TCP in real time
+	launch_firmware()                   : start a fake firmware for a pty://, socket:// or loop:// url (see controllers.Microcontroller)
+usage:
+	python3 simulation.py                     # prints the pseudo-terminal to connect to
+	python3 simulation.py --transport socket  # prints the socket:// url to connect to
+'''
+
+# other libraries
+import os
+import sys
+import time
+import random
+import select
+import signal
+import socket
+import argparse
+import threading
+import subprocess
+import urllib.parse
+from collections import deque
+
+import engine
+import telemetry
+from _def import *
+
+# firmware timing and settings (same names as in firmware.ino)
+READ_SENSORS_INTERVAL_S = 0.005
+SEND_UPDATE_INTERVAL_S = 0.02
+VACUUM_DECAY_TIME_S = 1
+PRESSURE_RAMP_UP_TIME_S = 5
+PUMP_POWER_FOR_EMPTYING_THE_FLUIDIC_LINE = 0.4
+TIME_TIMEOUT_FOR_EMPTYING_THE_FLUIDIC_LINE_S = 60
+THRESHOLD_PRESSURE_EMPTYING_THE_FLUIDIC_LINE_PSI = 4.20
+TIME_REMAINING_EMPTYING_THE_FLUIDIC_LINE_S = 5
+PORT_MANUAL_FLUSHING = 24
+PORT_AIR = 11
+PORT_STRIPPING_BUFFER = 7
+CMD_QUEUE_LENGTH = MCU_CMD_QUEUE_LENGTH
+
+class INTERNAL_PROGRAM:
+	IDLE = 0
+	REMOVE_MEDIUM = 1
+	RAMP_UP_PRESSURE = 2
+	PUMP_FLUID = 3
+	EMPTY_FLUIDIC_LINE = 4
+	PREUSE_CHECK_PRESSURE = 5
+	PREUSE_CHECK_VACUUM = 6
+
+# fluidics - lumped model of the disc pump, the line from the selector valve to the chamber and the aspiration line
+PUMP_STALL_PRESSURE_PSI = 8.0           # pressure at full power with the outlet closed
+PUMP_STALL_VACUUM_PSI = 7.0             # vacuum at full power with the inlet closed
+PUMP_RESISTANCE_PSI_PER_UL_PER_MIN = 0.002
+LINE_RESISTANCE_LIQUID_PSI_PER_UL_PER_MIN = 0.004
+LINE_RESISTANCE_AIR_PSI_PER_UL_PER_MIN = 0.0015
+TAU_PRESSURE_S = 0.3
+TAU_VACUUM_S = 0.3
+LINE_VOLUME_UL = 100                    # selector valve -> chamber
+BUBBLE_SENSOR_2_POSITION_UL = 10        # upstream bubble sensor and flow sensor, from the selector valve
+ASPIRATION_THRESHOLD_PSI = 0.5
+ASPIRATION_RATE_UL_PER_S_PER_PSI = 40
+ASPIRATION_FLICKER_VOLUME_UL = 20       # the downstream bubble sensor flickers while the last of the medium is aspirated
+SELECTOR_VALVE_SWITCH_TIME_S = 0.2
+SELECTOR_VALVE_STEP_TIME_S = 0.03
+SELECTOR_VALVE_NUMBER_OF_PORTS = 24
+PRESSURE_NOISE_PSI = 0.01
+FLOW_NOISE_UL_PER_MIN = 2
+
+# faults (see FirmwareModel.inject_fault)
+LEAK_CONDUCTANCE_UL_PER_MIN_PER_PSI = 1000 # between the flow sensors, the pump cannot hold 3.6 psi
+LEAK_VACUUM_FRACTION = 0.25 # of the vacuum without leak
+CLOG_RESISTANCE_FACTOR = 20
+AIR_BUBBLE_VOLUME_UL = 5
+
+def _pressure_to_raw(psi):
+	raw = (psi - MCU_CONSTANTS._p_min)*(MCU_CONSTANTS._output_max - MCU_CONSTANTS._output_min)/(MCU_CONSTANTS._p_max - MCU_CONSTANTS._p_min) + MCU_CONSTANTS._output_min
+	return int(min(0x3FFF,max(0,raw)))
+
+def _raw_to_pressure(raw):
+	return (min(MCU_CONSTANTS._output_max,max(MCU_CONSTANTS._output_min,raw)) - MCU_CONSTANTS._output_min)*(MCU_CONSTANTS._p_max - MCU_CONSTANTS._p_min)/(MCU_CONSTANTS._output_max - MCU_CONSTANTS._output_min) + MCU_CONSTANTS._p_min
+
+class FirmwareModel(object):
+	'''
+	mirrors loop() of the firmware: commands are parsed as they arrive, sensors are read every 5 ms (followed by the
+	control loops and the internal program state transitions) and a status frame is sent every 20 ms
+	commands flagged MCU_CMD_FLAG_QUEUED are queued (up to CMD_QUEUE_LENGTH) and executed in order when no internal program is running,
+	the other commands are executed at once (CLEAR and ABORT also discard the queue)
+	time (t, in seconds) starts at 0 and is advanced by run_until()
+	'''
+	def __init__(self,flow_sensor_present=True,seed=0,send_update_interval_s=SEND_UPDATE_INTERVAL_S,mark_frames=False,downstream_flow_sensor_present=False,telemetry_rate_supported=True):
+		self.random = random.Random(seed)
+		self.flow_sensor_present = flow_sensor_present
+		self.downstream_flow_sensor_present = downstream_flow_sensor_present # flow sensor 1 (bytes 16-17), not read by the current firmware
+		self.send_update_interval_s = send_update_interval_s
+		self.telemetry_rate_supported = telemetry_rate_supported # False: CMD_SET.SET_TELEMETRY_RATE is ignored and the frames keep their period (firmware without the command)
+		self.mark_frames = mark_frames # for benchmarks - number the frames in the reserved bytes 23-24 to detect frame loss
+		self.t = 0
+		self.t_next_read_sensors = READ_SENSORS_INTERVAL_S
+		self.t_next_send_update = send_update_interval_s
+		self.buffer_rx = bytearray()
+		self.frame_format = 1
+		self.frame_sequence = 0
+		self.telemetry_mode = TELEMETRY_MODE.FULL
+		self.summary_sums = [0,0,0] # pressure 1, pressure 2, flow 2 (raw), for TELEMETRY_MODE.SUMMARY
+		self.summary_number_of_readings = 0
+		self.last_sent_state = None # (UID, command execution status, internal program) of the last frame
+		self.cmd_queue = deque()
+		self.commands_dropped = 0
+		self.frames_sent = 0
+
+		# firmware variables
+		self.current_command_uid = 0
+		self.current_command = 0
+		self.command_execution_status = CMD_EXECUTION_STATUS.IN_PROGRESS
+		self.internal_program = INTERNAL_PROGRAM.IDLE
+		self.t_internal_program_start = 0
+		self.time_elapsed_s = 0
+		self.set_vacuum_duration_ms = 0
+		self.aspiration_mode = ASPIRATION_MODE.FIXED_TIME
+		self.aspiration_air_debounce_ms = 0
+		self.liquid_has_passed_bubble_sensor_1_during_aspiration = False
+		self.t_liquid_at_bubble_sensor_1 = 0
+		self.control_type = MCU_CMD_PARAMETERS.CONSTANT_POWER
+		self.fluidic_port = 0
+		self.control_setpoint = 0
+		self.set_flow_time_ms = 0
+		self.set_volume_ul = 0 # volume control, 0: pump for set_flow_time_ms
+		self.selector_valve_position_setValue = 0
+		self.manual_control_disabled_by_software = False
+		self.disc_pump_power = 0
+		self.disc_pump_enabled = False
+		self.valve_A1 = False # A1 and A2 are switched together: vacuum (True) or pressure (False)
+		self.valve_B1 = False
+		self.valve_B2 = False
+		self.NXP33996_state = 0
+		self.pressure_control_loop_enabled = False
+		self.pressure_set_point = 0
+		self.pressure_loop_p_coefficient = 1
+		self.pressure_loop_i_coefficient = 1
+		self.pressure_loop_integral_error = 0
+		self.flowrate_control_loop_enabled = False
+		self.flowrate_set_point = 0
+		self.flowrate_loop_p_coefficient = 1
+		self.flowrate_loop_i_coefficient = 1
+		self.flowrate_loop_integral_error = 0
+		self.duration_for_emptying_the_fluidic_line_s = 5
+		self.empty_fluidic_line_countdown_started = False
+		self.liquid_has_passed_bubble_sensor_2_during_pumping = False
+		self.flag_measure_volume = False
+		self.volume_ul = 0
+		self.pressure_1_raw = _pressure_to_raw(0)
+		self.pressure_2_raw = _pressure_to_raw(0)
+		self.pressure_1 = 0
+		self.pressure_2 = 0
+		self.flow_2_raw = 0
+		self.flow_1_raw = 0
+		self.scaled_flow_value = 0
+		self.liquid_present_1 = False
+		self.liquid_present_2 = False
+
+		# fluidics
+		self.pressure_psi = 0
+		self.vacuum_psi = 0
+		self.flow_ul_per_min = 0
+		self.line = deque([['air',LINE_VOLUME_UL]]) # segments from the selector valve to the chamber
+		self.chamber_volume_ul = 0
+		self.selector_valve_position = 1
+		self.t_selector_valve_arrival = 0
+		self.leak_flow_ul_per_min = 0
+		self.leak_conductance = 0 # faults, see inject_fault()
+		self.line_resistance_factor = 1
+		self.empty_ports = set()
+
+	######################## serial ########################
+	def receive(self,data):
+		self.buffer_rx += data
+		while len(self.buffer_rx) >= MCU_CMD_LENGTH:
+			cmd = bytes(self.buffer_rx[0:MCU_CMD_LENGTH])
+			del self.buffer_rx[0:MCU_CMD_LENGTH]
+			if cmd[2] == CMD_SET.SET_FRAME_FORMAT:
+				if cmd[3] in (1,2):
+					self.frame_format = cmd[3]
+			elif cmd[2] == CMD_SET.SET_TELEMETRY_RATE:
+				if self.telemetry_rate_supported == False:
+					continue
+				self.telemetry_mode = TELEMETRY_MODE.SUMMARY if cmd[3] == TELEMETRY_MODE.SUMMARY else TELEMETRY_MODE.FULL
+				telemetry_period_ms = min(MCU_TELEMETRY_PERIOD_MS_MAX,max(MCU_TELEMETRY_PERIOD_MS_MIN,(cmd[5] << 8) + cmd[6]))
+				self.send_update_interval_s = telemetry_period_ms/1000
+				self.t_next_send_update = self.t + self.send_update_interval_s
+				self.summary_number_of_readings = 0
+			elif cmd[2] == CMD_SET.CLEAR or cmd[2] == CMD_SET.ABORT:
+				self.cmd_queue.clear()
+				self._execute_command(cmd)
+			elif not (cmd[13] & MCU_CMD_FLAG_QUEUED):
+				self._execute_command(cmd)
+			elif len(self.cmd_queue) < CMD_QUEUE_LENGTH:
+				self.cmd_queue.append(cmd)
+			else:
+				# the command is dropped and reported, the commands queued before it are discarded so that none runs out of order
+				self.cmd_queue.clear()
+				self.commands_dropped = self.commands_dropped + 1
+				self.current_command_uid = (cmd[0] << 8) + cmd[1]
+				self.current_command = cmd[2]
+				self.command_execution_status = CMD_EXECUTION_STATUS.ERROR_CODE_CMD_QUEUE_FULL
+		self._dispatch_commands()
+
+	def _dispatch_commands(self):
+		while len(self.cmd_queue) > 0 and self.internal_program == INTERNAL_PROGRAM.IDLE:
+			self._execute_command(self.cmd_queue.popleft())
+
+	def run_until(self,t):
+		''' advance the model to time t, returns the frames sent in the meantime '''
+		frames = []
+		while True:
+			t_next = min(self.t_next_read_sensors,self.t_next_send_update)
+			if t_next > t:
+				break
+			self.t = t_next
+			if self.t_next_read_sensors == t_next:
+				self._read_sensors(READ_SENSORS_INTERVAL_S)
+				self._update_control_loops()
+				self._update_internal_program()
+				self._dispatch_commands()
+				self.t_next_read_sensors = self.t_next_read_sensors + READ_SENSORS_INTERVAL_S
+				if self.telemetry_mode == TELEMETRY_MODE.SUMMARY:
+					self._add_summary_reading()
+					# the change of command status is sent right away instead of at the end of the period
+					if self.last_sent_state != (self.current_command_uid,self.command_execution_status,self.internal_program) and self.t_next_send_update != t_next:
+						frames.append(self.frame())
+						self.frames_sent = self.frames_sent + 1
+			if self.t_next_send_update == t_next:
+				frames.append(self.frame())
+				self.frames_sent = self.frames_sent + 1
+				self.t_next_send_update = self.t_next_send_update + self.send_update_interval_s
+		self.t = max(self.t,t)
+		return frames
+
+	def next_frame_time(self):
+		''' time of the next frame - in TELEMETRY_MODE.SUMMARY a frame may be sent at any sensor reading (on a change of command status) '''
+		if self.telemetry_mode == TELEMETRY_MODE.SUMMARY:
+			return min(self.t_next_read_sensors,self.t_next_send_update)
+		return self.t_next_send_update
+
+	def _add_summary_reading(self):
+		if self.summary_number_of_readings == 0:
+			self.summary_sums = [0,0,0]
+		self.summary_sums[0] = self.summary_sums[0] + self.pressure_1_raw
+		self.summary_sums[1] = self.summary_sums[1] + self.pressure_2_raw
+		self.summary_sums[2] = self.summary_sums[2] + (self.flow_2_raw - 65536 if self.flow_2_raw >= 32768 else self.flow_2_raw)
+		self.summary_number_of_readings = self.summary_number_of_readings + 1
+
+	def frame(self):
+		buffer_tx = bytearray(MCU_MSG_LENGTH)
+		buffer_tx[0] = self.current_command_uid >> 8
+		buffer_tx[1] = self.current_command_uid & 0xff
+		buffer_tx[2] = self.current_command
+		buffer_tx[3] = self.command_execution_status
+		buffer_tx[4] = self.internal_program
+		buffer_tx[5] = (self.liquid_present_1 << 3) | (self.liquid_present_2 << 2)
+		buffer_tx[6] = 0
+		buffer_tx[7] = self.NXP33996_state >> 8
+		buffer_tx[8] = self.NXP33996_state & 0xff
+		buffer_tx[9] = self.selector_valve_position_setValue & 0xff
+		pump_power = int(self.disc_pump_power/1000*65535)
+		buffer_tx[10] = (pump_power >> 8) & 0xff
+		buffer_tx[11] = pump_power & 0xff
+		buffer_tx[12] = self.pressure_1_raw >> 8
+		buffer_tx[13] = self.pressure_1_raw & 0xff
+		buffer_tx[14] = self.pressure_2_raw >> 8
+		buffer_tx[15] = self.pressure_2_raw & 0xff
+		# bytes 16-17: flow sensor 1 is not read by the firmware (0 unless downstream_flow_sensor_present)
+		buffer_tx[16] = self.flow_1_raw >> 8
+		buffer_tx[17] = self.flow_1_raw & 0xff
+		buffer_tx[18] = self.flow_2_raw >> 8
+		buffer_tx[19] = self.flow_2_raw & 0xff
+		buffer_tx[20] = self.time_elapsed_s & 0xff
+		volume_ul_uint16 = int(min(65535,max(0,(self.volume_ul/MCU_CONSTANTS.VOLUME_UL_MAX)*65535)))
+		buffer_tx[21] = volume_ul_uint16 >> 8
+		buffer_tx[22] = volume_ul_uint16 & 0xff
+		if self.telemetry_mode == TELEMETRY_MODE.SUMMARY and self.summary_number_of_readings > 0:
+			pressure_1_raw = int(self.summary_sums[0]/self.summary_number_of_readings)
+			pressure_2_raw = int(self.summary_sums[1]/self.summary_number_of_readings)
+			flow_2_raw = int(self.summary_sums[2]/self.summary_number_of_readings) & 0xffff
+			buffer_tx[12:16] = bytes([pressure_1_raw >> 8,pressure_1_raw & 0xff,pressure_2_raw >> 8,pressure_2_raw & 0xff])
+			buffer_tx[18:20] = bytes([flow_2_raw >> 8,flow_2_raw & 0xff])
+			self.summary_number_of_readings = 0
+		self.last_sent_state = (self.current_command_uid,self.command_execution_status,self.internal_program)
+		if self.mark_frames:
+			buffer_tx[23] = (self.frames_sent >> 8) & 0xff
+			buffer_tx[24] = self.frames_sent & 0xff
+		if self.frame_format == 2:
+			frame = telemetry.encode_mcu_frame_v2(buffer_tx,self.frame_sequence)
+			self.frame_sequence = (self.frame_sequence + 1) & 0xff
+			return frame
+		return bytes(buffer_tx)
+
+	###################### commands ########################
+	def _elapsed_ms(self):
+		return (self.t - self.t_internal_program_start)*1000
+
+	def _start_internal_program(self,internal_program):
+		self.internal_program = internal_program
+		self.t_internal_program_start = self.t
+
+	def _set_selector_valve_position(self,position):
+		# the firmware does not wait for the valve to arrive, the fluidic path is closed while the valve moves
+		self.selector_valve_position_setValue = position
+		if position != self.selector_valve_position and 1 <= position <= SELECTOR_VALVE_NUMBER_OF_PORTS:
+			steps = abs(position - self.selector_valve_position)
+			steps = min(steps,SELECTOR_VALVE_NUMBER_OF_PORTS-steps)
+			self.t_selector_valve_arrival = self.t + SELECTOR_VALVE_SWITCH_TIME_S + steps*SELECTOR_VALVE_STEP_TIME_S
+			self.selector_valve_position = position
+
+	def _set_10mm_valve(self,port):
+		self.NXP33996_state = 0
+		if port > 0:
+			self.NXP33996_state = (1 << (port-1)) & 0xffff
+
+	def _stop_pump(self):
+		self.disc_pump_power = 0
+		self.disc_pump_enabled = False
+
+	def _execute_command(self,buffer_rx):
+		self.current_command_uid = (buffer_rx[0] << 8) + buffer_rx[1]
+		self.current_command = buffer_rx[2]
+		payload1 = buffer_rx[3]
+		payload2 = buffer_rx[4]
+		payload3 = (buffer_rx[5] << 8) + buffer_rx[6]
+		payload4 = (buffer_rx[7] << 24) + (buffer_rx[8] << 16) + (buffer_rx[9] << 8) + buffer_rx[10]
+		payload5 = (buffer_rx[11] << 8) + buffer_rx[12]
+		cmd = self.current_command
+		if cmd == CMD_SET.CLEAR:
+			self.current_command_uid = 0
+			self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+		elif cmd == CMD_SET.ABORT:
+			self.pressure_set_point = 0
+			self.pressure_control_loop_enabled = False
+			self.pressure_loop_integral_error = 0
+			self.flowrate_set_point = 0
+			self.flowrate_control_loop_enabled = False
+			self.flowrate_loop_integral_error = 0
+			self._stop_pump()
+			self.valve_A1 = False
+			self.valve_B1 = False
+			self._set_10mm_valve(0)
+			self.flag_measure_volume = False
+			self.internal_program = INTERNAL_PROGRAM.IDLE
+			self.time_elapsed_s = 0
+			self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+		elif cmd == CMD_SET.DISABLE_MANUAL_CONTROL:
+			if payload1 == 1:
+				self.manual_control_disabled_by_software = True
+			if payload1 == 0:
+				self.manual_control_disabled_by_software = False
+				self.pressure_control_loop_enabled = False
+			self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+		elif cmd == CMD_SET.PREUSE_CHECK_PRESSURE:
+			self.fluidic_port = payload2
+			self.control_setpoint = PRESSURE_FULL_SCALE_PSI*payload3/65535
+			self.set_flow_time_ms = payload4
+			self.manual_control_disabled_by_software = True
+			self.pressure_control_loop_enabled = False
+			self.valve_B1 = False
+			self._set_selector_valve_position(self.fluidic_port)
+			self._set_10mm_valve(self.fluidic_port)
+			self.valve_A1 = False
+			self.disc_pump_power = 1000
+			self.disc_pump_enabled = True
+			self.command_execution_status = CMD_EXECUTION_STATUS.IN_PROGRESS
+			self._start_internal_program(INTERNAL_PROGRAM.PREUSE_CHECK_PRESSURE)
+		elif cmd == CMD_SET.PREUSE_CHECK_VACUUM:
+			self.manual_control_disabled_by_software = True
+			self.pressure_control_loop_enabled = False
+			self.valve_B1 = False
+			self.control_setpoint = PRESSURE_FULL_SCALE_PSI*payload3/65535
+			self.set_flow_time_ms = payload4
+			self.valve_A1 = True
+			self.disc_pump_power = 1000
+			self.disc_pump_enabled = True
+			self.command_execution_status = CMD_EXECUTION_STATUS.IN_PROGRESS
+			self._start_internal_program(INTERNAL_PROGRAM.PREUSE_CHECK_VACUUM)
+		elif cmd == CMD_SET.REMOVE_MEDIUM:
+			self.manual_control_disabled_by_software = True
+			self.pressure_control_loop_enabled = False
+			self.valve_B1 = False
+			self.set_vacuum_duration_ms = payload4
+			self.aspiration_mode = payload1
+			self.aspiration_air_debounce_ms = payload2*ASPIRATION_AIR_DEBOUNCE_UNIT_MS
+			self.liquid_has_passed_bubble_sensor_1_during_aspiration = False
+			self.disc_pump_power = int((payload3/65535)*1000)
+			self.command_execution_status = CMD_EXECUTION_STATUS.IN_PROGRESS
+			self.valve_A1 = True
+			self.disc_pump_enabled = True
+			self._start_internal_program(INTERNAL_PROGRAM.REMOVE_MEDIUM)
+		elif cmd == CMD_SET.ADD_MEDIUM:
+			self.manual_control_disabled_by_software = True
+			self.command_execution_status = CMD_EXECUTION_STATUS.IN_PROGRESS
+			self.control_type = payload1
+			self.fluidic_port = payload2
+			self.control_setpoint = payload3/65535
+			self.set_flow_time_ms = payload4
+			self.set_volume_ul = 0
+			if self.control_type == MCU_CMD_PARAMETERS.VOLUME_CONTROL:
+				# pumped at constant pressure until the volume (payload 5) is reached, the flow time is the time limit
+				self.control_type = MCU_CMD_PARAMETERS.CONSTANT_PRESSURE
+				self.set_volume_ul = payload5
+			self.internal_program = INTERNAL_PROGRAM.RAMP_UP_PRESSURE
+			self.valve_B1 = False
+			self._set_selector_valve_position(self.fluidic_port)
+			self._set_10mm_valve(self.fluidic_port)
+			if self.control_type == MCU_CMD_PARAMETERS.CONSTANT_PRESSURE:
+				self.pressure_set_point = self.control_setpoint*PRESSURE_FULL_SCALE_PSI
+				self.pressure_control_loop_enabled = True
+				self.pressure_loop_integral_error = 0
+				self.disc_pump_power = 0
+				self.disc_pump_enabled = True
+			elif self.control_type == MCU_CMD_PARAMETERS.CONSTANT_POWER:
+				self.valve_A1 = False
+				self.disc_pump_power = int(self.control_setpoint*1000)
+				self.disc_pump_enabled = True
+			self.t_internal_program_start = self.t
+		elif cmd == CMD_SET.SET_SELECTOR_VALVE:
+			self._set_selector_valve_position(payload2)
+			self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+		elif cmd == CMD_SET.SET_10MM_SOLENOID_VALVE:
+			self._set_10mm_valve(payload2)
+			self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+		elif cmd == CMD_SET.SET_SOLENOID_VALVE_B:
+			if payload1 in (0,1,2,3):
+				self.valve_B1 = (payload1 & 1) > 0
+				self.valve_B2 = (payload1 & 2) > 0
+			self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+		elif cmd == CMD_SET.SET_SOLENOID_VALVE_C:
+			self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+		elif cmd == CMD_SET.ENABLE_PRESSURE_CONTROL_LOOP:
+			if payload1 == 1:
+				self.manual_control_disabled_by_software = True
+				self.pressure_control_loop_enabled = True
+				self.pressure_loop_integral_error = 0
+				self.disc_pump_enabled = True
+			if payload1 == 0:
+				self.pressure_control_loop_enabled = False
+			self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+		elif cmd == CMD_SET.SET_PRESSURE_CONTROL_LOOP_P_COEFFICIENT:
+			self.pressure_loop_p_coefficient = (payload4/4294967296)*PRESSURE_LOOP_COEFFICIENTS_FULL_SCALE
+			self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+		elif cmd == CMD_SET.SET_PRESSURE_CONTROL_LOOP_I_COEFFICIENT:
+			self.pressure_loop_i_coefficient = (payload4/4294967296)*PRESSURE_LOOP_COEFFICIENTS_FULL_SCALE
+			self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+		elif cmd == CMD_SET.SET_PRESSURE_CONTROL_SETPOINT_PSI:
+			self.pressure_set_point = (payload3/65536)*PRESSURE_FULL_SCALE_PSI
+			self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+		# unknown commands are ignored, as in the firmware
+
+	def inject_fault(self,fault):
+		''' for testing faults.FaultDetector - FAULT_TYPE.LEAK, CLOG, EMPTY_RESERVOIR (of the port selected) or AIR_IN_LINE (one bubble) '''
+		if fault == FAULT_TYPE.LEAK:
+			self.leak_conductance = LEAK_CONDUCTANCE_UL_PER_MIN_PER_PSI
+		elif fault == FAULT_TYPE.CLOG:
+			self.line_resistance_factor = CLOG_RESISTANCE_FACTOR
+		elif fault == FAULT_TYPE.EMPTY_RESERVOIR:
+			self.empty_ports.add(self.selector_valve_position)
+		elif fault == FAULT_TYPE.AIR_IN_LINE:
+			self._push_into_line('air',AIR_BUBBLE_VOLUME_UL)
+
+	###################### fluidics ########################
+	def _fluidic_path_open(self):
+		# pump -> selector valve -> chamber: valve B1, the 10 mm valve of the selected port and a selector valve that is not moving
+		return self.valve_B1 and self.t >= self.t_selector_valve_arrival and (self.NXP33996_state >> (self.selector_valve_position-1)) & 1 == 1
+
+	def _line_fluid_at(self,position_ul):
+		for segment in self.line:
+			if position_ul < segment[1]:
+				return segment[0]
+			position_ul = position_ul - segment[1]
+		return self.line[-1][0]
+
+	def _push_into_line(self,fluid,volume_ul):
+		# plug flow - fluid enters at the selector valve, the same volume leaves into the chamber
+		if self.line[0][0] == fluid:
+			self.line[0][1] = self.line[0][1] + volume_ul
+		else:
+			self.line.appendleft([fluid,volume_ul])
+		while volume_ul > 0:
+			segment = self.line[-1]
+			volume_out = min(volume_ul,segment[1]) if len(self.line) > 1 else volume_ul
+			if segment[0] == 'liquid':
+				self.chamber_volume_ul = self.chamber_volume_ul + volume_out
+			segment[1] = segment[1] - volume_out
+			volume_ul = volume_ul - volume_out
+			if segment[1] <= 0 and len(self.line) > 1:
+				self.line.pop()
+
+	def _update_fluidics(self,dt):
+		pump_on = self.disc_pump_enabled and self.disc_pump_power > 0
+		# pressure side
+		self.flow_ul_per_min = 0
+		self.leak_flow_ul_per_min = 0
+		if pump_on and self.valve_A1 == False:
+			source_pressure = PUMP_STALL_PRESSURE_PSI*self.disc_pump_power/1000
+		else:
+			source_pressure = 0
+		if self._fluidic_path_open():
+			liquid_volume = sum(segment[1] for segment in self.line if segment[0] == 'liquid')
+			resistance = (LINE_RESISTANCE_AIR_PSI_PER_UL_PER_MIN + (LINE_RESISTANCE_LIQUID_PSI_PER_UL_PER_MIN - LINE_RESISTANCE_AIR_PSI_PER_UL_PER_MIN)*liquid_volume/LINE_VOLUME_UL)*self.line_resistance_factor
+			steady_state_pressure = source_pressure*resistance/(resistance + PUMP_RESISTANCE_PSI_PER_UL_PER_MIN*(1 + resistance*self.leak_conductance))
+			self.pressure_psi = self.pressure_psi + (steady_state_pressure - self.pressure_psi)*min(1,dt/TAU_PRESSURE_S)
+			self.flow_ul_per_min = max(0,self.pressure_psi/resistance)
+			self.leak_flow_ul_per_min = max(0,self.pressure_psi*self.leak_conductance)
+			fluid = 'air' if self.selector_valve_position in (PORT_AIR,PORT_MANUAL_FLUSHING) or self.selector_valve_position in self.empty_ports else 'liquid'
+			self._push_into_line(fluid,self.flow_ul_per_min*dt/60)
+		else:
+			self.pressure_psi = self.pressure_psi + (source_pressure - self.pressure_psi)*min(1,dt/TAU_PRESSURE_S)
+		# vacuum side (aspiration from the chamber)
+		if pump_on and self.valve_A1 == True:
+			target_vacuum = -PUMP_STALL_VACUUM_PSI*self.disc_pump_power/1000
+			if self.leak_conductance > 0:
+				target_vacuum = target_vacuum*LEAK_VACUUM_FRACTION
+		else:
+			target_vacuum = 0
+		self.vacuum_psi = self.vacuum_psi + (target_vacuum - self.vacuum_psi)*min(1,dt/TAU_VACUUM_S)
+		aspirating = self.vacuum_psi < -ASPIRATION_THRESHOLD_PSI
+		if aspirating:
+			self.chamber_volume_ul = max(0,self.chamber_volume_ul - ASPIRATION_RATE_UL_PER_S_PER_PSI*abs(self.vacuum_psi)*dt)
+		# bubble sensors
+		if aspirating and self.chamber_volume_ul > ASPIRATION_FLICKER_VOLUME_UL:
+			self.liquid_present_1 = True
+		elif aspirating and self.chamber_volume_ul > 0:
+			self.liquid_present_1 = self.random.random() < self.chamber_volume_ul/ASPIRATION_FLICKER_VOLUME_UL
+		else:
+			self.liquid_present_1 = False
+		self.liquid_present_2 = self._line_fluid_at(BUBBLE_SENSOR_2_POSITION_UL) == 'liquid'
+
+	def _read_sensors(self,dt):
+		self._update_fluidics(dt)
+		if self.flow_sensor_present:
+			# the flow sensor is calibrated for liquid, it reads ~0 for air
+			flow = self.flow_ul_per_min + self.leak_flow_ul_per_min if self._line_fluid_at(BUBBLE_SENSOR_2_POSITION_UL) == 'liquid' else 0
+			flow = flow + self.random.gauss(0,FLOW_NOISE_UL_PER_MIN)
+			self.flow_2_raw = int(max(-32768,min(32767,flow*MCU_CONSTANTS.SCALE_FACTOR_FLOW))) & 0xffff
+			signed_flow_value = self.flow_2_raw - 65536 if self.flow_2_raw >= 32768 else self.flow_2_raw
+			self.scaled_flow_value = signed_flow_value/MCU_CONSTANTS.SCALE_FACTOR_FLOW
+			if self.flag_measure_volume:
+				self.volume_ul = self.volume_ul + self.scaled_flow_value*(dt/60)
+		if self.downstream_flow_sensor_present:
+			flow = self.flow_ul_per_min if self._line_fluid_at(LINE_VOLUME_UL - 1) == 'liquid' else 0
+			self.flow_1_raw = int(max(-32768,min(32767,(flow + self.random.gauss(0,FLOW_NOISE_UL_PER_MIN))*MCU_CONSTANTS.SCALE_FACTOR_FLOW))) & 0xffff
+		self.pressure_2_raw = _pressure_to_raw(self.pressure_psi + self.random.gauss(0,PRESSURE_NOISE_PSI))
+		self.pressure_2 = _raw_to_pressure(self.pressure_2_raw)
+		self.pressure_1_raw = _pressure_to_raw(self.vacuum_psi + self.random.gauss(0,PRESSURE_NOISE_PSI))
+		self.pressure_1 = _raw_to_pressure(self.pressure_1_raw)
+
+	def _update_control_loops(self):
+		if self.pressure_control_loop_enabled:
+			pressure_loop_error = self.pressure_set_point - self.pressure_2
+			self.pressure_loop_integral_error = self.pressure_loop_integral_error + pressure_loop_error
+			self.pressure_loop_integral_error = min(1/self.pressure_loop_i_coefficient,self.pressure_loop_integral_error)
+			self.pressure_loop_integral_error = max(0,self.pressure_loop_integral_error)
+			self.disc_pump_power = int((self.pressure_loop_integral_error*self.pressure_loop_i_coefficient + pressure_loop_error*self.pressure_loop_p_coefficient)*1000)
+			self.disc_pump_power = max(0,min(1000,self.disc_pump_power))
+		if self.flowrate_control_loop_enabled:
+			flowrate_loop_error = (self.flowrate_set_point - self.scaled_flow_value)/1000
+			self.flowrate_loop_integral_error = self.flowrate_loop_integral_error + flowrate_loop_error
+			self.flowrate_loop_integral_error = min(1/self.flowrate_loop_i_coefficient,self.flowrate_loop_integral_error)
+			self.flowrate_loop_integral_error = max(0,self.flowrate_loop_integral_error)
+			self.disc_pump_power = int((self.flowrate_loop_integral_error*self.flowrate_loop_i_coefficient + flowrate_loop_error*self.flowrate_loop_p_coefficient)*1000)
+			self.disc_pump_power = max(50,max(0,min(1000,self.disc_pump_power)))
+
+	def _update_internal_program(self):
+		if self.internal_program == INTERNAL_PROGRAM.PREUSE_CHECK_PRESSURE:
+			self.time_elapsed_s = int(self._elapsed_ms()/1000)
+			if self.time_elapsed_s >= self.set_flow_time_ms//1000:
+				self._stop_pump()
+				self.internal_program = INTERNAL_PROGRAM.IDLE
+				self.command_execution_status = CMD_EXECUTION_STATUS.ERROR_CODE_PREUSE_CHECK_FAILED
+			if self.pressure_2 > self.control_setpoint:
+				self._stop_pump()
+				self.internal_program = INTERNAL_PROGRAM.IDLE
+				self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+
+		elif self.internal_program == INTERNAL_PROGRAM.PREUSE_CHECK_VACUUM:
+			self.time_elapsed_s = int(self._elapsed_ms()/1000)
+			if self.time_elapsed_s >= self.set_flow_time_ms//1000:
+				self._stop_pump()
+				self.valve_A1 = False
+				self.internal_program = INTERNAL_PROGRAM.IDLE
+				self.command_execution_status = CMD_EXECUTION_STATUS.ERROR_CODE_PREUSE_CHECK_FAILED
+			if abs(self.pressure_1) > self.control_setpoint:
+				self._stop_pump()
+				self.valve_A1 = False
+				self.internal_program = INTERNAL_PROGRAM.IDLE
+				self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+
+		elif self.internal_program == INTERNAL_PROGRAM.REMOVE_MEDIUM:
+			self.time_elapsed_s = int(self._elapsed_ms()/1000)
+			# bubble sensor: the aspiration ends once the downstream bubble sensor has seen liquid, then air for the debounce time
+			if self.liquid_present_1:
+				self.liquid_has_passed_bubble_sensor_1_during_aspiration = True
+				self.t_liquid_at_bubble_sensor_1 = self.t
+			if (self.aspiration_mode == ASPIRATION_MODE.BUBBLE_SENSOR and self.disc_pump_enabled and self.liquid_has_passed_bubble_sensor_1_during_aspiration
+				and 1000*(self.t - self.t_liquid_at_bubble_sensor_1) >= self.aspiration_air_debounce_ms and self._elapsed_ms() < self.set_vacuum_duration_ms):
+				self.set_vacuum_duration_ms = self._elapsed_ms() # the pump is stopped below, followed by the vacuum decay
+			if self._elapsed_ms() > self.set_vacuum_duration_ms:
+				self._stop_pump()
+				self.valve_A1 = False
+			if self._elapsed_ms() > self.set_vacuum_duration_ms + 1000*VACUUM_DECAY_TIME_S:
+				self.internal_program = INTERNAL_PROGRAM.IDLE
+				self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+
+		elif self.internal_program == INTERNAL_PROGRAM.RAMP_UP_PRESSURE:
+			self.time_elapsed_s = int(self._elapsed_ms()/1000)
+			if self._elapsed_ms() >= PRESSURE_RAMP_UP_TIME_S*1000 or (self.control_type == MCU_CMD_PARAMETERS.CONSTANT_PRESSURE and self.pressure_2 >= self.pressure_set_point):
+				self.valve_B1 = True
+				self._start_internal_program(INTERNAL_PROGRAM.PUMP_FLUID)
+				self.volume_ul = 0
+				if self.liquid_present_2 == False:
+					self.liquid_has_passed_bubble_sensor_2_during_pumping = False
+
+		elif self.internal_program == INTERNAL_PROGRAM.PUMP_FLUID:
+			self.flag_measure_volume = True
+			self.time_elapsed_s = int(self._elapsed_ms()/1000)
+			if self.liquid_has_passed_bubble_sensor_2_during_pumping == False and self.liquid_present_2 == True:
+				self.liquid_has_passed_bubble_sensor_2_during_pumping = True
+				self.t_internal_program_start = self.t
+			if self._elapsed_ms() >= self.set_flow_time_ms or (self.set_volume_ul > 0 and self.volume_ul >= self.set_volume_ul):
+				self.valve_B1 = False
+				if self.control_type == MCU_CMD_PARAMETERS.CONSTANT_PRESSURE:
+					self.pressure_set_point = 0
+					self.pressure_control_loop_enabled = False
+					self.pressure_loop_integral_error = 0
+				self._stop_pump()
+				# switch to the air path
+				self._set_10mm_valve(0)
+				self._set_selector_valve_position(PORT_AIR)
+				self._set_10mm_valve(PORT_AIR)
+				if self.control_type == MCU_CMD_PARAMETERS.CONSTANT_POWER:
+					self.disc_pump_power = PUMP_POWER_FOR_EMPTYING_THE_FLUIDIC_LINE*1000
+					self.disc_pump_enabled = True
+					self.valve_B1 = True
+				elif self.control_type == MCU_CMD_PARAMETERS.CONSTANT_PRESSURE:
+					self.valve_B1 = True
+					if self.flow_sensor_present:
+						if self.fluidic_port == PORT_STRIPPING_BUFFER:
+							self.duration_for_emptying_the_fluidic_line_s = 36
+							self.disc_pump_power = 1000
+							self.disc_pump_enabled = True
+						else:
+							self.duration_for_emptying_the_fluidic_line_s = 15
+							self.flowrate_set_point = 1500
+							self.flowrate_control_loop_enabled = True
+							self.flowrate_loop_integral_error = 0
+							self.disc_pump_power = 0
+							self.disc_pump_enabled = True
+					else:
+						self.duration_for_emptying_the_fluidic_line_s = TIME_TIMEOUT_FOR_EMPTYING_THE_FLUIDIC_LINE_S
+						self.disc_pump_power = 1000
+						self.disc_pump_enabled = True
+				self._start_internal_program(INTERNAL_PROGRAM.EMPTY_FLUIDIC_LINE)
+				self.empty_fluidic_line_countdown_started = False
+
+		elif self.internal_program == INTERNAL_PROGRAM.EMPTY_FLUIDIC_LINE:
+			self.time_elapsed_s = int(self._elapsed_ms()/1000)
+			if self.time_elapsed_s >= 5 and self.pressure_2 < THRESHOLD_PRESSURE_EMPTYING_THE_FLUIDIC_LINE_PSI and self.empty_fluidic_line_countdown_started == False:
+				self.duration_for_emptying_the_fluidic_line_s = TIME_REMAINING_EMPTYING_THE_FLUIDIC_LINE_S
+				self.t_internal_program_start = self.t
+				self.empty_fluidic_line_countdown_started = True
+			if self._elapsed_ms() >= 1000*self.duration_for_emptying_the_fluidic_line_s:
+				self.flag_measure_volume = False
+				if self.control_type == MCU_CMD_PARAMETERS.CONSTANT_PRESSURE:
+					self.pressure_set_point = 0
+					self.pressure_control_loop_enabled = False
+					self.pressure_loop_integral_error = 0
+					if self.flow_sensor_present:
+						self.flowrate_set_point = 0
+						self.flowrate_control_loop_enabled = False
+						self.flowrate_loop_integral_error = 0
+				self._stop_pump()
+				self._set_10mm_valve(0)
+				self.internal_program = INTERNAL_PROGRAM.IDLE
+				if self.empty_fluidic_line_countdown_started == True:
+					self.command_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
+					self.valve_B1 = False
+				else:
+					self.command_execution_status = CMD_EXECUTION_STATUS.ERROR_CODE_EMPTYING_THE_FLUDIIC_LINE_FAILED
+					self._set_selector_valve_position(PORT_MANUAL_FLUSHING)
+				self.time_elapsed_s = 0
+
+#######################################################
+############# in-process firmware simulation ##########
+#######################################################
+
+class Microcontroller_Firmware_Simulation(object):
+	''' same interface as Microcontroller_Simulation, the frames come from FirmwareModel running on the given clock '''
+	def __init__(self,clock=None,flow_sensor_present=True,seed=0,downstream_flow_sensor_present=False):
+		self.serial = None
+		self.tx_buffer_length = MCU_CMD_LENGTH
+		self.rx_buffer_length = MCU_MSG_LENGTH
+		self.clock = clock if clock is not None else engine.MonotonicClock()
+		self.firmware = FirmwareModel(flow_sensor_present,seed,downstream_flow_sensor_present=downstream_flow_sensor_present)
+		self.t_start = self.clock.now()
+		self.rx_frames_parsed = 0
+		self.rx_frames_dropped = 0
+		self.telemetry_period_ms = MCU_TELEMETRY_PERIOD_MS
+		self.telemetry_mode = TELEMETRY_MODE.FULL
+
+	def _run_firmware(self):
+		return self.firmware.run_until(self.clock.now() - self.t_start)
+
+	def set_telemetry_rate(self,period_ms,mode=TELEMETRY_MODE.FULL):
+		period_ms = int(min(MCU_TELEMETRY_PERIOD_MS_MAX,max(MCU_TELEMETRY_PERIOD_MS_MIN,round(period_ms))))
+		self.send_command(engine.encode_mcu_command(CMD_SET.SET_TELEMETRY_RATE,mode,0,period_ms))
+		self.telemetry_period_ms = period_ms
+		self.telemetry_mode = mode
+		return period_ms
+
+	def read_received_packets_nowait(self):
+		frames = self._run_firmware()
+		self.rx_frames_parsed = self.rx_frames_parsed + len(frames)
+		return frames
+
+	def read_received_packet_nowait(self):
+		frames = self.read_received_packets_nowait()
+		if len(frames) == 0:
+			return None
+		self.rx_frames_dropped = self.rx_frames_dropped + len(frames) - 1
+		return frames[-1]
+
+	def next_event_time(self):
+		# for running on engine.VirtualClock - the next status frame
+		return self.t_start + self.firmware.next_frame_time()
+
+	def send_command(self,cmd):
+		self._run_firmware() # frames up to now are produced before the command takes effect, they are returned by the next read
+		self.firmware.receive(bytes(cmd))
+
+#######################################################
+################## firmware servers ###################
+#######################################################
+
+# frames waiting to be written when the host does not keep up - beyond this, new frames are dropped (as whole frames, the alignment is kept)
+TX_BUFFER_LIMIT_FRAMES = 64
+
+class FirmwareServer(object):
+	'''
+	serves a FirmwareModel in real time - commands are executed as they arrive, frames are sent on the schedule of the model
+	subclasses provide the connection (_fileno, _recv and _send)
+	'''
+	def __init__(self,firmware=None):
+		self.firmware = firmware if firmware is not None else FirmwareModel()
+		self.url = None
+		self.buffer_tx = bytearray()
+		self.frames_dropped = 0
+		self.lock = threading.Lock() # for accessing the firmware model from other threads
+		self.thread = None
+		self.stop_requested = False
+
+	def start(self):
+		self.stop_requested = False
+		self.thread = threading.Thread(target=self._run,daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.stop_requested = True
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+	def close(self):
+		self.stop()
+
+	def _run(self):
+		t_start = time.monotonic()
+		while self.stop_requested == False:
+			fd = self._fileno()
+			if fd is None:
+				# not connected - the firmware keeps running, the frames go nowhere
+				with self.lock:
+					self.firmware.run_until(time.monotonic()-t_start)
+				self.buffer_tx.clear()
+				self._wait_for_connection(SEND_UPDATE_INTERVAL_S)
+				continue
+			t_next_frame = t_start + self.firmware.next_frame_time()
+			writers = [fd] if len(self.buffer_tx) > 0 else []
+			readable, writable, exceptional = select.select([fd],writers,[],max(0,t_next_frame-time.monotonic()))
+			with self.lock:
+				# frames due before the command is executed are sent first
+				frames = self.firmware.run_until(time.monotonic()-t_start)
+				if len(readable) > 0:
+					data = self._recv()
+					if data is not None:
+						self.firmware.receive(data)
+			for frame in frames:
+				if len(self.buffer_tx) >= TX_BUFFER_LIMIT_FRAMES*len(frame):
+					self.frames_dropped = self.frames_dropped + 1
+				else:
+					self.buffer_tx += frame
+			if len(self.buffer_tx) > 0 and self._fileno() is not None:
+				n = self._send(self.buffer_tx)
+				del self.buffer_tx[:n]
+
+	def _wait_for_connection(self,timeout):
+		time.sleep(timeout)
+
+class FirmwarePty(FirmwareServer):
+	''' serves the firmware over a pseudo-terminal, open self.port (linux/macOS) '''
+	def __init__(self,firmware=None):
+		import pty
+		import tty
+		FirmwareServer.__init__(self,firmware)
+		self.master_fd, self.slave_fd = pty.openpty()
+		tty.setraw(self.slave_fd)
+		self.port = os.ttyname(self.slave_fd)
+		self.url = self.port
+		os.set_blocking(self.master_fd,False)
+
+	def close(self):
+		self.stop()
+		os.close(self.master_fd)
+		os.close(self.slave_fd)
+
+	def _fileno(self):
+		return self.master_fd
+
+	def _recv(self):
+		try:
+			return os.read(self.master_fd,1024)
+		except BlockingIOError:
+			return None
+
+	def _send(self,data):
+		try:
+			return os.write(self.master_fd,data)
+		except BlockingIOError:
+			return 0
+
+class FirmwareSocketServer(FirmwareServer):
+	''' serves the firmware over TCP (one host at a time), open socket://host:port - port 0 picks a free port '''
+	def __init__(self,firmware=None,host='localhost',port=0):
+		FirmwareServer.__init__(self,firmware)
+		self.server_socket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		self.server_socket.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+		self.server_socket.bind((host,port))
+		self.server_socket.listen(1)
+		self.port = self.server_socket.getsockname()[1]
+		self.url = 'socket://' + host + ':' + str(self.port)
+		self.connection = None
+
+	def close(self):
+		self.stop()
+		self._disconnect()
+		self.server_socket.close()
+
+	def _wait_for_connection(self,timeout):
+		readable, writable, exceptional = select.select([self.server_socket],[],[],timeout)
+		if len(readable) > 0:
+			self.connection, address = self.server_socket.accept()
+			self.connection.setblocking(False)
+			self.connection.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+
+	def _disconnect(self):
+		if self.connection is not None:
+			self.connection.close()
+			self.connection = None
+
+	def _fileno(self):
+		return self.connection.fileno() if self.connection is not None else None
+
+	def _recv(self):
+		try:
+			data = self.connection.recv(1024)
+		except BlockingIOError:
+			return None
+		except OSError:
+			data = b''
+		if len(data) == 0:
+			self._disconnect() # the host closed the connection
+			return None
+		return data
+
+	def _send(self,data):
+		try:
+			return self.connection.send(data)
+		except BlockingIOError:
+			return 0
+		except OSError:
+			self._disconnect()
+			return len(data)
+
+#######################################################
+################# fake firmware launcher ##############
+#######################################################
+
+class FirmwareProcess(object):
+	''' runs simulation.py in a separate process, self.url is the port/url it serves the firmware on '''
+	def __init__(self,transport='pty',options=()):
+		command = [sys.executable,os.path.abspath(__file__),'--transport',transport] + list(options)
+		self.process = subprocess.Popen(command,stdout=subprocess.PIPE,universal_newlines=True)
+		self.url = self.process.stdout.readline().strip() # the first line printed is the url
+		if self.url == '':
+			raise IOError('fake firmware process failed to start')
+
+	def close(self):
+		self.process.terminate()
+		self.process.wait()
+		self.process.stdout.close()
+
+def _firmware_model_from_options(options):
+	return FirmwareModel(flow_sensor_present=options.get('flow_sensor','1') != '0',seed=int(options.get('seed','0')),
+		send_update_interval_s=float(options.get('frame_interval_ms',1000*SEND_UPDATE_INTERVAL_S))/1000,mark_frames=options.get('mark_frames','0') != '0',
+		downstream_flow_sensor_present=options.get('downstream_flow_sensor','0') != '0',telemetry_rate_supported=options.get('telemetry_rate','1') != '0')
+
+def launch_firmware(url):
+	'''
+	start a fake firmware for url and return it (call close() when done), the host connects to its .url
+		pty://     separate process, served on a pseudo-terminal
+		socket://  separate process, served on a free TCP port on localhost
+		loop://    a thread of this process, served on a free TCP port on localhost
+	options go in the query string, e.g. pty://?frame_interval_ms=1&mark_frames=1&seed=1&flow_sensor=0&downstream_flow_sensor=1&telemetry_rate=0
+	(frame_interval_ms is replaced by the rate set when controllers.Microcontroller connects, unless its telemetry_period_ms is None)
+	'''
+	scheme, _, query = url.partition('://')
+	query = query.lstrip('?')
+	options = dict(urllib.parse.parse_qsl(query))
+	if scheme == 'loop':
+		server = FirmwareSocketServer(_firmware_model_from_options(options))
+		server.start()
+		return server
+	if scheme in ('pty','socket'):
+		return FirmwareProcess(scheme,['--' + key + '=' + value for key, value in options.items()])
+	raise ValueError('unsupported fake firmware url ' + url)
+
+if __name__ == "__main__":
+	# python3 simulation.py [--transport pty|socket] [--port 0] [--frame_interval_ms 20] [--mark_frames 0] [--seed 0] [--flow_sensor 1] [--downstream_flow_sensor 0] [--telemetry_rate 1]
+	parser = argparse.ArgumentParser(description='serve the simulated firmware, the first line printed is the port/url to connect to')
+	parser.add_argument('--transport',choices=['pty','socket'],default='pty')
+	parser.add_argument('--port',type=int,default=0,help='TCP port for --transport socket, 0 picks a free port')
+	parser.add_argument('--frame_interval_ms',default=str(1000*SEND_UPDATE_INTERVAL_S))
+	parser.add_argument('--mark_frames',default='0',help='1: number the frames in the reserved bytes 23-24')
+	parser.add_argument('--seed',default='0')
+	parser.add_argument('--flow_sensor',default='1')
+	parser.add_argument('--downstream_flow_sensor',default='0',help='1: a downstream flow sensor reports in bytes 16-17')
+	parser.add_argument('--telemetry_rate',default='1',help='0: ignore SET_TELEMETRY_RATE, the frames keep --frame_interval_ms (firmware without the command)')
+	args = parser.parse_args()
+	firmware = _firmware_model_from_options(vars(args))
+	if args.transport == 'socket':
+		server = FirmwareSocketServer(firmware,port=args.port)
+	else:
+		server = FirmwarePty(firmware)
+	server.start()
+	print(server.url,flush=True)
+	print('simulated firmware running (Ctrl-C to stop)',file=sys.stderr)
+	signal.signal(signal.SIGTERM,lambda signum, frame: sys.exit(0))
+	try:
+		while True:
+			time.sleep(1)
+	except (KeyboardInterrupt,SystemExit):
+		server.close()
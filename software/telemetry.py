@@ -0,0 +1,385 @@
+'''
+decoding and recording of the MCU -> computer messages (see the message structure in _def.py)
+'''
+
+import os
+import sys
+import struct
+import binascii
+import numpy as np
+from collections import namedtuple
+
+from _def import *
+
+# structured dtype that mirrors the 25-byte MCU message, multi-byte fields are big endian
+MCU_MSG_DTYPE = np.dtype([
+	('uid','>u2'),                          # byte 0-1
+	('cmd','u1'),                           # byte 2
+	('status','u1'),                        # byte 3
+	('internal_program','u1'),              # byte 4
+	('valve_A_B_and_bubble_sensors','u1'),  # byte 5
+	('valve_C','u1'),                       # byte 6
+	('valve_D','>u2'),                      # byte 7-8
+	('selector_valve_position','u1'),       # byte 9
+	('pump_power','>u2'),                   # byte 10-11
+	('vacuum_raw','>u2'),                   # byte 12-13
+	('pressure_raw','>u2'),                 # byte 14-15
+	('flow_downstream_raw','>i2'),          # byte 16-17
+	('flow_upstream_raw','>i2'),            # byte 18-19
+	('time_elapsed','u1'),                  # byte 20
+	('volume_raw','>u2'),                   # byte 21-22
+	('reserved','>u2')])                    # byte 23-24
+assert MCU_MSG_DTYPE.itemsize == MCU_MSG_LENGTH
+
+MCUMessage = namedtuple('MCUMessage',['uid','cmd','status','internal_program','valve_A_B_and_bubble_sensors','time_elapsed',
+	'selector_valve_position','pump_power','pressure','vacuum','bubble_sensor_1','bubble_sensor_2','flow_upstream','flow_downstream','volume_ul'])
+
+_PSI_PER_COUNT = (MCU_CONSTANTS._p_max - MCU_CONSTANTS._p_min) / (MCU_CONSTANTS._output_max - MCU_CONSTANTS._output_min)
+
+def _int16(value):
+	return value - 65536 if value >= 32768 else value
+
+def _psi(raw):
+	raw = min(MCU_CONSTANTS._output_max, max(MCU_CONSTANTS._output_min, raw))
+	return (raw - MCU_CONSTANTS._output_min) * _PSI_PER_COUNT + MCU_CONSTANTS._p_min
+
+def decode_mcu_message(msg):
+	''' decode one message (bytes or list of ints) using plain python ints '''
+	return MCUMessage(
+		uid = (msg[0] << 8) + msg[1],
+		cmd = msg[2],
+		status = msg[3],
+		internal_program = msg[4],
+		valve_A_B_and_bubble_sensors = msg[5],
+		time_elapsed = msg[20],
+		selector_valve_position = msg[9],
+		pump_power = ((msg[10] << 8) + msg[11])/65535,
+		pressure = _psi((msg[14] << 8) + msg[15]),
+		vacuum = _psi((msg[12] << 8) + msg[13]),
+		bubble_sensor_1 = msg[5] & 0b00001000,
+		bubble_sensor_2 = msg[5] & 0b00000100,
+		flow_upstream = _int16((msg[18] << 8) + msg[19])/MCU_CONSTANTS.SCALE_FACTOR_FLOW,
+		flow_downstream = _int16((msg[16] << 8) + msg[17])/MCU_CONSTANTS.SCALE_FACTOR_FLOW,
+		volume_ul = (((msg[21] << 8) + msg[22])/65535)*MCU_CONSTANTS.VOLUME_UL_MAX)
+
+def decode_mcu_messages(data):
+	'''
+	decode N messages in one pass - data is a bytes-like object holding N*MCU_MSG_LENGTH bytes
+	returns the structured array (raw fields) and a dict of calibrated arrays
+	'''
+	frames = np.frombuffer(data,dtype=MCU_MSG_DTYPE)
+	vacuum_raw = np.clip(frames['vacuum_raw'],MCU_CONSTANTS._output_min,MCU_CONSTANTS._output_max)
+	pressure_raw = np.clip(frames['pressure_raw'],MCU_CONSTANTS._output_min,MCU_CONSTANTS._output_max)
+	calibrated = {
+		'pump_power':frames['pump_power']/65535,
+		'pressure':(pressure_raw - MCU_CONSTANTS._output_min)*_PSI_PER_COUNT + MCU_CONSTANTS._p_min,
+		'vacuum':(vacuum_raw - MCU_CONSTANTS._output_min)*_PSI_PER_COUNT + MCU_CONSTANTS._p_min,
+		'flow_upstream':frames['flow_upstream_raw']/MCU_CONSTANTS.SCALE_FACTOR_FLOW,
+		'flow_downstream':frames['flow_downstream_raw']/MCU_CONSTANTS.SCALE_FACTOR_FLOW,
+		'volume_ul':(frames['volume_raw']/65535)*MCU_CONSTANTS.VOLUME_UL_MAX,
+		'bubble_sensor_1':(frames['valve_A_B_and_bubble_sensors'] & 0b00001000) > 0,
+		'bubble_sensor_2':(frames['valve_A_B_and_bubble_sensors'] & 0b00000100) > 0}
+	return frames, calibrated
+
+#######################################################
+################### frame format 2 ####################
+#######################################################
+'''
+frame format 2: sync header (MCU_MSG_V2_SYNC), sequence counter (1 byte), the 25-byte message with the CRC-16 of the
+sequence counter and message bytes 0-22 in bytes 23-24 (see the message structure in _def.py)
+'''
+_CRC_STRUCT = struct.Struct('>H')
+
+def crc16(data):
+	''' CRC-16/CCITT-FALSE, as crc16_ccitt() in firmware.ino '''
+	return binascii.crc_hqx(data,0xFFFF)
+
+def encode_mcu_frame_v2(msg,sequence):
+	''' frame format 2 for a 25-byte message, bytes 23-24 of the message are replaced by the CRC '''
+	frame = bytearray(MCU_MSG_V2_LENGTH)
+	frame[0:2] = MCU_MSG_V2_SYNC
+	frame[2] = sequence & 0xff
+	frame[3:MCU_MSG_V2_LENGTH-2] = msg[0:MCU_MSG_LENGTH-2]
+	_CRC_STRUCT.pack_into(frame,MCU_MSG_V2_LENGTH-2,crc16(frame[2:MCU_MSG_V2_LENGTH-2]))
+	return bytes(frame)
+
+class FrameParser(object):
+	'''
+	splits the bytes received in frame format 2 into 25-byte messages - a frame starts at a sync header and is accepted if
+	its CRC matches, otherwise the parser resynchronizes on the next sync header, so that a lost or corrupted byte only
+	costs the frame it belongs to
+		frames_parsed  : frames accepted
+		crc_errors     : frames rejected (sync header found, CRC mismatch)
+		frames_missed  : gaps in the sequence counter (lost and rejected frames, modulo 256)
+		bytes_skipped  : bytes discarded while looking for a sync header
+	'''
+	def __init__(self):
+		self.buffer = bytearray() # holds the trailing partial frame (if any) until the next call
+		self.sequence = None # sequence counter of the last frame accepted
+		self.frames_parsed = 0
+		self.crc_errors = 0
+		self.frames_missed = 0
+		self.bytes_skipped = 0
+
+	def parse(self,data):
+		''' returns the messages of the complete frames received so far '''
+		buffer = self.buffer
+		buffer += data
+		n = len(buffer)
+		messages = []
+		i = 0
+		while True:
+			j = buffer.find(MCU_MSG_V2_SYNC,i)
+			if j < 0:
+				# keep a trailing first byte of the sync header
+				j = n - 1 if n > i and buffer[n-1] == MCU_MSG_V2_SYNC[0] else n
+				self.bytes_skipped = self.bytes_skipped + j - i
+				i = j
+				break
+			self.bytes_skipped = self.bytes_skipped + j - i
+			i = j
+			if j + MCU_MSG_V2_LENGTH > n:
+				break
+			frame = bytes(buffer[j:j+MCU_MSG_V2_LENGTH])
+			if crc16(frame[2:MCU_MSG_V2_LENGTH-2]) != _CRC_STRUCT.unpack_from(frame,MCU_MSG_V2_LENGTH-2)[0]:
+				# a sync header inside a frame or a corrupted frame - resynchronize on the next sync header
+				self.crc_errors = self.crc_errors + 1
+				i = j + 1
+				continue
+			if self.sequence is not None:
+				self.frames_missed = self.frames_missed + ((frame[2] - self.sequence - 1) & 0xff)
+			self.sequence = frame[2]
+			messages.append(frame[3:])
+			i = j + MCU_MSG_V2_LENGTH
+		del buffer[:i]
+		self.frames_parsed = self.frames_parsed + len(messages)
+		return messages
+
+#######################################################
+################# telemetry recording #################
+#######################################################
+'''
+telemetry file: a 64-byte header followed by fixed-width records, one per MCU message
+	header	: magic (8 bytes), file format version (uint16), record length (uint16), reserved
+	record	: host timestamp (float64, little endian, seconds since epoch) + the raw 25-byte MCU message
+'''
+TELEMETRY_FILE_MAGIC = b'FLUIDTLM'
+TELEMETRY_FILE_VERSION = 1
+TELEMETRY_FILE_HEADER_LENGTH = 64
+TELEMETRY_RECORD_DTYPE = np.dtype([('timestamp','<f8'),('frame','u1',(MCU_MSG_LENGTH,))])
+
+_TIMESTAMP_STRUCT = struct.Struct('<d')
+
+class TelemetryRecorder(object):
+	''' appends (timestamp, raw message) records to a telemetry file, written to disk in chunks '''
+	def __init__(self,filename,flush_interval_records=TELEMETRY_RECORDER_FLUSH_INTERVAL_RECORDS):
+		self.filename = filename
+		self.file = open(filename,'wb')
+		header = bytearray(TELEMETRY_FILE_HEADER_LENGTH)
+		header[0:12] = TELEMETRY_FILE_MAGIC + struct.pack('<HH',TELEMETRY_FILE_VERSION,TELEMETRY_RECORD_DTYPE.itemsize)
+		self.file.write(header)
+		self.buffer = bytearray()
+		self.flush_interval_bytes = flush_interval_records*TELEMETRY_RECORD_DTYPE.itemsize
+		self.number_of_records = 0
+
+	def record(self,timestamp,msg):
+		self.buffer += _TIMESTAMP_STRUCT.pack(timestamp)
+		self.buffer += bytes(msg)
+		self.number_of_records = self.number_of_records + 1
+		if len(self.buffer) >= self.flush_interval_bytes:
+			self.flush()
+
+	def flush(self):
+		self.file.write(self.buffer)
+		self.file.flush()
+		self.buffer.clear()
+
+	def close(self):
+		if self.file.closed == False:
+			self.flush()
+			self.file.close()
+
+def load_telemetry(filename):
+	''' memory-map a telemetry file as a structured array with fields 'timestamp' and 'frame' '''
+	with open(filename,'rb') as f:
+		header = f.read(TELEMETRY_FILE_HEADER_LENGTH)
+	if header[0:8] != TELEMETRY_FILE_MAGIC:
+		raise IOError(filename + ' is not a telemetry file')
+	version, record_length = struct.unpack('<HH',header[8:12])
+	if record_length != TELEMETRY_RECORD_DTYPE.itemsize:
+		raise IOError('unsupported telemetry record length ' + str(record_length))
+	# a trailing partial record (e.g. after a crash) is ignored
+	number_of_records = (os.path.getsize(filename) - TELEMETRY_FILE_HEADER_LENGTH)//record_length
+	if number_of_records == 0:
+		return np.zeros(0,dtype=TELEMETRY_RECORD_DTYPE)
+	return np.memmap(filename,dtype=TELEMETRY_RECORD_DTYPE,mode='r',offset=TELEMETRY_FILE_HEADER_LENGTH,shape=(number_of_records,))
+
+def decode_telemetry(records):
+	''' decode the records returned by load_telemetry(), returns (timestamps, frames, calibrated) '''
+	frames, calibrated = decode_mcu_messages(np.ascontiguousarray(records['frame']).tobytes())
+	return np.array(records['timestamp']), frames, calibrated
+
+def telemetry_to_csv(filename,csv_filename):
+	''' convert a telemetry file to the csv format previously written by FluidController '''
+	timestamps, frames, calibrated = decode_telemetry(load_telemetry(filename))
+	columns = [timestamps,frames['uid'],frames['cmd'],frames['status'],frames['internal_program'],frames['valve_A_B_and_bubble_sensors'],
+		frames['time_elapsed'],frames['selector_valve_position'],calibrated['pump_power'],calibrated['pressure'],calibrated['vacuum'],
+		frames['valve_A_B_and_bubble_sensors'] & 0b00001000,frames['valve_A_B_and_bubble_sensors'] & 0b00000100,calibrated['flow_upstream'],calibrated['volume_ul']]
+	fmt = ['%.6f'] + ['%d']*7 + ['%.2f']*3 + ['%d']*2 + ['%.2f']*2
+	np.savetxt(csv_filename,np.column_stack(columns),fmt=fmt,delimiter=',')
+
+#######################################################
+################## telemetry history ##################
+#######################################################
+'''
+in-memory history of the decoded MCU messages for live plotting (see widgets.TelemetryPlotWidget)
+	history = telemetry.TelemetryHistory()
+	history.append_messages(timestamps,messages)             # raw 25-byte messages, decoded in one pass
+	t, y = history.decimate('pressure',t_start,t_end,width)   # at most ~2 points per pixel
+the memory is fixed: the raw values are kept in a ring of `capacity` messages, and each summary level keeps the min and max
+of blocks of level_factor**k messages over the same time span. a time window is decimated from the coarsest level that still
+has one block per pixel (plus the partial blocks at the end from the finer levels), so the cost of a redraw depends on the
+width of the plot and not on the length of the window. min/max keeps short pressure spikes visible at any zoom level
+'''
+
+class _TelemetryRing(object):
+	''' ring of (timestamp, min, max) entries, indexed by the entry count since the start (oldest kept: count - capacity) '''
+	def __init__(self,capacity,number_of_fields,summary=True):
+		self.capacity = capacity
+		self.count = 0
+		self.t = np.zeros(capacity,dtype=np.float64)
+		self.min = np.zeros((capacity,number_of_fields),dtype=np.float32)
+		self.max = np.zeros((capacity,number_of_fields),dtype=np.float32) if summary else self.min
+
+	def oldest(self):
+		return max(0,self.count - self.capacity)
+
+	def write(self,t,values_min,values_max):
+		index = np.arange(self.count,self.count + len(t)) % self.capacity
+		self.t[index] = t
+		self.min[index] = values_min
+		if self.max is not self.min:
+			self.max[index] = values_max
+		self.count = self.count + len(t)
+
+	def search(self,t):
+		''' index of the first entry with a timestamp >= t '''
+		oldest = self.oldest()
+		if self.count <= self.capacity:
+			return int(np.searchsorted(self.t[:self.count],t))
+		head = self.count % self.capacity
+		older = self.t[head:]
+		if t <= older[-1]:
+			return oldest + int(np.searchsorted(older,t))
+		return oldest + len(older) + int(np.searchsorted(self.t[:head],t))
+
+	def take(self,first,last,field_index):
+		index = np.arange(first,last) % self.capacity
+		return self.t[index], self.min[index,field_index], self.max[index,field_index]
+
+class TelemetryHistory(object):
+	''' fixed-memory history of the fields of the decoded MCU messages (calibrated values, see decode_mcu_messages) '''
+	def __init__(self,capacity=TELEMETRY_HISTORY_DURATION_S*1000//MCU_TELEMETRY_PERIOD_MS,fields=TELEMETRY_HISTORY_FIELDS,level_factor=TELEMETRY_HISTORY_LEVEL_FACTOR):
+		self.capacity = max(capacity,2*level_factor)
+		self.fields = list(fields)
+		self.field_index = {field:i for i, field in enumerate(self.fields)}
+		self.level_factor = level_factor
+		# level 0 holds the messages, level k the min/max of blocks of level_factor**k messages
+		self.levels = [_TelemetryRing(self.capacity,len(self.fields),summary=False)]
+		while self.capacity//level_factor**len(self.levels) >= level_factor:
+			# level_factor extra blocks so that the blocks being summarized are still in the finer level
+			self.levels.append(_TelemetryRing(self.capacity//level_factor**len(self.levels) + level_factor + 1,len(self.fields)))
+
+	def __len__(self):
+		return min(self.levels[0].count,self.capacity)
+
+	def append_messages(self,timestamps,messages):
+		''' messages: list of 25-byte MCU messages, timestamps: one per message (or one for all) '''
+		if len(messages) == 0:
+			return
+		frames, calibrated = decode_mcu_messages(b''.join(bytes(msg) for msg in messages))
+		self.extend(np.broadcast_to(np.asarray(timestamps,dtype=np.float64),(len(messages),)),np.column_stack([calibrated[field] for field in self.fields]))
+
+	def extend(self,timestamps,values):
+		''' timestamps: (N,) in increasing order, values: (N, number of fields) in the order of self.fields '''
+		# in chunks smaller than the capacity, so that a block being summarized is never overwritten
+		chunk_length = self.capacity - self.level_factor
+		for i in range(0,len(timestamps),chunk_length):
+			self._extend(timestamps[i:i+chunk_length],values[i:i+chunk_length])
+
+	def _extend(self,timestamps,values):
+		self.levels[0].write(timestamps,values,values)
+		for finer, level in zip(self.levels[:-1],self.levels[1:]):
+			number_of_blocks = finer.count//self.level_factor - level.count
+			if number_of_blocks == 0:
+				break
+			first = level.count*self.level_factor
+			t, values_min, values_max = finer.t, finer.min, finer.max
+			index = np.arange(first,first + number_of_blocks*self.level_factor) % finer.capacity
+			level.write(t[index[::self.level_factor]],
+				values_min[index].reshape(number_of_blocks,self.level_factor,-1).min(axis=1),
+				values_max[index].reshape(number_of_blocks,self.level_factor,-1).max(axis=1))
+
+	def latest(self,field):
+		raw = self.levels[0]
+		if raw.count == 0:
+			return None
+		return float(raw.min[(raw.count-1) % raw.capacity,self.field_index[field]])
+
+	def time_range(self):
+		raw = self.levels[0]
+		if raw.count == 0:
+			return None
+		return raw.t[raw.oldest() % raw.capacity], raw.t[(raw.count-1) % raw.capacity]
+
+	def decimate(self,field,t_start,t_end,width):
+		''' (t, y) of field between t_start and t_end, reduced to about 2 points per pixel for a plot `width` pixels wide '''
+		field_index = self.field_index[field]
+		width = max(1,int(width))
+		raw = self.levels[0]
+		if raw.count == 0:
+			return raw.t[:0], raw.min[:0,field_index]
+		# the summary levels may still hold blocks older than the oldest message
+		t_start = max(t_start,raw.t[raw.oldest() % raw.capacity])
+		first = raw.search(t_start)
+		last = raw.search(t_end)
+		if last - first <= 2*width:
+			t, y, _ = raw.take(first,last,field_index)
+			return t, y
+		level_index = 0
+		while level_index + 1 < len(self.levels) and (last - first)//self.level_factor**(level_index+1) >= width:
+			level_index = level_index + 1
+		# complete blocks of the coarsest level, then the blocks (and messages) after them from the finer levels
+		segments = []
+		covered = None
+		for level in reversed(self.levels[:level_index+1]):
+			first = max(level.search(t_start) - 1,level.oldest())
+			if covered is not None:
+				first = max(first,covered)
+			last = level.search(t_end)
+			if last > first:
+				segments.append(level.take(first,last,field_index))
+			covered = level.count*self.level_factor
+		t = np.concatenate([segment[0] for segment in segments])
+		y_min = np.concatenate([segment[1] for segment in segments])
+		y_max = np.concatenate([segment[2] for segment in segments])
+		return min_max_decimate(t,y_min,y_max,t_start,t_end,width)
+
+def min_max_decimate(t,y_min,y_max,t_start,t_end,width):
+	''' min and max of (t, y_min, y_max) in each of `width` time buckets between t_start and t_end (t in increasing order) '''
+	if len(t) == 0:
+		return t, y_min
+	bucket = ((t - t_start)*(width/max(t_end - t_start,1e-9))).astype(np.int64)
+	np.clip(bucket,0,width-1,out=bucket)
+	starts = np.flatnonzero(np.diff(bucket,prepend=-1))
+	t_decimated = np.repeat(t[starts],2)
+	y_decimated = np.empty(len(t_decimated),dtype=y_min.dtype)
+	y_decimated[0::2] = np.minimum.reduceat(y_min,starts)
+	y_decimated[1::2] = np.maximum.reduceat(y_max,starts)
+	return t_decimated, y_decimated
+
+if __name__ == "__main__":
+	# python3 telemetry.py <telemetry file> [<csv file>]
+	csv_filename = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(sys.argv[1])[0] + '.csv'
+	telemetry_to_csv(sys.argv[1],csv_filename)
+	print('saved ' + csv_filename)
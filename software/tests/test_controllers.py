@@ -0,0 +1,73 @@
+import os
+os.environ.setdefault('QT_API','pyqt5')
+os.environ.setdefault('QT_QPA_PLATFORM','offscreen')
+import time
+
+import pytest
+
+import controllers
+import engine
+import telemetry
+from qtpy.QtWidgets import QApplication
+from _def import *
+
+def read_for(mcu,duration_s):
+	t_end = time.monotonic() + duration_s
+	while time.monotonic() < t_end:
+		mcu.read_received_packets_nowait()
+		time.sleep(0.002)
+
+@pytest.mark.parametrize('frame_format',[1,2])
+def test_telemetry_rate_confirmed(frame_format):
+	mcu = controllers.Microcontroller(port='loop://',frame_format=frame_format,telemetry_period_ms=5)
+	try:
+		read_for(mcu,2*MCU_TELEMETRY_RATE_CHECK_S)
+		assert mcu.telemetry_rate_confirmed == True
+		assert mcu.telemetry_period_ms == 5
+	finally:
+		mcu.close()
+
+def test_telemetry_rate_not_applied():
+	# the firmware ignores SET_TELEMETRY_RATE and keeps sending every 20 ms - the measured period is used
+	mcu = controllers.Microcontroller(port='loop://?telemetry_rate=0',telemetry_period_ms=5,telemetry_mode=TELEMETRY_MODE.SUMMARY)
+	try:
+		read_for(mcu,2*MCU_TELEMETRY_RATE_CHECK_S)
+		assert mcu.telemetry_rate_confirmed == False
+		assert mcu.telemetry_period_ms == pytest.approx(MCU_TELEMETRY_PERIOD_MS,rel=0.25)
+		assert mcu.telemetry_mode == TELEMETRY_MODE.FULL
+	finally:
+		mcu.close()
+
+def test_step_duration_history_messages_logged(tmp_path):
+	# the history is loaded once the event loop runs, its messages go to the log instead of stdout
+	app = QApplication.instance() or QApplication([])
+	with open(tmp_path/'step durations (simulation).json','w') as f:
+		f.write('{"format": "something else"}')
+	fluidController = controllers.FluidController(controllers.Microcontroller_Simulation(),step_duration_history_file=str(tmp_path/'step durations.json'))
+	messages = []
+	fluidController.log_message.connect(messages.append)
+	try:
+		app.processEvents()
+		assert any('is not a step duration history' in message for message in messages)
+	finally:
+		fluidController.close()
+
+def test_stale_misaligned_stream_synchronized():
+	# the port is not read until its buffer is full (at a size that is not a multiple of the frame length), the stale bytes are
+	# discarded and the frames sent after them are delivered aligned
+	mcu = controllers.Microcontroller(port='pty://?seed=0',telemetry_period_ms=1)
+	try:
+		time.sleep(1)
+		assert mcu.serial.in_waiting % MCU_MSG_LENGTH != 0
+		uid = 0x1234
+		mcu.send_command(engine.MCU_CMD_UID_STRUCT.pack(uid) + engine.encode_mcu_command(CMD_SET.SET_SELECTOR_VALVE,1)[2:])
+		frames = []
+		t_end = time.monotonic() + 2
+		while time.monotonic() < t_end and not any(telemetry.decode_mcu_message(frame).uid == uid for frame in frames):
+			frames.extend(mcu.read_received_packets_nowait())
+			time.sleep(0.002)
+		assert mcu.rx_frame_synchronized == True
+		assert mcu.rx_bytes_discarded > 0
+		assert any(telemetry.decode_mcu_message(frame).uid == uid for frame in frames)
+	finally:
+		mcu.close()
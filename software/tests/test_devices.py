@@ -0,0 +1,32 @@
+import os
+os.environ.setdefault('QT_API','pyqt5')
+os.environ.setdefault('QT_QPA_PLATFORM','offscreen')
+import asyncio
+
+import devices
+import controllers
+from _def import *
+
+class SilentMicrocontroller(object):
+	''' receives the commands and never sends a frame (e.g. a port that is never synchronized) '''
+	telemetry_period_ms = MCU_TELEMETRY_PERIOD_MS
+
+	def send_command(self,cmd):
+		pass
+
+	def read_received_packets_nowait(self):
+		return []
+
+def test_instrument_without_frames_reported(monkeypatch):
+	monkeypatch.setattr(devices,'MCU_NO_FRAMES_TIMEOUT_S',0.2)
+	device_manager = devices.DeviceManager()
+	silent = device_manager.add_instrument('silent',SilentMicrocontroller(),print_log=False)
+	responding = device_manager.add_instrument('responding',controllers.Microcontroller_Simulation(cmd_execution_time_s=0.05),print_log=False)
+	for instrument in [silent,responding]:
+		instrument.engine.add_sequence('PBST Wash',Port['PBST'],0.1,0.005,aspiration_pump_power=0.3,aspiration_time_s=0.1)
+	asyncio.run(asyncio.wait_for(device_manager.run_sequences(),10))
+	assert silent.not_responding == True
+	assert silent.engine.sequences_in_progress == True
+	assert responding.not_responding == False
+	assert responding.engine.sequences_in_progress == False
+	device_manager.close()
@@ -0,0 +1,160 @@
+import pytest
+
+import engine
+import simulation
+import telemetry
+from _def import *
+
+class RecordingListener(engine.SequenceEngineListener):
+	''' records the log messages (without the time stamp) and the number of times execution stopped '''
+	def __init__(self):
+		self.messages = []
+		self.number_of_stops = 0
+
+	def on_log_message(self,message):
+		self.messages.append(message.split(' : ',1)[1])
+
+	def on_sequences_execution_stopped(self):
+		self.number_of_stops = self.number_of_stops + 1
+
+def make_engine(pipeline_window=1,listener=None):
+	clock = engine.VirtualClock()
+	mcu = simulation.Microcontroller_Firmware_Simulation(clock=clock)
+	listener = listener if listener is not None else RecordingListener()
+	return engine.SequenceEngine(mcu,clock,listener,pipeline_window=pipeline_window), mcu, listener
+
+def mcu_message(uid,cmd,status):
+	msg = bytearray(MCU_MSG_LENGTH)
+	msg[0] = uid >> 8
+	msg[1] = uid & 0xff
+	msg[2] = cmd
+	msg[3] = status
+	return bytes(msg)
+
+def test_full_run():
+	sequence_engine, mcu, listener = make_engine()
+	for k in range(2):
+		sequence_engine.add_sequence('PBST Wash',Port['PBST'],10,0.05,aspiration_pump_power=0.3,aspiration_time_s=5,round_=k)
+	sequence_engine.add_sequence('Add Imaging Buffer',Port['Imaging Buffer'],10,-1)
+	t_simulated = engine.run_sequences_virtual(sequence_engine)
+	assert sequence_engine.sequences_in_progress == False
+	assert listener.number_of_stops == 1
+	assert listener.messages[-1] == 'Finished executing all the selected sequences'
+	assert [message for message in listener.messages if message.startswith('Execute ')] == ['Execute PBST Wash, round 1','Execute PBST Wash, round 2','Execute Add Imaging Buffer']
+	# 3 additions of 10 s, 2 incubations of 3 s and 2 aspirations of 5 s
+	assert t_simulated > 3*10 + 2*3 + 2*5
+	assert mcu.firmware.internal_program == simulation.INTERNAL_PROGRAM.IDLE
+
+def test_abort():
+	sequence_engine, mcu, listener = make_engine()
+	for k in range(3):
+		sequence_engine.add_sequence('PBST Wash',Port['PBST'],10,1,aspiration_pump_power=0.3,aspiration_time_s=5,round_=k)
+	# during the first incubation
+	sequence_engine.clock.call_later(30,sequence_engine.request_abort_sequences)
+	t_simulated = engine.run_sequences_virtual(sequence_engine)
+	assert sequence_engine.sequences_in_progress == False
+	assert t_simulated < 60
+	assert '! PBST Wash, round 2 aborted' in listener.messages
+	assert '! PBST Wash, round 3 aborted' in listener.messages
+	assert 'Abort completed' in listener.messages
+	assert listener.messages[-1] == 'Finished executing all the selected sequences'
+
+def test_uid_mismatch():
+	# a message that does not carry the UID and command of the command in progress does not complete it
+	sequence_engine, mcu, listener = make_engine()
+	sequence_engine.add_sequence('Set Selector Valve Position',3)
+	sequence_engine.start_sequence_execution()
+	uid = sequence_engine.computer_to_MCU_command_counter
+	sequence_engine.process_microcontroller_message(mcu_message(uid-1,CMD_SET.SET_SELECTOR_VALVE,CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS))
+	sequence_engine.process_microcontroller_message(mcu_message(uid,CMD_SET.SET_10MM_SOLENOID_VALVE,CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS))
+	assert sequence_engine.sequences_in_progress == True
+	assert sequence_engine.timestamp_last_computer_mcu_mismatch is not None
+	sequence_engine.process_microcontroller_message(mcu_message(uid,CMD_SET.SET_SELECTOR_VALVE,CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS))
+	assert sequence_engine.timestamp_last_computer_mcu_mismatch is None
+	assert sequence_engine.sequences_in_progress == False
+
+class InFlightRecordingListener(RecordingListener):
+	def __init__(self):
+		super().__init__()
+		self.sequence_engine = None
+		self.max_in_flight = 0
+
+	def on_mcu_message(self,decoded_msg):
+		self.max_in_flight = max(self.max_in_flight,len(self.sequence_engine.mcu_commands_in_flight))
+
+@pytest.mark.parametrize('pipeline_window',[1,4,8])
+def test_pipelined_completion(pipeline_window):
+	listener = InFlightRecordingListener()
+	sequence_engine, mcu, listener = make_engine(pipeline_window,listener)
+	listener.sequence_engine = sequence_engine
+	for i in range(20):
+		sequence_engine.add_sequence('Set Selector Valve Position',1+i%12)
+	sequence_engine.add_sequence('Remove Medium',aspiration_pump_power=0.3,aspiration_time_s=1)
+	sequence_engine.add_sequence('Set 10 mm Valve State',5)
+	t_simulated = engine.run_sequences_virtual(sequence_engine)
+	assert listener.messages[-1] == 'Finished executing all the selected sequences'
+	assert len(sequence_engine.mcu_commands_in_flight) == 0
+	assert listener.max_in_flight <= pipeline_window
+	assert mcu.firmware.commands_dropped == 0
+	# the commands are executed in order, the last selector valve position and 10 mm valve are the ones left set
+	assert mcu.firmware.selector_valve_position_setValue == 1 + 19%12
+	assert mcu.firmware.NXP33996_state == 1 << 4
+
+def test_pipelined_queue_full():
+	# the firmware queues the pipelined commands while an internal program runs, beyond MCU_CMD_QUEUE_LENGTH the run is aborted
+	sequence_engine, mcu, listener = make_engine(MCU_CMD_QUEUE_LENGTH + 4)
+	mcu.firmware.receive(engine.encode_mcu_command(CMD_SET.REMOVE_MEDIUM,ASPIRATION_MODE.FIXED_TIME,0,int(0.3*65535),5000))
+	for i in range(MCU_CMD_QUEUE_LENGTH + 4):
+		sequence_engine.add_sequence('Set Selector Valve Position',1+i%12)
+	sequence_engine.add_sequence('PBST Wash',Port['PBST'],10,0.05,aspiration_pump_power=0.3,aspiration_time_s=5)
+	engine.run_sequences_virtual(sequence_engine)
+	assert mcu.firmware.commands_dropped > 0
+	assert '! the command queue of the microcontroller is full, all subsequent sequences aborted !' in listener.messages
+	# the wash waits for the pipelined commands to complete, it is not started
+	assert not any(message.startswith('[ microcontroller: Add Medium') for message in listener.messages)
+	assert sequence_engine.sequences_in_progress == False
+
+class FailingListener(RecordingListener):
+	''' raises once, on the first sequence '''
+	def __init__(self):
+		super().__init__()
+		self.failed = False
+
+	def on_current_sequence_changed(self,sequence_name):
+		if self.failed == False:
+			self.failed = True
+			raise RuntimeError('listener failed')
+
+def test_listener_exception_does_not_stall():
+	sequence_engine, mcu, listener = make_engine(listener=FailingListener())
+	sequence_engine.add_sequence('Set Selector Valve Position',3)
+	sequence_engine.add_sequence('Set Selector Valve Position',4)
+	with pytest.raises(RuntimeError):
+		sequence_engine.start_sequence_execution()
+	assert sequence_engine.sequence_execution_state_update_in_progress == False
+	engine.run_sequences_virtual(sequence_engine)
+	assert listener.messages[-1] == 'Finished executing all the selected sequences'
+	assert mcu.firmware.selector_valve_position_setValue == 4
+
+@pytest.mark.parametrize('field, kwargs',[('payload3',{'payload3':70000}),('payload1',{'payload1':-1}),('payload4',{'payload4':2**32}),('payload5',{'payload5':65536})])
+def test_encode_mcu_command_out_of_range(field,kwargs):
+	with pytest.raises(ValueError,match='^' + field + ' = '):
+		engine.encode_mcu_command(CMD_SET.ADD_MEDIUM,**kwargs)
+
+def test_encode_mcu_command_layout():
+	packet = engine.encode_mcu_command(CMD_SET.ADD_MEDIUM,1,2,0x0304,0x05060708,0x090a)
+	assert len(packet) == MCU_CMD_LENGTH
+	assert packet[0:2] == b'\x00\x00' # the UID is set when the command is sent
+	assert packet[2] == CMD_SET.ADD_MEDIUM
+	assert packet[3:5] == b'\x01\x02'
+	assert packet[5:7] == b'\x03\x04'
+	assert packet[7:11] == b'\x05\x06\x07\x08'
+	assert packet[11:13] == b'\x09\x0a'
+	assert packet[engine.MCU_CMD_FLAGS_BYTE] == 0
+	assert packet[13:] == b'\x00\x00'
+
+def test_negative_incubation_time_skips_sequence():
+	compiler = engine.PlanCompiler()
+	compiler.add_sequence('PBST Wash',Port['PBST'],10,-1)
+	plan = compiler.compile()
+	assert not any(plan.steps['type'] != PLAN_STEP_TYPE.SEQUENCE)
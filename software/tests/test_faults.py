@@ -0,0 +1,70 @@
+import pytest
+
+import engine
+import faults
+import simulation
+from _def import *
+
+class MCUMessageListener(engine.SequenceEngineListener):
+	''' records (wall time, decoded MCU message) and the log messages '''
+	def __init__(self,clock):
+		self.clock = clock
+		self.mcu_messages = []
+		self.log_messages = []
+
+	def on_mcu_message(self,decoded_msg):
+		self.mcu_messages.append((self.clock.wall_time(),decoded_msg))
+
+	def on_log_message(self,message):
+		self.log_messages.append(message)
+
+def run_pbst_wash(fault=None,t_fault_s=4,seed=0,downstream_flow_sensor_present=False,fault_abort_step=FAULT_DETECTOR_ABORT_STEP):
+	# a PBST wash on the firmware simulation with the fault injected while fluid is pumped, returns the detector, the listener and the wall time of the fault
+	clock = engine.VirtualClock()
+	mcu = simulation.Microcontroller_Firmware_Simulation(clock=clock,seed=seed,downstream_flow_sensor_present=downstream_flow_sensor_present)
+	listener = MCUMessageListener(clock)
+	detector = faults.FaultDetector()
+	sequence_engine = engine.SequenceEngine(mcu,clock,listener,fault_detector=detector,fault_abort_step=fault_abort_step)
+	sequence_engine.add_sequence('PBST Wash',Port['PBST'],10,0.05,aspiration_pump_power=0.3,aspiration_time_s=5)
+	if fault is not None:
+		clock.call_later(t_fault_s,lambda: mcu.firmware.inject_fault(fault))
+	engine.run_sequences_virtual(sequence_engine)
+	return detector, listener, clock.start_wall_time + t_fault_s
+
+@pytest.mark.parametrize('seed',range(3))
+@pytest.mark.parametrize('downstream_flow_sensor_present',[False,True])
+def test_no_false_alarm(seed,downstream_flow_sensor_present):
+	detector, listener, t_fault = run_pbst_wash(seed=seed,downstream_flow_sensor_present=downstream_flow_sensor_present)
+	assert detector.events == []
+
+# number of MCU messages from the injection of the fault to its detection, including the time the fluidics take to respond
+@pytest.mark.parametrize('fault,max_samples',[
+	(FAULT_TYPE.LEAK,3*FAULT_CUSUM_SAMPLES),
+	(FAULT_TYPE.CLOG,3*FAULT_CUSUM_SAMPLES),
+	(FAULT_TYPE.AIR_IN_LINE,FAULT_AIR_IN_LINE_SAMPLES + 20),
+	(FAULT_TYPE.EMPTY_RESERVOIR,FAULT_EMPTY_RESERVOIR_SAMPLES + 40)])
+@pytest.mark.parametrize('seed',range(3))
+def test_fault_detected(fault,max_samples,seed):
+	detector, listener, t_fault = run_pbst_wash(fault,seed=seed)
+	events = [event for event in detector.events if event.fault == fault]
+	assert len(events) > 0
+	samples = sum(1 for timestamp, decoded_msg in listener.mcu_messages if t_fault <= timestamp <= events[0].timestamp)
+	assert samples <= max_samples
+	# an empty reservoir is first seen as air in the line, no other fault is raised
+	assert set(event.fault for event in detector.events) <= {fault,FAULT_TYPE.AIR_IN_LINE}
+
+def test_detected_offline():
+	# the same detection from the recorded messages (see faults.detect_faults)
+	detector, listener, t_fault = run_pbst_wash(FAULT_TYPE.LEAK)
+	replay = faults.FaultDetector()
+	for timestamp, decoded_msg in listener.mcu_messages:
+		replay.update(decoded_msg,timestamp)
+	assert [(event.fault,event.sample) for event in replay.events] == [(event.fault,event.sample) for event in detector.events]
+
+def test_abort_is_opt_in():
+	# by default the faults are logged, the step in progress is aborted only for the faults of fault_abort_step
+	detector, listener, t_fault = run_pbst_wash(FAULT_TYPE.CLOG)
+	assert any('clog' in message for message in listener.log_messages)
+	assert not any(message.endswith('aborted ]') for message in listener.log_messages)
+	detector, listener, t_fault = run_pbst_wash(FAULT_TYPE.CLOG,fault_abort_step=[FAULT_TYPE.CLOG])
+	assert any(message.endswith('aborted ]') for message in listener.log_messages)
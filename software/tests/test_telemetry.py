@@ -0,0 +1,83 @@
+import pytest
+
+import simulation
+import telemetry
+from _def import *
+
+@pytest.mark.parametrize('volume_ul',[0,2500,3000,5000])
+def test_decode_volume(volume_ul):
+	# the volume is sent as an unsigned (volume_ul/VOLUME_UL_MAX)*65535, e.g. 3000 ul is 39321
+	firmware = simulation.FirmwareModel()
+	firmware.volume_ul = volume_ul
+	msg = bytes(firmware.frame())
+	tolerance = MCU_CONSTANTS.VOLUME_UL_MAX/65535
+	assert telemetry.decode_mcu_message(msg).volume_ul == pytest.approx(volume_ul,abs=tolerance)
+	frames, calibrated = telemetry.decode_mcu_messages(msg)
+	assert calibrated['volume_ul'][0] == pytest.approx(volume_ul,abs=tolerance)
+
+def v2_messages(number_of_messages):
+	# messages without the bytes of the sync header, so that a sync header only starts a frame (or is in a CRC)
+	return [bytes((7*i + k) % 0xa0 for k in range(MCU_MSG_LENGTH)) for i in range(number_of_messages)]
+
+def v2_stream(messages,first_sequence=0):
+	frames = [telemetry.encode_mcu_frame_v2(msg,first_sequence + i) for i, msg in enumerate(messages)]
+	return frames, [frame[3:] for frame in frames]
+
+def test_encode_mcu_frame_v2():
+	msg = v2_messages(1)[0]
+	frame = telemetry.encode_mcu_frame_v2(msg,257)
+	assert len(frame) == MCU_MSG_V2_LENGTH
+	assert frame[0:2] == MCU_MSG_V2_SYNC
+	assert frame[2] == 1 # the sequence counter wraps at 256
+	assert frame[3:3+MCU_MSG_LENGTH-2] == msg[:MCU_MSG_LENGTH-2]
+	assert frame[-2:] == telemetry.crc16(frame[2:-2]).to_bytes(2,'big')
+	assert telemetry.crc16(b'123456789') == 0x29b1 # CRC-16/CCITT-FALSE check value
+
+@pytest.mark.parametrize('chunk_length',[1,5,MCU_MSG_V2_LENGTH-1,MCU_MSG_V2_LENGTH+3,1000])
+def test_frame_parser_chunks(chunk_length):
+	# frames split across parse() calls, including a sync header split in two
+	frames, expected = v2_stream(v2_messages(50),250)
+	data = b''.join(frames)
+	parser = telemetry.FrameParser()
+	received = []
+	for i in range(0,len(data),chunk_length):
+		received.extend(parser.parse(data[i:i+chunk_length]))
+	assert received == expected
+	assert (parser.frames_parsed,parser.crc_errors,parser.frames_missed,parser.bytes_skipped) == (50,0,0,0)
+
+def corrupted(frames,k,corruption):
+	frame = bytearray(frames[k])
+	if corruption == 'dropped byte':
+		del frame[10]
+	elif corruption == 'inserted byte':
+		frame.insert(10,0x11)
+	elif corruption == 'bit flip':
+		frame[10] ^= 0x04
+	return b''.join(frames[:k]) + bytes(frame) + b''.join(frames[k+1:])
+
+@pytest.mark.parametrize('corruption, bytes_skipped',[('dropped byte',MCU_MSG_V2_LENGTH-2),('inserted byte',MCU_MSG_V2_LENGTH),('bit flip',MCU_MSG_V2_LENGTH-1)])
+def test_frame_parser_corrupted_frame(corruption,bytes_skipped):
+	# the corrupted frame is rejected by its CRC, the parser resynchronizes on the next frame and counts the gap
+	frames, expected = v2_stream(v2_messages(20))
+	parser = telemetry.FrameParser()
+	received = parser.parse(corrupted(frames,7,corruption))
+	assert received == expected[:7] + expected[8:]
+	assert (parser.frames_parsed,parser.crc_errors,parser.frames_missed,parser.bytes_skipped) == (19,1,1,bytes_skipped)
+
+def test_frame_parser_garbage():
+	# bytes between the frames (e.g. sent before the MCU switched to format 2) are skipped, no frame is lost
+	frames, expected = v2_stream(v2_messages(20))
+	garbage = bytes(range(64))
+	parser = telemetry.FrameParser()
+	received = parser.parse(garbage + b''.join(frames[:10]) + garbage + b''.join(frames[10:]))
+	assert received == expected
+	assert (parser.frames_parsed,parser.crc_errors,parser.frames_missed,parser.bytes_skipped) == (20,0,0,2*len(garbage))
+
+def test_frame_parser_sequence_gaps():
+	# frames lost on the way are counted from the sequence counter, across its wrap around
+	messages = v2_messages(4)
+	sequences = [254,255,0,3]
+	data = b''.join(telemetry.encode_mcu_frame_v2(msg,sequence) for msg, sequence in zip(messages,sequences))
+	parser = telemetry.FrameParser()
+	assert len(parser.parse(data)) == 4
+	assert (parser.crc_errors,parser.frames_missed) == (0,2)
@@ -0,0 +1,27 @@
+import os
+os.environ.setdefault('QT_API','pyqt5')
+os.environ.setdefault('QT_QPA_PLATFORM','offscreen')
+
+from qtpy.QtWidgets import QApplication
+
+import widgets
+
+def test_log_status_keeps_scroll_position():
+	# the countdown in the status row must not pull the view back to the bottom while the user reads older messages
+	app = QApplication.instance() or QApplication([])
+	log_widget = widgets.LogWidget()
+	log_widget.resize(400,200)
+	log_widget.show()
+	for i in range(200):
+		log_widget.log('message ' + str(i))
+	log_widget.model.flush()
+	log_widget.set_status('stop watch remaining time: 60 seconds')
+	app.processEvents()
+	scroll_bar = log_widget.view.verticalScrollBar()
+	assert scroll_bar.value() == scroll_bar.maximum() > 0
+	scroll_bar.setValue(0)
+	for t in [59,58]:
+		log_widget.set_status('stop watch remaining time: ' + str(t) + ' seconds')
+		app.processEvents()
+	assert scroll_bar.value() == 0
+	log_widget.close()
@@ -1,7 +1,36 @@
+import time
 from datetime import datetime
 
+from _def import LOG_SEVERITY
+
+# the formatted time is cached per minute, only the seconds are formatted on each call
+# (key, prefix) - key is the minute (seconds since epoch // 60), kept in one tuple so that it is updated atomically
+_timestamp_prefix = (None,'')
+_print_message_prefix = (None,'')
+
+def now():
+	# (monotonic time, wall-clock time) - for records that need both the time order and the date/time
+	return time.monotonic(), time.time()
+
 def print_message(msg):
-	print(datetime.now().strftime('%m/%d %H:%M:%S') + ' : '  + msg )
+	global _print_message_prefix
+	t = int(time.time())
+	key, prefix = _print_message_prefix
+	if key != t//60:
+		prefix = datetime.fromtimestamp(t - t%60).strftime('%m/%d %H:%M:')
+		_print_message_prefix = (t//60,prefix)
+	print(prefix + '%02d' % (t%60) + ' : '  + msg )
+
+def timestamp(t=None):
+	# t: seconds since epoch (e.g. from a simulated clock), default is now
+	global _timestamp_prefix
+	t = int(time.time() if t is None else t)
+	key, prefix = _timestamp_prefix
+	if key != t//60:
+		prefix = datetime.fromtimestamp(t - t%60).strftime('%Y/%m/%d %H:%M:')
+		_timestamp_prefix = (t//60,prefix)
+	return prefix + '%02d' % (t%60) + ' : '
 
-def timestamp():
-	return datetime.now().strftime('%Y/%m/%d %H:%M:%S') + ' : '
\ No newline at end of file
+def log_severity(message):
+	# messages starting with '!' (after the time stamp) report failures and aborts
+	return LOG_SEVERITY.ERROR if message.split(' : ',1)[-1].startswith('!') else LOG_SEVERITY.INFO
@@ -8,46 +8,54 @@ def generate_default_configuration(filename):
     sequence.set('Repeat','2')
     sequence.set('Incubation_Time_in_minute','10')
     sequence.set('Flow_Time_in_second','15')
+    sequence.set('Volume_in_ul','0')
 
     sequence = ET.SubElement(top,'sequence')
     sequence.set('Name','Stripping Buffer Rinse')
     sequence.set('Repeat','1')
     sequence.set('Incubation_Time_in_minute','0.5')
     sequence.set('Flow_Time_in_second','15')
+    sequence.set('Volume_in_ul','0')
 
     sequence = ET.SubElement(top,'sequence')
     sequence.set('Name','PBST Wash')
     sequence.set('Repeat','3')
     sequence.set('Incubation_Time_in_minute','5')
     sequence.set('Flow_Time_in_second','15')
+    sequence.set('Volume_in_ul','0')
 
     sequence = ET.SubElement(top,'sequence')
     sequence.set('Name','Wash (Post Ligation, 1)')
     sequence.set('Repeat','2')
     sequence.set('Incubation_Time_in_minute','10')
     sequence.set('Flow_Time_in_second','15')
+    sequence.set('Volume_in_ul','0')
 
     sequence = ET.SubElement(top,'sequence')
     sequence.set('Name','Wash (Post Ligation, 2)')
     sequence.set('Repeat','2')
     sequence.set('Incubation_Time_in_minute','10')
     sequence.set('Flow_Time_in_second','15')
+    sequence.set('Volume_in_ul','0')
 
     sequence = ET.SubElement(top,'sequence')
     sequence.set('Name','Stain with DAPI')
     sequence.set('Repeat','1')
     sequence.set('Incubation_Time_in_minute','10')
     sequence.set('Flow_Time_in_second','15')
+    sequence.set('Volume_in_ul','0')
 
     sequence = ET.SubElement(top,'sequence')
     sequence.set('Name','Ligate')
     sequence.set('Repeat','1')
     sequence.set('Incubation_Time_in_minute','180')
     sequence.set('Flow_Time_in_second','15')
+    sequence.set('Volume_in_ul','0')
 
     setting = ET.SubElement(top,'aspiration_setting')
     setting.set('Pump_Power','0.4')
     setting.set('Duration_Seconds','8')
+    setting.set('Mode','Fixed Time')
 
     tree = ET.ElementTree(top)
     tree.write(filename,encoding="utf-8", xml_declaration=True, pretty_print=True)
\ No newline at end of file
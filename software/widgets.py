@@ -13,12 +13,19 @@ from lxml import etree as ET
 
 # app specific libraries
 from datetime import datetime
+from pathlib import Path
+import math
 import threading
+import numpy as np
 import utils
 import utils_config
+import engine
 
 from _def import * 
 
+# the plan of each run is saved here (see SequenceWidget.save_plan)
+PLAN_DIRECTORY = os.path.join(Path.home(), 'Documents', 'starmap-automation plans')
+
 class PreUseCheckWidget(QFrame):
 
     log_message = Signal(str)
@@ -191,6 +198,9 @@ class SequenceEntry(QWidget):
         self.attributes['Flow Time (s)'] = QDoubleSpinBox()
         self.attributes['Flow Time (s)'].setMinimum(0) # -1: no flow
         self.attributes['Flow Time (s)'].setMaximum(FLOW_TIME_MAX) 
+        self.attributes['Volume (ul)'] = QSpinBox()
+        self.attributes['Volume (ul)'].setMinimum(0) # 0: pump for the flow time (the time limit otherwise)
+        self.attributes['Volume (ul)'].setMaximum(MCU_CONSTANTS.VOLUME_UL_MAX)
         self.attributes['Incubation Time (min)'] = QDoubleSpinBox()
         self.attributes['Incubation Time (min)'].setDecimals(1)
         self.attributes['Incubation Time (min)'].setMinimum(0) # -1: no incubation
@@ -251,6 +261,7 @@ class SequenceWidget(QFrame):
 
         self.sequences['Add Imaging Buffer'].attributes['Incubation Time (min)'].setEnabled(False)
         self.sequences['Remove Medium'].attributes['Flow Time (s)'].setEnabled(False) 
+        self.sequences['Remove Medium'].attributes['Volume (ul)'].setEnabled(False)
         # self.sequences['Ligate'].attributes['Repeat'].setEnabled(False) # change to false for testing
         self.sequences['Add Imaging Buffer'].attributes['Repeat'].setEnabled(False)
         self.sequences['Remove Medium'].attributes['Repeat'].setEnabled(False)
@@ -310,12 +321,20 @@ class SequenceWidget(QFrame):
         self.entry_aspiration_time_s.setSingleStep(1)
         self.entry_aspiration_time_s.setValue(DEFAULT_VALUES.vacuum_aspiration_time_s)
 
+        # Bubble Sensor: the aspiration ends once the downstream bubble sensor sees air, the duration is the time limit
+        self.dropdown_aspiration_mode = QComboBox()
+        for aspiration_mode_name in ASPIRATION_MODES.keys():
+            self.dropdown_aspiration_mode.addItem(aspiration_mode_name)
+        self.dropdown_aspiration_mode.setCurrentIndex(list(ASPIRATION_MODES.values()).index(DEFAULT_VALUES.aspiration_mode))
+
         hbox_aspiration_settings = QHBoxLayout()
         hbox_aspiration_settings.addWidget(QLabel(' Aspiration Settings: '))
         hbox_aspiration_settings.addWidget(QLabel('Pump Power'))
         hbox_aspiration_settings.addWidget(self.entry_aspiration_pump_power)
         hbox_aspiration_settings.addWidget(QLabel('Duration (s)'))
         hbox_aspiration_settings.addWidget(self.entry_aspiration_time_s)
+        hbox_aspiration_settings.addWidget(QLabel('Mode'))
+        hbox_aspiration_settings.addWidget(self.dropdown_aspiration_mode)
         hbox_aspiration_settings.addStretch()
 
         # settings loading and saveing
@@ -388,9 +407,12 @@ class SequenceWidget(QFrame):
             self.sequences[name].attributes['Repeat'].setValue(int(sequence.get('Repeat')))
             self.sequences[name].attributes['Incubation Time (min)'].setValue(float(sequence.get('Incubation_Time_in_minute')))
             self.sequences[name].attributes['Flow Time (s)'].setValue(float(sequence.get('Flow_Time_in_second')))
+            self.sequences[name].attributes['Volume (ul)'].setValue(int(float(sequence.get('Volume_in_ul','0'))))
         for aspiration_setting in self.config_xml_tree_root.iter('aspiration_setting'):
             self.entry_aspiration_pump_power.setValue(float(aspiration_setting.get('Pump_Power')))
             self.entry_aspiration_time_s.setValue(float(aspiration_setting.get('Duration_Seconds')))
+            if aspiration_setting.get('Mode') in ASPIRATION_MODES:
+                self.dropdown_aspiration_mode.setCurrentText(aspiration_setting.get('Mode'))
 
     def load_user_selected_sequence_settings(self):
         dialog = QFileDialog()
@@ -418,12 +440,14 @@ class SequenceWidget(QFrame):
                 sequence_to_update.set('Repeat',str(self.sequences[sequence_name].attributes['Repeat'].value()))
                 sequence_to_update.set('Incubation_Time_in_minute',str(self.sequences[sequence_name].attributes['Incubation Time (min)'].value()))
                 sequence_to_update.set('Flow_Time_in_second',str(self.sequences[sequence_name].attributes['Flow Time (s)'].value()))
+                sequence_to_update.set('Volume_in_ul',str(self.sequences[sequence_name].attributes['Volume (ul)'].value()))
         # aspiration settings
         list_ = self.config_xml_tree_root.xpath("//aspiration_setting")
         if list_:
             aspiration_setting = list_[0]
             aspiration_setting.set('Pump_Power',str(self.entry_aspiration_pump_power.value()))
             aspiration_setting.set('Duration_Seconds',str(self.entry_aspiration_time_s.value()))
+            aspiration_setting.set('Mode',self.dropdown_aspiration_mode.currentText())
         # save the configurations
         self.config_xml_tree.write(filename, encoding="utf-8", xml_declaration=True, pretty_print=True)
         print('sequence settings saved to ' + str(filename))    
@@ -461,33 +485,48 @@ class SequenceWidget(QFrame):
             self.disable_widgets_except_for_abort_btn() 
             # print a seperator for visuals
             self.log_message.emit('--------------------------------')
-            # go through sequences and execute *selected* sequences
-            counter = 0
+            # go through sequences and compile the *selected* sequences into one plan
+            compiler = engine.PlanCompiler()
             for i in range(len(SEQUENCE_NAME)):
                 current_sequence = self.sequences[SEQUENCE_NAME[i]]
                 if current_sequence.attributes['Include'].isChecked() == True:
                     for k in range(current_sequence.attributes['Repeat'].value()):
                         self.log_message.emit(utils.timestamp() + 'Add ' + SEQUENCE_NAME[i] + ', round ' + str(k+1) + ' to the queue')
-                        QApplication.processEvents()
-                        ################################################################
-                        ##### let the backend fluidController execute the sequence #####
-                        ################################################################
-                        self.fluidController.add_sequence(
-                            SEQUENCE_NAME[i],
-                            current_sequence.attributes['Fluidic Port'].value(),
-                            current_sequence.attributes['Flow Time (s)'].value(),
-                            current_sequence.attributes['Incubation Time (min)'].value(),
-                            pressure_setting=None,
-                            aspiration_pump_power=self.entry_aspiration_pump_power.value(),
-                            aspiration_time_s=self.entry_aspiration_time_s.value(),
-                            round_ = k)
-                        counter = counter + 1
-            if counter > 0:
+                    compiler.add_sequence(
+                        SEQUENCE_NAME[i],
+                        current_sequence.attributes['Fluidic Port'].value(),
+                        current_sequence.attributes['Flow Time (s)'].value(),
+                        current_sequence.attributes['Incubation Time (min)'].value(),
+                        pressure_setting=None,
+                        aspiration_pump_power=self.entry_aspiration_pump_power.value(),
+                        aspiration_time_s=self.entry_aspiration_time_s.value(),
+                        round_=0,
+                        repeat=current_sequence.attributes['Repeat'].value(),
+                        volume_ul=current_sequence.attributes['Volume (ul)'].value(),
+                        aspiration_mode=ASPIRATION_MODES[self.dropdown_aspiration_mode.currentText()])
+            plan = compiler.compile()
+            if plan.number_of_sequences() > 0:
+                self.save_plan(plan)
+                # corrected with the durations measured in past runs, if any
+                duration_s = plan.duration_s() if self.fluidController.duration_estimator is None else self.fluidController.duration_estimator.plan_forecast_s(plan)
+                self.log_message.emit(utils.timestamp() + str(plan.number_of_sequences()) + ' sequences queued, estimated duration: ' + str(math.ceil(duration_s/60)) + ' min')
+                ################################################################
+                ##### let the backend fluidController execute the sequence #####
+                ################################################################
+                self.fluidController.add_plan(plan)
                 self.fluidController.start_sequence_execution()
         else:
             self.log_message.emit(utils.timestamp() + 'no action.')
             QApplication.processEvents()
 
+    def save_plan(self, plan):
+        # the plan of each run is kept, so that runs can be compared (e.g. diff of two plan files)
+        try:
+            os.makedirs(PLAN_DIRECTORY, exist_ok=True)
+            plan.save(os.path.join(PLAN_DIRECTORY, 'plan ' + datetime.now().strftime('%Y-%m-%d %H-%M-%S') + '.jsonl'))
+        except OSError as e:
+            self.log_message.emit(utils.timestamp() + 'plan not saved: ' + str(e))
+
     def request_to_abort_sequences(self):
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Information)
@@ -686,6 +725,369 @@ class MicrocontrollerStateDisplayWidget(QFrame):
         vbox.addLayout(hbox3)
         self.setLayout(vbox)
 
+    def update_state(self, state):
+        # state: telemetry.MCUMessage, only the labels whose text changed are updated
+        texts = [(self.label_MCU_CMD_UID, str(state.uid)),
+            (self.label_CMD, str(state.cmd)), # @@@ to-do: map the command to the command description
+            (self.label_CMD_status, str(state.status)), # @@@ to-do: map the numerical value to text description
+            (self.label_MCU_internal_program, MCU_INTERNAL_PROGRAMS[state.internal_program]),
+            (self.label_MCU_CMD_time_elapsed, str(state.time_elapsed)),
+            (self.label_pump_power, '{:.2f}'.format(state.pump_power)),
+            (self.label_selector_valve_position, str(state.selector_valve_position)),
+            (self.label_pressure, '{:.2f}'.format(state.pressure)),
+            (self.label_vacuum, '{:.2f}'.format(state.vacuum)),
+            (self.label_bubble_sensor_downstream, str(int(state.bubble_sensor_1 > 0))),
+            (self.label_bubble_sensor_upstream, str(int(state.bubble_sensor_2 > 0))),
+            (self.label_flowrate_upstream, '{:.1f}'.format(state.flow_upstream)),
+            (self.label_dispensed_volume, '{:.1f}'.format(state.volume_ul))]
+        for label, text in texts:
+            if label.text() != text:
+                label.setText(text)
+
+
+# labels of the telemetry fields in the live plot
+TELEMETRY_PLOT_LABELS = {'pressure': 'Pressure (psi)', 'vacuum': 'Vacuum (psi)', 'flow_upstream': 'Flow Upstream',
+    'flow_downstream': 'Flow Downstream', 'volume_ul': 'Volume (uL)', 'pump_power': 'Pump Power'}
+TELEMETRY_PLOT_COLORS = ['#1f77b4', '#d62728', '#2ca02c', '#9467bd', '#ff7f0e', '#8c564b']
+
+
+def _polygon(x, y):
+    # QPolygonF from numpy arrays, the points (pairs of doubles) are written directly into the buffer of the polygon
+    polygon = QPolygonF(len(x))
+    buffer = polygon.data()
+    buffer.setsize(16*len(x))
+    points = np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)
+    points[:, 0] = x
+    points[:, 1] = y
+    return polygon
+
+
+class TelemetryPlotCanvas(QWidget):
+    '''
+    scrolling plot of a telemetry.TelemetryHistory, one lane per field with its own y range
+    the traces are decimated to the width of the plot, so a redraw costs about the same for a 1 min and a 24 h window
+    '''
+
+    LABEL_WIDTH = 170
+
+    def __init__(self, history, fields=TELEMETRY_HISTORY_FIELDS, time_span_s=TELEMETRY_PLOT_TIME_SPANS_S[0], main=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.history = history
+        self.fields = list(fields)
+        self.time_span_s = time_span_s
+        self.t_end = None # None: follow the latest message, otherwise the end of the window (paused)
+        self.setMinimumHeight(40*len(self.fields))
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        time_range = self.history.time_range()
+        if time_range is None:
+            painter.drawText(self.rect(), Qt.AlignCenter, 'no MCU messages received')
+            return
+        t_end = self.t_end if self.t_end is not None else time_range[1]
+        t_start = t_end - self.time_span_s
+        plot_left = self.LABEL_WIDTH
+        plot_width = max(1, self.width() - plot_left - 5)
+        lane_height = self.height()/len(self.fields)
+        margin = 4
+        for i, field in enumerate(self.fields):
+            top = i*lane_height
+            painter.setPen(QColor('#dddddd'))
+            painter.drawLine(QPointF(0, top + lane_height - 1), QPointF(self.width(), top + lane_height - 1))
+            t, y = self.history.decimate(field, t_start, t_end, plot_width)
+            if len(t) == 0:
+                continue
+            y_min, y_max = float(y.min()), float(y.max())
+            if y_max - y_min < 1e-6:
+                y_min, y_max = y_min - 0.5, y_max + 0.5
+            painter.setPen(QColor(TELEMETRY_PLOT_COLORS[i % len(TELEMETRY_PLOT_COLORS)]))
+            x_pixels = plot_left + (t - t_start)*(plot_width/self.time_span_s)
+            y_pixels = top + margin + (y_max - y)*((lane_height - 2*margin)/(y_max - y_min))
+            painter.drawPolyline(_polygon(x_pixels, y_pixels))
+            # field name, latest value and y range
+            painter.drawText(QRectF(5, top, plot_left - 10, lane_height), Qt.AlignLeft | Qt.AlignVCenter,
+                TELEMETRY_PLOT_LABELS.get(field, field) + '\n' + '{:.2f}'.format(self.history.latest(field)))
+            painter.setPen(Qt.gray)
+            painter.drawText(QRectF(5, top, plot_left - 10, lane_height), Qt.AlignRight | Qt.AlignTop, '{:.2f}'.format(y_max))
+            painter.drawText(QRectF(5, top, plot_left - 10, lane_height), Qt.AlignRight | Qt.AlignBottom, '{:.2f}'.format(y_min))
+        painter.setPen(Qt.gray)
+        painter.drawText(QRectF(plot_left, 0, plot_width, self.height()), Qt.AlignLeft | Qt.AlignBottom, '-' + str(self.time_span_s) + ' s')
+        painter.drawText(QRectF(plot_left, 0, plot_width, self.height()), Qt.AlignRight | Qt.AlignBottom, '0 s')
+
+
+class TelemetryPlotWidget(QFrame):
+    ''' live plot of the MCU telemetry (fluidController.telemetry_history), redrawn while it is visible '''
+
+    def __init__(self, fluidController, main=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fluidController = fluidController
+        self.add_components()
+        self.setFrameStyle(QFrame.Panel | QFrame.Raised)
+        self.timer_update_plot = QTimer()
+        self.timer_update_plot.setInterval(TELEMETRY_PLOT_UPDATE_INTERVAL_MS)
+        self.timer_update_plot.timeout.connect(self.update_plot)
+        self.timer_update_plot.start()
+
+    def add_components(self):
+        self.canvas = TelemetryPlotCanvas(self.fluidController.telemetry_history)
+        self.dropdown_time_span = QComboBox()
+        for time_span_s in TELEMETRY_PLOT_TIME_SPANS_S:
+            self.dropdown_time_span.addItem(str(time_span_s//60) + ' min' if time_span_s < 3600 else str(time_span_s//3600) + ' h', time_span_s)
+        self.dropdown_time_span.currentIndexChanged.connect(self.set_time_span)
+        self.checkbox_pause = QCheckBox('Pause')
+        self.checkbox_pause.stateChanged.connect(self.set_paused)
+
+        hbox = QHBoxLayout()
+        hbox.addWidget(QLabel('Time Span'))
+        hbox.addWidget(self.dropdown_time_span)
+        hbox.addWidget(self.checkbox_pause)
+        hbox.addStretch()
+
+        vbox = QVBoxLayout()
+        vbox.addLayout(hbox)
+        vbox.addWidget(self.canvas)
+        self.setLayout(vbox)
+
+    def set_time_span(self, index):
+        self.canvas.time_span_s = self.dropdown_time_span.itemData(index)
+        self.canvas.update()
+
+    def set_paused(self, state):
+        time_range = self.fluidController.telemetry_history.time_range()
+        if state == Qt.Checked and time_range is not None:
+            self.canvas.t_end = time_range[1]
+        else:
+            self.canvas.t_end = None
+        self.canvas.update()
+
+    def update_plot(self):
+        if self.isVisible() and self.canvas.t_end is None:
+            self.canvas.update()
+
+    def close(self):
+        self.timer_update_plot.stop()
+
+
+class LogModel(QAbstractListModel):
+    '''
+    log messages in a fixed-capacity ring buffer (the oldest messages are dropped) followed by an optional pinned status row
+    appended messages are inserted in batches, at most once every update_interval_ms
+    '''
+
+    SeverityRole = Qt.UserRole + 1
+    SequenceRole = Qt.UserRole + 2
+
+    def __init__(self, capacity=LOG_VIEW_CAPACITY, update_interval_ms=LOG_VIEW_UPDATE_INTERVAL_MS, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.capacity = capacity
+        self.buffer = [None]*capacity # entries: (message, severity, sequence)
+        self.start = 0
+        self.count = 0
+        self.pending = []
+        self.status = None
+        self.current_sequence = ''
+        self.timer_flush = QTimer()
+        self.timer_flush.setSingleShot(True)
+        self.timer_flush.setInterval(update_interval_ms)
+        self.timer_flush.timeout.connect(self.flush)
+
+    def append(self, message):
+        self.pending.append((message, utils.log_severity(message), self.current_sequence))
+        if self.timer_flush.isActive() == False:
+            self.timer_flush.start()
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        entries = self.pending[-self.capacity:]
+        self.pending = []
+        # drop the oldest rows to make room
+        number_to_remove = self.count + len(entries) - self.capacity
+        if number_to_remove > 0:
+            self.beginRemoveRows(QModelIndex(), 0, number_to_remove-1)
+            for i in range(number_to_remove):
+                self.buffer[(self.start + i) % self.capacity] = None
+            self.start = (self.start + number_to_remove) % self.capacity
+            self.count = self.count - number_to_remove
+            self.endRemoveRows()
+        # insert the new rows (before the status row)
+        self.beginInsertRows(QModelIndex(), self.count, self.count + len(entries) - 1)
+        for entry in entries:
+            self.buffer[(self.start + self.count) % self.capacity] = entry
+            self.count = self.count + 1
+        self.endInsertRows()
+
+    def entry(self, row):
+        return self.buffer[(self.start + row) % self.capacity]
+
+    def set_status(self, text):
+        # the pinned status row (e.g. the stopwatch countdown) is updated in place, an empty text removes it
+        if text == '':
+            if self.status is not None:
+                self.beginRemoveRows(QModelIndex(), self.count, self.count)
+                self.status = None
+                self.endRemoveRows()
+        elif self.status is None:
+            self.beginInsertRows(QModelIndex(), self.count, self.count)
+            self.status = text
+            self.endInsertRows()
+        elif self.status != text:
+            self.status = text
+            index = self.index(self.count)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.count + (1 if self.status is not None else 0)
+
+    def data(self, index, role=Qt.DisplayRole):
+        row = index.row()
+        if row == self.count:
+            if role == Qt.DisplayRole:
+                return self.status
+            if role == Qt.FontRole:
+                font = QFont()
+                font.setBold(True)
+                return font
+            return None
+        if role == Qt.DisplayRole:
+            return self.entry(row)[0]
+        if role == Qt.ForegroundRole and self.entry(row)[1] == LOG_SEVERITY.ERROR:
+            return QBrush(Qt.red)
+        if role == LogModel.SeverityRole:
+            return self.entry(row)[1]
+        if role == LogModel.SequenceRole:
+            return self.entry(row)[2]
+        return None
+
+
+class LogFilterProxyModel(QSortFilterProxyModel):
+    ''' shows the log messages of one severity / sequence containing a text, the status row is always shown '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.severity = None
+        self.sequence = None
+        self.text = ''
+
+    def set_filter(self, severity, sequence, text):
+        self.severity = severity
+        self.sequence = sequence
+        self.text = text.lower()
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        model = self.sourceModel()
+        if source_row == model.count:
+            return True
+        message, severity, sequence = model.entry(source_row)
+        if self.severity is not None and severity != self.severity:
+            return False
+        if self.sequence is not None and sequence != self.sequence:
+            return False
+        return self.text in message.lower()
+
+
+class LogWidget(QWidget):
+    '''
+    log view - only the visible rows are rendered; the view follows new messages while it is scrolled to the bottom
+    messages can be filtered by severity, by the sequence being executed when they were logged, and by text
+    '''
+
+    def __init__(self, capacity=LOG_VIEW_CAPACITY, main=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.model = LogModel(capacity)
+        self.proxy_model = LogFilterProxyModel()
+        self.proxy_model.setSourceModel(self.model)
+        self.follow_new_rows = True
+        self.highlight_requested = False
+        self.add_components()
+        self.model.rowsAboutToBeInserted.connect(self._before_rows_inserted)
+        self.model.rowsInserted.connect(self._after_rows_inserted)
+
+    def add_components(self):
+        # a table with fixed row heights lays out only the visible rows (QListView lays out all of them on every insert)
+        self.view = QTableView()
+        self.view.horizontalHeader().hide()
+        self.view.horizontalHeader().setStretchLastSection(True)
+        self.view.verticalHeader().hide()
+        self.view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.view.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 4)
+        self.view.setShowGrid(False)
+        self.view.setWordWrap(False)
+        self.view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.view.setModel(self.model)
+
+        self.dropdown_severity = QComboBox()
+        self.dropdown_severity.addItems(['All Messages', LOG_SEVERITY.INFO, LOG_SEVERITY.ERROR])
+        self.dropdown_sequence = QComboBox()
+        self.dropdown_sequence.addItem('All Sequences')
+        self.entry_search = QLineEdit()
+        self.entry_search.setPlaceholderText('Search')
+
+        self.dropdown_severity.currentIndexChanged.connect(self.update_filter)
+        self.dropdown_sequence.currentIndexChanged.connect(self.update_filter)
+        self.entry_search.textChanged.connect(self.update_filter)
+
+        hbox = QHBoxLayout()
+        hbox.addWidget(self.dropdown_severity)
+        hbox.addWidget(self.dropdown_sequence)
+        hbox.addWidget(self.entry_search)
+
+        vbox = QVBoxLayout()
+        vbox.setContentsMargins(0, 0, 0, 0)
+        vbox.addLayout(hbox)
+        vbox.addWidget(self.view)
+        self.setLayout(vbox)
+
+    def log(self, message):
+        self.model.append(message)
+
+    def set_status(self, text):
+        # updated in place, the view follows the status row only when it is inserted (see _after_rows_inserted)
+        self.model.set_status(text)
+
+    def set_current_sequence(self, sequence_name):
+        self.model.current_sequence = sequence_name
+        if self.dropdown_sequence.findText(sequence_name) < 0:
+            self.dropdown_sequence.addItem(sequence_name)
+
+    def highlight_last_row(self):
+        # select the last row once the pending messages are shown
+        if len(self.model.pending) > 0:
+            self.highlight_requested = True
+            return
+        model = self.view.model()
+        if model.rowCount() > 0:
+            self.view.setCurrentIndex(model.index(model.rowCount()-1, 0))
+
+    def update_filter(self):
+        severity = self.dropdown_severity.currentText() if self.dropdown_severity.currentIndex() > 0 else None
+        sequence = self.dropdown_sequence.currentText() if self.dropdown_sequence.currentIndex() > 0 else None
+        text = self.entry_search.text()
+        if severity is None and sequence is None and text == '':
+            # without a filter the view uses the model directly
+            self.view.setModel(self.model)
+        else:
+            self.proxy_model.set_filter(severity, sequence, text)
+            self.view.setModel(self.proxy_model)
+        self.view.scrollToBottom()
+
+    def _before_rows_inserted(self, parent, first, last):
+        scroll_bar = self.view.verticalScrollBar()
+        self.follow_new_rows = scroll_bar.value() == scroll_bar.maximum()
+
+    def _after_rows_inserted(self, parent, first, last):
+        if self.follow_new_rows:
+            self.view.scrollToBottom()
+        if self.highlight_requested and len(self.model.pending) == 0:
+            self.highlight_requested = False
+            self.highlight_last_row()
+
 
 class ManualFlushWidget(QFrame):
 